@@ -0,0 +1,1301 @@
+"""
+Asyncio-рантайм бота: AsyncTeleBot + client.aio.
+
+Повторяет поведение обработчиков из gemini_bot.py, но запросы к Gemini и
+Telegram не занимают поток на всё время ответа, поэтому сотни генераций
+могут выполняться в одном процессе. Сервисы, операции с БД и тексты
+ответов общие с gemini_bot.py (bot_common.py). Работа с SQLite остаётся синхронной
+(database/crud.py) и выносится в поток через asyncio.to_thread.
+
+Запуск: BOT_RUNTIME=asyncio python gemini_bot.py или python async_bot.py
+"""
+
+import ipv4_only  # noqa: F401 E261
+import asyncio
+import io
+from functools import wraps
+
+import telebot
+from google import genai
+from telebot.async_telebot import AsyncTeleBot
+
+from constants import (
+    ASYNC_DISPATCH_CONCURRENCY,
+    BOT_INGESTION,
+    COMMAND_LIST,
+    GEMINI_API_KEY,
+    PRO_CODE,
+    QUICK_TOOL_BATCH_CONCURRENCY,
+    MAX_FILE_SIZE_MB,
+    QUICK_TOOLS_CONFIG,
+    SEND_MODE_MANUAL,
+    STREAM_EDIT_INTERVAL,
+    STREAMING_ENABLED,
+    SUPPORTED_MIME_TYPES,
+    TELEGRAM_TOKEN,
+    METRICS_LOG_INTERVAL,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    get_model_alias,
+    is_image_generation_model,
+)
+import bot_common
+import http_client
+import metrics
+from bot_common import Services
+from dispatcher import AsyncUserDispatcher, install_async as install_dispatcher
+from chat_cache import chat_history
+from file_uploads import send_with_fresh_files_async
+from gemini_helpers import (
+    build_buffer_parts,
+    build_chat_config,
+    build_context_parts,
+    compile_quick_tool,
+    collect_response_parts,
+    extract_sources_text,
+    photo_part,
+    PHOTO_MIME_TYPE,
+)
+from image_preprocess import pick_photo_size
+from keyboards import (
+    get_file_download_keyboard,
+    get_main_keyboard,
+    get_model_selection_keyboard,
+)
+from persistence import (
+    add_file_context_entry,
+    add_to_message_buffer,
+    clear_user_context_db,
+    get_active_chat,
+    get_file_context_list,
+    fetch_user_settings,
+    get_message_buffer_list,
+    save_active_chat,
+    UserContext,
+)
+import quick_batch
+from rate_limiter import install_async as install_rate_limiter
+from response_cache import response_tokens
+from resilience import send_chat_async
+from router import Router, command_args
+from streaming import (
+    EditBudget,
+    delete_placeholder_async,
+    open_stream_async,
+    stream_chat_response_async,
+)
+from token_estimator import estimator, preflight
+from utils import markdown_to_text, send_rich_response_async
+from webhook import WebhookServer
+from whitelist import add_to_whitelist, load_whitelist
+
+from database import db, user_cache
+
+client = genai.Client(api_key=GEMINI_API_KEY)
+bot = AsyncTeleBot(TELEGRAM_TOKEN)
+dispatcher = AsyncUserDispatcher(ASYNC_DISPATCH_CONCURRENCY)
+install_dispatcher(bot, dispatcher)
+# Текстовые сообщения разбирает Router: один обработчик вместо цепочки func
+router = Router()
+bot.register_message_handler(router.dispatch, content_types=["text"])
+http_client.install_async()
+metrics.register("dispatcher", dispatcher.stats)
+outbound_limiter = bot_common.outbound_limiter()
+if outbound_limiter is not None:
+    install_rate_limiter(outbound_limiter)
+services = Services(client)
+file_uploads = services.file_uploads
+compactor = services.compactor
+gemini = services.gemini
+hedger = services.hedger
+image_preprocessor = services.image_preprocessor
+response_cache = services.response_cache
+map_reduce = services.map_reduce
+quick_tools = services.quick_tools
+
+user_last_responses = {}
+edit_budget = EditBudget(STREAM_EDIT_INTERVAL)
+
+
+async def send_chat_parts(chat_session, model, parts, rebuild, request):
+    """
+    send_chat_async для запроса с файлами: request(chat, parts) отправляет
+    parts. Если Files API уже удалил файл по ссылке, parts собираются заново
+    через rebuild() и запрос повторяется.
+    """
+    return await send_chat_async(
+        gemini,
+        client.aio.chats,
+        chat_session,
+        model,
+        lambda chat: send_with_fresh_files_async(
+            file_uploads, parts, rebuild, lambda: request(chat, parts)
+        ),
+    )
+
+
+# --- Вспомогательные функции ---
+
+
+def ensure_user_started(func):
+    """
+    Декоратор: проверяет, начал ли пользователь диалог командой /start (есть ли в БД),
+    и передаёт обработчику UserContext с настройками из кэша.
+    """
+
+    @wraps(func)
+    async def wrapper(message, *args, **kwargs):
+        if isinstance(message, telebot.types.CallbackQuery):
+            user_id = message.from_user.id
+            chat_id = message.message.chat.id
+            is_callback = True
+        elif isinstance(message, telebot.types.Message):
+            user_id = message.from_user.id
+            chat_id = message.chat.id
+            is_callback = False
+        else:
+            print(
+                f"Предупреждение: ensure_user_started получил неожиданный тип: {type(message)}"
+            )
+            return await func(message, None, *args, **kwargs)
+
+        # Попадание в кэш обходится без потока и без запроса к БД
+        settings = user_cache.get(user_id)
+        if settings is None:
+            settings = await asyncio.to_thread(fetch_user_settings, user_id)
+        if settings is None:
+            try:
+                if is_callback:
+                    await bot.answer_callback_query(message.id)
+                await bot.send_message(
+                    chat_id,
+                    bot_common.START_REQUIRED_TEXT,
+                    reply_markup=telebot.types.ReplyKeyboardRemove(),
+                )
+            except Exception as e:
+                print(f"Ошибка при отправке сообщения 'введите /start': {e}")
+            return None
+        ctx = UserContext(user_id, chat_id, settings)
+        return await func(message, ctx, *args, **kwargs)
+
+    return wrapper
+
+
+async def load_chat(user_id, model_name):
+    """Возвращает асинхронный чат пользователя (из кэша или БД)."""
+    return await asyncio.to_thread(
+        get_active_chat, user_id, model_name, client.aio.chats, compactor
+    )
+
+
+async def download_telegram_file(file_path):
+    """
+    Скачивает файл Telegram кусками через сессию бота; большие файлы
+    попадают во временный файл. Возвращает файловый объект.
+    """
+    return await http_client.download_async(
+        http_client.file_url(TELEGRAM_TOKEN, file_path),
+        MAX_FILE_SIZE_MB * 1024 * 1024,
+    )
+
+
+async def download_telegram_image(file_id):
+    """Загружает изображение из Telegram."""
+    file_info = await bot.get_file(file_id)
+    return await download_telegram_file(file_info.file_path)
+
+
+async def send_text_as_file(chat_id, text, filename="response.txt"):
+    """Отправляет ответ в виде файла."""
+    file_obj = io.BytesIO(text.encode("utf-8"))
+    await bot.send_document(
+        chat_id,
+        file_obj,
+        caption="Ваш запрошенный ответ",
+        visible_file_name=filename,
+    )
+
+
+async def delete_quietly(chat_id, message_id):
+    try:
+        await bot.delete_message(chat_id, message_id)
+    except Exception:
+        pass
+
+
+async def generate_content(model_name, contents, config, tokens=0):
+    """Одиночный запрос generate_content; хеджируется, если включено."""
+
+    def request(name):
+        return client.aio.models.generate_content(
+            model=name, contents=contents, config=config
+        )
+
+    if hedger is None:
+        return await request(model_name)
+    return await hedger.call_async(model_name, request, tokens)
+
+
+async def send_gemini_response_with_images(
+    chat_id, response, reply_to_message_id=None
+):
+    """Отправляет ответ Gemini, обрабатывая как текст, так и изображения."""
+    text_parts, media = collect_response_parts(response)
+
+    for data, mime_type in media:
+        try:
+            image_bytes = io.BytesIO(data)
+
+            if mime_type.startswith("image/"):
+                await bot.send_photo(
+                    chat_id,
+                    image_bytes,
+                    reply_to_message_id=reply_to_message_id,
+                )
+            else:
+                await bot.send_document(
+                    chat_id,
+                    image_bytes,
+                    visible_file_name=f"generated_content.{mime_type.split('/')[-1]}",
+                    reply_to_message_id=reply_to_message_id,
+                )
+        except Exception as e:
+            print(f"Ошибка отправки изображения: {e}")
+            text_parts.append(f"[Ошибка отправки изображения: {e}]")
+
+    if text_parts:
+        combined_text = "\n".join(text_parts)
+        await send_rich_response_async(
+            bot,
+            chat_id,
+            combined_text,
+            reply_to_message_id=reply_to_message_id,
+        )
+        return combined_text
+
+    return ""
+
+
+# --- Обработчики ---
+
+
+@router.command("help")
+async def handle_help_command(message):
+    """Выводит подробную справку по функциям бота."""
+    await bot.send_message(
+        message.chat.id, bot_common.help_text(), parse_mode="Markdown"
+    )
+
+
+@router.command("unlock_pro")
+@ensure_user_started
+async def handle_unlock_pro(message, ctx):
+    """Обрабатывает команду /unlock_pro."""
+    user_id = message.from_user.id
+    if command_args(message.text) == str(PRO_CODE):
+        add_to_whitelist(user_id)
+        await bot.reply_to(message, "✅ Доступ к про модели разблокирован!")
+    else:
+        await bot.reply_to(message, "❌ Неверный код. Используйте другой")
+
+
+@router.command("start")
+async def send_welcome(message):
+    """Обрабатывает команду /start."""
+    user_id = message.from_user.id
+
+    send_mode, search_enabled, current_model = await asyncio.to_thread(
+        bot_common.start_user, user_id
+    )
+    await load_chat(user_id, current_model)
+
+    user_last_responses[user_id] = None
+
+    await bot.send_message(
+        message.chat.id,
+        bot_common.greeting_text(send_mode, search_enabled, current_model),
+        reply_markup=get_main_keyboard(
+            send_mode, search_enabled, current_model
+        ),
+        parse_mode="Markdown",
+    )
+
+
+@router.exact("Новый чат")
+@ensure_user_started
+async def new_chat(message, ctx):
+    """Обрабатывает нажатие кнопки "Новый чат"."""
+    user_id = message.from_user.id
+
+    send_mode = ctx.send_mode
+    search_enabled = ctx.search_enabled
+    current_model = ctx.current_model
+    await asyncio.to_thread(bot_common.reset_chat, user_id)
+    await load_chat(user_id, current_model)
+
+    user_last_responses[user_id] = None
+
+    await bot.send_message(
+        message.chat.id,
+        bot_common.new_chat_text(send_mode, search_enabled, current_model),
+        reply_markup=get_main_keyboard(
+            send_mode, search_enabled, current_model
+        ),
+    )
+
+
+@router.prefix("Получить .")
+@ensure_user_started
+async def get_response_as_md(message, ctx):
+    """Обрабатывает нажатие кнопки "Получить .md 📄"."""
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+
+    if user_last_responses.get(user_id):
+        raw_response = user_last_responses[user_id]
+
+        filename_base = bot_common.filename_base(raw_response, "response")
+
+        await send_text_as_file(chat_id, raw_response, f"{filename_base}.md")
+
+        plain_text = await asyncio.to_thread(markdown_to_text, raw_response)
+        await send_text_as_file(chat_id, plain_text, f"{filename_base}.txt")
+    else:
+        await bot.send_message(
+            chat_id,
+            "У меня нет сохраненных ответов для отправки в виде файла.",
+            reply_markup=get_main_keyboard(
+                ctx.send_mode, ctx.search_enabled, ctx.current_model
+            ),
+        )
+
+
+@router.prefix("Режим:")
+@ensure_user_started
+async def handle_send_mode(message, ctx):
+    """Переключает режим отправки сообщений."""
+    new_mode, search_enabled, current_model = await asyncio.to_thread(
+        bot_common.toggle_send_mode, message.from_user.id, ctx.send_mode
+    )
+
+    await bot.send_message(
+        message.chat.id,
+        bot_common.send_mode_text(new_mode),
+        reply_markup=get_main_keyboard(
+            new_mode, search_enabled, current_model
+        ),
+        parse_mode="Markdown",
+    )
+
+
+@router.prefix("Поиск:")
+@ensure_user_started
+async def handle_search_command(message, ctx):
+    """Переключает режим поиска Google."""
+    send_mode, search_enabled, current_model = await asyncio.to_thread(
+        bot_common.toggle_search, message.from_user.id, ctx.search_enabled
+    )
+
+    await bot.reply_to(
+        message,
+        f"🔎 Поиск Google теперь: *{bot_common.search_status(search_enabled)}*",
+        parse_mode="Markdown",
+        reply_markup=get_main_keyboard(
+            send_mode, search_enabled, current_model
+        ),
+    )
+
+
+@router.prefix("Модель:")
+@ensure_user_started
+async def select_model(message, ctx):
+    """Обрабатывает нажатие кнопки "Выбрать модель"."""
+    await bot.send_message(
+        message.chat.id,
+        "Выберите модель Gemini:",
+        reply_markup=get_model_selection_keyboard(),
+    )
+
+
+@router.exact("Отправить всё")
+@ensure_user_started
+async def handle_send_all(message, ctx):
+    """Отправляет накопленные сообщения (текст и фото) из буфера, сохраняя разрывы между текстами."""
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+
+    current_mode = ctx.send_mode
+    search_enabled = ctx.search_enabled
+    current_model = ctx.current_model
+
+    if current_mode != SEND_MODE_MANUAL:
+        await bot.reply_to(
+            message,
+            f"Эта кнопка работает только в режиме '{SEND_MODE_MANUAL}'. "
+            f"Ваш текущий режим: '{current_mode}'. Используйте /send_mode.",
+            reply_markup=get_main_keyboard(
+                current_mode, search_enabled, current_model
+            ),
+        )
+        return
+
+    buffered_items = await asyncio.to_thread(get_message_buffer_list, user_id)
+
+    if not buffered_items:
+        await bot.reply_to(
+            message,
+            "Буфер сообщений пуст. Нечего отправлять.",
+            reply_markup=get_main_keyboard(
+                current_mode, search_enabled, current_model
+            ),
+        )
+        return
+
+    # Фото уменьшаются до предела модели до оценки токенов
+    buffered_items = await image_preprocessor.buffer_items_async(
+        buffered_items, current_model
+    )
+
+    chat_session = await load_chat(user_id, current_model)
+
+    # Оценка читает файлы с диска — выполняем в потоке
+    check = await asyncio.to_thread(
+        preflight,
+        current_model,
+        chat_history(chat_session),
+        texts=[i["content"] for i in buffered_items if i["type"] == "text"],
+        files=[i for i in buffered_items if i["type"] != "text"],
+    )
+    if not check.ok:
+        await bot.reply_to(
+            message,
+            check.rejection_text(),
+            reply_markup=get_main_keyboard(
+                current_mode, search_enabled, current_model
+            ),
+        )
+        return
+    for warning in check.dropped_texts():
+        await bot.send_message(chat_id, warning)
+    buffered_items = check.keep(buffered_items)
+
+    # Загрузка в Files API блокирующая — выполняем в потоке
+    combined_parts, file_errors = await asyncio.to_thread(
+        build_buffer_parts, buffered_items, file_uploads
+    )
+    for filename, file_err in file_errors:
+        await bot.send_message(
+            chat_id,
+            f"⚠️ Не удалось добавить файл '{filename}' из буфера в запрос: {file_err}",
+        )
+
+    if not combined_parts:
+        await bot.reply_to(
+            message,
+            "Не удалось сформировать сообщение для отправки из буфера (возможно, он пуст или содержит только пустые элементы).",
+            reply_markup=get_main_keyboard(
+                current_mode, search_enabled, current_model
+            ),
+        )
+        await asyncio.to_thread(clear_user_context_db, user_id)
+        return
+
+    await bot.send_chat_action(chat_id, "typing")
+    status_msg = await bot.reply_to(
+        message, "Отправляю накопленные сообщения и фото в Gemini..."
+    )
+
+    try:
+        gemini_config = build_chat_config(current_model, search_enabled)
+        streaming = STREAMING_ENABLED and not is_image_generation_model(
+            current_model
+        )
+
+        async def rebuild():
+            parts, _ = await asyncio.to_thread(
+                build_buffer_parts, buffered_items, file_uploads
+            )
+            return parts
+
+        if streaming:
+            stream, chat_session = await send_chat_parts(
+                chat_session,
+                current_model,
+                combined_parts,
+                rebuild,
+                lambda chat, parts: open_stream_async(chat, parts, gemini_config),
+            )
+            raw_response_text, response, status_msg = (
+                await stream_chat_response_async(
+                    bot,
+                    chat_session,
+                    combined_parts,
+                    gemini_config,
+                    chat_id,
+                    edit_budget,
+                    placeholder=status_msg,
+                    stream=stream,
+                )
+            )
+        else:
+            response, chat_session = await send_chat_parts(
+                chat_session,
+                current_model,
+                combined_parts,
+                rebuild,
+                lambda chat, parts: chat.send_message(
+                    message=parts, config=gemini_config
+                ),
+            )
+        await asyncio.to_thread(save_active_chat, user_id, chat_session)
+        estimator.observe(check.total, response)
+
+        if is_image_generation_model(current_model):
+            raw_response_text = await send_gemini_response_with_images(
+                chat_id, response, reply_to_message_id=message.message_id
+            )
+        elif not streaming:
+            raw_response_text = response.text
+
+        sources_text = extract_sources_text(response)
+        if sources_text:
+            raw_response_text += sources_text
+
+        await asyncio.to_thread(bot_common.clear_buffer, user_id)
+
+        user_last_responses[user_id] = raw_response_text
+
+        if not is_image_generation_model(current_model):
+            await send_rich_response_async(
+                bot,
+                chat_id,
+                raw_response_text,
+                reply_to_message_id=message.message_id,
+                fallback_download_keyboard=get_file_download_keyboard(user_id),
+            )
+
+        await delete_placeholder_async(bot, chat_id, status_msg)
+
+    except Exception as e:
+        await delete_quietly(chat_id, status_msg.message_id)
+        await bot.reply_to(
+            message,
+            f"Произошла ошибка при отправке: {e!s}\n\n"
+            "Ваши сообщения и фото сохранены в буфере. Попробуйте позже или измените содержимое буфера.",
+            reply_markup=get_main_keyboard(
+                current_mode, search_enabled, current_model
+            ),
+        )
+
+
+@bot.callback_query_handler(
+    func=lambda call: (
+        call.data.startswith("get_file_") or call.data.startswith("get_md_")
+    )
+)
+@ensure_user_started
+async def handle_get_file(call, ctx):
+    """Обрабатывает нажатие инлайн кнопок "Получить в виде файла" (.txt или .md)."""
+
+    user_id = int(call.data.split("_")[2])
+    file_format = "txt" if call.data.startswith("get_file_") else "md"
+
+    if user_last_responses.get(user_id):
+        raw_response = user_last_responses[user_id]
+
+        filename = (
+            f"{bot_common.filename_base(raw_response, 'response')}.{file_format}"
+        )
+
+        if file_format == "txt":
+            file_content = await asyncio.to_thread(
+                markdown_to_text, raw_response
+            )
+            alert_text = "Текстовый файл отправлен!"
+        else:
+            file_content = raw_response
+            alert_text = "Markdown файл отправлен!"
+
+        await send_text_as_file(call.message.chat.id, file_content, filename)
+        await bot.answer_callback_query(call.id, text=alert_text)
+    else:
+        await bot.answer_callback_query(
+            call.id,
+            text="У меня нет сохраненных ответов для отправки в виде файла.",
+        )
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("model_"))
+@ensure_user_started
+async def handle_model_selection(call, ctx):
+    """Обрабатывает нажатия кнопок выбора модели."""
+    user_id = call.from_user.id
+    selected_model = call.data.replace("model_", "")
+
+    denied_text = bot_common.model_access_denied(user_id, selected_model)
+    if denied_text:
+        await bot.answer_callback_query(
+            call.id,
+            text=f"Доступ к {denied_text} ограничен. Используйте /unlock_pro <Имя создателя бота>",
+        )
+        await bot.send_message(
+            call.message.chat.id,
+            f"Доступ к {denied_text} ограничен. Пожалуйста, используйте команду /unlock_pro <Имя создателя бота> для разблокировки.",
+            reply_markup=get_main_keyboard(
+                ctx.send_mode, ctx.search_enabled, ctx.current_model
+            ),
+        )
+        return
+
+    await asyncio.to_thread(bot_common.reset_chat, user_id, selected_model)
+    send_mode = ctx.send_mode
+    search_enabled = ctx.search_enabled
+    current_model = selected_model
+    await load_chat(user_id, current_model)
+
+    user_last_responses[user_id] = None
+
+    await bot.answer_callback_query(call.id)
+    await bot.edit_message_text(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=(
+            f"Выбрана модель: {get_model_alias(selected_model)}\n\n"
+            f"Контекст предыдущего разговора очищен."
+        ),
+    )
+
+    await bot.send_message(
+        call.message.chat.id,
+        "Можете начать новый диалог.",
+        reply_markup=get_main_keyboard(
+            send_mode, search_enabled, current_model
+        ),
+    )
+
+
+@bot.message_handler(content_types=["document"])
+@ensure_user_started
+async def handle_document(message, ctx):
+    """Обрабатывает входящие документы поддерживаемых типов, сохраняя их в контекст."""
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+
+    current_mode = ctx.send_mode
+    search_enabled = ctx.search_enabled
+    current_model = ctx.current_model
+    keyboard = get_main_keyboard(current_mode, search_enabled, current_model)
+
+    doc_mime_type = message.document.mime_type
+    if doc_mime_type not in SUPPORTED_MIME_TYPES:
+        await bot.reply_to(
+            message,
+            bot_common.unsupported_document_text(doc_mime_type),
+            reply_markup=keyboard,
+        )
+        return
+
+    try:
+        await bot.send_chat_action(chat_id, "upload_document")
+        file_info = await bot.get_file(message.document.file_id)
+
+        if file_info.file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+            await bot.reply_to(
+                message,
+                bot_common.document_too_large_text(message.document.file_name),
+                reply_markup=keyboard,
+            )
+            return
+
+        downloaded_file = await download_telegram_file(file_info.file_path)
+        filename = message.document.file_name
+        caption = message.caption or ""
+
+        file_data = {
+            "mime_type": doc_mime_type,
+            "data": downloaded_file,
+            "filename": filename,
+            "caption": caption,
+        }
+
+        # Загрузка закрывается, как только файл сохранён в хранилище
+        with downloaded_file:
+            await asyncio.to_thread(add_file_context_entry, user_id, file_data)
+            if current_mode == SEND_MODE_MANUAL:
+                await asyncio.to_thread(
+                    add_to_message_buffer,
+                    user_id,
+                    {**file_data, "type": "document"},
+                )
+        context_count = await asyncio.to_thread(
+            bot_common.count_file_contexts, user_id
+        )
+
+        buffer_count = None
+        if current_mode == SEND_MODE_MANUAL:
+            buffer_count = await asyncio.to_thread(
+                bot_common.count_buffer, user_id
+            )
+        await bot.reply_to(
+            message,
+            bot_common.document_added_text(
+                filename, doc_mime_type, caption, context_count, buffer_count
+            ),
+            reply_markup=keyboard,
+        )
+
+    except Exception as e:
+        await bot.reply_to(
+            message,
+            f"Не удалось обработать файл '{message.document.file_name}': {e!s}",
+            reply_markup=keyboard,
+        )
+
+
+@bot.message_handler(content_types=["photo"])
+@ensure_user_started
+async def handle_photo(message, ctx):
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+
+    current_mode = ctx.send_mode
+    search_enabled = ctx.search_enabled
+    current_model = ctx.current_model
+    keyboard = get_main_keyboard(current_mode, search_enabled, current_model)
+
+    # Наименьший вариант фото, которого хватает для предела модели
+    photo = pick_photo_size(
+        message.photo, image_preprocessor.max_edge(current_model)
+    )
+    file_id = photo.file_id
+    caption = message.caption if message.caption else ""
+    if current_mode == SEND_MODE_MANUAL:
+        try:
+            await bot.send_chat_action(chat_id, "typing")
+            with await download_telegram_image(file_id) as image_file:
+                await asyncio.to_thread(
+                    add_to_message_buffer,
+                    user_id,
+                    {
+                        "type": "photo",
+                        "data": image_file,
+                        "mime_type": PHOTO_MIME_TYPE,
+                        "caption": caption,
+                    },
+                )
+            buffer_count = await asyncio.to_thread(
+                bot_common.count_buffer, user_id
+            )
+
+            await bot.reply_to(
+                message,
+                bot_common.photo_buffered_text(buffer_count, caption),
+                reply_markup=keyboard,
+            )
+        except Exception as e:
+            await bot.reply_to(
+                message,
+                f"Не удалось добавить фото в буфер: {e!s}",
+                reply_markup=keyboard,
+            )
+        return
+
+    chat_session = await load_chat(user_id, current_model)
+
+    await bot.send_chat_action(chat_id, "typing")
+    try:
+        with await download_telegram_image(file_id) as image_file:
+            data, mime_type = await image_preprocessor.process_async(
+                image_file.read(),
+                PHOTO_MIME_TYPE,
+                current_model,
+                key=photo.file_unique_id,
+            )
+        image = photo_part({"data": data, "mime_type": mime_type})
+
+        api_message_parts = []
+        if caption:
+            api_message_parts.append(caption)
+        api_message_parts.append(image)
+
+        gemini_config = None
+        if is_image_generation_model(current_model):
+            gemini_config = build_chat_config(current_model, search_enabled)
+        response, chat_session = await send_chat_async(
+            gemini,
+            client.aio.chats,
+            chat_session,
+            current_model,
+            lambda chat: chat.send_message(
+                message=api_message_parts, config=gemini_config
+            ),
+        )
+        await asyncio.to_thread(save_active_chat, user_id, chat_session)
+
+        if is_image_generation_model(current_model):
+            raw_response_text = await send_gemini_response_with_images(
+                chat_id, response, reply_to_message_id=message.message_id
+            )
+        else:
+            raw_response_text = response.text
+
+        user_last_responses[user_id] = raw_response_text
+
+        if not is_image_generation_model(current_model):
+            await send_rich_response_async(
+                bot,
+                chat_id,
+                raw_response_text,
+                reply_to_message_id=message.message_id,
+                fallback_download_keyboard=get_file_download_keyboard(user_id),
+            )
+
+    except Exception as e:
+        await bot.reply_to(
+            message,
+            f"Произошла ошибка при обработке изображения ({current_model}): {e!s}\n\n"
+            "Возможно, стоит попробовать новый чат.",
+            reply_markup=keyboard,
+        )
+
+
+async def send_quick_tool_result(
+    message, command, user_query, text, send_text=True
+):
+    """Ответ быстрого инструмента; todo, markdown и dayplanner — ещё и .md-файлом."""
+    chat_id = message.chat.id
+    filename = bot_common.quick_tool_filename(command, user_query)
+    if filename is not None:
+        await send_text_as_file(chat_id, text, filename)
+    if send_text:
+        await send_rich_response_async(
+            bot, chat_id, text, reply_to_message_id=message.message_id
+        )
+
+
+async def quick_tool_request(tool, text):
+    """Один запрос быстрого инструмента QuickTool (с повторами и хеджированием)."""
+    tokens = tool.instruction_tokens + estimator.text(text)
+    response, _ = await gemini.call_async(
+        tool.model,
+        lambda model_name: generate_content(model_name, text, tool.config, tokens),
+        record=hedger is None,
+    )
+    estimator.observe(tokens, response)
+    return response
+
+
+async def read_reply_text(message):
+    """Текст сообщения или текстового файла, на который ответили командой."""
+    reply = message.reply_to_message
+    if reply is None:
+        return ""
+    document = reply.document
+    if document is not None and (document.mime_type or "").startswith("text/"):
+        file_info = await bot.get_file(document.file_id)
+        with await download_telegram_file(file_info.file_path) as text_file:
+            data = await asyncio.to_thread(text_file.read)
+        return data.decode("utf-8", errors="replace").strip()
+    return (reply.text or reply.caption or "").strip()
+
+
+async def handle_quick_tool_batch(message, command, tool_config, user_query, batch):
+    """Пакетный режим: элементы параллельно, прогресс — в одном сообщении."""
+    chat_id = message.chat.id
+    items = batch.items
+    cache = services.cache_for(tool_config)
+
+    async def process(item):
+        if cache is not None:
+            cached_text = await asyncio.to_thread(
+                cache.get, command, tool_config, item
+            )
+            if cached_text is not None:
+                return cached_text
+        response = await quick_tool_request(quick_tools[command], item)
+        if cache is not None:
+            await asyncio.to_thread(
+                cache.put,
+                command,
+                tool_config,
+                item,
+                response.text,
+                response_tokens(response),
+            )
+        return response.text
+
+    async def on_progress(done, total):
+        if done < total and edit_budget.try_acquire(chat_id):
+            try:
+                await bot.edit_message_text(
+                    f"Выполняю команду `/{command}`: {done}/{total}",
+                    chat_id,
+                    status_msg.message_id,
+                )
+            except Exception:
+                pass
+
+    await bot.send_chat_action(chat_id, "typing")
+    status_msg = await bot.reply_to(
+        message, f"Выполняю команду `/{command}`: 0/{len(items)}"
+    )
+    results = await quick_batch.run_async(
+        items, process, QUICK_TOOL_BATCH_CONCURRENCY, on_progress
+    )
+    text, failed = quick_batch.merge_results(batch, results)
+
+    await delete_quietly(chat_id, status_msg.message_id)
+    await send_quick_tool_result(message, command, user_query, text)
+    if failed:
+        error = next(r for r in results if isinstance(r, Exception) or not r)
+        print(f"Error in quick tool batch '{command}': {error}")
+        await bot.reply_to(
+            message, bot_common.batch_failed_text(failed, len(items))
+        )
+
+
+async def handle_quick_tool_map_reduce(message, command, tool_config, user_query):
+    """Длинный текст: части обрабатываются параллельно и сводятся в один ответ."""
+    chat_id = message.chat.id
+    cache = services.cache_for(tool_config)
+    if cache is not None:
+        cached_text = await asyncio.to_thread(
+            cache.get, command, tool_config, user_query
+        )
+        if cached_text is not None:
+            await send_quick_tool_result(message, command, user_query, cached_text)
+            return
+
+    tokens = []
+
+    async def call(config, text):
+        response = await quick_tool_request(
+            compile_quick_tool(config, estimator.text), text
+        )
+        tokens.append(response_tokens(response))
+        return response.text
+
+    async def on_progress(done, total):
+        if done < total and edit_budget.try_acquire(chat_id):
+            try:
+                await bot.edit_message_text(
+                    f"Обрабатываю текст по частям: {done}/{total}",
+                    chat_id,
+                    status_msg.message_id,
+                )
+            except Exception:
+                pass
+
+    await bot.send_chat_action(chat_id, "typing")
+    status_msg = await bot.reply_to(
+        message, f"Выполняю команду `/{command}` для длинного текста..."
+    )
+    try:
+        text = await map_reduce.run_async(tool_config, user_query, call, on_progress)
+        if cache is not None:
+            await asyncio.to_thread(
+                cache.put, command, tool_config, user_query, text, sum(tokens)
+            )
+        await delete_quietly(chat_id, status_msg.message_id)
+        await send_quick_tool_result(message, command, user_query, text)
+    except Exception as e:
+        await delete_quietly(chat_id, status_msg.message_id)
+        print(f"Error in quick tool map-reduce '{command}': {e}")
+        await bot.reply_to(
+            message,
+            f"Произошла ошибка при выполнении команды `/{command}`: {e!s}",
+        )
+
+
+@router.command(*QUICK_TOOLS_CONFIG)
+@ensure_user_started
+async def handle_quick_tool_command(message, ctx):
+    """Обрабатывает команды быстрых инструментов (напр., /translate, /prompt)."""
+    chat_id = message.chat.id
+    command, user_query = bot_common.parse_quick_tool(message.text)
+
+    if not user_query:
+        try:
+            user_query = await read_reply_text(message)
+        except Exception as e:
+            await bot.reply_to(message, f"Не удалось прочитать файл: {e!s}")
+            return
+    if not user_query:
+        await bot.reply_to(
+            message, bot_common.missing_query_text(command), parse_mode="Markdown"
+        )
+        return
+
+    tool_config = QUICK_TOOLS_CONFIG[command]
+    plan, detail = bot_common.plan_quick_tool(command, user_query, map_reduce)
+    if plan == "reject":
+        await bot.reply_to(message, detail)
+        return
+    if plan == "batch":
+        await handle_quick_tool_batch(
+            message, command, tool_config, user_query, detail
+        )
+        return
+    if plan == "map_reduce":
+        await handle_quick_tool_map_reduce(message, command, tool_config, user_query)
+        return
+
+    cache = services.cache_for(tool_config)
+    if cache is not None:
+        cached_text = await asyncio.to_thread(
+            cache.get, command, tool_config, user_query
+        )
+        if cached_text is not None:
+            await send_quick_tool_result(message, command, user_query, cached_text)
+            return
+
+    model_to_use, tool_gemini_config, _ = quick_tools[command]
+    check = preflight(
+        model_to_use, texts=[tool_config["system_instruction"], user_query]
+    )
+    if not check.ok:
+        await bot.reply_to(message, check.rejection_text())
+        return
+
+    await bot.send_chat_action(chat_id, "typing")
+    status_msg = await bot.reply_to(message, f"Выполняю команду `/{command}`...")
+
+    try:
+        response, _ = await gemini.call_async(
+            model_to_use,
+            lambda model_name: generate_content(
+                model_name, user_query, tool_gemini_config, check.total
+            ),
+            record=hedger is None,
+        )
+        estimator.observe(check.total, response)
+
+        if is_image_generation_model(model_to_use):
+            raw_response_text = await send_gemini_response_with_images(
+                chat_id, response, reply_to_message_id=message.message_id
+            )
+        else:
+            raw_response_text = response.text
+            if cache is not None:
+                await asyncio.to_thread(
+                    cache.put,
+                    command,
+                    tool_config,
+                    user_query,
+                    raw_response_text,
+                    response_tokens(response),
+                )
+
+        await delete_quietly(chat_id, status_msg.message_id)
+        await send_quick_tool_result(
+            message,
+            command,
+            user_query,
+            raw_response_text,
+            send_text=not is_image_generation_model(model_to_use),
+        )
+
+    except Exception as e:
+        await delete_quietly(chat_id, status_msg.message_id)
+        print(f"Error in quick tool command '{command}': {e}")
+        await bot.reply_to(
+            message,
+            f"Произошла ошибка при выполнении команды `/{command}`: {e!s}",
+        )
+
+
+@router.default
+@ensure_user_started
+async def handle_message(message, ctx):
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+
+    current_mode = ctx.send_mode
+    search_enabled = ctx.search_enabled
+    current_model = ctx.current_model
+
+    if current_mode == SEND_MODE_MANUAL:
+        await asyncio.to_thread(
+            add_to_message_buffer,
+            user_id,
+            {"type": "text", "content": message.text},
+        )
+        buffer_count = await asyncio.to_thread(bot_common.count_buffer, user_id)
+
+        await bot.reply_to(message, bot_common.message_buffered_text(buffer_count))
+        return
+
+    await bot.send_chat_action(chat_id, "typing")
+
+    try:
+        api_message_parts = []
+
+        chat_session = await load_chat(user_id, current_model)
+
+        files_in_context = await asyncio.to_thread(
+            get_file_context_list, user_id
+        )
+        check = await asyncio.to_thread(
+            preflight,
+            current_model,
+            chat_history(chat_session),
+            texts=[message.text],
+            files=files_in_context,
+        )
+        if not check.ok:
+            await bot.reply_to(message, check.rejection_text())
+            return
+        for warning in check.dropped_texts():
+            await bot.send_message(chat_id, warning)
+        files_to_send = check.keep(files_in_context)
+
+        if files_to_send:
+            await bot.send_message(
+                chat_id,
+                f"📎 Использую {len(files_to_send)} файл(а/ов) из контекста...",
+            )
+            context_parts, file_errors = await asyncio.to_thread(
+                build_context_parts, files_to_send, file_uploads
+            )
+            api_message_parts.extend(context_parts)
+            for filename, file_err in file_errors:
+                await bot.send_message(
+                    chat_id,
+                    f"⚠️ Не удалось добавить файл '{filename}' в запрос: {file_err}",
+                )
+
+        api_message_parts.append(message.text)
+
+        async def rebuild():
+            parts, _ = await asyncio.to_thread(
+                build_context_parts, files_to_send, file_uploads
+            )
+            return parts + [message.text]
+
+        gemini_config = build_chat_config(current_model, search_enabled)
+        streaming = STREAMING_ENABLED and not is_image_generation_model(
+            current_model
+        )
+
+        placeholder = None
+        if streaming:
+            stream, chat_session = await send_chat_parts(
+                chat_session,
+                current_model,
+                api_message_parts,
+                rebuild,
+                lambda chat, parts: open_stream_async(chat, parts, gemini_config),
+            )
+            raw_response_text, response, placeholder = (
+                await stream_chat_response_async(
+                    bot,
+                    chat_session,
+                    api_message_parts,
+                    gemini_config,
+                    chat_id,
+                    edit_budget,
+                    reply_to_message_id=message.message_id,
+                    stream=stream,
+                )
+            )
+        else:
+            response, chat_session = await send_chat_parts(
+                chat_session,
+                current_model,
+                api_message_parts,
+                rebuild,
+                lambda chat, parts: chat.send_message(
+                    message=parts, config=gemini_config
+                ),
+            )
+        await asyncio.to_thread(save_active_chat, user_id, chat_session)
+        estimator.observe(check.total, response)
+
+        if files_in_context:
+            await asyncio.to_thread(bot_common.clear_file_contexts, user_id)
+
+        if is_image_generation_model(current_model):
+            raw_response_text = await send_gemini_response_with_images(
+                chat_id, response, reply_to_message_id=message.message_id
+            )
+        elif not streaming:
+            raw_response_text = response.text
+
+        sources_text = extract_sources_text(response)
+        if sources_text:
+            raw_response_text += sources_text
+
+        user_last_responses[user_id] = raw_response_text
+
+        if not is_image_generation_model(current_model):
+            await send_rich_response_async(
+                bot,
+                chat_id,
+                raw_response_text,
+                reply_to_message_id=message.message_id,
+                fallback_download_keyboard=get_file_download_keyboard(user_id),
+            )
+        await delete_placeholder_async(bot, chat_id, placeholder)
+    except Exception as e:
+        await bot.reply_to(
+            message,
+            f"Произошла ошибка: {e!s}\n\nВозможно стоит "
+            f"попробовать другую модель или начать новый чат.",
+            reply_markup=get_main_keyboard(
+                current_mode, search_enabled, current_model
+            ),
+        )
+
+
+async def _serve_webhook():
+    """Принимает апдейты встроенным HTTP-сервером и передаёт их в цикл событий."""
+    loop = asyncio.get_running_loop()
+
+    def submit(updates):
+        asyncio.run_coroutine_threadsafe(bot.process_new_updates(updates), loop)
+
+    server = WebhookServer(
+        WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, submit
+    )
+    metrics.register("webhook", server.stats)
+    await bot.remove_webhook()
+    await bot.set_webhook(
+        url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET
+    )
+    server.start()
+    print(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.shutdown()
+        await bot.close_session()
+
+
+async def _run():
+    await bot.set_my_commands(COMMAND_LIST)
+    try:
+        if BOT_INGESTION == "webhook":
+            await _serve_webhook()
+        else:
+            await bot.remove_webhook()
+            await bot.infinity_polling()
+    finally:
+        # Обработчики дописывают ходы, затем кэш чатов сохраняет остальное
+        await dispatcher.join()
+        await asyncio.to_thread(services.shutdown)
+
+
+def main():
+    db.init_db()
+    if response_cache is not None:
+        response_cache.prune(QUICK_TOOLS_CONFIG)
+    load_whitelist()
+    metrics.start_reporter(METRICS_LOG_INTERVAL)
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Сколько commit (и fsync WAL) стоит один апдейт: отдельные commit в каждой
+функции crud против одного commit через crud.unit_of_work. Время включает
+подготовительную запись в буфер перед каждым апдейтом.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_commits.py [--updates 200]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from database import blob_store, crud  # noqa: E402
+from database.db import Base  # noqa: E402
+
+# Цепочки вызовов crud из обработчиков
+FLOWS = {
+    "/start": lambda db, uid: (
+        crud.get_or_create_user(db, uid),
+        crud.clear_file_contexts(db, uid),
+        crud.clear_buffer(db, uid),
+    ),
+    "Новый чат": lambda db, uid: (
+        crud.clear_chat_session(db, uid),
+        crud.clear_file_contexts(db, uid),
+        crud.clear_buffer(db, uid),
+    ),
+    "выбор модели": lambda db, uid: (
+        crud.update_user_model(db, uid, "gemini-3.7-flash"),
+        crud.clear_chat_session(db, uid),
+        crud.clear_file_contexts(db, uid),
+        crud.clear_buffer(db, uid),
+    ),
+    "Режим:": lambda db, uid: (
+        crud.update_user_send_mode(db, uid, "manual"),
+        crud.clear_buffer(db, uid),
+    ),
+}
+
+
+def make_engine(path):
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # Как у большинства дисков по умолчанию: fsync на каждый commit
+        cursor.execute("PRAGMA synchronous=FULL")
+        cursor.close()
+
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def run(flow, factory, updates, batched):
+    start = time.perf_counter()
+    for i in range(updates):
+        user_id = 1000 + i % 50
+        # В буфере есть что удалять, как в реальном сценарии
+        with factory() as db:
+            crud.add_to_buffer(db, user_id, "text", content="msg")
+        if batched:
+            with crud.unit_of_work(factory) as db:
+                flow(db, user_id)
+        else:
+            with factory() as db:
+                flow(db, user_id)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--updates", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        blob_store.configure(os.path.join(tmp, "blobs"))
+        engine = make_engine(os.path.join(tmp, "bench.db"))
+        factory = sessionmaker(
+            autoflush=False, expire_on_commit=False, bind=engine
+        )
+        commits = [0]
+
+        @event.listens_for(engine, "commit")
+        def count(conn):
+            commits[0] += 1
+
+        print(f"{'обработчик':<14}{'режим':<14}{'commit/апдейт':>14}{'мс/апдейт':>12}")
+        for name, flow in FLOWS.items():
+            for batched in (False, True):
+                commits[0] = 0
+                elapsed = run(flow, factory, args.updates, batched)
+                # Коммит подготовки (add_to_buffer) не учитываем
+                per_update = commits[0] / args.updates - 1
+                print(
+                    f"{name:<14}{'unit_of_work' if batched else 'по функциям':<14}"
+                    f"{per_update:>14.1f}{elapsed / args.updates * 1000:>12.2f}"
+                )
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Подготовка фото перед отправкой в Gemini: пропускная способность
+последовательной обработки и пула процессов, сэкономленные байты и
+оценка токенов картинок до и после уменьшения.
+
+Без --dir генерирует синтетические снимки камеры (4032x3024 JPEG с EXIF).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_image_preprocess.py [--dir photos/] [--edge 1536]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from image_preprocess import ImagePreprocessor  # noqa: E402
+from token_estimator import estimator  # noqa: E402
+
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def synthetic_images(count, size=(4032, 3024)):
+    images = []
+    for i in range(count):
+        # Градиент с шумом: JPEG такого размера весит как фото с телефона
+        noise = Image.effect_noise(size, 40 + i).convert("RGB")
+        gradient = Image.linear_gradient("L").resize(size).convert("RGB")
+        image = Image.blend(noise, gradient, 0.5)
+        exif = Image.Exif()
+        exif[0x0112] = 1
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=92, exif=exif.tobytes())
+        images.append(out.getvalue())
+    return images
+
+
+def folder_images(path):
+    return [
+        open(os.path.join(path, name), "rb").read()
+        for name in sorted(os.listdir(path))
+        if name.lower().endswith(EXTENSIONS)
+    ]
+
+
+def image_tokens(data):
+    with Image.open(io.BytesIO(data)) as image:
+        return estimator.image_size(*image.size)
+
+
+def run(images, edge, workers):
+    preprocessor = ImagePreprocessor({}, edge, workers=workers)
+    jobs = [(data, "image/jpeg", None) for data in images]
+    if workers:
+        # Запуск процессов пула не входит в замер
+        preprocessor.process_many(jobs[:1], "bench")
+    start = time.perf_counter()
+    results = preprocessor.process_many(jobs, "bench")
+    elapsed = time.perf_counter() - start
+    preprocessor.shutdown()
+    return results, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dir", help="папка с фото (по умолчанию синтетика)")
+    parser.add_argument("--count", type=int, default=8)
+    parser.add_argument("--edge", type=int, default=1536)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    args = parser.parse_args()
+
+    images = folder_images(args.dir) if args.dir else synthetic_images(args.count)
+    if not images:
+        sys.exit("Нет картинок для замера")
+
+    for label, workers in (("последовательно", 0), ("пул", args.workers)):
+        results, elapsed = run(images, args.edge, workers)
+        print(
+            f"{label:>16}: {len(images) / elapsed:6.1f} фото/с "
+            f"({elapsed * 1000 / len(images):.0f} мс на фото, workers={workers})"
+        )
+
+    bytes_before = sum(len(data) for data in images)
+    bytes_after = sum(len(data) for data, _ in results)
+    tokens_before = sum(image_tokens(data) for data in images)
+    tokens_after = sum(image_tokens(data) for data, _ in results)
+    print(
+        f"байты: {bytes_before / 1e6:.1f} МБ -> {bytes_after / 1e6:.1f} МБ "
+        f"(-{100 - bytes_after * 100 / bytes_before:.0f}%)"
+    )
+    print(
+        f"токены (оценка): {tokens_before} -> {tokens_after} "
+        f"(-{100 - tokens_after * 100 / tokens_before:.0f}%)"
+    )
+
+
+if __name__ == "__main__":
+    main()
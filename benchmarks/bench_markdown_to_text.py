@@ -0,0 +1,76 @@
+"""
+markdown_to_text: однопроходный конвертер против прежнего пути
+markdown() → HTML → BeautifulSoup на ответах разной длины.
+
+Без --file ответ собирается из корпуса tests/fixtures/markdown_to_text
+(заголовки, списки, таблицы, код, ссылки), повторённого до нужной длины.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_markdown_to_text.py [--sizes 1000 5000 30000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests.markdown_reference import legacy_markdown_to_text  # noqa: E402
+from utils import markdown_to_text  # noqa: E402
+
+CORPUS = os.path.join(ROOT, "tests", "fixtures", "markdown_to_text")
+
+
+def corpus_text():
+    parts = []
+    for name in sorted(os.listdir(CORPUS)):
+        if name.endswith(".md"):
+            with open(os.path.join(CORPUS, name), encoding="utf-8") as f:
+                parts.append(f.read())
+    return "\n\n".join(parts)
+
+
+def sized(text, size):
+    return ((text + "\n\n") * (size // len(text) + 1))[:size]
+
+
+def measure(fn, text, min_time=0.5):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn(text)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 5000, 30000, 100000]
+    )
+    parser.add_argument("--file", help="markdown-файл вместо корпуса")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            base = f.read()
+    else:
+        base = corpus_text()
+
+    print(f"{'символов':>9} {'прежний, мс':>12} {'новый, мс':>10} {'ускорение':>10}")
+    for size in args.sizes:
+        text = sized(base, size)
+        legacy = measure(legacy_markdown_to_text, text)
+        fast = measure(markdown_to_text, text)
+        print(
+            f"{size:>9} {legacy * 1e3:>12.2f} {fast * 1e3:>10.2f} "
+            f"{legacy / fast:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Стоимость выбора обработчика на один апдейт: прежняя цепочка
+@message_handler(func=...) против Router, оба внутри настоящего
+TeleBot.process_new_messages (обработчики пустые, сеть не нужна).
+Плюс сборка конфига быстрого инструмента на каждый вызов против
+готового QuickTool.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_router.py [--updates 20000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telebot  # noqa: E402
+from telebot import types  # noqa: E402
+
+from gemini_helpers import build_quick_tool_config, compile_quick_tools  # noqa: E402
+from quick_tools_config import QUICK_TOOLS_CONFIG  # noqa: E402
+from router import Router  # noqa: E402
+
+# Типичная смесь апдейтов: в основном обычный текст, затем кнопки и команды
+TEXTS = [
+    "Расскажи, как работает фотосинтез",
+    "Привет! Помоги составить письмо",
+    "Что такое map-reduce?",
+    "Новый чат",
+    "Режим: Ручной ✍️",
+    "Поиск: Вкл ✅",
+    "Получить .MD 📄",
+    "/translate Доброе утро",
+    "/proofread Превет мир",
+    "Отправить всё",
+]
+
+
+def noop(message):
+    pass
+
+
+def legacy_bot():
+    """Регистрация обработчиков в том виде, что была до Router."""
+    bot = telebot.TeleBot("1:x", threaded=False)
+    bot.message_handler(commands=["help"])(noop)
+    bot.message_handler(commands=["unlock_pro"])(noop)
+    bot.message_handler(commands=["start"])(noop)
+    bot.message_handler(func=lambda message: message.text == "Новый чат")(noop)
+    bot.message_handler(
+        func=lambda message: message.text.startswith("Получить .")
+    )(noop)
+    bot.message_handler(func=lambda message: message.text.startswith("Режим:"))(noop)
+    bot.message_handler(func=lambda message: message.text.startswith("Поиск:"))(noop)
+    bot.message_handler(func=lambda message: message.text.startswith("Модель:"))(noop)
+    bot.message_handler(func=lambda message: message.text == "Отправить всё")(noop)
+    bot.message_handler(
+        func=lambda message: (
+            message.text
+            and message.text.startswith("/")
+            and message.text.split(" ", 1)[0][1:] in QUICK_TOOLS_CONFIG
+        )
+    )(noop)
+    bot.message_handler(func=lambda message: True)(noop)
+    return bot
+
+
+def router_bot():
+    bot = telebot.TeleBot("1:x", threaded=False)
+    router = Router()
+    router.command("help", "unlock_pro", "start", *QUICK_TOOLS_CONFIG)(noop)
+    router.exact("Новый чат", "Отправить всё")(noop)
+    for prefix in ("Получить .", "Режим:", "Поиск:", "Модель:"):
+        router.prefix(prefix)(noop)
+    router.default(noop)
+    bot.register_message_handler(router.dispatch, content_types=["text"])
+    return bot
+
+
+def make_message(message_id, text):
+    return types.Message.de_json(
+        {
+            "message_id": message_id,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "u"},
+            "text": text,
+        }
+    )
+
+
+def measure(bot, messages):
+    start = time.perf_counter()
+    for message in messages:
+        bot.process_new_messages([message])
+    return (time.perf_counter() - start) / len(messages)
+
+
+def measure_configs(calls):
+    names = list(QUICK_TOOLS_CONFIG)
+    start = time.perf_counter()
+    for i in range(calls):
+        build_quick_tool_config(QUICK_TOOLS_CONFIG[names[i % len(names)]])
+    per_build = (time.perf_counter() - start) / calls
+
+    tools = compile_quick_tools(QUICK_TOOLS_CONFIG, len)
+    start = time.perf_counter()
+    for i in range(calls):
+        tools[names[i % len(names)]]
+    per_lookup = (time.perf_counter() - start) / calls
+    return per_build, per_lookup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+
+    messages = [
+        make_message(i, TEXTS[i % len(TEXTS)]) for i in range(args.updates)
+    ]
+    legacy = measure(legacy_bot(), messages)
+    routed = measure(router_bot(), messages)
+    print(f"цепочка func: {legacy * 1e6:7.1f} мкс на апдейт")
+    print(f"Router:       {routed * 1e6:7.1f} мкс на апдейт ({legacy / routed:.1f}x)")
+
+    per_build, per_lookup = measure_configs(args.updates)
+    print(
+        f"конфиг инструмента: сборка {per_build * 1e6:.1f} мкс, "
+        f"готовый {per_lookup * 1e6:.2f} мкс"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Разбиение длинного ответа на сообщения: прежний split_long_message
+(срез остатка текста и посимвольный разбор части на каждом шаге) против
+генератора iter_message_parts. Проверяет, что части совпадают, и печатает
+время, пиковую память и время до первой части.
+
+Без --file ответ собирается из корпуса tests/fixtures/markdown_to_text.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_split_message.py [--sizes 50000 100000 300000]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from constants import MAX_MESSAGE_LENGTH  # noqa: E402
+from utils import (  # noqa: E402
+    find_split_point,
+    get_closers_and_openers,
+    iter_message_parts,
+    split_long_message,
+)
+
+CORPUS = os.path.join(ROOT, "tests", "fixtures", "markdown_to_text")
+
+
+# Прежняя реализация без изменений (кроме имён)
+def legacy_parse_markdown_state(text: str) -> dict:
+    in_code_block = False
+    code_block_lang = ""
+    in_inline_code = False
+    in_bold = False
+    in_italic = False
+    in_strike = False
+    in_spoiler = False
+
+    lines = text.split("\n")
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            if not in_code_block:
+                in_code_block = True
+                code_block_lang = stripped[3:].strip()
+            else:
+                in_code_block = False
+                code_block_lang = ""
+            continue
+
+        if in_code_block:
+            continue
+
+        i = 0
+        n = len(line)
+        while i < n:
+            if line[i] == "`":
+                in_inline_code = not in_inline_code
+                i += 1
+            elif in_inline_code:
+                i += 1
+            elif line[i : i + 2] == "||":
+                in_spoiler = not in_spoiler
+                i += 2
+            elif line[i : i + 2] == "~~":
+                in_strike = not in_strike
+                i += 2
+            elif line[i : i + 3] == "***":
+                in_bold = not in_bold
+                in_italic = not in_italic
+                i += 3
+            elif line[i : i + 2] == "**":
+                in_bold = not in_bold
+                i += 2
+            elif line[i] == "*":
+                # Не считаем маркированный список (* в начале строки с пробелом) за курсив
+                if i == 0 and len(line) > 1 and line[1] == " ":
+                    i += 1
+                else:
+                    in_italic = not in_italic
+                    i += 1
+            else:
+                i += 1
+
+    return {
+        "in_code_block": in_code_block,
+        "code_block_lang": code_block_lang,
+        "in_inline_code": in_inline_code,
+        "in_bold": in_bold,
+        "in_italic": in_italic,
+        "in_strike": in_strike,
+        "in_spoiler": in_spoiler,
+    }
+
+
+def legacy_split_long_message(text: str, max_length: int) -> list[str]:
+    if not text:
+        return []
+    if len(text) <= max_length:
+        return [text]
+
+    parts = []
+    current_text = text
+    current_prefix = ""
+
+    while current_text:
+        if len(current_text) + len(current_prefix) <= max_length:
+            parts.append(current_prefix + current_text)
+            break
+
+        # Учитываем запас под закрывающие теги (например, **\n```)
+        safety_reserve = min(50, max(0, max_length // 4))
+        available_len = max(1, max_length - len(current_prefix) - safety_reserve)
+
+        candidate_chunk = current_text[:available_len]
+
+        cut_idx, delimiter_len = find_split_point(candidate_chunk)
+
+        raw_chunk = current_text[:cut_idx]
+        current_text = current_text[cut_idx + delimiter_len :].lstrip("\n")
+
+        # Определяем открытые теги в этой части
+        combined_chunk = current_prefix + raw_chunk
+        state = legacy_parse_markdown_state(combined_chunk)
+        suffix, next_prefix = get_closers_and_openers(state)
+
+        final_part = combined_chunk + suffix
+        parts.append(final_part)
+        current_prefix = next_prefix
+
+    return parts
+
+
+def corpus_text():
+    parts = []
+    for name in sorted(os.listdir(CORPUS)):
+        if name.endswith(".md"):
+            with open(os.path.join(CORPUS, name), encoding="utf-8") as f:
+                parts.append(f.read())
+    return "\n\n".join(parts)
+
+
+def sized(text, size):
+    return ((text + "\n\n") * (size // len(text) + 1))[:size]
+
+
+def measure(fn, min_time=0.5):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / calls
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[50000, 100000, 300000]
+    )
+    parser.add_argument("--max-length", type=int, default=MAX_MESSAGE_LENGTH)
+    parser.add_argument("--file", help="markdown-файл вместо корпуса")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            base = f.read()
+    else:
+        base = corpus_text()
+
+    for size in args.sizes:
+        text = sized(base, size)
+        parts = split_long_message(text, args.max_length)
+        if parts != legacy_split_long_message(text, args.max_length):
+            print(f"{size}: части отличаются от прежней реализации!")
+
+        legacy = measure(lambda: legacy_split_long_message(text, args.max_length))
+        fast = measure(lambda: split_long_message(text, args.max_length))
+        first = measure(lambda: next(iter_message_parts(text, args.max_length)))
+        legacy_peak = peak_memory(
+            lambda: legacy_split_long_message(text, args.max_length)
+        )
+        fast_peak = peak_memory(lambda: split_long_message(text, args.max_length))
+        print(
+            f"{size} символов, {len(parts)} частей: "
+            f"{legacy * 1e3:.2f} мс -> {fast * 1e3:.2f} мс ({legacy / fast:.1f}x), "
+            f"первая часть за {first * 1e3:.3f} мс, "
+            f"пик памяти {legacy_peak / 1024:.0f} -> {fast_peak / 1024:.0f} КиБ"
+        )
+
+
+if __name__ == "__main__":
+    main()
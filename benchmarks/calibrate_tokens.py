@@ -0,0 +1,107 @@
+"""
+Пересчитывает token_calibration.json по реальным подсчётам Gemini
+(client.models.count_tokens) для переданных образцов и печатает, насколько
+локальная оценка расходится с ними до и после калибровки.
+
+Образцы — текстовые файлы, картинки и PDF; тип определяется по расширению.
+Запуск из корня репозитория (нужен GEMINI_API_KEY):
+    python benchmarks/calibrate_tokens.py samples/*.txt samples/*.png samples/*.pdf \
+        [--model gemini-3.7-flash] [--write]
+"""
+
+import argparse
+import json
+import mimetypes
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google import genai  # noqa: E402
+from google.genai import types as genai_types  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from constants import DEFAULT_MODEL, GEMINI_API_KEY  # noqa: E402
+from token_estimator import (  # noqa: E402
+    CALIBRATION_PATH,
+    TokenEstimator,
+    _cyrillic_share,
+    pdf_page_count,
+)
+
+
+def count_tokens(client, model, part):
+    return client.models.count_tokens(model=model, contents=[part]).total_tokens
+
+
+def measure(client, model, path):
+    """Строка калибровочной таблицы (раздел, строка) для файла."""
+    with open(path, "rb") as f:
+        data = f.read()
+    mime_type = mimetypes.guess_type(path)[0] or "text/plain"
+    name = os.path.basename(path)
+    if mime_type.startswith("image/"):
+        width, height = Image.open(path).size
+        part = genai_types.Part.from_bytes(data=data, mime_type=mime_type)
+        row = {"width": width, "height": height}
+        section = "image"
+    elif mime_type == "application/pdf":
+        part = genai_types.Part.from_bytes(data=data, mime_type=mime_type)
+        row = {"pages": pdf_page_count(data)}
+        section = "pdf"
+    else:
+        text = data.decode("utf-8", errors="replace")
+        part = genai_types.Part(text=text)
+        row = {
+            "sample": name,
+            "chars": len(text),
+            "cyrillic": round(_cyrillic_share(text), 3),
+        }
+        section = "text"
+    row["tokens"] = count_tokens(client, model, part)
+    return section, row, part
+
+
+def report(title, estimator, samples):
+    errors = [
+        abs(estimator.part(part) - row["tokens"]) / row["tokens"]
+        for _, row, part in samples
+        if row["tokens"]
+    ]
+    mean = sum(errors) / len(errors) * 100 if errors else 0.0
+    worst = max(errors, default=0) * 100
+    print(f"{title}: средняя ошибка {mean:.1f}%, максимум {worst:.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument(
+        "--write", action="store_true", help="перезаписать token_calibration.json"
+    )
+    args = parser.parse_args()
+
+    client = genai.Client(api_key=GEMINI_API_KEY)
+    samples = [measure(client, args.model, path) for path in args.paths]
+
+    with open(CALIBRATION_PATH, encoding="utf-8") as f:
+        old = json.load(f)
+    report("Текущая калибровка", TokenEstimator(old), samples)
+
+    # Разделы без новых образцов остаются прежними
+    calibration = {"source": f"count_tokens, {args.model}", "calibrated": True}
+    for section in ("text", "image", "pdf"):
+        rows = [row for kind, row, _ in samples if kind == section]
+        calibration[section] = rows or old[section]
+    report("Новая калибровка", TokenEstimator(calibration), samples)
+
+    if args.write:
+        with open(CALIBRATION_PATH, "w", encoding="utf-8") as f:
+            json.dump(calibration, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"Записано в {CALIBRATION_PATH}")
+
+
+if __name__ == "__main__":
+    main()
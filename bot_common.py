@@ -0,0 +1,462 @@
+"""
+Общая часть обоих рантаймов бота (gemini_bot.py и async_bot.py).
+
+Здесь собраны сервисы, операции с БД, тексты ответов и выбор способа
+выполнения быстрого инструмента. Рантаймы отличаются только вводом-выводом:
+вызовы Telegram и Gemini выполняются синхронно или через await, а
+операции с БД в asyncio-рантайме выносятся в поток (asyncio.to_thread).
+"""
+
+import metrics
+import quick_batch
+from compaction import HistoryCompactor, gemini_summarizer
+from constants import (
+    COMMAND_LIST,
+    FILES_API_ENABLED,
+    FILES_API_EXPIRY_MARGIN,
+    FILES_API_MIN_BYTES,
+    GEMINI_BREAKER_RESET,
+    GEMINI_BREAKER_THRESHOLD,
+    GEMINI_FALLBACKS,
+    GEMINI_MAX_ATTEMPTS,
+    GEMINI_RETRY_BASE_DELAY,
+    GEMINI_RETRY_MAX_DELAY,
+    GEMINI_SYNC_RETRY_BUDGET,
+    GREETING_MESSAGE_TEMPLATE,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_MODELS,
+    HEDGE_PERCENTILE,
+    HEDGING_ENABLED,
+    HELP_TEXT_TEMPLATE,
+    HISTORY_COMPACTION,
+    HISTORY_KEEP_MEDIA_TURNS,
+    HISTORY_SUMMARY_MODEL,
+    HISTORY_TOKEN_BUDGET,
+    HISTORY_TOKEN_BUDGETS,
+    IMAGE_CACHE_MB,
+    IMAGE_JPEG_QUALITY,
+    IMAGE_MAX_EDGE,
+    IMAGE_MAX_EDGES,
+    IMAGE_WORKERS,
+    MAP_REDUCE_CHUNK_CHARS,
+    MAP_REDUCE_CONCURRENCY,
+    MAP_REDUCE_MAX_CHARS,
+    MAP_REDUCE_MODEL,
+    MAX_FILE_SIZE_MB,
+    QUICK_TOOL_BATCH_CONCURRENCY,
+    QUICK_TOOL_BATCH_MAX_CHARS,
+    QUICK_TOOL_BATCH_MAX_ITEMS,
+    QUICK_TOOL_BATCH_MIN_ITEMS,
+    QUICK_TOOL_CACHE_ENABLED,
+    QUICK_TOOL_CACHE_MAX_ENTRIES,
+    QUICK_TOOL_CACHE_TTL,
+    QUICK_TOOL_MAX_CHARS,
+    QUICK_TOOLS_CONFIG,
+    SEND_MODE_IMMEDIATE,
+    SEND_MODE_MANUAL,
+    SUPPORTED_MIME_TYPES,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_GROUP_RATE,
+    TELEGRAM_MAX_RETRIES,
+    TELEGRAM_RATE_LIMIT_ENABLED,
+    get_model_alias,
+    is_image_generation_model,
+)
+from file_uploads import FileUploadCache
+from gemini_helpers import compile_quick_tools
+from hedging import Hedger
+from image_preprocess import ImagePreprocessor
+from map_reduce import MapReduce
+from persistence import user_chats
+from rate_limiter import OutboundLimiter
+from resilience import ResilientGemini
+from response_cache import ResponseCache
+from router import command_args, command_name
+from token_estimator import estimator
+from whitelist import is_whitelisted
+
+from database import crud, user_cache
+from database.db import SessionLocal
+
+PRO_MODEL_NAME = "gemini-3.1-pro-preview"
+
+# Ответ этих инструментов дополнительно отправляется .md-файлом
+QUICK_TOOL_FILE_COMMANDS = ("todo", "markdown", "dayplanner")
+
+START_REQUIRED_TEXT = "Пожалуйста, введите /start для начала работы."
+
+
+class Services:
+    """Сервисы, не зависящие от рантайма; создаются при импорте модуля бота."""
+
+    def __init__(self, client):
+        metrics.register("chat_cache", user_chats.stats)
+        metrics.register("user_cache", user_cache.stats)
+        metrics.register("tokens", estimator.stats)
+
+        self.file_uploads = None
+        if FILES_API_ENABLED:
+            self.file_uploads = FileUploadCache(
+                client.files, FILES_API_MIN_BYTES, FILES_API_EXPIRY_MARGIN
+            )
+            metrics.register("file_uploads", self.file_uploads.stats)
+
+        self.compactor = None
+        if HISTORY_COMPACTION != "off":
+            self.compactor = HistoryCompactor(
+                HISTORY_TOKEN_BUDGETS,
+                HISTORY_TOKEN_BUDGET,
+                HISTORY_KEEP_MEDIA_TURNS,
+                summarize=gemini_summarizer(client.models, HISTORY_SUMMARY_MODEL),
+                mode=HISTORY_COMPACTION,
+            )
+            metrics.register("compaction", self.compactor.stats)
+
+        self.gemini = ResilientGemini(
+            GEMINI_MAX_ATTEMPTS,
+            GEMINI_RETRY_BASE_DELAY,
+            GEMINI_RETRY_MAX_DELAY,
+            GEMINI_BREAKER_THRESHOLD,
+            GEMINI_BREAKER_RESET,
+            GEMINI_FALLBACKS,
+            GEMINI_SYNC_RETRY_BUDGET,
+        )
+        metrics.register("gemini_resilience", self.gemini.stats)
+
+        self.hedger = None
+        if HEDGING_ENABLED:
+            # Пачка и map-reduce одновременно, у каждого запроса — место под дубль
+            fan_out = QUICK_TOOL_BATCH_CONCURRENCY + MAP_REDUCE_CONCURRENCY
+            self.hedger = Hedger(
+                HEDGE_MODELS,
+                HEDGE_PERCENTILE,
+                HEDGE_MIN_SAMPLES,
+                max_workers=2 * fan_out,
+                gemini=self.gemini,
+            )
+            metrics.register("hedging", self.hedger.stats)
+
+        self.image_preprocessor = ImagePreprocessor(
+            IMAGE_MAX_EDGES,
+            IMAGE_MAX_EDGE,
+            IMAGE_JPEG_QUALITY,
+            IMAGE_WORKERS,
+            int(IMAGE_CACHE_MB * 1024 * 1024),
+        )
+        metrics.register("image_preprocess", self.image_preprocessor.stats)
+
+        self.response_cache = None
+        if QUICK_TOOL_CACHE_ENABLED:
+            self.response_cache = ResponseCache(
+                QUICK_TOOL_CACHE_MAX_ENTRIES, QUICK_TOOL_CACHE_TTL
+            )
+            metrics.register("quick_tool_cache", self.response_cache.stats)
+
+        self.map_reduce = MapReduce(
+            MAP_REDUCE_CHUNK_CHARS, MAP_REDUCE_MODEL, MAP_REDUCE_CONCURRENCY
+        )
+        self.quick_tools = compile_quick_tools(QUICK_TOOLS_CONFIG, estimator.text)
+
+    def cache_for(self, tool_config):
+        """Кэш ответов для инструмента или None, если кэшировать нельзя."""
+        if self.response_cache is None:
+            return None
+        if not self.response_cache.enabled_for(tool_config):
+            return None
+        return self.response_cache
+
+    def shutdown(self):
+        """
+        При остановке бота: сохраняет чаты, чьи ходы ещё не записаны в БД
+        (save_active_chat не удался), и останавливает пул обработки фото.
+        Вызывать после того, как диспетчер дождался обработчиков.
+        """
+        try:
+            user_chats.flush()
+        finally:
+            self.image_preprocessor.shutdown()
+
+
+def outbound_limiter():
+    """Лимитер исходящих запросов к Telegram или None, если он выключен."""
+    if not TELEGRAM_RATE_LIMIT_ENABLED:
+        return None
+    limiter = OutboundLimiter(
+        TELEGRAM_GLOBAL_RATE,
+        TELEGRAM_CHAT_RATE,
+        TELEGRAM_CHAT_BURST,
+        TELEGRAM_GROUP_RATE,
+        TELEGRAM_MAX_RETRIES,
+    )
+    metrics.register("telegram_outbound", limiter.stats)
+    return limiter
+
+
+# --- Операции с БД (в asyncio-рантайме выполняются в потоке) ---
+
+
+def start_user(user_id):
+    """Создаёт пользователя при необходимости и очищает файлы и буфер."""
+    with crud.unit_of_work() as session:
+        user = crud.get_or_create_user(session, user_id)
+        settings = (user.send_mode, user.search_enabled, user.current_model)
+        crud.clear_file_contexts(session, user_id)
+        crud.clear_buffer(session, user_id)
+    return settings
+
+
+def reset_chat(user_id, model=None):
+    """Очищает историю и контекст; при model сохраняет новую модель."""
+    with crud.unit_of_work() as session:
+        if model:
+            crud.update_user_model(session, user_id, model)
+        crud.clear_chat_session(session, user_id)
+        crud.clear_file_contexts(session, user_id)
+        crud.clear_buffer(session, user_id)
+    user_chats.pop(user_id, None)
+
+
+def toggle_send_mode(user_id, current_mode):
+    """Переключает режим отправки и очищает буфер; возвращает настройки."""
+    new_mode = (
+        SEND_MODE_MANUAL
+        if current_mode == SEND_MODE_IMMEDIATE
+        else SEND_MODE_IMMEDIATE
+    )
+    with crud.unit_of_work() as session:
+        user = crud.update_user_send_mode(session, user_id, new_mode)
+        settings = (user.send_mode, user.search_enabled, user.current_model)
+        crud.clear_buffer(session, user_id)
+    return settings
+
+
+def toggle_search(user_id, search_enabled):
+    """Переключает поиск Google; возвращает настройки."""
+    with SessionLocal() as session:
+        user = crud.update_user_search_enabled(
+            session, user_id, not search_enabled
+        )
+        return user.send_mode, user.search_enabled, user.current_model
+
+
+def count_buffer(user_id):
+    with SessionLocal() as session:
+        return crud.count_buffer(session, user_id)
+
+
+def count_file_contexts(user_id):
+    with SessionLocal() as session:
+        return crud.count_file_contexts(session, user_id)
+
+
+def clear_buffer(user_id):
+    with SessionLocal() as session:
+        crud.clear_buffer(session, user_id)
+
+
+def clear_file_contexts(user_id):
+    with SessionLocal() as session:
+        crud.clear_file_contexts(session, user_id)
+
+
+# --- Тексты ответов ---
+
+
+def help_text():
+    """Справка со списком команд."""
+    text = HELP_TEXT_TEMPLATE.format(
+        MAX_FILE_SIZE_MB=MAX_FILE_SIZE_MB,
+        SEND_MODE_IMMEDIATE=SEND_MODE_IMMEDIATE,
+        SEND_MODE_MANUAL=SEND_MODE_MANUAL,
+    )
+    for command_info in COMMAND_LIST:
+        if command_info.command not in ["/start"]:
+            example = ""
+            if command_info.command == "/translate":
+                example = " (напр. `/translate привет мир`)"
+            elif command_info.command == "/prompt":
+                example = " (напр. `/prompt напиши стих`)"
+            text += f"- *{command_info.command}*: {command_info.description}{example}\n"
+    text += "- *Пример:* `/translate Hello world`\n"
+    return text
+
+
+def search_status(search_enabled):
+    return "Вкл ✅" if search_enabled else "Выкл ❌"
+
+
+def greeting_text(send_mode, search_enabled, current_model):
+    return GREETING_MESSAGE_TEMPLATE.format(
+        model_name=get_model_alias(current_model),
+        send_mode=send_mode,
+        search_status=search_status(search_enabled),
+        send_mode_immediate=SEND_MODE_IMMEDIATE,
+        send_mode_manual=SEND_MODE_MANUAL,
+    )
+
+
+def new_chat_text(send_mode, search_enabled, current_model):
+    return (
+        f"Начат новый чат. Контекст предыдущего разговора очищен.\n\n"
+        f"Текущая модель: {get_model_alias(current_model)}\n"
+        f"Режим отправки: {send_mode}\n"
+        f"Поиск Google: {search_status(search_enabled)}"
+    )
+
+
+def send_mode_text(new_mode):
+    text = f"Режим отправки изменен на: *{new_mode}*\n\n"
+    if new_mode == SEND_MODE_MANUAL:
+        text += (
+            "Теперь ваши сообщения будут накапливаться. Нажмите кнопку "
+            "'Отправить всё', чтобы отправить их в Gemini."
+        )
+    else:
+        text += "Теперь каждое ваше сообщение будет сразу отправляться в Gemini."
+    return text
+
+
+def filename_base(text, default):
+    """Имя файла из первых трёх слов текста без разделителей пути."""
+    words = text.split()
+    base = "_".join(words[:3]) if len(words) > 0 else default
+    return base.replace("/", "_").replace("\\", "_").replace(":", "_")
+
+
+def quick_tool_filename(command, user_query):
+    """Имя .md-файла с ответом инструмента или None, если файл не нужен."""
+    if command not in QUICK_TOOL_FILE_COMMANDS:
+        return None
+    return f"{filename_base(user_query, command)}_{command}.md"
+
+
+def model_access_denied(user_id, model):
+    """Название закрытой группы моделей или None, если доступ есть."""
+    if is_whitelisted(user_id):
+        return None
+    if model == PRO_MODEL_NAME:
+        return "про модели"
+    if is_image_generation_model(model):
+        return "модели генерации изображений"
+    return None
+
+
+def document_too_large_text(filename):
+    return (
+        f"❌ Файл '{filename}' слишком большой "
+        f"(> {MAX_FILE_SIZE_MB} МБ). Я могу обрабатывать файлы размером "
+        f"до {MAX_FILE_SIZE_MB} МБ."
+    )
+
+
+def document_added_text(filename, mime_type, caption, context_count, buffer_count=None):
+    """Ответ на добавленный документ; buffer_count — только в ручном режиме."""
+    file_type_short = mime_type.split("/")[-1].upper()
+    if buffer_count is None:
+        return (
+            f"✅ Файл '{filename}' ({file_type_short}) добавлен в контекст "
+            f"(всего: {context_count}). "
+            "Он будет автоматически использован при следующем текстовом запросе."
+        )
+    return (
+        f"📄 Файл '{filename}' ({file_type_short}) добавлен в буфер "
+        f"({buffer_count} шт.). "
+        + ("Подпись также добавлена.\n" if caption else "\n")
+        + f"Всего файлов в контексте: {context_count}.\n"
+        + "Нажмите 'Отправить всё', когда будете готовы."
+    )
+
+
+def unsupported_document_text(mime_type):
+    supported_types_str = ", ".join(
+        sorted(
+            [
+                t.split("/")[-1].upper()
+                for t in SUPPORTED_MIME_TYPES
+                if not t.startswith("application/x")
+            ]
+        )
+    )
+    return (
+        f"Извините, я не могу обработать этот тип файла ({mime_type}). \n"
+        f"Поддерживаемые типы: {supported_types_str}"
+    )
+
+
+def photo_buffered_text(buffer_count, caption):
+    return (
+        f"Фото добавлено в буфер ({buffer_count} шт.). "
+        + ("Подпись также добавлена.\n" if caption else "\n")
+        + "Нажмите 'Отправить всё', когда будете готовы."
+    )
+
+
+def message_buffered_text(buffer_count):
+    return (
+        f"Сообщение добавлено в буфер ({buffer_count} шт.). "
+        "Нажмите 'Отправить всё', когда будете готовы."
+    )
+
+
+# --- Быстрые инструменты ---
+
+
+def missing_query_text(command):
+    return (
+        f"Пожалуйста, укажите текст после команды /{command}.\n"
+        f"Например: `/{command} ваш текст здесь`\n"
+        "Или ответьте командой на сообщение или текстовый файл."
+    )
+
+
+def parse_quick_tool(text):
+    """(команда без "/" и "@бот", запрос) из текста команды инструмента."""
+    return command_name(text), command_args(text)
+
+
+def plan_quick_tool(command, user_query, map_reduce):
+    """
+    Способ выполнения инструмента: ("batch", Batch) — по элементам,
+    ("map_reduce", None) — длинный текст по частям, ("single", None) —
+    одним запросом, ("reject", текст ответа) — если текст не подходит.
+    """
+    tool_config = QUICK_TOOLS_CONFIG[command]
+    batch = quick_batch.split_input(
+        tool_config, user_query, QUICK_TOOL_BATCH_MIN_ITEMS, QUICK_TOOL_MAX_CHARS
+    )
+    if batch is not None:
+        items = batch.items
+        if (
+            len(items) > QUICK_TOOL_BATCH_MAX_ITEMS
+            or len(user_query) > QUICK_TOOL_BATCH_MAX_CHARS
+            or max(len(item) for item in items) > QUICK_TOOL_MAX_CHARS
+        ):
+            return "reject", (
+                f"Слишком большой пакет для /{command}: не больше "
+                f"{QUICK_TOOL_BATCH_MAX_ITEMS} элементов по {QUICK_TOOL_MAX_CHARS} "
+                f"символов, всего до {QUICK_TOOL_BATCH_MAX_CHARS} символов."
+            )
+        return "batch", batch
+
+    if len(user_query) <= QUICK_TOOL_MAX_CHARS:
+        return "single", None
+    if not map_reduce.enabled_for(tool_config):
+        return "reject", (
+            f"Текст слишком длинный для команды /{command}. "
+            f"Максимум {QUICK_TOOL_MAX_CHARS} символов."
+        )
+    if len(user_query) > MAP_REDUCE_MAX_CHARS:
+        return "reject", (
+            f"Текст слишком длинный для команды /{command}. "
+            f"Максимум {MAP_REDUCE_MAX_CHARS} символов."
+        )
+    return "map_reduce", None
+
+
+def batch_failed_text(failed, total):
+    return (
+        f"⚠️ Не удалось обработать {failed} из {total} элементов, "
+        "они отмечены ⚠️ и оставлены без изменений."
+    )
@@ -0,0 +1,218 @@
+"""
+Ограниченный кэш активных чатов Gemini (LRU + TTL).
+
+Объект чата держит всю историю, включая картинки от модели генерации
+изображений, поэтому кэш ограничен и по числу записей, и по оценке размера
+в байтах. Записи, к которым давно не обращались, истекают по TTL. При
+вытеснении несохранённая история записывается через on_evict, а
+get_active_chat потом прозрачно поднимает чат из БД.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_history_bytes(history):
+    """Грубая оценка размера истории: текст и inline-данные частей."""
+    total = 0
+    for content in history or []:
+        for part in getattr(content, "parts", None) or []:
+            text = getattr(part, "text", None)
+            if text:
+                total += len(text.encode("utf-8"))
+            inline_data = getattr(part, "inline_data", None)
+            data = getattr(inline_data, "data", None) if inline_data else None
+            if data:
+                total += len(data)
+    return total
+
+
+def chat_history(chat):
+    """История чата для сохранения и оценки размера."""
+    if hasattr(chat, "get_history"):
+        return chat.get_history()
+    return getattr(chat, "_curated_history", [])
+
+
+class _Entry:
+    __slots__ = ("chat", "size", "saved_len", "last_access", "tokens", "counted")
+
+    def __init__(self, chat, size, saved_len, now):
+        self.chat = chat
+        self.size = size
+        self.saved_len = saved_len
+        self.last_access = now
+        # Нарастающая оценка токенов первых counted ходов истории
+        self.tokens = 0
+        self.counted = 0
+
+
+class ChatCache:
+    """
+    LRU-кэш чатов с TTL. on_evict(key, chat) вызывается вне блокировки для
+    вытесненных чатов, история которых выросла с последнего сохранения.
+    """
+
+    def __init__(self, max_entries, max_bytes, ttl, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Возвращает чат и отмечает обращение или None, если чата нет."""
+        now = time.monotonic()
+        with self._lock:
+            evicted = self._expire(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                entry.last_access = now
+                self._entries.move_to_end(key)
+        self._write_back(evicted)
+        return entry.chat if entry else None
+
+    def peek(self, key):
+        """Чат без учёта в счётчиках и без продления TTL."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.chat if entry else None
+
+    def put(self, key, chat, history=None):
+        """
+        Кладёт чат в кэш. history — уже известная история (например, только
+        что загруженная из БД), чтобы не запрашивать её у чата повторно.
+        """
+        if history is None:
+            history = chat_history(chat)
+        now = time.monotonic()
+        entry = _Entry(chat, estimate_history_bytes(history), len(history), now)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            evicted = self._expire(now) + self._shrink()
+        self._write_back(evicted)
+
+    def mark_saved(self, key, history):
+        """Обновляет размер записи после сохранения истории в БД."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            size = estimate_history_bytes(history)
+            self._bytes += size - entry.size
+            entry.size = size
+            entry.saved_len = len(history)
+            evicted = self._shrink()
+        self._write_back(evicted)
+
+    def tokens(self, key, history, estimate):
+        """
+        Оценка токенов истории чата key: estimate(turns) вызывается только
+        для ходов, добавленных с прошлого вызова.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return estimate(history)
+        if entry.counted > len(history):
+            entry.tokens, entry.counted = 0, 0
+        if entry.counted < len(history):
+            entry.tokens += estimate(history[entry.counted :])
+            entry.counted = len(history)
+        return entry.tokens
+
+    def pop(self, key, default=None):
+        """Удаляет чат без сохранения (сброс или смена модели)."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._bytes -= entry.size
+            return entry.chat
+
+    def __delitem__(self, key):
+        if self.pop(key) is None:
+            raise KeyError(key)
+
+    def flush(self):
+        """Сохраняет несохранённые чаты (Services.shutdown при остановке бота)."""
+        with self._lock:
+            items = list(self._entries.items())
+        self._write_back(items)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    # Вызываются под self._lock и возвращают вытесненные записи
+
+    def _expire(self, now):
+        evicted = []
+        if not self.ttl or self.ttl <= 0:
+            return evicted
+        # Порядок OrderedDict совпадает с порядком обращений
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry.last_access < self.ttl:
+                break
+            self._remove_oldest()
+            self.expirations += 1
+            evicted.append((key, entry))
+        return evicted
+
+    def _shrink(self):
+        evicted = []
+        # Самую свежую запись не трогаем, даже если она одна больше лимита
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            evicted.append(self._remove_oldest())
+            self.evictions += 1
+        return evicted
+
+    def _remove_oldest(self):
+        key, entry = self._entries.popitem(last=False)
+        self._bytes -= entry.size
+        return key, entry
+
+    def _write_back(self, evicted):
+        if not self.on_evict:
+            return
+        for key, entry in evicted:
+            try:
+                if len(chat_history(entry.chat)) != entry.saved_len:
+                    self.on_evict(key, entry.chat)
+            except Exception as e:
+                print(f"Не удалось сохранить вытесненный чат {key}: {e}")
@@ -0,0 +1,292 @@
+"""
+Сжатие истории чата по бюджету токенов.
+
+get_active_chat передаёт в Gemini всю сохранённую историю, поэтому без
+ограничения каждый ход длинного чата дороже и медленнее предыдущего. Когда
+оценка истории превышает бюджет модели, HistoryCompactor:
+
+1. убирает картинки и файлы из старых ходов (они самые «тяжёлые»);
+2. если этого мало — заменяет начало истории кратким содержанием
+   (пара синтетических ходов user/model) или просто отбрасывает его
+   (скользящее окно).
+
+Сжимает с запасом (до target_ratio бюджета), чтобы следующая пара сообщений
+не вызывала сжатие снова. Краткое содержание для чата пользователя пишется в
+фоне: текущий ход идёт с несжатой историей, а результат подставляется на
+одном из следующих ходов.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from google.genai import types as genai_types
+
+from token_estimator import estimator
+
+# Ответ суммаризатора не длиннее этого (резервируется в бюджете)
+SUMMARY_MAX_TOKENS = 1024
+# Сколько кратких содержаний пишется одновременно
+SUMMARY_WORKERS = 2
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части разговора:\n"
+SUMMARY_ACK = "Понял, продолжаем с учётом этого."
+SUMMARY_PROMPT = (
+    "Сожми переписку пользователя с ассистентом в краткое содержание на языке "
+    "переписки. Сохрани факты о пользователе, принятые решения, важные данные "
+    "(имена, числа, код) и открытые вопросы. Без вступлений.\n\n"
+)
+MEDIA_PLACEHOLDER = "[вложение удалено из истории]"
+
+MODE_SUMMARIZE = "summarize"
+MODE_WINDOW = "window"
+
+
+def _has_media(part):
+    return (
+        getattr(part, "inline_data", None) is not None
+        or getattr(part, "file_data", None) is not None
+    )
+
+
+def strip_media(content):
+    """Копия хода без картинок, файлов и мыслей модели (или сам ход, если их нет)."""
+    parts = getattr(content, "parts", None) or []
+    if not any(_has_media(part) or part.thought for part in parts):
+        return content
+    stripped = []
+    for part in parts:
+        if part.thought:
+            continue
+        if _has_media(part):
+            # Подпись мысли сохраняем: модели Gemini 3 сверяют её в истории
+            stripped.append(
+                genai_types.Part(
+                    text=MEDIA_PLACEHOLDER,
+                    thought_signature=part.thought_signature,
+                )
+            )
+        else:
+            stripped.append(part)
+    return genai_types.Content(role=content.role, parts=stripped)
+
+
+def render_transcript(history):
+    """Текст переписки для суммаризатора (только текстовые части)."""
+    lines = []
+    for content in history:
+        speaker = "Пользователь" if content.role == "user" else "Ассистент"
+        text = "\n".join(
+            part.text
+            for part in content.parts or []
+            if part.text and not part.thought
+        )
+        if text:
+            lines.append(f"{speaker}: {text}")
+    return "\n\n".join(lines)
+
+
+def gemini_summarizer(models, model_name):
+    """summarize(history) -> str на основе client.models.generate_content."""
+
+    def summarize(history):
+        response = models.generate_content(
+            model=model_name,
+            contents=SUMMARY_PROMPT + render_transcript(history),
+            config=genai_types.GenerateContentConfig(
+                max_output_tokens=SUMMARY_MAX_TOKENS
+            ),
+        )
+        if not response.text:
+            raise ValueError("Пустое краткое содержание")
+        return response.text.strip()
+
+    return summarize
+
+
+def _summary_turns(summary):
+    return [
+        genai_types.Content(
+            role="user", parts=[genai_types.Part(text=SUMMARY_PREFIX + summary)]
+        ),
+        genai_types.Content(role="model", parts=[genai_types.Part(text=SUMMARY_ACK)]),
+    ]
+
+
+def _window_start(history, target):
+    """
+    Индекс первого хода пользователя, с которого хвост истории укладывается
+    в target. Если не укладывается даже последний обмен — индекс последнего
+    хода пользователя (без него продолжить разговор нельзя).
+    """
+    starts = [
+        index
+        for index, content in enumerate(history)
+        if index > 0 and content.role == "user"
+    ]
+    if not starts:
+        return 0
+    tail = 0
+    fits = None
+    position = len(history)
+    for start in reversed(starts):
+        tail += estimator.history(history[start:position])
+        position = start
+        if tail > target:
+            break
+        fits = start
+    return fits if fits is not None else starts[-1]
+
+
+class _SummaryJob:
+    """Фоновое краткое содержание первых length ходов истории."""
+
+    __slots__ = ("length", "first", "last", "future")
+
+    def __init__(self, head, future):
+        self.length = len(head)
+        self.first = head[0]
+        self.last = head[-1]
+        self.future = future
+
+    def matches(self, history):
+        """Начало history — те же ходы (история не сброшена и не перезагружена)."""
+        return (
+            len(history) >= self.length
+            and history[0] is self.first
+            and history[self.length - 1] is self.last
+        )
+
+
+class HistoryCompactor:
+    """
+    budgets — бюджет токенов истории по моделям, default_budget — для
+    остальных. keep_media_turns — сколько последних ходов сохраняют вложения.
+    summarize(history) -> str; без него (или при mode="window") начало
+    истории отбрасывается.
+    """
+
+    def __init__(
+        self,
+        budgets,
+        default_budget,
+        keep_media_turns=4,
+        summarize=None,
+        mode=MODE_SUMMARIZE,
+        target_ratio=0.6,
+    ):
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.keep_media_turns = keep_media_turns
+        self.summarize = summarize if mode == MODE_SUMMARIZE else None
+        self.target_ratio = target_ratio
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._executor = None
+        if self.summarize:
+            self._executor = ThreadPoolExecutor(
+                max_workers=SUMMARY_WORKERS, thread_name_prefix="summary"
+            )
+        self.compactions = 0
+        self.summarized = 0
+        self.windowed = 0
+        self.media_only = 0
+        self.summary_failures = 0
+        self.tokens_removed = 0
+
+    def budget_for(self, model_name):
+        return self.budgets.get(model_name, self.default_budget)
+
+    def compact(self, history, model_name, tokens=None, key=None):
+        """
+        Возвращает сжатую историю (новый список) или None, если история
+        укладывается в бюджет модели. tokens — уже известная оценка истории
+        (кэш чатов ведёт её нарастающим итогом). С key краткое содержание
+        пишется в фоне, а пока оно не готово, возвращается None.
+        """
+        budget = self.budget_for(model_name)
+        before = estimator.history(history) if tokens is None else tokens
+        if not budget or before <= budget:
+            return None
+        if key is not None and self._pending(key, history):
+            return None
+        target = int(budget * self.target_ratio)
+
+        keep_from = max(len(history) - self.keep_media_turns, 0)
+        compacted = [strip_media(content) for content in history[:keep_from]]
+        compacted += history[keep_from:]
+        if estimator.history(compacted) <= target:
+            self._record(before, compacted, "media_only")
+            return compacted
+
+        reserve = SUMMARY_MAX_TOKENS if self.summarize else 0
+        start = _window_start(compacted, max(target - reserve, 0))
+        head, tail = compacted[:start], compacted[start:]
+        kind = "windowed"
+        if self.summarize and head:
+            if key is None:
+                summary = self._summarize(head)
+            else:
+                done = self._take_summary(key, history, head)
+                if done is None:
+                    return None
+                length, summary = done
+                if summary is not None:
+                    # Ходы, добавленные, пока писалось содержание, остаются
+                    tail = compacted[length:]
+            if summary is not None:
+                tail = _summary_turns(summary) + tail
+                kind = "summarized"
+        self._record(before, tail, kind)
+        return tail
+
+    def _summarize(self, head):
+        """Краткое содержание или None, если суммаризатор не справился."""
+        try:
+            return self.summarize(head)
+        except Exception as e:
+            with self._lock:
+                self.summary_failures += 1
+            print(f"Не удалось сжать историю в краткое содержание: {e}")
+            return None
+
+    def _pending(self, key, history):
+        """Для key уже пишется краткое содержание этой же истории."""
+        with self._lock:
+            job = self._jobs.get(key)
+            return (
+                job is not None and not job.future.done() and job.matches(history)
+            )
+
+    def _take_summary(self, key, history, head):
+        """
+        (число сжатых ходов, краткое содержание или None) из готовой фоновой
+        задачи. Если задачи нет или история сменилась — запускает новую и
+        возвращает None.
+        """
+        with self._lock:
+            job = self._jobs.pop(key, None)
+            if job is None or not job.matches(history):
+                if job is not None:
+                    job.future.cancel()
+                future = self._executor.submit(self._summarize, head)
+                self._jobs[key] = _SummaryJob(history[: len(head)], future)
+                return None
+        return job.length, job.future.result()
+
+    def _record(self, before, compacted, kind):
+        with self._lock:
+            self.compactions += 1
+            setattr(self, kind, getattr(self, kind) + 1)
+            self.tokens_removed += before - estimator.history(compacted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "compactions": self.compactions,
+                "summarized": self.summarized,
+                "windowed": self.windowed,
+                "media_only": self.media_only,
+                "summary_failures": self.summary_failures,
+                "summaries_pending": len(self._jobs),
+                "tokens_removed": self.tokens_removed,
+            }
@@ -10,9 +10,158 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 PRO_CODE = os.getenv("PRO_CODE")
 
+# "threaded" — TeleBot с пулом потоков, "asyncio" — AsyncTeleBot + client.aio
+BOT_RUNTIME = os.getenv("BOT_RUNTIME", "threaded")
+
+# Размер пула обработчиков: потоки в threaded-рантайме и число
+# одновременно выполняемых апдейтов в asyncio-рантайме
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "16"))
+ASYNC_DISPATCH_CONCURRENCY = int(os.getenv("ASYNC_DISPATCH_CONCURRENCY", "256"))
+
+# Приём апдейтов: "polling" или "webhook" (встроенный HTTP-сервер)
+BOT_INGESTION = os.getenv("BOT_INGESTION", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный адрес, напр. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Потоковые ответы: текст появляется по мере генерации, правки сообщения
+# в одном чате не чаще раза в STREAM_EDIT_INTERVAL секунд
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# Кэш активных чатов: лимит записей, оценка размера в байтах и время
+# простоя (сек), после которого чат выгружается из памяти
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "1000"))
+CHAT_CACHE_MAX_BYTES = int(os.getenv("CHAT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+CHAT_CACHE_TTL = int(os.getenv("CHAT_CACHE_TTL", "3600"))
+
+# Каталог для содержимого файлов и фото (хранятся по SHA-256)
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "./blobs")
+
+# Файлы контекста и буфера загружаются в Gemini Files API один раз и
+# передаются ссылкой; файлы меньше FILES_API_MIN_BYTES уходят inline.
+# FILES_API_EXPIRY_MARGIN — за сколько секунд до истечения файл перезагружается
+FILES_API_ENABLED = os.getenv("FILES_API_ENABLED", "1") == "1"
+FILES_API_MIN_BYTES = int(os.getenv("FILES_API_MIN_BYTES", str(256 * 1024)))
+FILES_API_EXPIRY_MARGIN = int(os.getenv("FILES_API_EXPIRY_MARGIN", "3600"))
+
+# Сжатие истории чата: "window" (по умолчанию) — начало отбрасывается,
+# "summarize" — заменяется кратким содержанием (HISTORY_SUMMARY_MODEL,
+# отдельные запросы к Gemini), "off" — не сжимать (запрос растёт без предела).
+# Бюджет токенов истории задаётся по моделям (HISTORY_TOKEN_BUDGETS ниже),
+# для остальных — HISTORY_TOKEN_BUDGET. Вложения сохраняются только в
+# последних HISTORY_KEEP_MEDIA_TURNS ходах сжатой истории
+HISTORY_COMPACTION = os.getenv("HISTORY_COMPACTION", "window")
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "32000"))
+HISTORY_KEEP_MEDIA_TURNS = int(os.getenv("HISTORY_KEEP_MEDIA_TURNS", "4"))
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gemini-3.5-flash-lite")
+
+# Запас окна контекста под ответ модели: запрос длиннее окна за вычетом
+# этого запаса отклоняется (или из него убираются файлы) до отправки
+RESPONSE_TOKEN_RESERVE = int(os.getenv("RESPONSE_TOKEN_RESERVE", "16384"))
+
+# Лимиты исходящих запросов к Telegram: сообщений в секунду на бота и в
+# личном чате (с запасом TELEGRAM_CHAT_BURST), сообщений в минуту в группе.
+# После 429 запрос повторяется до TELEGRAM_MAX_RETRIES раз
+TELEGRAM_RATE_LIMIT_ENABLED = os.getenv("TELEGRAM_RATE_LIMIT_ENABLED", "1") == "1"
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", "20"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+
+
+def _model_map(value):
+    """Разбирает строку "модель=другая,..." в словарь."""
+    return {
+        model.strip(): other.strip()
+        for model, _, other in (pair.partition("=") for pair in value.split(","))
+        if other.strip()
+    }
+
+
+# Повторы запросов к Gemini после 429/5xx и сетевых ошибок: до
+# GEMINI_MAX_ATTEMPTS попыток с задержкой до GEMINI_RETRY_MAX_DELAY сек.
+# В синхронном боте паузы занимают поток диспетчера (и очередь пользователя),
+# поэтому в сумме они не дольше GEMINI_SYNC_RETRY_BUDGET сек.
+# После GEMINI_BREAKER_THRESHOLD сбоев подряд модель отключается на
+# GEMINI_BREAKER_RESET сек, а запросы к ней уходят на запасную модель из
+# GEMINI_FALLBACKS ("модель=запасная,..."; пустая строка — без замены)
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "3"))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.5"))
+GEMINI_RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "8"))
+GEMINI_SYNC_RETRY_BUDGET = float(os.getenv("GEMINI_SYNC_RETRY_BUDGET", "1"))
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))
+GEMINI_FALLBACKS = _model_map(
+    os.getenv("GEMINI_FALLBACKS", "gemini-3.1-pro-preview=gemini-3.7-flash")
+)
+
+# Хеджирование быстрых инструментов (1 — включено): если модель не ответила
+# за HEDGE_PERCENTILE-й процентиль своих задержек (по последним замерам, не
+# меньше HEDGE_MIN_SAMPLES), запрос дублируется на модель из HEDGE_MODELS
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MODELS = _model_map(
+    os.getenv(
+        "HEDGE_MODELS",
+        "gemini-3.1-pro-preview=gemini-3.7-flash,"
+        "gemini-3.7-flash=gemini-3.5-flash-lite",
+    )
+)
+
+# HTTP-транспорт Telegram: размер пула соединений, таймауты (сек) и порог,
+# после которого загружаемый файл пишется во временный файл, а не в память
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+DOWNLOAD_SPOOL_MB = float(os.getenv("DOWNLOAD_SPOOL_MB", "1"))
+
+# Подготовка фото: предел длинной стороны в пикселях (по моделям — в
+# IMAGE_MAX_EDGES), качество JPEG после уменьшения, число процессов пула
+# (0 — в потоке обработчика) и размер кэша готовых картинок, МБ
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1536"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_CACHE_MB = float(os.getenv("IMAGE_CACHE_MB", "32"))
+
+# Кэш ответов быстрых инструментов с "cache": True (1 — включён): не больше
+# QUICK_TOOL_CACHE_MAX_ENTRIES ответов, каждый живёт QUICK_TOOL_CACHE_TTL сек
+QUICK_TOOL_CACHE_ENABLED = os.getenv("QUICK_TOOL_CACHE_ENABLED", "1") == "1"
+QUICK_TOOL_CACHE_MAX_ENTRIES = int(os.getenv("QUICK_TOOL_CACHE_MAX_ENTRIES", "5000"))
+QUICK_TOOL_CACHE_TTL = int(os.getenv("QUICK_TOOL_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Пакетный режим быстрых инструментов с "batch" в конфиге: включается для
+# текста от QUICK_TOOL_BATCH_MIN_ITEMS строк/абзацев или длиннее обычного
+# лимита; не больше QUICK_TOOL_BATCH_MAX_ITEMS элементов и
+# QUICK_TOOL_BATCH_MAX_CHARS символов, QUICK_TOOL_BATCH_CONCURRENCY запросов
+# к Gemini одновременно
+QUICK_TOOL_BATCH_MIN_ITEMS = int(os.getenv("QUICK_TOOL_BATCH_MIN_ITEMS", "8"))
+QUICK_TOOL_BATCH_MAX_ITEMS = int(os.getenv("QUICK_TOOL_BATCH_MAX_ITEMS", "100"))
+QUICK_TOOL_BATCH_MAX_CHARS = int(os.getenv("QUICK_TOOL_BATCH_MAX_CHARS", "40000"))
+QUICK_TOOL_BATCH_CONCURRENCY = int(os.getenv("QUICK_TOOL_BATCH_CONCURRENCY", "8"))
+
+# Map-reduce для текста длиннее QUICK_TOOL_MAX_CHARS у инструментов с
+# "map_reduce": куски по MAP_REDUCE_CHUNK_CHARS символов обрабатываются
+# моделью MAP_REDUCE_MODEL (до MAP_REDUCE_CONCURRENCY одновременно), вход
+# не длиннее MAP_REDUCE_MAX_CHARS
+MAP_REDUCE_MODEL = os.getenv("MAP_REDUCE_MODEL", "gemini-3.5-flash-lite")
+MAP_REDUCE_CHUNK_CHARS = int(os.getenv("MAP_REDUCE_CHUNK_CHARS", "12000"))
+MAP_REDUCE_MAX_CHARS = int(os.getenv("MAP_REDUCE_MAX_CHARS", "300000"))
+MAP_REDUCE_CONCURRENCY = int(os.getenv("MAP_REDUCE_CONCURRENCY", "8"))
+
+# Интервал печати метрик в лог, сек (0 — выключено)
+METRICS_LOG_INTERVAL = int(os.getenv("METRICS_LOG_INTERVAL", "0"))
+
 
 MAX_MESSAGE_LENGTH = 16000
 
+# Максимальная длина текста одного запроса быстрого инструмента
+QUICK_TOOL_MAX_CHARS = 4000
+
 MAX_FILE_SIZE_MB = 20
 
 DEFAULT_MODEL = "gemini-3.7-flash"
@@ -24,6 +173,27 @@ AVAILABLE_MODELS = [
     "gemini-3.1-flash-image",
 ]
 
+HISTORY_TOKEN_BUDGETS = {
+    "gemini-3.7-flash": HISTORY_TOKEN_BUDGET,
+    "gemini-3.1-pro-preview": HISTORY_TOKEN_BUDGET * 2,
+    "gemini-3.5-flash-lite": HISTORY_TOKEN_BUDGET // 2,
+    # Каждая сгенерированная картинка в истории — отдельный платный ввод
+    "gemini-3.1-flash-image": HISTORY_TOKEN_BUDGET // 4,
+}
+
+IMAGE_MAX_EDGES = {
+    "gemini-3.7-flash": IMAGE_MAX_EDGE,
+    "gemini-3.1-pro-preview": IMAGE_MAX_EDGE * 2,
+    "gemini-3.5-flash-lite": IMAGE_MAX_EDGE // 2,
+    "gemini-3.1-flash-image": IMAGE_MAX_EDGE,
+}
+
+DEFAULT_CONTEXT_WINDOW = 1048576
+
+MODEL_CONTEXT_WINDOWS = {
+    "gemini-3.1-flash-image": 65536,
+}
+
 
 MODEL_ALIASES = {
     "gemini-3.7-flash": "3.7 Flash 🚀",
@@ -38,6 +208,12 @@ def get_model_alias(full_name, default="Неизвестно"):
     return MODEL_ALIASES.get(full_name, default)
 
 
+def get_input_token_limit(model_name):
+    """Сколько токенов запроса (с историей) помещается в окно модели."""
+    window = MODEL_CONTEXT_WINDOWS.get(model_name, DEFAULT_CONTEXT_WINDOW)
+    return window - RESPONSE_TOKEN_RESERVE
+
+
 def is_image_generation_model(model_name):
     """Проверяет, поддерживает ли модель генерацию изображений."""
     return model_name in [
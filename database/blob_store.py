@@ -0,0 +1,155 @@
+"""
+Контентно-адресуемое хранилище файлов: байты лежат на диске под именем
+SHA-256, а строки БД хранят только хэш и метаданные.
+
+Один и тот же файл (например, PDF, добавленный в контекст и в буфер)
+хранится один раз. Счётчики ссылок ведутся в таблице blobs (см. crud).
+Байты хэшируются и пишутся во временный файл без блокировки (stage); под
+lock выполняются только перенос готового файла на место (publish),
+изменение счётчиков и удаление, чтобы освобождение блоба не гонялось с
+повторной загрузкой тех же байтов. Файлы, оставшиеся без строки в blobs
+после сбоя, удаляет sweep при запуске.
+"""
+
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from constants import BLOB_STORE_DIR
+
+lock = threading.RLock()
+
+CHUNK_SIZE = 64 * 1024
+TMP_SUFFIX = ".tmp"
+# Файлы моложе этого возраста (сек) sweep не трогает
+SWEEP_MIN_AGE = 3600
+_BLOB_NAME = re.compile(r"[0-9a-f]{64}")
+
+
+class StagedBlob:
+    """Байты во временном файле, ещё не перенесённые в хранилище."""
+
+    def __init__(self, blob_hash, size, tmp_path):
+        self.hash = blob_hash
+        self.size = size
+        self.tmp_path = tmp_path
+
+    def discard(self):
+        """Удаляет временный файл, если он не был перенесён."""
+        if self.tmp_path is not None:
+            try:
+                os.unlink(self.tmp_path)
+            except FileNotFoundError:
+                pass
+            self.tmp_path = None
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, blob_hash):
+        # Двухуровневое разбиение, чтобы не держать всё в одном каталоге
+        return os.path.join(self.root, blob_hash[:2], blob_hash[2:4], blob_hash)
+
+    def stage(self, data):
+        """
+        Хэширует байты или файловый объект (кусками) и записывает их во
+        временный файл в корне хранилища. Блокировка не нужна.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=TMP_SUFFIX)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if hasattr(data, "read"):
+                    data.seek(0)
+                    chunks = iter(lambda: data.read(CHUNK_SIZE), b"")
+                else:
+                    chunks = [data]
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return StagedBlob(digest.hexdigest(), size, tmp_path)
+
+    def publish(self, staged):
+        """
+        Переносит подготовленный файл на место (вызывать под lock).
+        Возвращает True, если блоба с таким хэшем ещё не было.
+        """
+        path = self.path(staged.hash)
+        if os.path.exists(path):
+            staged.discard()
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(staged.tmp_path, path)
+        staged.tmp_path = None
+        return True
+
+    def write(self, data):
+        """Сохраняет байты или файл (если их ещё нет) и возвращает SHA-256."""
+        staged = self.stage(data)
+        with lock:
+            self.publish(staged)
+        return staged.hash
+
+    def sweep(self, referenced, min_age=SWEEP_MIN_AGE):
+        """
+        Удаляет временные файлы и блобы, которых нет в referenced, если они
+        не менялись min_age секунд (запись, идущая прямо сейчас, не
+        задевается). Возвращает число удалённых файлов.
+        """
+        removed = 0
+        deadline = time.time() - min_age
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                orphan = _BLOB_NAME.fullmatch(filename) and filename not in referenced
+                if not orphan and not filename.endswith(TMP_SUFFIX):
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    if os.path.getmtime(path) <= deadline:
+                        os.unlink(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    @contextmanager
+    def open(self, blob_hash):
+        """Отображает блоб в память; отдаёт объект mmap (или b"" для пустого)."""
+        with open(self.path(blob_hash), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    def read(self, blob_hash):
+        with self.open(blob_hash) as mapped:
+            return bytes(mapped)
+
+    def delete(self, blob_hashes):
+        for blob_hash in blob_hashes:
+            try:
+                os.unlink(self.path(blob_hash))
+            except FileNotFoundError:
+                pass
+
+
+store = BlobStore(BLOB_STORE_DIR)
+
+
+def configure(root):
+    """Меняет каталог хранилища (используется в тестах)."""
+    store.root = root
@@ -1,5 +1,103 @@
+from collections import Counter
+from contextlib import contextmanager
+from typing import BinaryIO, Union
+
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from database.models import User, ChatSession, FileContext, MessageBuffer
+from database import blob_store, user_cache
+from database.db import SessionLocal
+from database.models import (
+    User,
+    Blob,
+    ChatSession,
+    ChatTurn,
+    FileContext,
+    MessageBuffer,
+    ToolResponse,
+)
+
+# Ключи Session.info для unit_of_work
+_UNIT_OF_WORK = "unit_of_work"
+_AFTER_COMMIT = "after_commit"
+_ON_ROLLBACK = "on_rollback"
+_BLOB_LOCK = "blob_lock"
+
+
+# Unit of Work
+@contextmanager
+def unit_of_work(session_factory=SessionLocal):
+    """
+    Сессия, в которой все изменения апдейта фиксируются одним commit при
+    выходе из блока. Функции crud внутри неё только делают flush, а действия,
+    допустимые лишь после фиксации (кэш настроек, удаление файлов блобов),
+    откладывают до неё.
+    """
+    db = session_factory()
+    db.info[_UNIT_OF_WORK] = True
+    db.info[_AFTER_COMMIT] = []
+    try:
+        yield db
+        db.commit()
+        for action in db.info[_AFTER_COMMIT]:
+            action()
+    except BaseException:
+        db.rollback()
+        _rolled_back(db)
+        raise
+    finally:
+        if db.info.pop(_BLOB_LOCK, False):
+            blob_store.lock.release()
+        db.close()
+
+
+def _after_commit(db: Session, action):
+    if db.info.get(_UNIT_OF_WORK):
+        db.info[_AFTER_COMMIT].append(action)
+    else:
+        action()
+
+
+def _on_rollback(db: Session, action):
+    """Действие при откате транзакции (выполняется до снятия blob_store.lock)."""
+    db.info.setdefault(_ON_ROLLBACK, []).append(action)
+
+
+def _rolled_back(db: Session):
+    for action in db.info.pop(_ON_ROLLBACK, []):
+        action()
+
+
+def _commit(db: Session, after=None):
+    """commit вне unit_of_work; внутри — flush и отложенный after."""
+    if db.info.get(_UNIT_OF_WORK):
+        db.flush()
+    else:
+        db.commit()
+    if after:
+        _after_commit(db, after)
+
+
+@contextmanager
+def _blob_transaction(db: Session):
+    """
+    Держит blob_store.lock до фиксации транзакции: в unit_of_work — до конца
+    блока, иначе — до выхода из with.
+    """
+    if not db.info.get(_UNIT_OF_WORK):
+        with blob_store.lock:
+            try:
+                yield
+            except BaseException:
+                db.rollback()
+                _rolled_back(db)
+                raise
+            finally:
+                db.info.pop(_ON_ROLLBACK, None)
+        return
+    if not db.info.get(_BLOB_LOCK):
+        blob_store.lock.acquire()
+        db.info[_BLOB_LOCK] = True
+    yield
 
 
 # User Operations
@@ -10,8 +108,7 @@ def get_user(db: Session, user_id: int):
 def create_user(db: Session, user_id: int):
     db_user = User(id=user_id)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    _commit(db, after=lambda: user_cache.store(db_user))
     return db_user
 
 
@@ -19,30 +116,35 @@ def get_or_create_user(db: Session, user_id: int):
     user = get_user(db, user_id)
     if not user:
         user = create_user(db, user_id)
+    else:
+        _after_commit(db, lambda: user_cache.store(user))
     return user
 
 
+def ensure_user(db: Session, user_id: int):
+    """Создаёт пользователя, если его нет; известных по кэшу не запрашивает."""
+    if user_cache.get(user_id) is None:
+        get_or_create_user(db, user_id)
+
+
 def update_user_model(db: Session, user_id: int, model: str):
     user = get_or_create_user(db, user_id)
     user.current_model = model
-    db.commit()
-    db.refresh(user)
+    _commit(db, after=lambda: user_cache.store(user))
     return user
 
 
 def update_user_send_mode(db: Session, user_id: int, mode: str):
     user = get_or_create_user(db, user_id)
     user.send_mode = mode
-    db.commit()
-    db.refresh(user)
+    _commit(db, after=lambda: user_cache.store(user))
     return user
 
 
 def update_user_search_enabled(db: Session, user_id: int, enabled: bool):
     user = get_or_create_user(db, user_id)
     user.search_enabled = enabled
-    db.commit()
-    db.refresh(user)
+    _commit(db, after=lambda: user_cache.store(user))
     return user
 
 
@@ -58,16 +160,128 @@ def save_chat_session(db: Session, user_id: int, history_json: str):
         db.add(session)
     else:
         session.history_json = history_json
-    db.commit()
-    db.refresh(session)
+    _commit(db)
     return session
 
 
 def clear_chat_session(db: Session, user_id: int):
-    session = get_chat_session(db, user_id)
-    if session:
-        db.delete(session)
-        db.commit()
+    db.query(ChatSession).filter(ChatSession.user_id == user_id).delete()
+    db.query(ChatTurn).filter(ChatTurn.user_id == user_id).delete()
+    _commit(db)
+
+
+# Chat Turn Operations
+def get_chat_turns(db: Session, user_id: int):
+    return (
+        db.query(ChatTurn)
+        .filter(ChatTurn.user_id == user_id)
+        .order_by(ChatTurn.position)
+        .all()
+    )
+
+
+def count_chat_turns(db: Session, user_id: int):
+    return (
+        db.query(func.count(ChatTurn.id))
+        .filter(ChatTurn.user_id == user_id)
+        .scalar()
+    )
+
+
+def _add_turns(db: Session, user_id: int, start: int, turns):
+    db.add_all(
+        ChatTurn(
+            user_id=user_id,
+            position=start + offset,
+            role=role,
+            content_json=content_json,
+        )
+        for offset, (role, content_json) in enumerate(turns)
+    )
+
+
+def append_chat_turns(db: Session, user_id: int, start: int, turns):
+    """Добавляет turns — список (role, content_json) — с позиции start."""
+    _add_turns(db, user_id, start, turns)
+    _commit(db)
+
+
+def replace_chat_turns(db: Session, user_id: int, turns):
+    """Перезаписывает историю целиком (если она стала короче сохранённой)."""
+    db.query(ChatTurn).filter(ChatTurn.user_id == user_id).delete()
+    _add_turns(db, user_id, 0, turns)
+    _commit(db)
+
+
+# Blob Operations
+@contextmanager
+def _staged(data):
+    """
+    Байты, заранее записанные во временный файл вне blob_store.lock;
+    неиспользованный временный файл удаляется при выходе.
+    """
+    if data is None or isinstance(data, blob_store.StagedBlob):
+        yield data
+        return
+    staged = blob_store.store.stage(data)
+    try:
+        yield staged
+    finally:
+        staged.discard()
+
+
+# Вызывать внутри _blob_transaction (или под blob_store.lock с фиксацией
+# транзакции до снятия блокировки)
+def acquire_blob(db: Session, data: Union[bytes, BinaryIO, blob_store.StagedBlob]):
+    """
+    Переносит блоб в blob_store и увеличивает счётчик ссылок. Новый файл
+    удаляется, если транзакция откатится.
+    """
+    with _staged(data) as staged:
+        if blob_store.store.publish(staged):
+            _on_rollback(db, lambda: blob_store.store.delete([staged.hash]))
+    blob = db.get(Blob, staged.hash)
+    if blob is None:
+        db.add(Blob(hash=staged.hash, size=staged.size, refcount=1))
+    else:
+        blob.refcount += 1
+    return staged.hash
+
+
+def sweep_blobs(db: Session, min_age=blob_store.SWEEP_MIN_AGE):
+    """Удаляет из blob_store файлы без строки в blobs (остатки сбоев)."""
+    referenced = {blob_hash for (blob_hash,) in db.query(Blob.hash)}
+    return blob_store.store.sweep(referenced, min_age)
+
+
+def release_blobs(db: Session, blob_hashes):
+    """Уменьшает счётчики; возвращает хэши, на которые больше нет ссылок."""
+    freed = []
+    for blob_hash, count in Counter(blob_hashes).items():
+        blob = db.get(Blob, blob_hash)
+        if blob is None:
+            continue
+        blob.refcount -= count
+        if blob.refcount <= 0:
+            db.delete(blob)
+            freed.append(blob_hash)
+    return freed
+
+
+def _delete_with_blobs(db: Session, model, user_id: int):
+    with _blob_transaction(db):
+        query = db.query(model).filter(model.user_id == user_id)
+        blob_hashes = [
+            blob_hash
+            for (blob_hash,) in query.with_entities(model.blob_hash)
+            if blob_hash
+        ]
+        query.delete()
+        freed = release_blobs(db, blob_hashes)
+        _commit(
+            db,
+            after=(lambda: blob_store.store.delete(freed)) if freed else None,
+        )
 
 
 # File Context Operations
@@ -76,21 +290,20 @@ def add_file_context(
     user_id: int,
     filename: str,
     mime_type: str,
-    data: bytes,
+    data: Union[bytes, BinaryIO],
     caption: str = None,
 ):
-    # Ensure user exists
-    get_or_create_user(db, user_id)
-    file_ctx = FileContext(
-        user_id=user_id,
-        filename=filename,
-        mime_type=mime_type,
-        data=data,
-        caption=caption,
-    )
-    db.add(file_ctx)
-    db.commit()
-    db.refresh(file_ctx)
+    ensure_user(db, user_id)
+    with _staged(data) as staged, _blob_transaction(db):
+        file_ctx = FileContext(
+            user_id=user_id,
+            filename=filename,
+            mime_type=mime_type,
+            blob_hash=acquire_blob(db, staged),
+            caption=caption,
+        )
+        db.add(file_ctx)
+        _commit(db)
     return file_ctx
 
 
@@ -103,9 +316,35 @@ def get_file_contexts(db: Session, user_id: int):
     )
 
 
+def count_file_contexts(db: Session, user_id: int):
+    return (
+        db.query(func.count(FileContext.id))
+        .filter(FileContext.user_id == user_id)
+        .scalar()
+    )
+
+
+def list_file_contexts(db: Session, user_id: int):
+    """Метаданные файлов контекста без байтов: id, filename, mime_type,
+    caption, blob_hash и size (из blobs)."""
+    return (
+        db.query(
+            FileContext.id,
+            FileContext.filename,
+            FileContext.mime_type,
+            FileContext.caption,
+            FileContext.blob_hash,
+            Blob.size,
+        )
+        .outerjoin(Blob, Blob.hash == FileContext.blob_hash)
+        .filter(FileContext.user_id == user_id)
+        .order_by(FileContext.id)
+        .all()
+    )
+
+
 def clear_file_contexts(db: Session, user_id: int):
-    db.query(FileContext).filter(FileContext.user_id == user_id).delete()
-    db.commit()
+    _delete_with_blobs(db, FileContext, user_id)
 
 
 # Message Buffer Operations
@@ -114,21 +353,22 @@ def add_to_buffer(
     user_id: int,
     item_type: str,
     content: str = None,
-    blob_data: bytes = None,
+    blob_data: Union[bytes, BinaryIO] = None,
     filename: str = None,
     mime_type: str = None,
 ):
-    get_or_create_user(db, user_id)
-    item = MessageBuffer(
-        user_id=user_id,
-        item_type=item_type,
-        content=content,
-        blob_data=blob_data,
-        filename=filename,
-        mime_type=mime_type,
-    )
-    db.add(item)
-    db.commit()
+    ensure_user(db, user_id)
+    with _staged(blob_data) as staged, _blob_transaction(db):
+        item = MessageBuffer(
+            user_id=user_id,
+            item_type=item_type,
+            content=content,
+            blob_hash=acquire_blob(db, staged) if staged is not None else None,
+            filename=filename,
+            mime_type=mime_type,
+        )
+        db.add(item)
+        _commit(db)
     return item
 
 
@@ -141,6 +381,118 @@ def get_buffer(db: Session, user_id: int):
     )
 
 
+def count_buffer(db: Session, user_id: int):
+    return (
+        db.query(func.count(MessageBuffer.id))
+        .filter(MessageBuffer.user_id == user_id)
+        .scalar()
+    )
+
+
+def list_buffer(db: Session, user_id: int):
+    """Метаданные буфера без байтов: id, item_type, content, filename,
+    mime_type, blob_hash и size (из blobs)."""
+    return (
+        db.query(
+            MessageBuffer.id,
+            MessageBuffer.item_type,
+            MessageBuffer.content,
+            MessageBuffer.filename,
+            MessageBuffer.mime_type,
+            MessageBuffer.blob_hash,
+            Blob.size,
+        )
+        .outerjoin(Blob, Blob.hash == MessageBuffer.blob_hash)
+        .filter(MessageBuffer.user_id == user_id)
+        .order_by(MessageBuffer.id)
+        .all()
+    )
+
+
 def clear_buffer(db: Session, user_id: int):
-    db.query(MessageBuffer).filter(MessageBuffer.user_id == user_id).delete()
-    db.commit()
+    _delete_with_blobs(db, MessageBuffer, user_id)
+
+
+# Tool Response Operations
+def get_tool_response(db: Session, key: str):
+    return db.get(ToolResponse, key)
+
+
+def touch_tool_responses(db: Session, used_at):
+    """Записывает время использования ответов {key: время} одним коммитом."""
+    for key, now in used_at.items():
+        db.query(ToolResponse).filter(ToolResponse.key == key).update(
+            {ToolResponse.used_at: now}, synchronize_session=False
+        )
+    _commit(db)
+
+
+def put_tool_response(
+    db: Session,
+    key: str,
+    tool: str,
+    config_hash: str,
+    response: str,
+    tokens: int,
+    now: float,
+):
+    db.merge(
+        ToolResponse(
+            key=key,
+            tool=tool,
+            config_hash=config_hash,
+            response=response,
+            tokens=tokens,
+            created_at=now,
+            used_at=now,
+        )
+    )
+    _commit(db)
+
+
+def delete_tool_response(db: Session, key: str):
+    db.query(ToolResponse).filter(ToolResponse.key == key).delete()
+    _commit(db)
+
+
+def evict_tool_responses(db: Session, max_entries: int, created_before: float):
+    """Удаляет ответы старше created_before и самые давние сверх max_entries."""
+    removed = (
+        db.query(ToolResponse)
+        .filter(ToolResponse.created_at < created_before)
+        .delete(synchronize_session=False)
+    )
+    excess = db.query(func.count(ToolResponse.key)).scalar() - max_entries
+    if excess > 0:
+        oldest = [
+            key
+            for (key,) in db.query(ToolResponse.key)
+            .order_by(ToolResponse.used_at)
+            .limit(excess)
+        ]
+        removed += (
+            db.query(ToolResponse)
+            .filter(ToolResponse.key.in_(oldest))
+            .delete(synchronize_session=False)
+        )
+    _commit(db)
+    return removed
+
+
+def delete_stale_tool_responses(db: Session, config_hashes):
+    """Удаляет ответы инструментов, чей конфиг не совпадает с config_hashes."""
+    removed = 0
+    for tool, config_hash in (
+        db.query(ToolResponse.tool, ToolResponse.config_hash).distinct().all()
+    ):
+        if config_hashes.get(tool) != config_hash:
+            removed += (
+                db.query(ToolResponse)
+                .filter(
+                    ToolResponse.tool == tool,
+                    ToolResponse.config_hash == config_hash,
+                )
+                .delete(synchronize_session=False)
+            )
+    _commit(db)
+    return removed
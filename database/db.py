@@ -19,10 +19,18 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
 
 event.listen(engine, "connect", set_sqlite_pragma)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Объекты не перечитываются после commit: сессии короткие, а значения,
+# записанные в этой же транзакции, уже актуальны
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
 
 Base = declarative_base()
 
 
 def init_db():
+    from database.migrations import run_migrations
+
     Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        run_migrations(session)
@@ -0,0 +1,125 @@
+"""
+Миграции данных, выполняются из init_db после create_all.
+
+Каждая миграция идемпотентна: повторный запуск ничего не меняет.
+"""
+
+import json
+
+from sqlalchemy import inspect, text
+
+from database import blob_store, crud
+from database.models import ChatSession, ChatTurn, FileContext, MessageBuffer
+
+# Столбцы, добавленные после первой версии схемы (create_all их не добавит)
+ADDED_COLUMNS = (
+    ("file_contexts", "blob_hash", "VARCHAR(64)"),
+    ("message_buffers", "blob_hash", "VARCHAR(64)"),
+)
+
+# Индексы, добавленные после первой версии схемы (имена как у index=True)
+ADDED_INDEXES = (
+    ("ix_file_contexts_user_id", "file_contexts", "user_id"),
+    ("ix_message_buffers_user_id", "message_buffers", "user_id"),
+)
+
+
+def migrate_chat_sessions_to_turns(db):
+    """
+    Переносит историю из chat_sessions.history_json в chat_turns (по строке
+    на Content) и удаляет перенесённые записи chat_sessions.
+    Возвращает число перенесённых пользователей.
+    """
+    user_ids = [row.user_id for row in db.query(ChatSession.user_id).all()]
+    migrated = 0
+    for user_id in user_ids:
+        chat_session = db.get(ChatSession, user_id)
+        has_turns = (
+            db.query(ChatTurn.id).filter(ChatTurn.user_id == user_id).first()
+        )
+        # Если ходы уже есть, они новее старой записи
+        if not has_turns and chat_session.history_json:
+            try:
+                items = json.loads(chat_session.history_json)
+            except ValueError as e:
+                print(f"Пропускаю историю пользователя {user_id}: {e}")
+                continue
+            db.add_all(
+                ChatTurn(
+                    user_id=user_id,
+                    position=position,
+                    role=item.get("role"),
+                    content_json=json.dumps(item),
+                )
+                for position, item in enumerate(items)
+            )
+        db.delete(chat_session)
+        db.commit()
+        migrated += 1
+    return migrated
+
+
+def add_missing_columns(db):
+    """Добавляет новые столбцы и индексы в таблицы существующей БД."""
+    inspector = inspect(db.get_bind())
+    for table, column, ddl in ADDED_COLUMNS:
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        if column not in existing:
+            db.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    for index, table, column in ADDED_INDEXES:
+        db.execute(
+            text(f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({column})")
+        )
+    db.commit()
+
+
+def migrate_blobs_to_store(db):
+    """
+    Переносит байты из file_contexts.data и message_buffers.blob_data в
+    blob_store. Строки обрабатываются по одной, чтобы не держать все файлы
+    в памяти. Возвращает число перенесённых строк.
+    """
+    migrated = 0
+    for model, legacy in (
+        (FileContext, "legacy_data"),
+        (MessageBuffer, "legacy_blob_data"),
+    ):
+        legacy_column = getattr(model, legacy)
+        row_ids = [
+            row_id
+            for (row_id,) in db.query(model.id).filter(
+                legacy_column.isnot(None), model.blob_hash.is_(None)
+            )
+        ]
+        for row_id in row_ids:
+            row = db.get(model, row_id)
+            with blob_store.lock:
+                row.blob_hash = crud.acquire_blob(db, getattr(row, legacy))
+                setattr(row, legacy, None)
+                db.commit()
+            db.expunge(row)
+            migrated += 1
+    return migrated
+
+
+def vacuum(db):
+    """Возвращает освободившееся место файлу БД (VACUUM вне транзакции)."""
+    with db.get_bind().connect() as connection:
+        connection.execution_options(isolation_level="AUTOCOMMIT").execute(
+            text("VACUUM")
+        )
+
+
+def run_migrations(db):
+    add_missing_columns(db)
+    migrated = migrate_chat_sessions_to_turns(db)
+    if migrated:
+        print(f"Перенесена история {migrated} чатов в chat_turns")
+    moved = migrate_blobs_to_store(db)
+    if moved:
+        print(f"Перенесено {moved} файлов из БД в {blob_store.store.root}")
+    if migrated or moved:
+        vacuum(db)
+    swept = crud.sweep_blobs(db)
+    if swept:
+        print(f"Удалено {swept} файлов без ссылок из {blob_store.store.root}")
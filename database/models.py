@@ -1,14 +1,17 @@
 from sqlalchemy import (
     Column,
+    Float,
     Integer,
     String,
     Boolean,
     Text,
     BigInteger,
     ForeignKey,
+    Index,
     LargeBinary,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
+from database import blob_store
 from database.db import Base
 from constants import DEFAULT_MODEL, SEND_MODE_IMMEDIATE
 
@@ -25,6 +28,12 @@ class User(Base):
     chat_session = relationship(
         "ChatSession", back_populates="user", uselist=False
     )
+    chat_turns = relationship(
+        "ChatTurn",
+        back_populates="user",
+        cascade="all, delete-orphan",
+        order_by="ChatTurn.position",
+    )
     file_contexts = relationship(
         "FileContext", back_populates="user", cascade="all, delete-orphan"
     )
@@ -34,6 +43,8 @@ class User(Base):
 
 
 class ChatSession(Base):
+    """Старый формат истории: весь список в одной строке, см. ChatTurn."""
+
     __tablename__ = "chat_sessions"
 
     user_id = Column(BigInteger, ForeignKey("users.id"), primary_key=True)
@@ -44,29 +55,87 @@ class ChatSession(Base):
     user = relationship("User", back_populates="chat_session")
 
 
+class ChatTurn(Base):
+    """Один Content истории чата; строки только добавляются."""
+
+    __tablename__ = "chat_turns"
+    __table_args__ = (
+        Index("ix_chat_turns_user_position", "user_id", "position", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
+    position = Column(Integer, nullable=False)  # Порядковый номер в истории
+    role = Column(String)
+    content_json = Column(Text)  # JSON одного Content (bytes в base64)
+
+    user = relationship("User", back_populates="chat_turns")
+
+
+class Blob(Base):
+    """Содержимое в blob_store: размер и число ссылающихся строк."""
+
+    __tablename__ = "blobs"
+
+    hash = Column(String(64), primary_key=True)  # SHA-256
+    size = Column(BigInteger)
+    refcount = Column(Integer, default=0)
+
+
+class ToolResponse(Base):
+    """Кэшированный ответ быстрого инструмента (см. response_cache)."""
+
+    __tablename__ = "tool_responses"
+
+    key = Column(String(64), primary_key=True)  # SHA-256 конфига и текста
+    tool = Column(String, nullable=False)
+    config_hash = Column(String(64), nullable=False)
+    response = Column(Text, nullable=False)
+    tokens = Column(Integer, default=0)  # Токены запроса и ответа
+    created_at = Column(Float, nullable=False)
+    used_at = Column(Float, nullable=False, index=True)
+
+
+def _read_blob(blob_hash, legacy_data):
+    if blob_hash:
+        return blob_store.store.read(blob_hash)
+    return legacy_data
+
+
 class FileContext(Base):
     __tablename__ = "file_contexts"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(BigInteger, ForeignKey("users.id"))
+    user_id = Column(BigInteger, ForeignKey("users.id"), index=True)
     filename = Column(String)
     mime_type = Column(String)
-    data = Column(LargeBinary)  # Storing file bytes
+    blob_hash = Column(String(64), nullable=True)  # Bytes live in blob_store
+    # Старые байты в БД; переносятся в blob_store миграцией
+    legacy_data = deferred(Column("data", LargeBinary))
     caption = Column(Text, nullable=True)
 
     user = relationship("User", back_populates="file_contexts")
 
+    @property
+    def data(self):
+        return _read_blob(self.blob_hash, self.legacy_data)
+
 
 class MessageBuffer(Base):
     __tablename__ = "message_buffers"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(BigInteger, ForeignKey("users.id"))
+    user_id = Column(BigInteger, ForeignKey("users.id"), index=True)
     item_type = Column(String)  # "text", "photo", "document"
 
     content = Column(Text, nullable=True)  # Text content or caption
-    blob_data = Column(LargeBinary, nullable=True)  # Image or file bytes
+    blob_hash = Column(String(64), nullable=True)  # Image or file bytes
+    legacy_blob_data = deferred(Column("blob_data", LargeBinary, nullable=True))
     filename = Column(String, nullable=True)
     mime_type = Column(String, nullable=True)
 
     user = relationship("User", back_populates="message_buffer")
+
+    @property
+    def blob_data(self):
+        return _read_blob(self.blob_hash, self.legacy_blob_data)
@@ -0,0 +1,51 @@
+"""
+Кэш настроек пользователей в памяти процесса.
+
+Настройки читаются почти в каждом апдейте, а меняются только кнопками,
+поэтому crud обновляет кэш сразу при записи (write-through), и обычное
+сообщение обходится без запросов к таблице users.
+"""
+
+import threading
+from collections import namedtuple
+
+UserSettings = namedtuple(
+    "UserSettings", ["current_model", "send_mode", "search_enabled"]
+)
+
+_settings = {}
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0}
+
+
+def get(user_id):
+    """Возвращает UserSettings из кэша или None."""
+    with _lock:
+        settings = _settings.get(user_id)
+        _counters["hits" if settings is not None else "misses"] += 1
+        return settings
+
+
+def store(user):
+    """Кладёт в кэш настройки из строки User и возвращает их."""
+    settings = UserSettings(
+        user.current_model, user.send_mode, user.search_enabled
+    )
+    with _lock:
+        _settings[user.id] = settings
+    return settings
+
+
+def invalidate(user_id):
+    with _lock:
+        _settings.pop(user_id, None)
+
+
+def clear():
+    with _lock:
+        _settings.clear()
+
+
+def stats():
+    with _lock:
+        return {"users": len(_settings), **_counters}
@@ -0,0 +1,211 @@
+"""
+Диспетчер обновлений: апдейты одного пользователя выполняются строго по
+очереди, разные пользователи — параллельно на пуле заданного размера.
+
+Так два быстрых сообщения одного пользователя не обрабатываются
+одновременно с одним и тем же объектом чата из кэша и не перетирают
+историю друг друга в save_active_chat.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+WAIT_SAMPLES = 1000
+
+
+def update_user_key(update):
+    """Ключ очереди для апдейта: id пользователя или, если его нет, id апдейта."""
+    for field in (
+        "message",
+        "edited_message",
+        "callback_query",
+        "inline_query",
+        "chosen_inline_result",
+        "pre_checkout_query",
+        "shipping_query",
+    ):
+        event = getattr(update, field, None)
+        from_user = getattr(event, "from_user", None) if event else None
+        if from_user is not None:
+            return from_user.id
+    return ("update", update.update_id)
+
+
+class _DispatchStats:
+    """Счётчики глубины очереди и времени ожидания."""
+
+    def __init__(self):
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.pending = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        self.max_wait = 0.0
+
+    def record_wait(self, wait):
+        self.waits.append(wait)
+        self.max_wait = max(self.max_wait, wait)
+
+    def as_dict(self, workers, active_users):
+        waits = sorted(self.waits)
+        p95 = waits[int(len(waits) * 0.95) - 1] if waits else 0.0
+        return {
+            "workers": workers,
+            "queue_depth": self.pending,
+            "active_users": active_users,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_wait_ms": (
+                round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0
+            ),
+            "p95_wait_ms": round(p95 * 1000, 1),
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+        }
+
+
+class UserDispatcher:
+    """Упорядоченная по пользователю очередь поверх пула потоков."""
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="dispatch"
+        )
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queues = {}
+        self._stats = _DispatchStats()
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Ставит вызов в очередь пользователя key."""
+        with self._lock:
+            self._stats.submitted += 1
+            self._stats.pending += 1
+            queue = self._queues.get(key)
+            start = queue is None
+            if start:
+                queue = self._queues[key] = deque()
+            queue.append((time.monotonic(), fn, args, kwargs))
+        if start:
+            self._executor.submit(self._run_next, key)
+
+    def _run_next(self, key):
+        # Выполняем одну задачу и переставляем пользователя в конец пула,
+        # чтобы активный пользователь не занимал поток целиком.
+        with self._lock:
+            enqueued_at, fn, args, kwargs = self._queues[key][0]
+            self._stats.pending -= 1
+            self._stats.record_wait(time.monotonic() - enqueued_at)
+
+        try:
+            fn(*args, **kwargs)
+            failed = False
+        except Exception as e:
+            print(f"Ошибка при обработке апдейта ({key}): {e}")
+            failed = True
+
+        with self._lock:
+            self._stats.processed += 1
+            self._stats.failed += failed
+            queue = self._queues[key]
+            queue.popleft()
+            has_more = bool(queue)
+            if not has_more:
+                del self._queues[key]
+                if not self._queues:
+                    self._idle.notify_all()
+        if has_more:
+            self._executor.submit(self._run_next, key)
+
+    def stats(self):
+        with self._lock:
+            return self._stats.as_dict(self.max_workers, len(self._queues))
+
+    def join(self, timeout=None):
+        """Ждёт, пока все очереди опустеют."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._queues, timeout)
+
+    def shutdown(self, wait=True):
+        if wait:
+            self.join()
+        self._executor.shutdown(wait=wait)
+
+
+class AsyncUserDispatcher:
+    """То же для asyncio: очередь на пользователя и общий лимит конкурентности."""
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._queues = {}
+        self._tasks = set()
+        self._stats = _DispatchStats()
+
+    def submit(self, key, coro_fn, *args, **kwargs):
+        """Ставит корутинную функцию в очередь пользователя key."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._stats.submitted += 1
+        self._stats.pending += 1
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            task = asyncio.get_running_loop().create_task(self._drain(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        queue.append((time.monotonic(), coro_fn, args, kwargs))
+
+    async def _drain(self, key):
+        queue = self._queues[key]
+        while queue:
+            enqueued_at, coro_fn, args, kwargs = queue[0]
+            async with self._semaphore:
+                self._stats.pending -= 1
+                self._stats.record_wait(time.monotonic() - enqueued_at)
+                try:
+                    await coro_fn(*args, **kwargs)
+                except Exception as e:
+                    print(f"Ошибка при обработке апдейта ({key}): {e}")
+                    self._stats.failed += 1
+                self._stats.processed += 1
+            queue.popleft()
+        del self._queues[key]
+
+    async def join(self):
+        """Ждёт завершения всех поставленных задач."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+    def stats(self):
+        return self._stats.as_dict(self.max_concurrency, len(self._queues))
+
+
+def install(bot, dispatcher):
+    """Ставит диспетчер перед обработчиками TeleBot (threaded=False)."""
+    process_new_updates = bot.process_new_updates
+
+    def dispatch_updates(updates):
+        for update in updates:
+            dispatcher.submit(
+                update_user_key(update), process_new_updates, [update]
+            )
+
+    bot.process_new_updates = dispatch_updates
+
+
+def install_async(bot, dispatcher):
+    """Ставит диспетчер перед обработчиками AsyncTeleBot."""
+    process_new_updates = bot.process_new_updates
+
+    async def dispatch_updates(updates):
+        for update in updates:
+            dispatcher.submit(
+                update_user_key(update), process_new_updates, [update]
+            )
+
+    bot.process_new_updates = dispatch_updates
@@ -0,0 +1,253 @@
+"""
+Кэш загрузок в Gemini Files API.
+
+Файл из контекста или буфера загружается один раз, а в запросы уходит
+ссылка Part.from_uri вместо всех байтов. URI кэшируется по SHA-256
+содержимого вместе со сроком жизни файла; когда срок подходит к концу,
+файл прозрачно загружается заново. Мелкие файлы по-прежнему передаются
+inline — отдельный запрос на загрузку для них дороже.
+
+Если сервер удалил файл раньше срока, запрос с его ссылкой получает 403/404:
+send_with_fresh_files забывает такие ссылки, загружает файлы заново и
+повторяет запрос один раз.
+"""
+
+import datetime
+import hashlib
+import io
+import threading
+import time
+
+from google.genai import errors as genai_errors
+from google.genai import types as genai_types
+
+from gemini_helpers import file_bytes
+
+# Срок жизни файлов Files API, если сервер его не вернул
+DEFAULT_FILE_TTL = 47 * 3600
+PROCESSING_POLL_INTERVAL = 1.0
+PROCESSING_TIMEOUT = 120
+# Так Gemini отвечает на ссылку на удалённый или чужой файл
+MISSING_FILE_CODES = {403, 404}
+
+
+def is_missing_file_error(error):
+    """Ошибка запроса, которая может означать, что файла по ссылке уже нет."""
+    return (
+        isinstance(error, genai_errors.ClientError)
+        and error.code in MISSING_FILE_CODES
+    )
+
+
+def _file_uris(parts):
+    return {
+        part.file_data.file_uri
+        for part in parts
+        if getattr(part, "file_data", None) is not None
+    }
+
+
+def send_with_fresh_files(uploads, parts, rebuild, send):
+    """
+    send() отправляет запрос с частями parts. Если Gemini не нашёл файл по
+    ссылке из кэша uploads, ссылки забываются, parts пересобираются на месте
+    через rebuild() (файлы загружаются заново) и запрос повторяется один раз.
+    """
+    try:
+        return send()
+    except Exception as e:
+        if not _stale(uploads, parts, e):
+            raise
+    parts[:] = rebuild()
+    return send()
+
+
+async def send_with_fresh_files_async(uploads, parts, rebuild, send):
+    """То же для asyncio: rebuild() и send() возвращают awaitable."""
+    try:
+        return await send()
+    except Exception as e:
+        if not _stale(uploads, parts, e):
+            raise
+    parts[:] = await rebuild()
+    return await send()
+
+
+def _stale(uploads, parts, error):
+    if uploads is None or not is_missing_file_error(error):
+        return False
+    if not uploads.invalidate_uris(_file_uris(parts)):
+        return False
+    print(f"Файл Files API недоступен раньше срока, загружаю заново: {error}")
+    return True
+
+
+class _Upload:
+    __slots__ = ("uri", "mime_type", "expires_at")
+
+    def __init__(self, uri, mime_type, expires_at):
+        self.uri = uri
+        self.mime_type = mime_type
+        self.expires_at = expires_at
+
+
+def _expires_at(uploaded, now):
+    expiration = getattr(uploaded, "expiration_time", None)
+    if expiration is None:
+        return now + DEFAULT_FILE_TTL
+    if expiration.tzinfo is None:
+        expiration = expiration.replace(tzinfo=datetime.timezone.utc)
+    return expiration.timestamp()
+
+
+def _state_name(uploaded):
+    state = getattr(uploaded, "state", None)
+    return getattr(state, "value", state)
+
+
+class FileUploadCache:
+    """
+    files — объект с интерфейсом client.files (upload/get).
+    expiry_margin — за сколько секунд до истечения считать ссылку устаревшей,
+    чтобы файл не пропал посреди запроса.
+    """
+
+    def __init__(self, files, min_bytes=0, expiry_margin=3600, clock=time.time):
+        self.files = files
+        self.min_bytes = min_bytes
+        self.expiry_margin = expiry_margin
+        self.clock = clock
+        self._uploads = {}
+        self._lock = threading.Lock()
+        # Отдельная блокировка на хэш: один файл не грузим дважды параллельно
+        self._key_locks = {}
+        self.hits = 0
+        self.uploads = 0
+        self.reuploads = 0
+        self.failures = 0
+        self.invalidated = 0
+        self.uploaded_bytes = 0
+
+    def part_for(self, file_info):
+        """
+        Возвращает Part для файла ({"mime_type", "filename"}, байты в "data"
+        или отложенно в "load", необязательные "blob_hash" и "size").
+        Байты читаются, только если файл нужно загрузить или отправить
+        inline. При ошибке загрузки — inline-часть.
+        """
+        mime_type = file_info["mime_type"]
+        loaded = []
+
+        def load():
+            if not loaded:
+                loaded.append(file_bytes(file_info))
+            return loaded[0]
+
+        size = file_info.get("size")
+        if size is None:
+            size = len(load())
+        if size < self.min_bytes:
+            return genai_types.Part.from_bytes(mime_type=mime_type, data=load())
+
+        content_hash = (
+            file_info.get("blob_hash") or hashlib.sha256(load()).hexdigest()
+        )
+        try:
+            upload = self._get_or_upload(
+                content_hash, load, mime_type, file_info.get("filename")
+            )
+        except Exception as e:
+            self.failures += 1
+            print(f"Не удалось загрузить файл в Files API, отправляю inline: {e}")
+            return genai_types.Part.from_bytes(mime_type=mime_type, data=load())
+        return genai_types.Part.from_uri(
+            file_uri=upload.uri, mime_type=upload.mime_type or mime_type
+        )
+
+    def invalidate(self, content_hash):
+        """Забывает ссылку (например, если сервер сообщил, что файла нет)."""
+        with self._lock:
+            if self._uploads.pop(content_hash, None) is not None:
+                self.invalidated += 1
+
+    def invalidate_uris(self, uris):
+        """Забывает ссылки с адресами из uris; True, если такие были в кэше."""
+        with self._lock:
+            stale = [
+                content_hash
+                for content_hash, upload in self._uploads.items()
+                if upload.uri in uris
+            ]
+        for content_hash in stale:
+            self.invalidate(content_hash)
+        return bool(stale)
+
+    def _get_or_upload(self, content_hash, load, mime_type, filename):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(content_hash, threading.Lock())
+        with key_lock:
+            now = self.clock()
+            with self._lock:
+                upload = self._uploads.get(content_hash)
+            if upload and upload.expires_at - self.expiry_margin > now:
+                self.hits += 1
+                return upload
+            if upload:
+                self.reuploads += 1
+
+            try:
+                upload = self._upload(load(), mime_type, filename, now)
+            except Exception:
+                with self._lock:
+                    # Иначе блокировка неудачного хэша остаётся навсегда
+                    if content_hash not in self._uploads:
+                        self._key_locks.pop(content_hash, None)
+                raise
+            with self._lock:
+                self._uploads[content_hash] = upload
+                self._purge_expired(now)
+            return upload
+
+    def _upload(self, data, mime_type, filename, now):
+        uploaded = self.files.upload(
+            file=io.BytesIO(data),
+            config=genai_types.UploadFileConfig(
+                mime_type=mime_type, display_name=filename
+            ),
+        )
+        # PDF и видео сначала обрабатываются; до ACTIVE ссылка не работает
+        deadline = now + PROCESSING_TIMEOUT
+        while _state_name(uploaded) == "PROCESSING":
+            if self.clock() > deadline:
+                raise TimeoutError(f"Файл {uploaded.name} не обработан вовремя")
+            time.sleep(PROCESSING_POLL_INTERVAL)
+            uploaded = self.files.get(name=uploaded.name)
+        if _state_name(uploaded) == "FAILED":
+            raise RuntimeError(f"Files API не смог обработать {uploaded.name}")
+
+        self.uploads += 1
+        self.uploaded_bytes += len(data)
+        return _Upload(uploaded.uri, uploaded.mime_type, _expires_at(uploaded, now))
+
+    def _purge_expired(self, now):
+        expired = [
+            content_hash
+            for content_hash, upload in self._uploads.items()
+            if upload.expires_at <= now
+        ]
+        for content_hash in expired:
+            del self._uploads[content_hash]
+            self._key_locks.pop(content_hash, None)
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._uploads)
+        return {
+            "cached": cached,
+            "hits": self.hits,
+            "uploads": self.uploads,
+            "reuploads": self.reuploads,
+            "failures": self.failures,
+            "invalidated": self.invalidated,
+            "uploaded_bytes": self.uploaded_bytes,
+        }
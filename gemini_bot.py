@@ -1,267 +1,149 @@
 import ipv4_only  # noqa: F401 E261
 import io
-import json
-import base64
 
-import requests
 import telebot
-from dotenv import load_dotenv
 from google import genai
-from google.genai import types as genai_types
-from google.genai.types import GenerateContentConfig, GoogleSearch, Tool
-from PIL import Image
 
 from constants import (
+    BOT_INGESTION,
+    BOT_RUNTIME,
     COMMAND_LIST,
-    DEFAULT_MODEL,
+    DISPATCH_WORKERS,
     GEMINI_API_KEY,
     PRO_CODE,
-    GREETING_MESSAGE_TEMPLATE,
+    QUICK_TOOL_BATCH_CONCURRENCY,
     MAX_FILE_SIZE_MB,
     QUICK_TOOLS_CONFIG,
-    SEND_MODE_IMMEDIATE,
     SEND_MODE_MANUAL,
+    STREAM_EDIT_INTERVAL,
+    STREAMING_ENABLED,
     SUPPORTED_MIME_TYPES,
     TELEGRAM_TOKEN,
-    HELP_TEXT_TEMPLATE,
+    METRICS_LOG_INTERVAL,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
     get_model_alias,
     is_image_generation_model,
 )
 
+import bot_common
+import http_client
+import metrics
+from bot_common import Services
+from dispatcher import UserDispatcher, install as install_dispatcher
 from keyboards import (
     get_file_download_keyboard,
     get_main_keyboard,
     get_model_selection_keyboard,
 )
-from functools import wraps
-
+from functools import partial, wraps
+
+from chat_cache import chat_history
+from file_uploads import send_with_fresh_files
+from gemini_helpers import (
+    build_buffer_parts,
+    build_chat_config,
+    build_context_parts,
+    compile_quick_tool,
+    collect_response_parts,
+    extract_sources_text,
+    photo_part,
+    PHOTO_MIME_TYPE,
+)
+from image_preprocess import pick_photo_size
+from persistence import (
+    add_file_context_entry,
+    add_to_message_buffer,
+    clear_user_context_db,
+    get_active_chat,
+    get_file_context_list,
+    get_message_buffer_list,
+    load_user_settings,
+    save_active_chat,
+    UserContext,
+)
+import quick_batch
+from rate_limiter import install as install_rate_limiter
+from resilience import send_chat
+from response_cache import response_tokens
+from router import Router, command_args
+from streaming import (
+    EditBudget,
+    delete_placeholder,
+    open_stream,
+    stream_chat_response,
+)
+from token_estimator import estimator, preflight
 from utils import (
-    BytesEncoder,
     markdown_to_text,
     send_rich_response,
 )
+from webhook import WebhookServer
+from whitelist import add_to_whitelist, load_whitelist
 
-from database import db, crud
-from database.db import SessionLocal
+from database import db
 
-load_dotenv()
+if __name__ == "__main__" and BOT_RUNTIME == "asyncio":
+    # Рантайм выбирается до настройки threaded-бота: TeleBot, пул
+    # обработчиков, транспорт и пул процессов создаёт только async_bot
+    import async_bot
 
-client = genai.Client(api_key=GEMINI_API_KEY)
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
+    async_bot.main()
+    raise SystemExit
 
-bot.set_my_commands(COMMAND_LIST)
+client = genai.Client(api_key=GEMINI_API_KEY)
+# Потоки TeleBot не используются: апдейты раздаёт UserDispatcher
+bot = telebot.TeleBot(TELEGRAM_TOKEN, threaded=False)
+dispatcher = UserDispatcher(DISPATCH_WORKERS)
+install_dispatcher(bot, dispatcher)
+# Текстовые сообщения разбирает Router: один обработчик вместо цепочки func
+router = Router()
+bot.register_message_handler(router.dispatch, content_types=["text"])
+http_client.install()
+metrics.register("dispatcher", dispatcher.stats)
+outbound_limiter = bot_common.outbound_limiter()
+if outbound_limiter is not None:
+    install_rate_limiter(outbound_limiter, http_client.session)
+services = Services(client)
+file_uploads = services.file_uploads
+compactor = services.compactor
+gemini = services.gemini
+hedger = services.hedger
+image_preprocessor = services.image_preprocessor
+response_cache = services.response_cache
+map_reduce = services.map_reduce
+quick_tools = services.quick_tools
 
 # Global stores
-user_chats = {}  # Cache for active chat sessions
 user_last_responses = {}
-
-WHITELIST_FILE = "whitelist.txt"
-whitelisted_users = set()
-
-# --- Helper Functions for Persistence ---
-
-
-def deserialize_history(history_json):
-    """Deserializes JSON history into list of types.Content."""
-    if not history_json:
-        return []
-    try:
-        data = json.loads(history_json)
-        history = []
-        for item in data:
-            parts = []
-            for part_data in item.get("parts", []):
-                if "inline_data" in part_data and part_data["inline_data"]:
-                    blob_data = part_data["inline_data"]
-                    if "data" in blob_data and isinstance(
-                        blob_data["data"], str
-                    ):
-                        try:
-                            blob_data["data"] = base64.b64decode(
-                                blob_data["data"]
-                            )
-                        except Exception:
-                            # Already bytes or invalid base64, leaving as is
-                            pass
-                parts.append(genai_types.Part(**part_data))
-            history.append(
-                genai_types.Content(role=item.get("role"), parts=parts)
-            )
-        return history
-    except Exception as e:
-        print(f"Error deserializing history: {e}")
-        return []
-
-
-def get_active_chat(user_id, model_name):
-    """Gets active chat from cache or loads from DB."""
-    if user_id in user_chats:
-        return user_chats[user_id]
-
-    with SessionLocal() as session:
-        chat_session = crud.get_chat_session(session, user_id)
-        history = []
-        if chat_session and chat_session.history_json:
-            history = deserialize_history(chat_session.history_json)
-
-    try:
-        new_chat = client.chats.create(model=model_name, history=history)
-        user_chats[user_id] = new_chat
-        return new_chat
-    except Exception as e:
-        print(f"Error creating chat with history: {e}. Starting fresh.")
-        new_chat = client.chats.create(model=model_name)
-        user_chats[user_id] = new_chat
-        return new_chat
-
-
-def save_active_chat(user_id):
-    """Saves current chat history to DB."""
-    if user_id in user_chats:
-        chat = user_chats[user_id]
-        try:
-            history_data = []
-            history_list = (
-                chat.get_history()
-                if hasattr(chat, "get_history")
-                else getattr(chat, "_curated_history", [])
-            )
-            for content in history_list:
-                if hasattr(content, "model_dump"):
-                    history_data.append(content.model_dump())
-                else:
-                    pass
-
-            history_json = json.dumps(history_data, cls=BytesEncoder)
-
-            with SessionLocal() as session:
-                crud.save_chat_session(session, user_id, history_json)
-        except Exception as e:
-            print(f"Error saving chat history: {e}")
-
-
-def get_file_context_list(user_id):
-    with SessionLocal() as session:
-        files = crud.get_file_contexts(session, user_id)
-        return [
-            {
-                "mime_type": f.mime_type,
-                "data": f.data,
-                "filename": f.filename,
-                "caption": f.caption,
-            }
-            for f in files
-        ]
-
-
-def add_file_context_entry(user_id, file_data):
-    with SessionLocal() as session:
-        crud.add_file_context(
-            session,
-            user_id,
-            filename=file_data["filename"],
-            mime_type=file_data["mime_type"],
-            data=file_data["data"],
-            caption=file_data.get("caption"),
-        )
-
-
-def get_message_buffer_list(user_id):
-    with SessionLocal() as session:
-        items = crud.get_buffer(session, user_id)
-        result = []
-        for item in items:
-            entry = {"type": item.item_type}
-            if item.item_type == "text":
-                entry["content"] = item.content or ""
-            elif item.item_type == "photo":
-                entry["caption"] = item.content or ""
-                if item.blob_data:
-                    entry["image"] = Image.open(io.BytesIO(item.blob_data))
-            elif item.item_type == "document":
-                entry["mime_type"] = item.mime_type
-                entry["data"] = item.blob_data
-                entry["filename"] = item.filename
-                entry["caption"] = item.content
-            result.append(entry)
-        return result
-
-
-def add_to_message_buffer(user_id, entry):
-    with SessionLocal() as session:
-        if entry["type"] == "text":
-            crud.add_to_buffer(
-                session, user_id, "text", content=entry["content"]
-            )
-        elif entry["type"] == "photo":
-            # Convert PIL image to bytes
-            img_byte_arr = io.BytesIO()
-            entry["image"].save(
-                img_byte_arr, format=entry["image"].format or "PNG"
-            )
-            img_bytes = img_byte_arr.getvalue()
-            crud.add_to_buffer(
-                session,
-                user_id,
-                "photo",
-                content=entry.get("caption"),
-                blob_data=img_bytes,
-            )
-        elif entry["type"] == "document":
-            crud.add_to_buffer(
-                session,
-                user_id,
-                "document",
-                content=entry.get("caption"),
-                blob_data=entry["data"],
-                filename=entry["filename"],
-                mime_type=entry["mime_type"],
-            )
-
-
-def clear_user_context_db(user_id):
-    with SessionLocal() as session:
-        crud.clear_file_contexts(session, user_id)
-        crud.clear_buffer(session, user_id)
-
-
-def load_whitelist():
-    """Загружает белый список пользователей из файла"""
-    try:
-        with open(WHITELIST_FILE, "r") as f:
-            for line in f:
-                user_id = line.strip()
-                if user_id:
-                    whitelisted_users.add(int(user_id))
-        print(f"Loaded {len(whitelisted_users)} users into whitelist.")
-    except FileNotFoundError:
-        print(
-            f"Whitelist file '{WHITELIST_FILE}' not found. Starting with empty whitelist."
-        )
-    except Exception as e:
-        print(f"Error loading whitelist: {e}")
-
-
-def add_to_whitelist(user_id):
-    """Добавляет пользователя в белый список."""
-    if user_id not in whitelisted_users:
-        try:
-            with open(WHITELIST_FILE, "a") as f:
-                f.write(f"{user_id}\n")
-            whitelisted_users.add(user_id)
-            print(f"Added user {user_id} to whitelist.")
-        except Exception as e:
-            print(f"Error adding user {user_id} to whitelist: {e}")
-
-
-def is_whitelisted(user_id):
-    """Checks if a user ID is in the whitelist."""
-
-    return user_id in whitelisted_users
+edit_budget = EditBudget(STREAM_EDIT_INTERVAL)
+
+
+def send_chat_parts(chat_session, model, parts, rebuild, request):
+    """
+    send_chat для запроса с файлами: request(chat, parts) отправляет parts.
+    Если Files API уже удалил файл по ссылке, parts собираются заново через
+    rebuild() и запрос повторяется.
+    """
+    return send_chat(
+        gemini,
+        client.chats,
+        chat_session,
+        model,
+        lambda chat: send_with_fresh_files(
+            file_uploads, parts, rebuild, lambda: request(chat, parts)
+        ),
+    )
 
 
 def ensure_user_started(func):
-    """Декоратор: проверяет, начал ли пользователь диалог командой /start (есть ли в БД)."""
+    """
+    Декоратор: проверяет, начал ли пользователь диалог командой /start (есть ли в БД),
+    и передаёт обработчику UserContext с настройками из кэша.
+    """
 
     @wraps(func)
     def wrapper(message, *args, **kwargs):
@@ -277,35 +159,42 @@ def ensure_user_started(func):
             print(
                 f"Предупреждение: ensure_user_started получил неожиданный тип: {type(message)}"
             )
-            return func(message, *args, **kwargs)
-
-        with SessionLocal() as session:
-            user = crud.get_user(session, user_id)
-            if not user:
-                try:
-                    if is_callback:
-                        bot.answer_callback_query(message.id)
-                    bot.send_message(
-                        chat_id,
-                        "Пожалуйста, введите /start для начала работы.",
-                        reply_markup=telebot.types.ReplyKeyboardRemove(),
-                    )
-                except Exception as e:
-                    print(
-                        f"Ошибка при отправке сообщения 'введите /start': {e}"
-                    )
-                return None
-        return func(message, *args, **kwargs)
+            return func(message, None, *args, **kwargs)
+
+        settings = load_user_settings(user_id)
+        if settings is None:
+            try:
+                if is_callback:
+                    bot.answer_callback_query(message.id)
+                bot.send_message(
+                    chat_id,
+                    bot_common.START_REQUIRED_TEXT,
+                    reply_markup=telebot.types.ReplyKeyboardRemove(),
+                )
+            except Exception as e:
+                print(f"Ошибка при отправке сообщения 'введите /start': {e}")
+            return None
+        ctx = UserContext(user_id, chat_id, settings)
+        return func(message, ctx, *args, **kwargs)
 
     return wrapper
 
 
+def download_telegram_file(file_path):
+    """
+    Скачивает файл Telegram кусками через общий пул соединений; большие
+    файлы попадают во временный файл. Возвращает файловый объект.
+    """
+    return http_client.download(
+        http_client.file_url(TELEGRAM_TOKEN, file_path),
+        MAX_FILE_SIZE_MB * 1024 * 1024,
+    )
+
+
 def download_telegram_image(file_id):
     """Загружает изображение из Telegram."""
     file_info = bot.get_file(file_id)
-    file_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file_info.file_path}"
-    response = requests.get(file_url)
-    return io.BytesIO(response.content)
+    return download_telegram_file(file_info.file_path)
 
 
 def send_text_as_file(chat_id, text, filename="response.txt"):
@@ -319,50 +208,52 @@ def send_text_as_file(chat_id, text, filename="response.txt"):
     )
 
 
+def delete_quietly(chat_id, message_id):
+    try:
+        bot.delete_message(chat_id, message_id)
+    except Exception:
+        pass
+
+
+def generate_content(model_name, contents, config, tokens=0):
+    """Одиночный запрос generate_content; хеджируется, если включено."""
+
+    def request(name):
+        return client.models.generate_content(
+            model=name, contents=contents, config=config
+        )
+
+    if hedger is None:
+        return request(model_name)
+    return hedger.call(model_name, request, tokens)
+
+
 def send_gemini_response_with_images(
     chat_id, response, reply_to_message_id=None
 ):
     """Отправляет ответ Gemini, обрабатывая как текст, так и изображения."""
-    text_parts = []
-
-    if hasattr(response, "candidates") and response.candidates:
-        for candidate in response.candidates:
-            if hasattr(candidate, "content") and candidate.content:
-                if (
-                    hasattr(candidate.content, "parts")
-                    and candidate.content.parts
-                ):
-                    for part in candidate.content.parts:
-                        if hasattr(part, "text") and part.text:
-                            text_parts.append(part.text)
-                        elif hasattr(part, "inline_data"):
-                            try:
-                                image_data = part.inline_data.data
-                                mime_type = part.inline_data.mime_type
-
-                                image_bytes = io.BytesIO(image_data)
-
-                                if mime_type.startswith("image/"):
-                                    bot.send_photo(
-                                        chat_id,
-                                        image_bytes,
-                                        reply_to_message_id=reply_to_message_id,
-                                    )
-                                else:
-                                    bot.send_document(
-                                        chat_id,
-                                        image_bytes,
-                                        visible_file_name=f"generated_content.{mime_type.split('/')[-1]}",
-                                        reply_to_message_id=reply_to_message_id,
-                                    )
-                            except Exception as e:
-                                print(f"Ошибка отправки изображения: {e}")
-                                text_parts.append(
-                                    f"[Ошибка отправки изображения: {e}]"
-                                )
-
-    if not text_parts and hasattr(response, "text") and response.text:
-        text_parts.append(response.text)
+    text_parts, media = collect_response_parts(response)
+
+    for data, mime_type in media:
+        try:
+            image_bytes = io.BytesIO(data)
+
+            if mime_type.startswith("image/"):
+                bot.send_photo(
+                    chat_id,
+                    image_bytes,
+                    reply_to_message_id=reply_to_message_id,
+                )
+            else:
+                bot.send_document(
+                    chat_id,
+                    image_bytes,
+                    visible_file_name=f"generated_content.{mime_type.split('/')[-1]}",
+                    reply_to_message_id=reply_to_message_id,
+                )
+        except Exception as e:
+            print(f"Ошибка отправки изображения: {e}")
+            text_parts.append(f"[Ошибка отправки изображения: {e}]")
 
     if text_parts:
         combined_text = "\n".join(text_parts)
@@ -377,76 +268,39 @@ def send_gemini_response_with_images(
     return ""
 
 
-@bot.message_handler(commands=["help"])
+@router.command("help")
 def handle_help_command(message):
     """Выводит подробную справку по функциям бота."""
-    help_text = HELP_TEXT_TEMPLATE.format(
-        MAX_FILE_SIZE_MB=MAX_FILE_SIZE_MB,
-        SEND_MODE_IMMEDIATE=SEND_MODE_IMMEDIATE,
-        SEND_MODE_MANUAL=SEND_MODE_MANUAL,
+    bot.send_message(
+        message.chat.id, bot_common.help_text(), parse_mode="Markdown"
     )
 
-    for command_info in COMMAND_LIST:
-        if command_info.command not in ["/start"]:
-            example = ""
-            if command_info.command == "/translate":
-                example = " (напр. `/translate привет мир`)"
-            elif command_info.command == "/prompt":
-                example = " (напр. `/prompt напиши стих`)"
-            help_text += f"- *{command_info.command}*: {command_info.description}{example}\n"
-    help_text += "- *Пример:* `/translate Hello world`\n"
 
-    bot.send_message(message.chat.id, help_text, parse_mode="Markdown")
-
-
-@bot.message_handler(commands=["unlock_pro"])
+@router.command("unlock_pro")
 @ensure_user_started
-def handle_unlock_pro(message):
+def handle_unlock_pro(message, ctx):
     """Обрабатывает команду /unlock_pro."""
     user_id = message.from_user.id
-    command_parts = message.text.split(" ", 1)
-
-    if len(command_parts) == 2 and command_parts[1].strip() == str(PRO_CODE):
+    if command_args(message.text) == str(PRO_CODE):
         add_to_whitelist(user_id)
         bot.reply_to(message, "✅ Доступ к про модели разблокирован!")
     else:
         bot.reply_to(message, "❌ Неверный код. Используйте другой")
 
 
-@bot.message_handler(commands=["start"])
+@router.command("start")
 def send_welcome(message):
     """Обрабатывает команду /start."""
     user_id = message.from_user.id
 
-    with SessionLocal() as session:
-        # Create user with defaults if not exists
-        user = crud.get_or_create_user(session, user_id)
-        current_model = user.current_model
-        send_mode = user.send_mode
-        search_enabled = user.search_enabled
-
-        # Clear buffers/files on start
-        crud.clear_file_contexts(session, user_id)
-        crud.clear_buffer(session, user_id)
-
-    # Initialize chat session
-    get_active_chat(user_id, current_model)
+    send_mode, search_enabled, current_model = bot_common.start_user(user_id)
+    get_active_chat(user_id, current_model, client.chats, compactor)
 
     user_last_responses[user_id] = None
 
-    search_status_text = "Вкл ✅" if search_enabled else "Выкл ❌"
-
-    greeting_text = GREETING_MESSAGE_TEMPLATE.format(
-        model_name=get_model_alias(current_model),
-        send_mode=send_mode,
-        search_status=search_status_text,
-        send_mode_immediate=SEND_MODE_IMMEDIATE,
-        send_mode_manual=SEND_MODE_MANUAL,
-    )
-
     bot.send_message(
         message.chat.id,
-        greeting_text,
+        bot_common.greeting_text(send_mode, search_enabled, current_model),
         reply_markup=get_main_keyboard(
             send_mode, search_enabled, current_model
         ),
@@ -454,52 +308,33 @@ def send_welcome(message):
     )
 
 
-@bot.message_handler(func=lambda message: message.text == "Новый чат")
+@router.exact("Новый чат")
 @ensure_user_started
-def new_chat(message):
+def new_chat(message, ctx):
     """Обрабатывает нажатие кнопки "Новый чат"."""
     user_id = message.from_user.id
 
-    with SessionLocal() as session:
-        user = crud.get_or_create_user(session, user_id)
-        current_model = user.current_model
-        send_mode = user.send_mode
-        search_enabled = user.search_enabled
-
-        # Clear history in DB
-        crud.clear_chat_session(session, user_id)
-        # Clear contexts
-        crud.clear_file_contexts(session, user_id)
-        crud.clear_buffer(session, user_id)
-
-    # Clear memory cache
-    if user_id in user_chats:
-        del user_chats[user_id]
+    current_model = ctx.current_model
+    send_mode = ctx.send_mode
+    search_enabled = ctx.search_enabled
 
-    # Start new
-    get_active_chat(user_id, current_model)
+    bot_common.reset_chat(user_id)
+    get_active_chat(user_id, current_model, client.chats, compactor)
 
     user_last_responses[user_id] = None
 
-    search_status = "Вкл ✅" if search_enabled else "Выкл ❌"
-
     bot.send_message(
         message.chat.id,
-        f"Начат новый чат. Контекст предыдущего разговора очищен.\n\n"
-        f"Текущая модель: {get_model_alias(current_model)}\n"
-        f"Режим отправки: {send_mode}\n"
-        f"Поиск Google: {search_status}",
+        bot_common.new_chat_text(send_mode, search_enabled, current_model),
         reply_markup=get_main_keyboard(
             send_mode, search_enabled, current_model
         ),
     )
 
 
-@bot.message_handler(
-    func=lambda message: message.text.startswith("Получить .")
-)
+@router.prefix("Получить .")
 @ensure_user_started
-def get_response_as_md(message):
+def get_response_as_md(message, ctx):
     """Обрабатывает нажатие кнопки "Получить .md 📄"."""
     user_id = message.from_user.id
     chat_id = message.chat.id
@@ -507,84 +342,32 @@ def get_response_as_md(message):
     if user_last_responses.get(user_id):
         raw_response = user_last_responses[user_id]
 
-        words = raw_response.split()
-        filename_base = "_".join(words[:3]) if len(words) > 0 else "response"
-        filename_base = (
-            filename_base.replace("/", "_")
-            .replace("\\", "_")
-            .replace(":", "_")
-        )
-
-        md_filename = f"{filename_base}.md"
-        send_text_as_file(
-            chat_id,
-            raw_response,
-            md_filename,
-        )
+        filename_base = bot_common.filename_base(raw_response, "response")
+        send_text_as_file(chat_id, raw_response, f"{filename_base}.md")
 
-        txt_filename = f"{filename_base}.txt"
         plain_text = markdown_to_text(raw_response)
-        send_text_as_file(
-            chat_id,
-            plain_text,
-            txt_filename,
-        )
+        send_text_as_file(chat_id, plain_text, f"{filename_base}.txt")
     else:
-        with SessionLocal() as session:
-            user = crud.get_or_create_user(session, user_id)
-            search_enabled = user.search_enabled
-            current_model = user.current_model
-            send_mode = user.send_mode
-
         bot.send_message(
             chat_id,
             "У меня нет сохраненных ответов для отправки в виде файла.",
             reply_markup=get_main_keyboard(
-                send_mode, search_enabled, current_model
+                ctx.send_mode, ctx.search_enabled, ctx.current_model
             ),
         )
 
 
-@bot.message_handler(func=lambda message: message.text.startswith("Режим:"))
+@router.prefix("Режим:")
 @ensure_user_started
-def handle_send_mode(message):
+def handle_send_mode(message, ctx):
     """Переключает режим отправки сообщений."""
-    user_id = message.from_user.id
-    chat_id = message.chat.id
-
-    with SessionLocal() as session:
-        user = crud.get_or_create_user(session, user_id)
-        current_mode = user.send_mode
-
-        new_mode = (
-            SEND_MODE_MANUAL
-            if current_mode == SEND_MODE_IMMEDIATE
-            else SEND_MODE_IMMEDIATE
-        )
-
-        updated_user = crud.update_user_send_mode(session, user_id, new_mode)
-        new_mode = updated_user.send_mode
-        search_enabled = updated_user.search_enabled
-        current_model = updated_user.current_model
-
-        # Clear buffer if switching to manual? No, keep it.
-        # Clear buffer if switching to immediate? Maybe send existing?
-        # Logic says: switching mode just switches future behavior.
-        # If switching from manual to immediate, buffer remains until manually cleared or sent.
-        # But 'user_message_buffer[user_id] = []' was in original code.
-        crud.clear_buffer(session, user_id)
-
-    mode_message = f"Режим отправки изменен на: *{new_mode}*\n\n"
-    if new_mode == SEND_MODE_MANUAL:
-        mode_message += "Теперь ваши сообщения будут накапливаться. Нажмите кнопку 'Отправить всё', чтобы отправить их в Gemini."
-    else:
-        mode_message += (
-            "Теперь каждое ваше сообщение будет сразу отправляться в Gemini."
-        )
+    new_mode, search_enabled, current_model = bot_common.toggle_send_mode(
+        message.from_user.id, ctx.send_mode
+    )
 
     bot.send_message(
-        chat_id,
-        mode_message,
+        message.chat.id,
+        bot_common.send_mode_text(new_mode),
         reply_markup=get_main_keyboard(
             new_mode, search_enabled, current_model
         ),
@@ -592,27 +375,17 @@ def handle_send_mode(message):
     )
 
 
-@bot.message_handler(func=lambda message: message.text.startswith("Поиск:"))
+@router.prefix("Поиск:")
 @ensure_user_started
-def handle_search_command(message):
+def handle_search_command(message, ctx):
     """Переключает режим поиска Google."""
-    user_id = message.from_user.id
-
-    with SessionLocal() as session:
-        user = crud.get_or_create_user(session, user_id)
-        new_status = not user.search_enabled
-        updated_user = crud.update_user_search_enabled(
-            session, user_id, new_status
-        )
-
-        search_enabled = updated_user.search_enabled
-        send_mode = updated_user.send_mode
-        current_model = updated_user.current_model
+    send_mode, search_enabled, current_model = bot_common.toggle_search(
+        message.from_user.id, ctx.search_enabled
+    )
 
-    search_status = "Вкл ✅" if search_enabled else "Выкл ❌"
     bot.reply_to(
         message,
-        f"🔎 Поиск Google теперь: *{search_status}*",
+        f"🔎 Поиск Google теперь: *{bot_common.search_status(search_enabled)}*",
         parse_mode="Markdown",
         reply_markup=get_main_keyboard(
             send_mode, search_enabled, current_model
@@ -620,9 +393,9 @@ def handle_search_command(message):
     )
 
 
-@bot.message_handler(func=lambda message: message.text.startswith("Модель:"))
+@router.prefix("Модель:")
 @ensure_user_started
-def select_model(message):
+def select_model(message, ctx):
     """Обрабатывает нажатие кнопки "Выбрать модель"."""
     bot.send_message(
         message.chat.id,
@@ -631,18 +404,16 @@ def select_model(message):
     )
 
 
-@bot.message_handler(func=lambda message: message.text == "Отправить всё")
+@router.exact("Отправить всё")
 @ensure_user_started
-def handle_send_all(message):
+def handle_send_all(message, ctx):
     """Отправляет накопленные сообщения (текст и фото) из буфера, сохраняя разрывы между текстами."""
     user_id = message.from_user.id
     chat_id = message.chat.id
 
-    with SessionLocal() as session:
-        user = crud.get_or_create_user(session, user_id)
-        current_mode = user.send_mode
-        search_enabled = user.search_enabled
-        current_model = user.current_model
+    current_mode = ctx.send_mode
+    search_enabled = ctx.search_enabled
+    current_model = ctx.current_model
 
     if current_mode != SEND_MODE_MANUAL:
         bot.reply_to(
@@ -667,50 +438,39 @@ def handle_send_all(message):
         )
         return
 
-    # Load/Ensure chat exists
-    chat_session = get_active_chat(user_id, current_model)
-
-    combined_parts = []
-    current_text_block = ""
+    # Фото уменьшаются до предела модели до оценки токенов
+    buffered_items = image_preprocessor.buffer_items(buffered_items, current_model)
 
-    for item in buffered_items:
-        if item["type"] == "text":
-            if current_text_block:
-                current_text_block += "\n\n" + item["content"]
-            else:
-                current_text_block = item["content"]
-        elif item["type"] == "photo":
-            if current_text_block:
-                combined_parts.append(current_text_block)
-                current_text_block = ""
-
-            if item.get("caption"):
-                combined_parts.append(item["caption"])
-            combined_parts.append(item["image"])
-        elif item["type"] == "document":
-            if current_text_block:
-                combined_parts.append(current_text_block)
-                current_text_block = ""
-            if item.get("caption"):
-                combined_parts.append(item["caption"])
-            try:
-                combined_parts.append(
-                    genai_types.Part.from_bytes(
-                        mime_type=item["mime_type"], data=item["data"]
-                    )
-                )
-
-                combined_parts.append(f"(Файл: {item['filename']})")
-            except Exception as file_err:
-                bot.send_message(
-                    chat_id,
-                    f"⚠️ Не удалось добавить файл '{item['filename']}' из буфера в запрос: {file_err}",
-                )
+    # Load/Ensure chat exists
+    chat_session = get_active_chat(
+        user_id, current_model, client.chats, compactor
+    )
 
-                continue
+    check = preflight(
+        current_model,
+        chat_history(chat_session),
+        texts=[i["content"] for i in buffered_items if i["type"] == "text"],
+        files=[i for i in buffered_items if i["type"] != "text"],
+    )
+    if not check.ok:
+        bot.reply_to(
+            message,
+            check.rejection_text(),
+            reply_markup=get_main_keyboard(
+                current_mode, search_enabled, current_model
+            ),
+        )
+        return
+    for warning in check.dropped_texts():
+        bot.send_message(chat_id, warning)
+    buffered_items = check.keep(buffered_items)
 
-    if current_text_block:
-        combined_parts.append(current_text_block)
+    combined_parts, file_errors = build_buffer_parts(buffered_items, file_uploads)
+    for filename, file_err in file_errors:
+        bot.send_message(
+            chat_id,
+            f"⚠️ Не удалось добавить файл '{filename}' из буфера в запрос: {file_err}",
+        )
 
     if not combined_parts:
         bot.reply_to(
@@ -729,68 +489,60 @@ def handle_send_all(message):
     )
 
     try:
-        if is_image_generation_model(current_model):
-            gemini_config = GenerateContentConfig(
-                response_modalities=["TEXT", "IMAGE"]
+        gemini_config = build_chat_config(current_model, search_enabled)
+        streaming = STREAMING_ENABLED and not is_image_generation_model(
+            current_model
+        )
+
+        def rebuild():
+            return build_buffer_parts(buffered_items, file_uploads)[0]
+
+        if streaming:
+            stream, chat_session = send_chat_parts(
+                chat_session,
+                current_model,
+                combined_parts,
+                rebuild,
+                lambda chat, parts: open_stream(chat, parts, gemini_config),
+            )
+            # Статусное сообщение служит заглушкой для потокового текста
+            raw_response_text, response, status_msg = stream_chat_response(
+                bot,
+                chat_session,
+                combined_parts,
+                gemini_config,
+                chat_id,
+                edit_budget,
+                placeholder=status_msg,
+                stream=stream,
             )
         else:
-            tools = [Tool(url_context=genai_types.UrlContext())]
-            if search_enabled:
-                tools.append(Tool(google_search=GoogleSearch()))
-            gemini_config = GenerateContentConfig(tools=tools)
-
-        response = chat_session.send_message(
-            message=combined_parts, config=gemini_config
-        )
-        save_active_chat(user_id)  # Save history
+            response, chat_session = send_chat_parts(
+                chat_session,
+                current_model,
+                combined_parts,
+                rebuild,
+                lambda chat, parts: chat.send_message(
+                    message=parts, config=gemini_config
+                ),
+            )
+        save_active_chat(user_id, chat_session)  # Save history
+        estimator.observe(check.total, response)
 
         if is_image_generation_model(current_model):
             raw_response_text = send_gemini_response_with_images(
                 chat_id, response, reply_to_message_id=message.message_id
             )
-        else:
+        elif not streaming:
             raw_response_text = response.text
 
-        sources_text = ""
-        try:
-            if (
-                response.candidates
-                and response.candidates[0].grounding_metadata
-                and response.candidates[0].grounding_metadata.grounding_chunks
-            ):
-                sources = []
-                for i, chunk in enumerate(
-                    response.candidates[0].grounding_metadata.grounding_chunks
-                ):
-                    if (
-                        hasattr(chunk, "web")
-                        and chunk.web.uri
-                        and chunk.web.title
-                    ):
-                        sources.append(
-                            f"{i + 1}. [{chunk.web.title}]({chunk.web.uri})"
-                        )
-                    elif hasattr(chunk, "web") and chunk.web.uri:
-                        sources.append(
-                            f"{i + 1}. [{chunk.web.uri}]({chunk.web.uri})"
-                        )
-
-                if sources:
-                    sources_text = "\n\nИсточники:\n" + "\n".join(sources)
-                    raw_response_text += sources_text
-        except (AttributeError, IndexError) as e:
-            print(f"Не удалось извлечь источники: {e}")
-
-        # Clear buffer after successful send
-        with SessionLocal() as session:
-            crud.clear_buffer(session, user_id)
+        sources_text = extract_sources_text(response)
+        if sources_text:
+            raw_response_text += sources_text
 
-        user_last_responses[user_id] = raw_response_text
+        bot_common.clear_buffer(user_id)
 
-        try:
-            bot.delete_message(chat_id, status_msg.message_id)
-        except Exception:
-            pass
+        user_last_responses[user_id] = raw_response_text
 
         if not is_image_generation_model(current_model):
             send_rich_response(
@@ -801,11 +553,10 @@ def handle_send_all(message):
                 fallback_download_keyboard=get_file_download_keyboard(user_id),
             )
 
+        delete_placeholder(bot, chat_id, status_msg)
+
     except Exception as e:
-        try:
-            bot.delete_message(chat_id, status_msg.message_id)
-        except Exception:
-            pass
+        delete_quietly(chat_id, status_msg.message_id)
         bot.reply_to(
             message,
             f"Произошла ошибка при отправке: {e!s}\n\n"
@@ -822,7 +573,7 @@ def handle_send_all(message):
     )
 )
 @ensure_user_started
-def handle_get_file(call):
+def handle_get_file(call, ctx):
     """Обрабатывает нажатие инлайн кнопок "Получить в виде файла" (.txt или .md)."""
 
     user_id = int(call.data.split("_")[2])
@@ -831,14 +582,8 @@ def handle_get_file(call):
     if user_last_responses.get(user_id):
         raw_response = user_last_responses[user_id]
 
-        words = raw_response.split()
-        filename = (
-            "_".join(words[:3]) + f".{file_format}"
-            if len(words) > 0
-            else f"response.{file_format}"
-        )
         filename = (
-            filename.replace("/", "_").replace("\\", "_").replace(":", "_")
+            f"{bot_common.filename_base(raw_response, 'response')}.{file_format}"
         )
 
         if file_format == "txt":
@@ -848,11 +593,7 @@ def handle_get_file(call):
             file_content = raw_response
             alert_text = "Markdown файл отправлен!"
 
-        send_text_as_file(
-            call.message.chat.id,
-            file_content,
-            filename,
-        )
+        send_text_as_file(call.message.chat.id, file_content, filename)
         bot.answer_callback_query(call.id, text=alert_text)
     else:
         bot.answer_callback_query(
@@ -863,58 +604,31 @@ def handle_get_file(call):
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("model_"))
 @ensure_user_started
-def handle_model_selection(call):
+def handle_model_selection(call, ctx):
     """Обрабатывает нажатия кнопок выбора модели."""
     user_id = call.from_user.id
     selected_model = call.data.replace("model_", "")
 
-    PRO_MODEL_NAME = "gemini-3.1-pro-preview"
-
-    with SessionLocal() as session:
-        user = crud.get_or_create_user(session, user_id)
-
-        if selected_model == PRO_MODEL_NAME and not is_whitelisted(user_id):
-            bot.answer_callback_query(
-                call.id,
-                text="Доступ к про модели ограничен. Используйте /unlock_pro <Имя создателя бота>",
-            )
-            bot.send_message(
-                call.message.chat.id,
-                "Доступ к про модели ограничен. Пожалуйста, используйте команду /unlock_pro <Имя создателя бота> для разблокировки.",
-                reply_markup=get_main_keyboard(
-                    user.send_mode, user.search_enabled, user.current_model
-                ),
-            )
-            return
-
-        if is_image_generation_model(selected_model) and not is_whitelisted(user_id):
-            bot.answer_callback_query(
-                call.id,
-                text="Доступ к модели генерации изображений ограничен. Используйте /unlock_pro <Имя создателя бота>",
-            )
-            bot.send_message(
-                call.message.chat.id,
-                "Доступ к модели генерации изображений ограничен. Пожалуйста, используйте команду /unlock_pro <Имя создателя бота> для разблокировки.",
-                reply_markup=get_main_keyboard(
-                    user.send_mode, user.search_enabled, user.current_model
-                ),
-            )
-            return
-
-        updated_user = crud.update_user_model(session, user_id, selected_model)
-        current_model = updated_user.current_model
-        send_mode = updated_user.send_mode
-        search_enabled = updated_user.search_enabled
-
-        # Clear DB session and context when switching models
-        crud.clear_chat_session(session, user_id)
-        crud.clear_file_contexts(session, user_id)
-        crud.clear_buffer(session, user_id)
+    denied_text = bot_common.model_access_denied(user_id, selected_model)
+    if denied_text:
+        bot.answer_callback_query(
+            call.id,
+            text=f"Доступ к {denied_text} ограничен. Используйте /unlock_pro <Имя создателя бота>",
+        )
+        bot.send_message(
+            call.message.chat.id,
+            f"Доступ к {denied_text} ограничен. Пожалуйста, используйте команду /unlock_pro <Имя создателя бота> для разблокировки.",
+            reply_markup=get_main_keyboard(
+                ctx.send_mode, ctx.search_enabled, ctx.current_model
+            ),
+        )
+        return
 
-    # Recreate chat (this will be fresh because we cleared DB)
-    if user_id in user_chats:
-        del user_chats[user_id]
-    get_active_chat(user_id, current_model)
+    bot_common.reset_chat(user_id, selected_model)
+    send_mode = ctx.send_mode
+    search_enabled = ctx.search_enabled
+    current_model = selected_model
+    get_active_chat(user_id, current_model, client.chats, compactor)
 
     user_last_responses[user_id] = None
 
@@ -939,143 +653,109 @@ def handle_model_selection(call):
 
 @bot.message_handler(content_types=["document"])
 @ensure_user_started
-def handle_document(message):
+def handle_document(message, ctx):
     """Обрабатывает входящие документы поддерживаемых типов, сохраняя их в контекст."""
     user_id = message.from_user.id
     chat_id = message.chat.id
 
-    with SessionLocal() as session:
-        user = crud.get_or_create_user(session, user_id)
-        current_mode = user.send_mode
-        search_enabled = user.search_enabled
-        current_model = user.current_model
+    current_mode = ctx.send_mode
+    search_enabled = ctx.search_enabled
+    current_model = ctx.current_model
+    keyboard = get_main_keyboard(current_mode, search_enabled, current_model)
 
     doc_mime_type = message.document.mime_type
-    if doc_mime_type in SUPPORTED_MIME_TYPES:
-        try:
-            bot.send_chat_action(chat_id, "upload_document")
-            file_info = bot.get_file(message.document.file_id)
-
-            if file_info.file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
-                bot.reply_to(
-                    message,
-                    f"❌ Файл '{message.document.file_name}' слишком большой "
-                    f"(> {MAX_FILE_SIZE_MB} МБ). Я могу обрабатывать файлы размером до {MAX_FILE_SIZE_MB} МБ.",
-                    reply_markup=get_main_keyboard(
-                        current_mode, search_enabled, current_model
-                    ),
-                )
-                return
+    if doc_mime_type not in SUPPORTED_MIME_TYPES:
+        bot.reply_to(
+            message,
+            bot_common.unsupported_document_text(doc_mime_type),
+            reply_markup=keyboard,
+        )
+        return
 
-            downloaded_file = bot.download_file(file_info.file_path)
-            pdf_bytes = downloaded_file
-            filename = message.document.file_name
-            caption = message.caption or ""
+    try:
+        bot.send_chat_action(chat_id, "upload_document")
+        file_info = bot.get_file(message.document.file_id)
 
-            file_data = {
-                "mime_type": doc_mime_type,
-                "data": pdf_bytes,
-                "filename": filename,
-                "caption": caption,
-            }
+        if file_info.file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+            bot.reply_to(
+                message,
+                bot_common.document_too_large_text(message.document.file_name),
+                reply_markup=keyboard,
+            )
+            return
 
-            # Save to DB (File Context)
-            add_file_context_entry(user_id, file_data)
+        downloaded_file = download_telegram_file(file_info.file_path)
+        filename = message.document.file_name
+        caption = message.caption or ""
 
-            # Get count from DB
-            with SessionLocal() as session:
-                context_count = len(crud.get_file_contexts(session, user_id))
+        file_data = {
+            "mime_type": doc_mime_type,
+            "data": downloaded_file,
+            "filename": filename,
+            "caption": caption,
+        }
 
+        # Загрузка закрывается, как только файл сохранён в хранилище
+        with downloaded_file:
+            add_file_context_entry(user_id, file_data)
             if current_mode == SEND_MODE_MANUAL:
-                # Add to buffer as well
-                add_to_message_buffer(
-                    user_id, {**file_data, "type": "document"}
-                )
+                add_to_message_buffer(user_id, {**file_data, "type": "document"})
+        context_count = bot_common.count_file_contexts(user_id)
 
-                with SessionLocal() as session:
-                    buffer_count = len(crud.get_buffer(session, user_id))
-
-                file_type_short = doc_mime_type.split("/")[-1].upper()
-                bot.reply_to(
-                    message,
-                    f"📄 Файл '{filename}' ({file_type_short}) добавлен в буфер ({buffer_count} шт.). "
-                    + ("Подпись также добавлена.\n" if caption else "\n")
-                    + f"Всего файлов в контексте: {context_count}.\n"
-                    + "Нажмите 'Отправить всё', когда будете готовы.",
-                    reply_markup=get_main_keyboard(
-                        current_mode, search_enabled, current_model
-                    ),
-                )
-            else:
-                file_type_short = doc_mime_type.split("/")[-1].upper()
-                bot.reply_to(
-                    message,
-                    f"✅ Файл '{filename}' ({file_type_short}) добавлен в контекст (всего: {context_count}). "
-                    "Он будет автоматически использован при следующем текстовом запросе.",
-                    reply_markup=get_main_keyboard(
-                        current_mode, search_enabled, current_model
-                    ),
-                )
-
-        except Exception as e:
-            bot.reply_to(
-                message,
-                f"Не удалось обработать файл '{message.document.file_name}': {e!s}",
-                reply_markup=get_main_keyboard(
-                    current_mode, search_enabled, current_model
-                ),
-            )
-    else:
-        supported_types_str = ", ".join(
-            sorted(
-                [
-                    t.split("/")[-1].upper()
-                    for t in SUPPORTED_MIME_TYPES
-                    if not t.startswith("application/x")
-                ]
-            )
-        )
+        buffer_count = None
+        if current_mode == SEND_MODE_MANUAL:
+            buffer_count = bot_common.count_buffer(user_id)
         bot.reply_to(
             message,
-            f"Извините, я не могу обработать этот тип файла ({doc_mime_type}). \nПоддерживаемые типы: {supported_types_str}",
-            reply_markup=get_main_keyboard(
-                current_mode, search_enabled, current_model
+            bot_common.document_added_text(
+                filename, doc_mime_type, caption, context_count, buffer_count
             ),
+            reply_markup=keyboard,
+        )
+
+    except Exception as e:
+        bot.reply_to(
+            message,
+            f"Не удалось обработать файл '{message.document.file_name}': {e!s}",
+            reply_markup=keyboard,
         )
 
 
 @bot.message_handler(content_types=["photo"])
 @ensure_user_started
-def handle_photo(message):
+def handle_photo(message, ctx):
     user_id = message.from_user.id
     chat_id = message.chat.id
 
-    with SessionLocal() as session:
-        user = crud.get_or_create_user(session, user_id)
-        current_mode = user.send_mode
-        search_enabled = user.search_enabled
-        current_model = user.current_model
+    current_mode = ctx.send_mode
+    search_enabled = ctx.search_enabled
+    current_model = ctx.current_model
 
-    file_id = message.photo[-1].file_id
+    # Наименьший вариант фото, которого хватает для предела модели
+    photo = pick_photo_size(
+        message.photo, image_preprocessor.max_edge(current_model)
+    )
+    file_id = photo.file_id
     caption = message.caption if message.caption else ""
     if current_mode == SEND_MODE_MANUAL:
         try:
             bot.send_chat_action(chat_id, "typing")
-            image_stream = download_telegram_image(file_id)
-            img = Image.open(image_stream)
-
-            add_to_message_buffer(
-                user_id, {"type": "photo", "image": img, "caption": caption}
-            )
+            with download_telegram_image(file_id) as image_file:
+                add_to_message_buffer(
+                    user_id,
+                    {
+                        "type": "photo",
+                        "data": image_file,
+                        "mime_type": PHOTO_MIME_TYPE,
+                        "caption": caption,
+                    },
+                )
 
-            with SessionLocal() as session:
-                buffer_count = len(crud.get_buffer(session, user_id))
+            buffer_count = bot_common.count_buffer(user_id)
 
             bot.reply_to(
                 message,
-                f"Фото добавлено в буфер ({buffer_count} шт.). "
-                + ("Подпись также добавлена.\n" if caption else "\n")
-                + "Нажмите 'Отправить всё', когда будете готовы.",
+                bot_common.photo_buffered_text(buffer_count, caption),
                 reply_markup=get_main_keyboard(
                     current_mode, search_enabled, current_model
                 ),
@@ -1090,29 +770,40 @@ def handle_photo(message):
             )
         return
 
-    chat_session = get_active_chat(user_id, current_model)
+    chat_session = get_active_chat(
+        user_id, current_model, client.chats, compactor
+    )
 
     bot.send_chat_action(chat_id, "typing")
     try:
-        image_stream = download_telegram_image(file_id)
-        img = Image.open(image_stream)
+        with download_telegram_image(file_id) as image_file:
+            data, mime_type = image_preprocessor.process(
+                image_file.read(),
+                PHOTO_MIME_TYPE,
+                current_model,
+                key=photo.file_unique_id,
+            )
+        image = photo_part({"data": data, "mime_type": mime_type})
 
         api_message_parts = []
 
         if caption:
             api_message_parts.append(caption)
-        api_message_parts.append(img)
+        api_message_parts.append(image)
 
+        gemini_config = None
         if is_image_generation_model(current_model):
-            gemini_config = GenerateContentConfig(
-                response_modalities=["TEXT", "IMAGE"]
-            )
-            response = chat_session.send_message(
+            gemini_config = build_chat_config(current_model, search_enabled)
+        response, chat_session = send_chat(
+            gemini,
+            client.chats,
+            chat_session,
+            current_model,
+            lambda chat: chat.send_message(
                 message=api_message_parts, config=gemini_config
-            )
-        else:
-            response = chat_session.send_message(message=api_message_parts)
-        save_active_chat(user_id)  # Save
+            ),
+        )
+        save_active_chat(user_id, chat_session)  # Save
 
         if is_image_generation_model(current_model):
             raw_response_text = send_gemini_response_with_images(
@@ -1143,64 +834,197 @@ def handle_photo(message):
         )
 
 
-@bot.message_handler(
-    func=lambda message: (
-        message.text
-        and message.text.startswith("/")
-        and message.text.split(" ", 1)[0][1:] in QUICK_TOOLS_CONFIG
+def send_quick_tool_result(message, command, user_query, text, send_text=True):
+    """Ответ быстрого инструмента; todo, markdown и dayplanner — ещё и .md-файлом."""
+    chat_id = message.chat.id
+    filename = bot_common.quick_tool_filename(command, user_query)
+    if filename is not None:
+        send_text_as_file(chat_id, text, filename)
+    if send_text:
+        send_rich_response(
+            bot, chat_id, text, reply_to_message_id=message.message_id
+        )
+
+
+def quick_tool_request(tool, text):
+    """Один запрос быстрого инструмента QuickTool (с повторами и хеджированием)."""
+    tokens = tool.instruction_tokens + estimator.text(text)
+    response, _ = gemini.call(
+        tool.model,
+        lambda model_name: generate_content(model_name, text, tool.config, tokens),
+        record=hedger is None,
     )
-)
-@ensure_user_started
-def handle_quick_tool_command(message):
-    """Обрабатывает команды быстрых инструментов (напр., /translate, /prompt)."""
+    estimator.observe(tokens, response)
+    return response
+
+
+def read_reply_text(message):
+    """Текст сообщения или текстового файла, на который ответили командой."""
+    reply = message.reply_to_message
+    if reply is None:
+        return ""
+    document = reply.document
+    if document is not None and (document.mime_type or "").startswith("text/"):
+        file_info = bot.get_file(document.file_id)
+        with download_telegram_file(file_info.file_path) as text_file:
+            data = text_file.read()
+        return data.decode("utf-8", errors="replace").strip()
+    return (reply.text or reply.caption or "").strip()
+
+
+def handle_quick_tool_batch(message, command, tool_config, user_query, batch):
+    """Пакетный режим: элементы параллельно, прогресс — в одном сообщении."""
     chat_id = message.chat.id
-    command_with_slash = message.text.split(" ", 1)[0]
-    command = command_with_slash[1:]
-    user_query = (
-        message.text.split(" ", 1)[1].strip() if " " in message.text else ""
+    items = batch.items
+    cache = services.cache_for(tool_config)
+
+    def process(item):
+        if cache is not None:
+            cached_text = cache.get(command, tool_config, item)
+            if cached_text is not None:
+                return cached_text
+        response = quick_tool_request(quick_tools[command], item)
+        if cache is not None:
+            cache.put(
+                command, tool_config, item, response.text, response_tokens(response)
+            )
+        return response.text
+
+    def on_progress(done, total):
+        if done < total and edit_budget.try_acquire(chat_id):
+            try:
+                bot.edit_message_text(
+                    f"Выполняю команду `/{command}`: {done}/{total}",
+                    chat_id,
+                    status_msg.message_id,
+                )
+            except Exception:
+                pass
+
+    bot.send_chat_action(chat_id, "typing")
+    status_msg = bot.reply_to(
+        message, f"Выполняю команду `/{command}`: 0/{len(items)}"
+    )
+    results = quick_batch.run(
+        items, process, QUICK_TOOL_BATCH_CONCURRENCY, on_progress
     )
+    text, failed = quick_batch.merge_results(batch, results)
 
-    if not user_query:
-        bot.reply_to(
-            message,
-            f"Пожалуйста, укажите текст после команды {command_with_slash}.\n"
-            f"Например: `{command_with_slash} ваш текст здесь`",
-            parse_mode="Markdown",
+    delete_quietly(chat_id, status_msg.message_id)
+    send_quick_tool_result(message, command, user_query, text)
+    if failed:
+        error = next(r for r in results if isinstance(r, Exception) or not r)
+        print(f"Error in quick tool batch '{command}': {error}")
+        bot.reply_to(message, bot_common.batch_failed_text(failed, len(items)))
+
+
+def handle_quick_tool_map_reduce(message, command, tool_config, user_query):
+    """Длинный текст: части обрабатываются параллельно и сводятся в один ответ."""
+    chat_id = message.chat.id
+    cache = services.cache_for(tool_config)
+    if cache is not None:
+        cached_text = cache.get(command, tool_config, user_query)
+        if cached_text is not None:
+            send_quick_tool_result(message, command, user_query, cached_text)
+            return
+
+    tokens = []
+
+    def call(config, text):
+        response = quick_tool_request(
+            compile_quick_tool(config, estimator.text), text
         )
-        return
+        tokens.append(response_tokens(response))
+        return response.text
 
-    tool_config = QUICK_TOOLS_CONFIG[command]
-    system_instruction = tool_config["system_instruction"]
-    model_to_use = tool_config.get("model", DEFAULT_MODEL)
-    thinking_budget = tool_config.get("thinking_budget", None)
+    def on_progress(done, total):
+        if done < total and edit_budget.try_acquire(chat_id):
+            try:
+                bot.edit_message_text(
+                    f"Обрабатываю текст по частям: {done}/{total}",
+                    chat_id,
+                    status_msg.message_id,
+                )
+            except Exception:
+                pass
 
     bot.send_chat_action(chat_id, "typing")
     status_msg = bot.reply_to(
-        message, f"Выполняю команду `{command_with_slash}`..."
+        message, f"Выполняю команду `/{command}` для длинного текста..."
     )
-
-    if len(user_query) > 4000:
+    try:
+        text = map_reduce.run(tool_config, user_query, call, on_progress)
+        if cache is not None:
+            cache.put(command, tool_config, user_query, text, sum(tokens))
+        delete_quietly(chat_id, status_msg.message_id)
+        send_quick_tool_result(message, command, user_query, text)
+    except Exception as e:
+        delete_quietly(chat_id, status_msg.message_id)
+        print(f"Error in quick tool map-reduce '{command}': {e}")
         bot.reply_to(
             message,
-            f"Текст слишком длинный для команды {command_with_slash}. Максимум 4000 символов.",
+            f"Произошла ошибка при выполнении команды `/{command}`: {e!s}",
+        )
+
+
+@router.command(*QUICK_TOOLS_CONFIG)
+@ensure_user_started
+def handle_quick_tool_command(message, ctx):
+    """Обрабатывает команды быстрых инструментов (напр., /translate, /prompt)."""
+    chat_id = message.chat.id
+    command, user_query = bot_common.parse_quick_tool(message.text)
+
+    if not user_query:
+        try:
+            user_query = read_reply_text(message)
+        except Exception as e:
+            bot.reply_to(message, f"Не удалось прочитать файл: {e!s}")
+            return
+    if not user_query:
+        bot.reply_to(
+            message, bot_common.missing_query_text(command), parse_mode="Markdown"
         )
         return
 
-    try:
-        config_kwargs = {"system_instruction": system_instruction}
-        if thinking_budget is not None:
-            config_kwargs["thinking_config"] = genai_types.ThinkingConfig(
-                thinking_budget=thinking_budget
-            )
+    tool_config = QUICK_TOOLS_CONFIG[command]
+    plan, detail = bot_common.plan_quick_tool(command, user_query, map_reduce)
+    if plan == "reject":
+        bot.reply_to(message, detail)
+        return
+    if plan == "batch":
+        handle_quick_tool_batch(message, command, tool_config, user_query, detail)
+        return
+    if plan == "map_reduce":
+        handle_quick_tool_map_reduce(message, command, tool_config, user_query)
+        return
 
-        if is_image_generation_model(model_to_use):
-            config_kwargs["response_modalities"] = ["TEXT", "IMAGE"]
+    cache = services.cache_for(tool_config)
+    if cache is not None:
+        cached_text = cache.get(command, tool_config, user_query)
+        if cached_text is not None:
+            send_quick_tool_result(message, command, user_query, cached_text)
+            return
 
-        response = client.models.generate_content(
-            model=model_to_use,
-            contents=user_query,
-            config=genai_types.GenerateContentConfig(**config_kwargs),
+    model_to_use, tool_gemini_config, _ = quick_tools[command]
+    check = preflight(
+        model_to_use, texts=[tool_config["system_instruction"], user_query]
+    )
+    if not check.ok:
+        bot.reply_to(message, check.rejection_text())
+        return
+
+    bot.send_chat_action(chat_id, "typing")
+    status_msg = bot.reply_to(message, f"Выполняю команду `/{command}`...")
+
+    try:
+        response, _ = gemini.call(
+            model_to_use,
+            lambda model_name: generate_content(
+                model_name, user_query, tool_gemini_config, check.total
+            ),
+            record=hedger is None,
         )
+        estimator.observe(check.total, response)
 
         if is_image_generation_model(model_to_use):
             raw_response_text = send_gemini_response_with_images(
@@ -1208,66 +1032,50 @@ def handle_quick_tool_command(message):
             )
         else:
             raw_response_text = response.text
+            if cache is not None:
+                cache.put(
+                    command,
+                    tool_config,
+                    user_query,
+                    raw_response_text,
+                    response_tokens(response),
+                )
 
-        if command in ["todo", "markdown", "dayplanner"]:
-            words = user_query.split()
-            filename_base = "_".join(words[:3]) if len(words) > 0 else command
-            filename = f"{filename_base}_{command}.md"
-            filename = (
-                filename.replace("/", "_").replace("\\", "_").replace(":", "_")
-            )
-            send_text_as_file(chat_id, raw_response_text, filename)
-
-        try:
-            bot.delete_message(chat_id, status_msg.message_id)
-        except Exception:
-            pass
-
-        if not is_image_generation_model(model_to_use):
-            send_rich_response(
-                bot,
-                chat_id,
-                raw_response_text,
-                reply_to_message_id=message.message_id,
-            )
+        delete_quietly(chat_id, status_msg.message_id)
+        send_quick_tool_result(
+            message,
+            command,
+            user_query,
+            raw_response_text,
+            send_text=not is_image_generation_model(model_to_use),
+        )
 
     except Exception as e:
-        try:
-            bot.delete_message(chat_id, status_msg.message_id)
-        except Exception:
-            pass
+        delete_quietly(chat_id, status_msg.message_id)
         print(f"Error in quick tool command '{command}': {e}")
         bot.reply_to(
             message,
-            f"Произошла ошибка при выполнении команды `{command_with_slash}`: {e!s}",
+            f"Произошла ошибка при выполнении команды `/{command}`: {e!s}",
         )
 
 
-@bot.message_handler(func=lambda message: True)
+@router.default
 @ensure_user_started
-def handle_message(message):
+def handle_message(message, ctx):
     user_id = message.from_user.id
     chat_id = message.chat.id
 
-    with SessionLocal() as session:
-        user = crud.get_or_create_user(session, user_id)
-        current_mode = user.send_mode
-        search_enabled = user.search_enabled
-        current_model = user.current_model
+    current_mode = ctx.send_mode
+    search_enabled = ctx.search_enabled
+    current_model = ctx.current_model
 
     if current_mode == SEND_MODE_MANUAL:
-        # Add to buffer in DB
         add_to_message_buffer(
             user_id, {"type": "text", "content": message.text}
         )
+        buffer_count = bot_common.count_buffer(user_id)
 
-        with SessionLocal() as session:
-            buffer_count = len(crud.get_buffer(session, user_id))
-
-        bot.reply_to(
-            message,
-            f"Сообщение добавлено в буфер ({buffer_count} шт.). Нажмите 'Отправить всё', когда будете готовы.",
-        )
+        bot.reply_to(message, bot_common.message_buffered_text(buffer_count))
         return
 
     bot.send_chat_action(message.chat.id, "typing")
@@ -1275,95 +1083,98 @@ def handle_message(message):
     try:
         api_message_parts = []
 
+        # Load chat from cache or DB
+        chat_session = get_active_chat(
+            user_id, current_model, client.chats, compactor
+        )
+
         files_in_context = get_file_context_list(user_id)
-        if files_in_context:
+        check = preflight(
+            current_model,
+            chat_history(chat_session),
+            texts=[message.text],
+            files=files_in_context,
+        )
+        if not check.ok:
+            bot.reply_to(message, check.rejection_text())
+            return
+        for warning in check.dropped_texts():
+            bot.send_message(chat_id, warning)
+        files_to_send = check.keep(files_in_context)
+
+        if files_to_send:
             bot.send_message(
                 chat_id,
-                f"📎 Использую {len(files_in_context)} файл(а/ов) из контекста...",
+                f"📎 Использую {len(files_to_send)} файл(а/ов) из контекста...",
+            )
+            context_parts, file_errors = build_context_parts(
+                files_to_send, file_uploads
             )
-            for file_info in files_in_context:
-                if file_info["caption"]:
-                    api_message_parts.append(file_info["caption"])
-
-                try:
-                    api_message_parts.append(
-                        genai_types.Part.from_bytes(
-                            mime_type=file_info["mime_type"],
-                            data=file_info["data"],
-                        )
-                    )
-
-                    api_message_parts.append(
-                        f"(Файл: {file_info['filename']})"
-                    )
-                except Exception as file_err:
-                    bot.send_message(
-                        chat_id,
-                        f"⚠️ Не удалось добавить файл '{file_info['filename']}' в запрос: {file_err}",
-                    )
+            api_message_parts.extend(context_parts)
+            for filename, file_err in file_errors:
+                bot.send_message(
+                    chat_id,
+                    f"⚠️ Не удалось добавить файл '{filename}' в запрос: {file_err}",
+                )
 
         api_message_parts.append(message.text)
 
-        # Load chat from cache or DB
-        chat_session = get_active_chat(user_id, current_model)
+        def rebuild():
+            parts, _ = build_context_parts(files_to_send, file_uploads)
+            return parts + [message.text]
 
-        if is_image_generation_model(current_model):
-            gemini_config = GenerateContentConfig(
-                response_modalities=["TEXT", "IMAGE"]
+        gemini_config = build_chat_config(current_model, search_enabled)
+        streaming = STREAMING_ENABLED and not is_image_generation_model(
+            current_model
+        )
+
+        placeholder = None
+        if streaming:
+            stream, chat_session = send_chat_parts(
+                chat_session,
+                current_model,
+                api_message_parts,
+                rebuild,
+                lambda chat, parts: open_stream(chat, parts, gemini_config),
+            )
+            raw_response_text, response, placeholder = stream_chat_response(
+                bot,
+                chat_session,
+                api_message_parts,
+                gemini_config,
+                chat_id,
+                edit_budget,
+                reply_to_message_id=message.message_id,
+                stream=stream,
             )
         else:
-            tools = [Tool(url_context=genai_types.UrlContext())]
-            if search_enabled:
-                tools.append(Tool(google_search=GoogleSearch()))
-            gemini_config = GenerateContentConfig(tools=tools)
-
-        response = chat_session.send_message(
-            message=api_message_parts, config=gemini_config
-        )
-        save_active_chat(user_id)  # Save history
+            response, chat_session = send_chat_parts(
+                chat_session,
+                current_model,
+                api_message_parts,
+                rebuild,
+                lambda chat, parts: chat.send_message(
+                    message=parts, config=gemini_config
+                ),
+            )
+        save_active_chat(user_id, chat_session)  # Save history
+        estimator.observe(check.total, response)
 
         # Clear file contexts after successful immediate-mode send
         if files_in_context:
-            with SessionLocal() as session:
-                crud.clear_file_contexts(session, user_id)
+            bot_common.clear_file_contexts(user_id)
         if is_image_generation_model(current_model):
             raw_response_text = send_gemini_response_with_images(
                 message.chat.id,
                 response,
                 reply_to_message_id=message.message_id,
             )
-        else:
+        elif not streaming:
             raw_response_text = response.text
 
-        sources_text = ""
-        try:
-            if (
-                response.candidates
-                and response.candidates[0].grounding_metadata
-                and response.candidates[0].grounding_metadata.grounding_chunks
-            ):
-                sources = []
-                for i, chunk in enumerate(
-                    response.candidates[0].grounding_metadata.grounding_chunks
-                ):
-                    if (
-                        hasattr(chunk, "web")
-                        and chunk.web.uri
-                        and chunk.web.title
-                    ):
-                        sources.append(
-                            f"{i + 1}. [{chunk.web.title}]({chunk.web.uri})"
-                        )
-                    elif hasattr(chunk, "web") and chunk.web.uri:
-                        sources.append(
-                            f"{i + 1}. [{chunk.web.uri}]({chunk.web.uri})"
-                        )
-
-                if sources:
-                    sources_text = "\n\nИсточники:\n" + "\n".join(sources)
-                    raw_response_text += sources_text
-        except (AttributeError, IndexError) as e:
-            print(f"Не удалось извлечь источники: {e}")
+        sources_text = extract_sources_text(response)
+        if sources_text:
+            raw_response_text += sources_text
 
         user_last_responses[user_id] = raw_response_text
 
@@ -1375,6 +1186,7 @@ def handle_message(message):
                 reply_to_message_id=message.message_id,
                 fallback_download_keyboard=get_file_download_keyboard(user_id),
             )
+        delete_placeholder(bot, chat_id, placeholder)
     except Exception as e:
         bot.reply_to(
             message,
@@ -1388,5 +1200,32 @@ def handle_message(message):
 
 if __name__ == "__main__":
     db.init_db()
+    if response_cache is not None:
+        response_cache.prune(QUICK_TOOLS_CONFIG)
     load_whitelist()
-    bot.polling(none_stop=True)
+    bot.set_my_commands(COMMAND_LIST)
+    metrics.start_reporter(METRICS_LOG_INTERVAL)
+    if BOT_INGESTION == "webhook":
+        server = WebhookServer(
+            WEBHOOK_HOST,
+            WEBHOOK_PORT,
+            WEBHOOK_PATH,
+            WEBHOOK_SECRET,
+            bot.process_new_updates,
+        )
+        metrics.register("webhook", server.stats)
+        bot.remove_webhook()
+        bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET
+        )
+        print(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+        serve = server.serve_forever
+    else:
+        bot.remove_webhook()
+        serve = partial(bot.polling, none_stop=True)
+    try:
+        serve()
+    finally:
+        # Обработчики дописывают ходы, затем кэш чатов сохраняет остальное
+        dispatcher.shutdown()
+        services.shutdown()
@@ -0,0 +1,212 @@
+"""Сборка запросов к Gemini и разбор ответов, общие для обоих рантаймов бота."""
+
+from collections import namedtuple
+from functools import lru_cache
+
+from google.genai import types as genai_types
+from google.genai.types import GenerateContentConfig, GoogleSearch, Tool
+
+from constants import DEFAULT_MODEL, is_image_generation_model
+
+# Telegram отдаёт фото (message.photo) в JPEG
+PHOTO_MIME_TYPE = "image/jpeg"
+
+
+# Готовый быстрый инструмент: модель, конфиг запроса и токены system_instruction
+QuickTool = namedtuple("QuickTool", ["model", "config", "instruction_tokens"])
+
+
+# Конфиги только читаются, поэтому один объект на пару (модель, поиск)
+@lru_cache(maxsize=32)
+def build_chat_config(model_name, search_enabled):
+    """Возвращает конфиг запроса для диалога с учётом модели и поиска."""
+    if is_image_generation_model(model_name):
+        return GenerateContentConfig(response_modalities=["TEXT", "IMAGE"])
+
+    tools = [Tool(url_context=genai_types.UrlContext())]
+    if search_enabled:
+        tools.append(Tool(google_search=GoogleSearch()))
+    return GenerateContentConfig(tools=tools)
+
+
+def build_quick_tool_config(tool_config):
+    """Возвращает (модель, конфиг) для быстрого инструмента."""
+    model_to_use = tool_config.get("model", DEFAULT_MODEL)
+    thinking_budget = tool_config.get("thinking_budget", None)
+
+    config_kwargs = {"system_instruction": tool_config["system_instruction"]}
+    if thinking_budget is not None:
+        config_kwargs["thinking_config"] = genai_types.ThinkingConfig(
+            thinking_budget=thinking_budget
+        )
+
+    if is_image_generation_model(model_to_use):
+        config_kwargs["response_modalities"] = ["TEXT", "IMAGE"]
+
+    return model_to_use, genai_types.GenerateContentConfig(**config_kwargs)
+
+
+def compile_quick_tool(tool_config, count_tokens):
+    """QuickTool из записи QUICK_TOOLS_CONFIG; count_tokens(text) — оценка токенов."""
+    model_to_use, config = build_quick_tool_config(tool_config)
+    return QuickTool(
+        model_to_use, config, count_tokens(tool_config["system_instruction"])
+    )
+
+
+def compile_quick_tools(tools_config, count_tokens):
+    """Все быстрые инструменты, собранные один раз при запуске: {команда: QuickTool}."""
+    return {
+        name: compile_quick_tool(tool_config, count_tokens)
+        for name, tool_config in tools_config.items()
+    }
+
+
+def file_bytes(file_info):
+    """Байты файла: готовые "data" или отложенная загрузка через "load"."""
+    data = file_info.get("data")
+    if data is None:
+        data = file_info["load"]()
+    return data
+
+
+def image_mime_type(data):
+    """MIME-тип картинки по сигнатуре (фото из старых записей буфера без типа)."""
+    head = bytes(data[:12])
+    if head.startswith(b"\x89PNG"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return PHOTO_MIME_TYPE
+
+
+def photo_part(photo):
+    """
+    Фото для запроса — исходные байты с их MIME-типом, без декодирования и
+    перекодирования. photo — элемент буфера или {"data": ..., "mime_type": ...}.
+    """
+    data = file_bytes(photo)
+    if hasattr(data, "read"):
+        data = data.read()
+    return genai_types.Part.from_bytes(
+        data=data, mime_type=photo.get("mime_type") or image_mime_type(data)
+    )
+
+
+def _file_parts(file_info, uploads=None):
+    if uploads is not None:
+        file_part = uploads.part_for(file_info)
+    else:
+        file_part = genai_types.Part.from_bytes(
+            mime_type=file_info["mime_type"], data=file_bytes(file_info)
+        )
+    return [file_part, f"(Файл: {file_info['filename']})"]
+
+
+def build_context_parts(files_in_context, uploads=None):
+    """
+    Собирает части запроса из файлов контекста. uploads — FileUploadCache:
+    файлы передаются ссылками Files API вместо байтов.
+    Возвращает (parts, errors), где errors — список пар (имя файла, исключение).
+    """
+    parts = []
+    errors = []
+    for file_info in files_in_context:
+        if file_info["caption"]:
+            parts.append(file_info["caption"])
+        try:
+            parts.extend(_file_parts(file_info, uploads))
+        except Exception as file_err:
+            errors.append((file_info["filename"], file_err))
+    return parts, errors
+
+
+def build_buffer_parts(buffered_items, uploads=None):
+    """
+    Собирает части запроса из буфера ручного режима, склеивая подряд идущие
+    тексты через пустую строку. Возвращает (parts, errors).
+    """
+    combined_parts = []
+    errors = []
+    current_text_block = ""
+
+    for item in buffered_items:
+        if item["type"] == "text":
+            if current_text_block:
+                current_text_block += "\n\n" + item["content"]
+            else:
+                current_text_block = item["content"]
+        elif item["type"] == "photo":
+            if current_text_block:
+                combined_parts.append(current_text_block)
+                current_text_block = ""
+
+            if item.get("caption"):
+                combined_parts.append(item["caption"])
+            if "data" in item or "load" in item:
+                combined_parts.append(photo_part(item))
+        elif item["type"] == "document":
+            if current_text_block:
+                combined_parts.append(current_text_block)
+                current_text_block = ""
+            if item.get("caption"):
+                combined_parts.append(item["caption"])
+            try:
+                combined_parts.extend(_file_parts(item, uploads))
+            except Exception as file_err:
+                errors.append((item["filename"], file_err))
+
+    if current_text_block:
+        combined_parts.append(current_text_block)
+
+    return combined_parts, errors
+
+
+def extract_sources_text(response):
+    """Формирует блок «Источники» из grounding-метаданных ответа."""
+    try:
+        if (
+            response.candidates
+            and response.candidates[0].grounding_metadata
+            and response.candidates[0].grounding_metadata.grounding_chunks
+        ):
+            sources = []
+            for i, chunk in enumerate(
+                response.candidates[0].grounding_metadata.grounding_chunks
+            ):
+                if hasattr(chunk, "web") and chunk.web.uri and chunk.web.title:
+                    sources.append(
+                        f"{i + 1}. [{chunk.web.title}]({chunk.web.uri})"
+                    )
+                elif hasattr(chunk, "web") and chunk.web.uri:
+                    sources.append(
+                        f"{i + 1}. [{chunk.web.uri}]({chunk.web.uri})"
+                    )
+
+            if sources:
+                return "\n\nИсточники:\n" + "\n".join(sources)
+    except (AttributeError, IndexError) as e:
+        print(f"Не удалось извлечь источники: {e}")
+    return ""
+
+
+def collect_response_parts(response):
+    """
+    Разбирает ответ Gemini на текстовые части и вложения.
+    Возвращает (text_parts, media), где media — список пар (bytes, mime_type).
+    """
+    text_parts = []
+    media = []
+
+    for candidate in getattr(response, "candidates", None) or []:
+        content = getattr(candidate, "content", None)
+        for part in getattr(content, "parts", None) or []:
+            if getattr(part, "text", None):
+                text_parts.append(part.text)
+            elif getattr(part, "inline_data", None):
+                media.append((part.inline_data.data, part.inline_data.mime_type))
+
+    if not text_parts and getattr(response, "text", None):
+        text_parts.append(response.text)
+
+    return text_parts, media
@@ -0,0 +1,261 @@
+"""
+Хеджирование одиночных запросов к Gemini (быстрые инструменты).
+
+Если основная модель не ответила за percentile-й процентиль своих недавних
+задержек, тот же запрос отправляется более быстрой модели (HEDGE_MODELS);
+побеждает первый ответ, проигравший отменяется. Пока замеров меньше
+min_samples, запросы не хеджируются.
+
+В синхронном боте запрос в полёте прервать нельзя: проигравший доработает
+в фоновом потоке, его ответ отбрасывается. В асинхронном задача отменяется.
+Отсчёт задержки начинается, когда основной запрос начал выполняться, —
+очередь к пулу потоков (пачки и map-reduce) не вызывает ложных дублей.
+Дубли стоят токенов — их число и оценка лишних токенов есть в stats().
+
+С gemini (ResilientGemini) исход каждой попытки записывается в
+предохранитель её модели, а дубль не отправляется на разомкнутую модель.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+
+def percentile(samples, q):
+    """q-й процентиль (0–100) по ближайшему рангу."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class LatencyTracker:
+    """Последние window задержек успешных ответов по каждой модели."""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, seconds):
+        with self._lock:
+            samples = self._samples.get(model)
+            if samples is None:
+                samples = self._samples[model] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def samples(self, model):
+        with self._lock:
+            return list(self._samples.get(model, ()))
+
+    def models(self):
+        with self._lock:
+            return list(self._samples)
+
+
+class Hedger:
+    """
+    call(model, fn, tokens) вызывает fn(model_name) и при задержке дублирует
+    запрос на models[model]. tokens — оценка запроса для учёта лишних токенов.
+    max_workers — на сколько одновременных вызовов (с дублями) рассчитан пул.
+    """
+
+    def __init__(
+        self,
+        models,
+        percentile=95,
+        min_samples=20,
+        window=200,
+        max_workers=8,
+        gemini=None,
+        clock=time.monotonic,
+    ):
+        self.models = models
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.gemini = gemini
+        self.clock = clock
+        self.latency = LatencyTracker(window)
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.extra_tokens = 0
+
+    def delay_for(self, model):
+        """Через сколько секунд хеджировать запрос к model (None — не хеджировать)."""
+        if model not in self.models:
+            return None
+        samples = self.latency.samples(model)
+        if len(samples) < self.min_samples:
+            return None
+        return percentile(samples, self.percentile)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def _hedged(self, tokens):
+        self._count("hedged")
+        self._count("extra_tokens", tokens)
+
+    def _outcome(self, model, future):
+        """Записывает исход попытки в предохранитель её модели."""
+        if self.gemini is None:
+            return
+        if future.cancelled():
+            # Отменённая попытка не говорит о модели — освобождаем её место
+            self.gemini.breaker(model).release()
+        else:
+            self.gemini.record_outcome(model, future.exception())
+
+    def _watch(self, future, model):
+        future.add_done_callback(lambda done: self._outcome(model, done))
+        return future
+
+    def _may_hedge(self, model):
+        return self.gemini is None or self.gemini.breaker(model).allow()
+
+    def _direct(self, model, fn):
+        try:
+            result = self._timed(model, fn)
+        except Exception as e:
+            if self.gemini is not None:
+                self.gemini.record_outcome(model, e)
+            raise
+        if self.gemini is not None:
+            self.gemini.record_outcome(model)
+        return result
+
+    async def _direct_async(self, model, fn):
+        try:
+            result = await self._timed_async(model, fn)
+        except Exception as e:
+            if self.gemini is not None:
+                self.gemini.record_outcome(model, e)
+            raise
+        if self.gemini is not None:
+            self.gemini.record_outcome(model)
+        return result
+
+    def _timed(self, model, fn, started=None):
+        if started is not None:
+            started.set()
+        start = self.clock()
+        result = fn(model)
+        self.latency.record(model, self.clock() - start)
+        return result
+
+    async def _timed_async(self, model, fn):
+        start = self.clock()
+        result = await fn(model)
+        self.latency.record(model, self.clock() - start)
+        return result
+
+    def call(self, model, fn, tokens=0):
+        self._count("calls")
+        delay = self.delay_for(model)
+        if delay is None:
+            return self._direct(model, fn)
+        started = threading.Event()
+        primary = self._watch(
+            self._executor.submit(self._timed, model, fn, started), model
+        )
+        # Время в очереди пула не считается задержкой модели
+        started.wait()
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeout:
+            pass
+
+        hedge_model = self.models[model]
+        if not self._may_hedge(hedge_model):
+            return primary.result()
+        self._hedged(tokens)
+        hedge = self._watch(
+            self._executor.submit(self._timed, hedge_model, fn), hedge_model
+        )
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is hedge:
+                        self._count("hedge_wins")
+                    return future.result()
+                if error is None or future is primary:
+                    error = future.exception()
+        raise error
+
+    async def call_async(self, model, fn, tokens=0):
+        """То же для корутин: fn(model_name) возвращает awaitable."""
+        self._count("calls")
+        delay = self.delay_for(model)
+        if delay is None:
+            return await self._direct_async(model, fn)
+        primary = self._watch(
+            asyncio.ensure_future(self._timed_async(model, fn)), model
+        )
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            hedge_model = self.models[model]
+            if not self._may_hedge(hedge_model):
+                return await primary
+            self._hedged(tokens)
+            hedge = self._watch(
+                asyncio.ensure_future(self._timed_async(hedge_model, fn)),
+                hedge_model,
+            )
+            pending.add(hedge)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count("hedge_wins")
+                        return task.result()
+                    if error is None or task is primary:
+                        error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        with self._lock:
+            result = {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": (
+                    round(self.hedged / self.calls, 3) if self.calls else 0.0
+                ),
+                "hedge_wins": self.hedge_wins,
+                "win_rate": (
+                    round(self.hedge_wins / self.hedged, 3) if self.hedged else 0.0
+                ),
+                "extra_tokens": self.extra_tokens,
+            }
+        latency = {}
+        for model in self.latency.models():
+            samples = self.latency.samples(model)
+            latency[model] = {
+                "p50_ms": round(percentile(samples, 50) * 1000),
+                f"p{self.percentile}_ms": round(
+                    percentile(samples, self.percentile) * 1000
+                ),
+            }
+        result["latency"] = latency
+        return result
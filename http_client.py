@@ -0,0 +1,127 @@
+"""
+Общий HTTP-транспорт для Bot API и загрузки файлов из Telegram.
+
+Один requests.Session с пулом соединений (keep-alive, без TLS-рукопожатия
+на каждый файл) используется и TeleBot, и загрузками. Файлы читаются
+кусками: лимит MAX_FILE_SIZE_MB проверяется по мере чтения, а всё, что
+больше DOWNLOAD_SPOOL_MB, уходит во временный файл вместо памяти.
+
+Асинхронный бот качает через aiohttp-сессию AsyncTeleBot.
+"""
+
+import tempfile
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper, asyncio_helper
+
+from constants import (
+    DOWNLOAD_SPOOL_MB,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_POOL_SIZE,
+    HTTP_READ_TIMEOUT,
+)
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_FILE_URL = "https://api.telegram.org/file/bot{0}/{1}"
+
+
+class FileTooLargeError(ValueError):
+    def __init__(self, max_bytes):
+        super().__init__(
+            f"Файл больше {max_bytes // (1024 * 1024)} МБ и не может быть обработан."
+        )
+        self.max_bytes = max_bytes
+
+
+class DownloadError(Exception):
+    """Telegram ответил на загрузку файла не 200."""
+
+
+def create_session(pool_size=HTTP_POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+session = create_session()
+
+
+def file_url(token, file_path):
+    """URL файла Telegram (с учётом apihelper.FILE_URL для локального Bot API)."""
+    return (apihelper.FILE_URL or DEFAULT_FILE_URL).format(token, file_path)
+
+
+def _spool():
+    return tempfile.SpooledTemporaryFile(max_size=int(DOWNLOAD_SPOOL_MB * 1024 * 1024))
+
+
+def _write_chunk(out, chunk, max_bytes):
+    if max_bytes is not None and out.tell() + len(chunk) > max_bytes:
+        raise FileTooLargeError(max_bytes)
+    out.write(chunk)
+
+
+def download(url, max_bytes=None, timeout=None):
+    """
+    Скачивает url кусками и возвращает файловый объект (перемотанный в
+    начало); вызывающий закрывает его. FileTooLargeError — если ответ
+    больше max_bytes.
+    """
+    timeout = timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    with session.get(url, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            raise DownloadError(
+                f"Не удалось скачать файл: HTTP {response.status_code}"
+            )
+        length = response.headers.get("Content-Length")
+        if max_bytes is not None and length and int(length) > max_bytes:
+            raise FileTooLargeError(max_bytes)
+        out = _spool()
+        try:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                _write_chunk(out, chunk, max_bytes)
+        except BaseException:
+            out.close()
+            raise
+    out.seek(0)
+    return out
+
+
+async def download_async(url, max_bytes=None):
+    """download для asyncio: через сессию AsyncTeleBot."""
+    http = await asyncio_helper.session_manager.get_session()
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT
+    )
+    async with http.get(
+        url, proxy=asyncio_helper.proxy, timeout=timeout
+    ) as response:
+        if response.status != 200:
+            raise DownloadError(f"Не удалось скачать файл: HTTP {response.status}")
+        if max_bytes is not None and (response.content_length or 0) > max_bytes:
+            raise FileTooLargeError(max_bytes)
+        out = _spool()
+        try:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                _write_chunk(out, chunk, max_bytes)
+        except BaseException:
+            out.close()
+            raise
+    out.seek(0)
+    return out
+
+
+def install():
+    """Переводит запросы TeleBot на общий пул соединений и таймауты."""
+    apihelper.session = session
+    apihelper.CONNECT_TIMEOUT = HTTP_CONNECT_TIMEOUT
+    apihelper.READ_TIMEOUT = HTTP_READ_TIMEOUT
+
+
+def install_async():
+    """Размер пула aiohttp-сессии AsyncTeleBot."""
+    asyncio_helper.REQUEST_LIMIT = HTTP_POOL_SIZE
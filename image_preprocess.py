@@ -0,0 +1,254 @@
+"""
+Подготовка фото перед отправкой в Gemini.
+
+Картинка больше предела модели по длинной стороне (IMAGE_MAX_EDGES) только
+увеличивает загрузку и число токенов (плитки по 768 px). ImagePreprocessor:
+
+- по заголовку решает, нужна ли обработка: фото в пределах лимита и без
+  EXIF уходят как есть, без перекодирования;
+- остальные уменьшает, поворачивает по EXIF, убирает метаданные и
+  пережимает в JPEG (PNG при прозрачности) в пуле процессов, чтобы
+  декодирование не держало GIL потоков бота. Процессы запускаются через
+  spawn: fork копировал бы потоки бота вместе с захваченными блокировками;
+- кэширует результат по file_unique_id Telegram (или хэшу блоба) и пределу.
+
+pick_photo_size выбирает из вариантов message.photo наименьший, которого
+хватает для предела, — такой файл часто вообще не нужно обрабатывать.
+
+Обрабатываются только фото: картинки, отправленные документом, в
+SUPPORTED_MIME_TYPES не входят и отклоняются до загрузки.
+"""
+
+import asyncio
+import io
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+from gemini_helpers import file_bytes
+
+JPEG = "image/jpeg"
+PNG = "image/png"
+
+
+def pick_photo_size(photo_sizes, max_edge):
+    """Наименьший PhotoSize со стороной от max_edge (иначе самый большой)."""
+    ordered = sorted(photo_sizes, key=lambda size: max(size.width, size.height))
+    for size in ordered:
+        if max(size.width, size.height) >= max_edge:
+            return size
+    return ordered[-1]
+
+
+def needs_transform(data, max_edge):
+    """По заголовку: картинка больше предела или несёт EXIF."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return max(image.size) > max_edge or "exif" in image.info
+    except Exception:
+        # Не картинка для PIL — отправляем как есть, пусть решает Gemini
+        return False
+
+
+def transform(data, max_edge, quality):
+    """
+    Уменьшает картинку до max_edge по длинной стороне и пережимает без
+    метаданных. Выполняется в процессе пула; возвращает (байты, MIME-тип).
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if image.format == "JPEG":
+            # Декодирование JPEG сразу в уменьшенном масштабе (кратно 1/2..1/8)
+            image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        if image.mode in ("RGBA", "LA") or (
+            image.mode == "P" and "transparency" in image.info
+        ):
+            image.save(out, format="PNG", optimize=True)
+            return out.getvalue(), PNG
+        image.convert("RGB").save(
+            out, format="JPEG", quality=quality, optimize=True
+        )
+        return out.getvalue(), JPEG
+
+
+class ImagePreprocessor:
+    """
+    max_edges — {модель: предел}, для остальных default_edge. workers=0 —
+    обработка в текущем потоке (без пула процессов).
+    """
+
+    def __init__(
+        self,
+        max_edges,
+        default_edge,
+        quality=85,
+        workers=None,
+        cache_bytes=32 * 1024 * 1024,
+    ):
+        self.max_edges = max_edges
+        self.default_edge = default_edge
+        self.quality = quality
+        self.workers = min(4, os.cpu_count() or 1) if workers is None else workers
+        self.cache_bytes = cache_bytes
+        self._pool = None
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self.transformed = 0
+        self.passed = 0
+        self.cache_hits = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.transform_time = 0.0
+
+    def max_edge(self, model):
+        return self.max_edges.get(model, self.default_edge)
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def _cached(self, key):
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+            return result
+
+    def _store(self, key, data, result, elapsed):
+        with self._lock:
+            self.transformed += 1
+            self.bytes_in += len(data)
+            self.bytes_out += len(result[0])
+            self.transform_time += elapsed
+            if key is None:
+                return
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cached_bytes -= len(old[0])
+            self._cache[key] = result
+            self._cached_bytes += len(result[0])
+            while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted[0])
+
+    def _pass(self, data, mime_type):
+        with self._lock:
+            self.passed += 1
+        return data, mime_type
+
+    def _submit(self, data, max_edge):
+        if self.workers:
+            return self._executor().submit(transform, data, max_edge, self.quality)
+        future = Future()
+        future.set_result(transform(data, max_edge, self.quality))
+        return future
+
+    def process_many(self, images, model):
+        """
+        Готовит картинки [(байты, MIME-тип, ключ кэша)] для модели model;
+        требующие обработки идут в пул параллельно. Возвращает [(байты, MIME)].
+        """
+        max_edge = self.max_edge(model)
+        results = []
+        pending = []
+        for data, mime_type, key in images:
+            cache_key = (key, max_edge) if key else None
+            result = self._cached(cache_key) if cache_key else None
+            if result is None and not needs_transform(data, max_edge):
+                result = self._pass(data, mime_type)
+            if result is None:
+                start = time.perf_counter()
+                future = self._submit(data, max_edge)
+                pending.append((len(results), data, cache_key, future, start))
+            results.append(result)
+        for index, data, cache_key, future, start in pending:
+            results[index] = future.result()
+            self._store(
+                cache_key, data, results[index], time.perf_counter() - start
+            )
+        return results
+
+    def process(self, data, mime_type, model, key=None):
+        """(байты, MIME-тип) картинки, готовой для модели model."""
+        return self.process_many([(data, mime_type, key)], model)[0]
+
+    async def process_async(self, data, mime_type, model, key=None):
+        """process для asyncio: пул ожидается в потоке, цикл не блокируется."""
+        return await asyncio.to_thread(self.process, data, mime_type, model, key)
+
+    def buffer_items(self, items, model):
+        """
+        Элементы буфера с подготовленными фото: байты в "data", а ключ
+        памяти оценщика токенов ("blob_hash") уменьшенного фото учитывает предел.
+        """
+        photos = [
+            (index, _photo_bytes(item))
+            for index, item in enumerate(items)
+            if _is_photo(item)
+        ]
+        processed = self.process_many(
+            [
+                (data, items[index].get("mime_type"), items[index].get("blob_hash"))
+                for index, data in photos
+            ],
+            model,
+        )
+        result = list(items)
+        for (index, data), (new_data, mime_type) in zip(photos, processed):
+            result[index] = self._buffer_photo(
+                items[index], model, data, new_data, mime_type
+            )
+        return result
+
+    async def buffer_items_async(self, items, model):
+        return await asyncio.to_thread(self.buffer_items, items, model)
+
+    def _buffer_photo(self, item, model, original, data, mime_type):
+        item = {**item, "data": data, "mime_type": mime_type, "size": len(data)}
+        item.pop("load", None)
+        if data is not original and item.get("blob_hash"):
+            item["blob_hash"] = f"{item['blob_hash']}@{self.max_edge(model)}"
+        return item
+
+    def stats(self):
+        with self._lock:
+            return {
+                "transformed": self.transformed,
+                "passed_through": self.passed,
+                "cache_hits": self.cache_hits,
+                "cached": len(self._cache),
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "avg_transform_ms": (
+                    round(self.transform_time / self.transformed * 1000, 1)
+                    if self.transformed
+                    else 0.0
+                ),
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+def _is_photo(item):
+    return item["type"] == "photo" and ("data" in item or "load" in item)
+
+
+def _photo_bytes(item):
+    data = file_bytes(item)
+    return bytes(data.read() if hasattr(data, "read") else data)
@@ -0,0 +1,144 @@
+"""
+Map-reduce для длинных входов быстрых инструментов.
+
+Инструмент с "map_reduce" в QUICK_TOOLS_CONFIG обрабатывает текст длиннее
+одного запроса по частям: текст делится на куски по границам абзацев
+(utils.split_text), каждый кусок параллельно обрабатывается дешёвой
+моделью (map), а затем:
+
+- "merge" — один запрос моделью инструмента сводит частичные ответы в
+  один (списки, таблицы);
+- "concat" — частичные ответы склеиваются по порядку без reduce-запроса
+  (переписывание текста, где ответ сопоставим по длине со входом).
+
+Время ответа — примерно самый медленный кусок плюс один reduce.
+"""
+
+import quick_batch
+from utils import split_text
+
+MODES = ("merge", "concat")
+
+MAP_NOTE = (
+    "\n\nThe text below is part {index} of {total} of a longer document. "
+    "Process only this part; its results will be combined with the other parts."
+)
+
+REDUCE_INSTRUCTION = (
+    "You receive partial results produced by applying the instruction below "
+    "to consecutive parts of one long document. Combine them into a single "
+    "result that follows the instruction: merge duplicates, keep the original "
+    "order and return only the combined result.\n\nInstruction:\n{instruction}"
+)
+
+
+def chunk_header(index, total):
+    return f"--- Part {index} of {total} ---"
+
+
+class MapReduce:
+    """
+    call(tool_config, text) -> str — один запрос к модели с конфигом
+    инструмента (async-версия движка ожидает корутину).
+    """
+
+    def __init__(self, chunk_chars, map_model, concurrency):
+        self.chunk_chars = chunk_chars
+        self.map_model = map_model
+        self.concurrency = concurrency
+
+    @staticmethod
+    def enabled_for(tool_config):
+        return tool_config.get("map_reduce") in MODES
+
+    def chunks(self, text):
+        return split_text(text, self.chunk_chars)
+
+    def map_config(self, tool_config, index, total):
+        return {
+            **tool_config,
+            "system_instruction": tool_config["system_instruction"]
+            + MAP_NOTE.format(index=index, total=total),
+            "model": self.map_model,
+            "thinking_budget": 0,
+        }
+
+    def reduce_config(self, tool_config):
+        return {
+            **tool_config,
+            "system_instruction": REDUCE_INSTRUCTION.format(
+                instruction=tool_config["system_instruction"]
+            ),
+        }
+
+    @staticmethod
+    def reduce_input(partials):
+        total = len(partials)
+        return "\n\n".join(
+            f"{chunk_header(index, total)}\n{partial.strip()}"
+            for index, partial in enumerate(partials, 1)
+        )
+
+    def _jobs(self, tool_config, text):
+        chunks = self.chunks(text)
+        return [
+            (self.map_config(tool_config, index, len(chunks)), chunk)
+            for index, chunk in enumerate(chunks, 1)
+        ]
+
+    @staticmethod
+    def _check(partials):
+        for partial in partials:
+            if isinstance(partial, Exception):
+                raise partial
+        return [partial or "" for partial in partials]
+
+    def run(self, tool_config, text, call, on_progress=None):
+        """
+        Ответ инструмента на длинный text. on_progress(done, total) — после
+        каждого куска; total включает reduce-запрос. Ошибка любого куска
+        прерывает обработку.
+        """
+        jobs = self._jobs(tool_config, text)
+        merge = tool_config["map_reduce"] == "merge"
+        total = len(jobs) + merge
+        partials = self._check(
+            quick_batch.run(
+                jobs,
+                lambda job: call(*job),
+                self.concurrency,
+                on_progress and (lambda done, _: on_progress(done, total)),
+            )
+        )
+        if not merge:
+            return "\n\n".join(partial.strip() for partial in partials)
+        result = call(self.reduce_config(tool_config), self.reduce_input(partials))
+        if on_progress:
+            on_progress(total, total)
+        return result
+
+    async def run_async(self, tool_config, text, call, on_progress=None):
+        """run для корутин: call и on_progress — корутины."""
+        jobs = self._jobs(tool_config, text)
+        merge = tool_config["map_reduce"] == "merge"
+        total = len(jobs) + merge
+
+        async def progress(done, _):
+            await on_progress(done, total)
+
+        partials = self._check(
+            await quick_batch.run_async(
+                jobs,
+                lambda job: call(*job),
+                self.concurrency,
+                progress if on_progress else None,
+            )
+        )
+        if not merge:
+            return "\n\n".join(partial.strip() for partial in partials)
+        result = await call(
+            self.reduce_config(tool_config), self.reduce_input(partials)
+        )
+        if on_progress:
+            await on_progress(total, total)
+        return result
@@ -0,0 +1,42 @@
+"""Простой реестр метрик: компоненты регистрируют функцию, возвращающую dict."""
+
+import json
+import threading
+import time
+
+_providers = {}
+_lock = threading.Lock()
+
+
+def register(name, provider):
+    """Регистрирует источник метрик под именем name."""
+    with _lock:
+        _providers[name] = provider
+
+
+def snapshot():
+    """Возвращает текущие значения всех зарегистрированных метрик."""
+    with _lock:
+        providers = dict(_providers)
+    result = {}
+    for name, provider in providers.items():
+        try:
+            result[name] = provider()
+        except Exception as e:
+            result[name] = {"error": str(e)}
+    return result
+
+
+def start_reporter(interval):
+    """Периодически печатает снимок метрик в лог (interval в секундах)."""
+    if not interval or interval <= 0:
+        return None
+
+    def report():
+        while True:
+            time.sleep(interval)
+            print(f"Metrics: {json.dumps(snapshot(), ensure_ascii=False)}")
+
+    thread = threading.Thread(target=report, name="metrics", daemon=True)
+    thread.start()
+    return thread
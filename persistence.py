@@ -0,0 +1,304 @@
+import json
+import base64
+
+from google.genai import types as genai_types
+
+from chat_cache import ChatCache, chat_history
+from constants import (
+    CHAT_CACHE_MAX_BYTES,
+    CHAT_CACHE_MAX_ENTRIES,
+    CHAT_CACHE_TTL,
+)
+from token_estimator import estimator
+from utils import BytesEncoder
+
+from database import blob_store, crud, user_cache
+from database.db import SessionLocal
+
+
+def deserialize_content(item):
+    """Builds types.Content from a dict produced by model_dump()."""
+    parts = []
+    for part_data in item.get("parts", []):
+        if "inline_data" in part_data and part_data["inline_data"]:
+            blob_data = part_data["inline_data"]
+            if "data" in blob_data and isinstance(blob_data["data"], str):
+                try:
+                    blob_data["data"] = base64.b64decode(blob_data["data"])
+                except Exception:
+                    # Already bytes or invalid base64, leaving as is
+                    pass
+        parts.append(genai_types.Part(**part_data))
+    return genai_types.Content(role=item.get("role"), parts=parts)
+
+
+def serialize_content(content):
+    """JSON of a single Content for the chat_turns table."""
+    return json.dumps(content.model_dump(exclude_none=True), cls=BytesEncoder)
+
+
+def deserialize_history(turns):
+    """Deserializes stored turns (JSON per Content, in order) into list of types.Content."""
+    history = []
+    for content_json in turns:
+        try:
+            history.append(deserialize_content(json.loads(content_json)))
+        except Exception as e:
+            print(f"Error deserializing history: {e}")
+            return []
+    return history
+
+
+def get_active_chat(user_id, model_name, chats, compactor=None):
+    """Gets active chat from cache or loads from DB.
+
+    `chats` is the chat factory of the runtime: `client.chats` for the
+    threaded bot or `client.aio.chats` for the asyncio one. With
+    `compactor`, a history over the model's token budget is compacted
+    and the compacted form replaces the stored turns; summaries are
+    written in the background and applied on a later turn.
+    """
+    cached = user_chats.get(user_id)
+    if cached is not None:
+        if compactor is None:
+            return cached
+        history = chat_history(cached)
+        # The cache keeps a running total, so a hit only estimates new turns
+        tokens = user_chats.tokens(user_id, history, estimator.history)
+        compacted = compactor.compact(history, model_name, tokens, key=user_id)
+        if compacted is None:
+            return cached
+        return _replace_chat(user_id, model_name, chats, compacted)
+
+    with SessionLocal() as session:
+        turns = crud.get_chat_turns(session, user_id)
+        history = deserialize_history(turn.content_json for turn in turns)
+
+    if compactor is not None:
+        compacted = compactor.compact(history, model_name, key=user_id)
+        if compacted is not None:
+            return _replace_chat(user_id, model_name, chats, compacted)
+
+    try:
+        new_chat = chats.create(model=model_name, history=history)
+    except Exception as e:
+        print(f"Error creating chat with history: {e}. Starting fresh.")
+        new_chat = chats.create(model=model_name)
+        history = []
+    user_chats.put(user_id, new_chat, history)
+    return new_chat
+
+
+def _replace_chat(user_id, model_name, chats, history):
+    """Stores compacted history in place of the saved turns and caches its chat."""
+    try:
+        with SessionLocal() as session:
+            crud.replace_chat_turns(
+                session,
+                user_id,
+                [(content.role, serialize_content(content)) for content in history],
+            )
+    except Exception as e:
+        # The compacted chat still serves this request; next save rewrites turns
+        print(f"Error saving compacted history: {e}")
+    new_chat = chats.create(model=model_name, history=history)
+    user_chats.put(user_id, new_chat, history)
+    return new_chat
+
+
+def _write_history(user_id, chat):
+    """Appends new turns of chat history to DB and returns the history list.
+
+    Only turns past the stored count are serialized, so a save costs the
+    same for long and short conversations.
+    """
+    history_list = [
+        content
+        for content in chat_history(chat)
+        if hasattr(content, "model_dump")
+    ]
+
+    with SessionLocal() as session:
+        stored = crud.count_chat_turns(session, user_id)
+        if len(history_list) >= stored:
+            new_turns = [
+                (content.role, serialize_content(content))
+                for content in history_list[stored:]
+            ]
+            if new_turns:
+                crud.append_chat_turns(session, user_id, stored, new_turns)
+        else:
+            crud.replace_chat_turns(
+                session,
+                user_id,
+                [
+                    (content.role, serialize_content(content))
+                    for content in history_list
+                ],
+            )
+    return history_list
+
+
+def save_active_chat(user_id, chat=None):
+    """Saves current chat history to DB.
+
+    Pass `chat` from the handler so the turn is saved even if the cache
+    evicted the entry while the request was in flight.
+    If `chat` is not the cached one (e.g. the answer came from a fallback
+    model), the cached chat is stale: it is dropped and reloaded from DB
+    on the next request.
+    """
+    if chat is None:
+        chat = user_chats.peek(user_id)
+    if chat is None:
+        return
+    try:
+        history_list = _write_history(user_id, chat)
+        cached = user_chats.peek(user_id)
+        if cached is not None and cached is not chat:
+            user_chats.pop(user_id)
+        else:
+            user_chats.mark_saved(user_id, history_list)
+    except Exception as e:
+        print(f"Error saving chat history: {e}")
+
+
+# Cache for active chat sessions; evicted chats are written back to DB
+user_chats = ChatCache(
+    CHAT_CACHE_MAX_ENTRIES,
+    CHAT_CACHE_MAX_BYTES,
+    CHAT_CACHE_TTL,
+    on_evict=_write_history,
+)
+
+
+class UserContext:
+    """Per-update user data passed by ensure_user_started to handlers."""
+
+    __slots__ = ("user_id", "chat_id", "settings")
+
+    def __init__(self, user_id, chat_id, settings):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.settings = settings
+
+    @property
+    def current_model(self):
+        return self.settings.current_model
+
+    @property
+    def send_mode(self):
+        return self.settings.send_mode
+
+    @property
+    def search_enabled(self):
+        return self.settings.search_enabled
+
+
+def fetch_user_settings(user_id):
+    """Reads user settings from DB into the cache; None if user has not started."""
+    with SessionLocal() as session:
+        user = crud.get_user(session, user_id)
+        return user_cache.store(user) if user else None
+
+
+def load_user_settings(user_id):
+    """User settings from the cache, hitting DB only on a miss."""
+    settings = user_cache.get(user_id)
+    if settings is None:
+        settings = fetch_user_settings(user_id)
+    return settings
+
+
+def _blob_loader(blob_hash):
+    """Deferred read of blob bytes: called only when a request is built."""
+    return lambda: blob_store.store.read(blob_hash)
+
+
+def get_file_context_list(user_id):
+    """File context metadata; bytes are loaded lazily through "load"."""
+    with SessionLocal() as session:
+        files = crud.list_file_contexts(session, user_id)
+    return [
+        {
+            "mime_type": f.mime_type,
+            "blob_hash": f.blob_hash,
+            "size": f.size,
+            "load": _blob_loader(f.blob_hash),
+            "filename": f.filename,
+            "caption": f.caption,
+        }
+        for f in files
+    ]
+
+
+def add_file_context_entry(user_id, file_data):
+    with SessionLocal() as session:
+        crud.add_file_context(
+            session,
+            user_id,
+            filename=file_data["filename"],
+            mime_type=file_data["mime_type"],
+            data=file_data["data"],
+            caption=file_data.get("caption"),
+        )
+
+
+def get_message_buffer_list(user_id):
+    """Buffer items; photo and document bytes are loaded lazily through "load"."""
+    with SessionLocal() as session:
+        items = crud.list_buffer(session, user_id)
+    result = []
+    for item in items:
+        entry = {"type": item.item_type}
+        if item.item_type == "text":
+            entry["content"] = item.content or ""
+        elif item.item_type == "photo":
+            entry["caption"] = item.content or ""
+            entry["mime_type"] = item.mime_type
+            if item.blob_hash:
+                entry["blob_hash"] = item.blob_hash
+                entry["load"] = _blob_loader(item.blob_hash)
+        elif item.item_type == "document":
+            entry["mime_type"] = item.mime_type
+            entry["blob_hash"] = item.blob_hash
+            entry["size"] = item.size
+            entry["load"] = _blob_loader(item.blob_hash)
+            entry["filename"] = item.filename
+            entry["caption"] = item.content
+        result.append(entry)
+    return result
+
+
+def add_to_message_buffer(user_id, entry):
+    with SessionLocal() as session:
+        if entry["type"] == "text":
+            crud.add_to_buffer(
+                session, user_id, "text", content=entry["content"]
+            )
+        elif entry["type"] == "photo":
+            # Original bytes as downloaded: no decode/re-encode round trip
+            crud.add_to_buffer(
+                session,
+                user_id,
+                "photo",
+                content=entry.get("caption"),
+                blob_data=entry["data"],
+                mime_type=entry.get("mime_type"),
+            )
+        elif entry["type"] == "document":
+            crud.add_to_buffer(
+                session,
+                user_id,
+                "document",
+                content=entry.get("caption"),
+                blob_data=entry["data"],
+                filename=entry["filename"],
+                mime_type=entry["mime_type"],
+            )
+
+
+def clear_user_context_db(user_id):
+    with crud.unit_of_work() as session:
+        crud.clear_file_contexts(session, user_id)
+        crud.clear_buffer(session, user_id)
@@ -0,0 +1,114 @@
+"""
+Пакетный режим быстрых инструментов.
+
+Инструмент с "batch": "line" или "paragraph" в QUICK_TOOLS_CONFIG,
+получив список фраз или абзацев, обрабатывает каждый элемент отдельным
+запросом: до concurrency запросов одновременно, результаты собираются в
+исходном порядке с теми же разделителями. Ошибка одного элемента не
+прерывает остальные.
+"""
+
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SEPARATORS = {"line": "\n", "paragraph": "\n\n"}
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+
+
+class Batch:
+    """Текст, разбитый на элементы; пустые строки между ними сохраняются."""
+
+    def __init__(self, text, mode):
+        self.separator = SEPARATORS[mode]
+        if mode == "line":
+            self.segments = text.split("\n")
+        else:
+            self.segments = _PARAGRAPH_BREAK.split(text.strip())
+        self.positions = [
+            index
+            for index, segment in enumerate(self.segments)
+            if segment.strip()
+        ]
+
+    @property
+    def items(self):
+        return [self.segments[index].strip() for index in self.positions]
+
+    def assemble(self, results):
+        """Текст с результатами (по порядку items) на местах элементов."""
+        segments = list(self.segments)
+        for index, result in zip(self.positions, results):
+            segments[index] = result
+        return self.separator.join(segments)
+
+
+def split_input(tool_config, text, min_items, max_chars):
+    """
+    Batch, если инструмент поддерживает пакетный режим и текст состоит
+    хотя бы из min_items элементов или длиннее max_chars; иначе None.
+    """
+    mode = tool_config.get("batch")
+    if mode not in SEPARATORS:
+        return None
+    batch = Batch(text, mode)
+    count = len(batch.positions)
+    if count < 2 or (count < min_items and len(text) <= max_chars):
+        return None
+    return batch
+
+
+def run(items, fn, concurrency, on_progress=None):
+    """
+    Вызывает fn(item) для всех items в concurrency потоках. Возвращает
+    список результатов по порядку; на месте упавшего элемента — исключение.
+    on_progress(done, total) вызывается в вызывающем потоке.
+    """
+    results = [None] * len(items)
+    with ThreadPoolExecutor(max(1, min(concurrency, len(items)))) as pool:
+        futures = {pool.submit(fn, item): index for index, item in enumerate(items)}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                results[futures[future]] = e
+            if on_progress:
+                on_progress(done, len(items))
+    return results
+
+
+async def run_async(items, fn, concurrency, on_progress=None):
+    """run для корутин: fn(item) — awaitable, on_progress — корутина."""
+    semaphore = asyncio.Semaphore(concurrency)
+    results = [None] * len(items)
+    done = 0
+
+    async def worker(index, item):
+        nonlocal done
+        async with semaphore:
+            try:
+                results[index] = await fn(item)
+            except Exception as e:
+                results[index] = e
+        done += 1
+        if on_progress:
+            await on_progress(done, len(items))
+
+    await asyncio.gather(*(worker(index, item) for index, item in enumerate(items)))
+    return results
+
+
+def merge_results(batch, results):
+    """
+    Собирает ответ: упавшие элементы остаются в исходном виде с пометкой ⚠️.
+    Возвращает (текст, число ошибок).
+    """
+    failed = 0
+    texts = []
+    for item, result in zip(batch.items, results):
+        if isinstance(result, Exception) or not result:
+            failed += 1
+            texts.append(f"⚠️ {item}")
+        else:
+            texts.append(result.strip())
+    return batch.assemble(texts), failed
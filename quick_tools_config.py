@@ -1,4 +1,11 @@
-"""This module contains the configuration for various quick tools."""
+"""This module contains the configuration for various quick tools.
+
+"batch": "line" or "paragraph" sends each line or paragraph of a long input
+as a separate request (see quick_batch.py). Items are processed without the
+surrounding text, so only enable it for tools whose output for one item does
+not depend on the others (e.g. line-by-line translation), not for rewriting
+or proofreading prose, where tone and references span paragraphs.
+"""
 
 QUICK_TOOLS_CONFIG = {
     "translate": {
@@ -11,6 +18,8 @@ QUICK_TOOLS_CONFIG = {
         "description": "ru<>en Перевод текста",
         "model": "gemini-3.5-flash-lite",
         "thinking_budget": 0,
+        "batch": "line",
+        "cache": True,
     },
     "prompt": {
         "system_instruction": (
@@ -55,6 +64,7 @@ QUICK_TOOLS_CONFIG = {
             "Return only the simplified text."
         ),
         "description": "💡 Упростить текст, сделать его понятнее",
+        "map_reduce": "concat",
     },
     "elaborate": {
         "system_instruction": (
@@ -76,6 +86,7 @@ QUICK_TOOLS_CONFIG = {
             "Return only the formal text."
         ),
         "description": "👔 Сделать текст более формальным и деловым",
+        "cache": True,
     },
     "proofread": {
         "system_instruction": (
@@ -86,6 +97,7 @@ QUICK_TOOLS_CONFIG = {
             "comments or explanations about the errors."
         ),
         "description": "✍️ Коррекция грамматики, орфографии, пунктуации",
+        "cache": True,
     },
     "list": {
         "system_instruction": (
@@ -100,6 +112,8 @@ QUICK_TOOLS_CONFIG = {
         ),
         "description": "📋 Преобразовать текст в маркированный или нумерованный список",
         "thinking_budget": 0,
+        "cache": True,
+        "map_reduce": "merge",
     },
     "table": {
         "system_instruction": (
@@ -115,6 +129,7 @@ QUICK_TOOLS_CONFIG = {
         ),
         "description": "📊 Преобразовать текст в таблицу Markdown",
         "model": "gemini-3.1-pro-preview",
+        "map_reduce": "merge",
     },
     "todo": {
         "system_instruction": (
@@ -0,0 +1,408 @@
+"""
+Ограничитель исходящих запросов к Telegram Bot API.
+
+Telegram допускает около 30 сообщений в секунду на бота, 1 в секунду в
+одном чате и 20 в минуту в группе; при превышении отвечает 429 с
+retry_after. OutboundLimiter ставит запросы в очередь и выпускает их по
+корзинам токенов (общей и по чатам):
+
+- в пределах чата и приоритета запросы уходят в порядке поступления;
+- удаления сообщений и chat actions пропускают вперёд настоящие ответы;
+- 429 не доходит до обработчиков: запрос ждёт retry_after и повторяется.
+
+install подключает ограничитель к TeleBot (apihelper.CUSTOM_REQUEST_SENDER),
+install_async — к AsyncTeleBot.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import threading
+import time
+
+import requests
+from telebot import apihelper, asyncio_helper
+
+# Виды запросов
+NORMAL = 0
+LOW = 1
+
+LOW_PRIORITY_METHODS = {"deleteMessage", "deleteMessages", "sendChatAction"}
+# Сколько простаивающих корзин чатов держать, прежде чем чистить полные
+MAX_IDLE_CHAT_BUCKETS = 10000
+
+
+def classify(api_method):
+    """
+    (приоритет, учитывать ли в лимите чата) или None для запросов вне
+    лимитов (getUpdates, getFile, answerCallbackQuery...).
+    """
+    if api_method in LOW_PRIORITY_METHODS:
+        return LOW, False
+    if (
+        api_method.startswith("send")
+        or api_method.startswith("editMessage")
+        or api_method in ("copyMessage", "forwardMessage")
+    ):
+        return NORMAL, True
+    return None
+
+
+def retry_after(result_json):
+    """retry_after из ответа 429 (или None, если это не 429)."""
+    if not result_json or result_json.get("error_code") != 429:
+        return None
+    return (result_json.get("parameters") or {}).get("retry_after", 1)
+
+
+def is_flood_error(error):
+    """Исключение telebot из-за превышения лимитов (429)."""
+    return getattr(error, "error_code", None) == 429
+
+
+def _rewind(files):
+    # Файлы при повторе отправляются заново — возвращаем потоки в начало
+    for value in (files or {}).values():
+        stream = value[1] if isinstance(value, tuple) else value
+        if hasattr(stream, "seek"):
+            stream.seek(0)
+
+
+class _Bucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def refill(self, now):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def wait(self, now):
+        """Через сколько секунд будет токен (0 — уже есть)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _Waiter:
+    __slots__ = ("ticket", "chat_id", "priority", "per_chat", "enqueued_at")
+
+    def __init__(self, ticket, chat_id, priority, per_chat, now):
+        self.ticket = ticket
+        self.chat_id = chat_id
+        self.priority = priority
+        self.per_chat = per_chat
+        self.enqueued_at = now
+
+
+class OutboundLimiter:
+    """
+    global_rate — сообщений в секунду на бота, chat_rate/chat_burst — в
+    личном чате, group_rate — в минуту в группе (chat_id < 0).
+    """
+
+    def __init__(
+        self,
+        global_rate=30,
+        chat_rate=1,
+        chat_burst=3,
+        group_rate=20,
+        max_retries=3,
+        clock=time.monotonic,
+    ):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.clock = clock
+        self._global = _Bucket(global_rate, global_rate, clock())
+        self._chats = {}
+        self._waiters = {}
+        # Очередь каждого чата — куча (приоритет, номер, waiter); первые
+        # запросы чатов лежат в кучах _pending (по времени готовности) и
+        # _ready (по приоритету и номеру). Устаревшие записи куч
+        # отбрасываются при извлечении
+        self._queues = {}
+        self._pending = []
+        self._ready = []
+        self._tickets = itertools.count()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self.granted = 0
+        self.delayed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.throttled = 0
+
+    def acquire(self, chat_id, priority=NORMAL, per_chat=True):
+        """Блокирует поток до разрешения на запрос."""
+        with self._changed:
+            waiter = self._enqueue(chat_id, priority, per_chat)
+            try:
+                while True:
+                    wait = self._poll(waiter)
+                    if wait <= 0:
+                        self._changed.notify_all()
+                        return
+                    self._changed.wait(wait)
+            except BaseException:
+                self._cancel(waiter)
+                self._changed.notify_all()
+                raise
+
+    async def acquire_async(self, chat_id, priority=NORMAL, per_chat=True):
+        """То же для asyncio: ожидание — asyncio.sleep, без блокировки цикла."""
+        with self._lock:
+            waiter = self._enqueue(chat_id, priority, per_chat)
+        try:
+            while True:
+                with self._lock:
+                    wait = self._poll(waiter)
+                if wait <= 0:
+                    return
+                await asyncio.sleep(wait)
+        except BaseException:
+            with self._lock:
+                self._cancel(waiter)
+            raise
+
+    def penalize(self, chat_id, seconds):
+        """Учитывает 429: чат (или весь бот) молчит seconds секунд."""
+        with self._changed:
+            self.throttled += 1
+            now = self.clock()
+            bucket = self._chat_bucket(chat_id, now) if chat_id else self._global
+            bucket.blocked_until = max(bucket.blocked_until, now + seconds)
+            self._changed.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": len(self._waiters),
+                "granted": self.granted,
+                "delayed": self.delayed,
+                "avg_wait_ms": (
+                    round(self.total_wait / self.delayed * 1000, 1)
+                    if self.delayed
+                    else 0.0
+                ),
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+                "throttled_429": self.throttled,
+                "chats": len(self._chats),
+            }
+
+    # Вызываются под self._lock
+
+    def _enqueue(self, chat_id, priority, per_chat):
+        if chat_id is not None:
+            # TeleBot передаёт chat_id числом, AsyncTeleBot — строкой
+            chat_id = str(chat_id)
+        now = self.clock()
+        waiter = _Waiter(next(self._tickets), chat_id, priority, per_chat, now)
+        self._waiters[waiter.ticket] = waiter
+        queue = self._queues.setdefault(chat_id, [])
+        heapq.heappush(queue, (priority, waiter.ticket, waiter))
+        if queue[0][2] is waiter:
+            self._schedule(chat_id, now)
+        return waiter
+
+    def _cancel(self, waiter):
+        if self._waiters.pop(waiter.ticket, None) is None:
+            return
+        queue = self._queues[waiter.chat_id]
+        was_head = queue[0][2] is waiter
+        queue.remove((waiter.priority, waiter.ticket, waiter))
+        heapq.heapify(queue)
+        if not queue:
+            del self._queues[waiter.chat_id]
+        elif was_head:
+            self._schedule(waiter.chat_id, self.clock())
+
+    def _head(self, chat_id, ticket):
+        """Первый запрос чата, если это всё ещё запрос с номером ticket."""
+        queue = self._queues.get(chat_id)
+        if queue and queue[0][1] == ticket:
+            return queue[0][2]
+        return None
+
+    def _chat_wait(self, waiter, now):
+        if not waiter.per_chat or waiter.chat_id is None:
+            return 0.0
+        bucket = self._chat_bucket(waiter.chat_id, now)
+        bucket.refill(now)
+        return bucket.wait(now)
+
+    def _schedule(self, chat_id, now):
+        """Кладёт новый первый запрос чата в _pending или _ready."""
+        head = self._queues[chat_id][0][2]
+        wait = self._chat_wait(head, now)
+        if wait > 0:
+            heapq.heappush(self._pending, (now + wait, head.ticket, chat_id))
+        else:
+            heapq.heappush(self._ready, (head.priority, head.ticket, chat_id))
+
+    def _first_ready(self, now):
+        """Самый ранний (по приоритету и номеру) готовый первый запрос чата."""
+        while self._pending and self._pending[0][0] <= now:
+            _, ticket, chat_id = heapq.heappop(self._pending)
+            head = self._head(chat_id, ticket)
+            if head is not None:
+                heapq.heappush(self._ready, (head.priority, ticket, chat_id))
+        while self._ready:
+            _, ticket, chat_id = self._ready[0]
+            head = self._head(chat_id, ticket)
+            if head is None:
+                heapq.heappop(self._ready)
+                continue
+            # Чат мог получить 429 после того, как запрос стал готов
+            wait = self._chat_wait(head, now)
+            if wait > 0:
+                heapq.heappop(self._ready)
+                heapq.heappush(self._pending, (now + wait, ticket, chat_id))
+                continue
+            return head
+        return None
+
+    def _chat_bucket(self, chat_id, now):
+        key = str(chat_id)
+        bucket = self._chats.get(key)
+        if bucket is None:
+            if len(self._chats) >= MAX_IDLE_CHAT_BUCKETS:
+                self._prune(now)
+            if key.startswith("-"):
+                bucket = _Bucket(self.group_rate / 60, self.chat_burst, now)
+            else:
+                bucket = _Bucket(self.chat_rate, self.chat_burst, now)
+            self._chats[key] = bucket
+        return bucket
+
+    def _prune(self, now):
+        for key, bucket in list(self._chats.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity and now >= bucket.blocked_until:
+                del self._chats[key]
+
+    def _poll(self, waiter):
+        """
+        0 — запрос waiter выпущен (токены списаны), иначе сколько ждать.
+        Выпускается только первый запрос своего чата, и только если среди
+        готовых первых запросов он самый ранний по (приоритет, номер).
+        """
+        now = self.clock()
+        self._global.refill(now)
+        if self._first_ready(now) is waiter:
+            global_wait = self._global.wait(now)
+            if global_wait > 0:
+                return global_wait
+            self._grant(waiter, now)
+            return 0.0
+        if self._head(waiter.chat_id, waiter.ticket) is waiter:
+            chat_wait = self._chat_wait(waiter, now)
+            if chat_wait > 0:
+                return chat_wait
+        # Очередь впереди: ждём уведомления или токена общей корзины
+        return max(self._global.wait(now), 1 / self.global_rate)
+
+    def _grant(self, waiter, now):
+        self._global.tokens -= 1
+        if waiter.per_chat and waiter.chat_id is not None:
+            self._chat_bucket(waiter.chat_id, now).tokens -= 1
+        del self._waiters[waiter.ticket]
+        queue = self._queues[waiter.chat_id]
+        heapq.heappop(queue)
+        if queue:
+            self._schedule(waiter.chat_id, now)
+        else:
+            del self._queues[waiter.chat_id]
+        self.granted += 1
+        waited = now - waiter.enqueued_at
+        if waited > 0:
+            self.delayed += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+
+def _api_method(url):
+    return url.rstrip("/").rsplit("/", 1)[-1]
+
+
+def install(limiter, session=None):
+    """Пропускает запросы TeleBot через limiter (с повтором после 429)."""
+    session = session or requests.Session()
+
+    def send(method, url, params=None, files=None, timeout=None, proxies=None):
+        def request():
+            return session.request(
+                method,
+                url,
+                params=params,
+                files=files,
+                timeout=timeout,
+                proxies=proxies,
+            )
+
+        kind = classify(_api_method(url))
+        if kind is None:
+            return request()
+        priority, per_chat = kind
+        chat_id = (params or {}).get("chat_id")
+        for attempt in range(limiter.max_retries + 1):
+            limiter.acquire(chat_id, priority, per_chat)
+            response = request()
+            if response.status_code != 429 or attempt == limiter.max_retries:
+                return response
+            try:
+                delay = retry_after(response.json())
+            except (ValueError, json.JSONDecodeError):
+                delay = 1
+            limiter.penalize(chat_id, delay or 1)
+            _rewind(files)
+        return response
+
+    apihelper.CUSTOM_REQUEST_SENDER = send
+
+
+def install_async(limiter):
+    """Пропускает запросы AsyncTeleBot через limiter (с повтором после 429)."""
+    process_request = asyncio_helper._process_request
+
+    async def limited_request(
+        token, url, method="get", params=None, files=None, **kwargs
+    ):
+        kind = classify(url)
+        if kind is None:
+            return await process_request(
+                token, url, method, params=params, files=files, **kwargs
+            )
+        priority, per_chat = kind
+        chat_id = (params or {}).get("chat_id")
+        for attempt in range(limiter.max_retries + 1):
+            await limiter.acquire_async(chat_id, priority, per_chat)
+            try:
+                # _process_request изменяет params — передаём копию
+                return await process_request(
+                    token,
+                    url,
+                    method,
+                    params=dict(params) if params else params,
+                    files=files,
+                    **kwargs,
+                )
+            except apihelper.ApiTelegramException as e:
+                if not is_flood_error(e) or attempt == limiter.max_retries:
+                    raise
+                limiter.penalize(chat_id, retry_after(e.result_json) or 1)
+                _rewind(files)
+
+    asyncio_helper._process_request = limited_request
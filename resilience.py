@@ -0,0 +1,338 @@
+"""
+Устойчивость вызовов Gemini: повторы, предохранитель и запасная модель.
+
+Кратковременные 429/5xx и сетевые сбои не должны сразу доходить до
+пользователя. ResilientGemini:
+
+- повторяет идемпотентные вызовы с экспоненциальной задержкой и полным
+  джиттером (ограниченной max_delay);
+- считает сбои по каждой модели и после failure_threshold подряд
+  «размыкает» её на reset_timeout секунд — запросы к ней не отправляются,
+  затем пропускается один пробный;
+- пока предохранитель модели разомкнут, может отправлять запросы на
+  запасную модель (например, с Pro на Flash).
+
+Ошибки запроса (400, 403, 404) не повторяются и сбоями модели не считаются.
+В синхронном боте пауза перед повтором занимает поток диспетчера, поэтому
+суммарное ожидание одного вызова ограничено max_blocking_wait.
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+import httpx
+from google.genai import errors as genai_errors
+
+from chat_cache import chat_history
+
+TRANSIENT = "transient"
+FATAL = "fatal"
+
+TRANSIENT_CODES = {408, 429, 500, 502, 503, 504}
+NETWORK_ERRORS = (
+    httpx.TimeoutException,
+    httpx.NetworkError,
+    ConnectionError,
+    TimeoutError,
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def classify_error(error):
+    """TRANSIENT — можно повторить (перегрузка, сеть), FATAL — нет."""
+    if isinstance(error, genai_errors.APIError):
+        return TRANSIENT if error.code in TRANSIENT_CODES else FATAL
+    if isinstance(error, NETWORK_ERRORS):
+        return TRANSIENT
+    return FATAL
+
+
+class CircuitOpenError(Exception):
+    """Модель временно не принимает запросы (предохранитель разомкнут)."""
+
+    def __init__(self, model):
+        super().__init__(
+            f"Модель {model} временно недоступна из-за повторяющихся ошибок. "
+            "Попробуйте позже или выберите другую модель."
+        )
+        self.model = model
+
+
+class CircuitBreaker:
+    """Предохранитель одной модели; методы потокобезопасны."""
+
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if self.clock() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self._probing = False
+            # Полуоткрыт: пропускаем один пробный запрос
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        """Освобождает пробный запрос, не меняя состояния (ошибка запроса)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opens += 1
+                self.state = OPEN
+                self.opened_at = self.clock()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self.state == OPEN
+
+
+class ResilientGemini:
+    """
+    call(model, fn) вызывает fn(model_name) с повторами и возвращает
+    (результат, модель, которая ответила). fallbacks — {модель: запасная}.
+    """
+
+    def __init__(
+        self,
+        max_attempts=3,
+        base_delay=0.5,
+        max_delay=8.0,
+        failure_threshold=5,
+        reset_timeout=30.0,
+        fallbacks=None,
+        max_blocking_wait=None,
+        sleep=time.sleep,
+        async_sleep=asyncio.sleep,
+        clock=time.monotonic,
+        rng=random.random,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.fallbacks = fallbacks or {}
+        self.max_blocking_wait = max_blocking_wait
+        self.sleep = sleep
+        self.async_sleep = async_sleep
+        self.clock = clock
+        self.rng = rng
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.fallback_calls = 0
+        self.rejected = 0
+
+    def breaker(self, model):
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = self._breakers[model] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout, self.clock
+                )
+            return breaker
+
+    def delay(self, attempt):
+        """Полный джиттер: случайная задержка до base·2^attempt, не больше max_delay."""
+        return self.rng() * min(self.max_delay, self.base_delay * 2**attempt)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _candidates(self, model):
+        fallback = self.fallbacks.get(model)
+        return [model, fallback] if fallback else [model]
+
+    def record_outcome(self, model, error=None):
+        """Исход одной попытки к model: успех, сбой модели или ошибка запроса."""
+        breaker = self.breaker(model)
+        if error is None:
+            breaker.record_success()
+        elif classify_error(error) == TRANSIENT:
+            breaker.record_failure()
+        else:
+            breaker.release()
+
+    def call(self, model, fn, idempotent=True, record=True):
+        """
+        record=False — исходы попыток записывает сам fn (Hedger: ответить
+        могла другая модель), здесь предохранитель только пропускает запрос.
+        """
+        self._count("calls")
+        error = None
+        for candidate in self._candidates(model):
+            # На запасную модель — только пока основная разомкнута
+            if candidate != model and not self.breaker(model).is_open:
+                break
+            if candidate != model:
+                self._count("fallback_calls")
+            try:
+                return self._attempt(candidate, fn, idempotent, record), candidate
+            except Exception as e:
+                if isinstance(e, CircuitOpenError) or classify_error(e) == TRANSIENT:
+                    error = e
+                    continue
+                raise
+        raise error
+
+    def _attempt(self, model, fn, idempotent, record=True):
+        breaker = self.breaker(model)
+        attempts = self.max_attempts if idempotent else 1
+        budget = self.max_blocking_wait
+        for attempt in range(attempts):
+            if not breaker.allow():
+                self._count("rejected")
+                raise CircuitOpenError(model)
+            try:
+                result = fn(model)
+            except Exception as e:
+                last = attempt == attempts - 1 or (budget is not None and budget <= 0)
+                if not self._failed(breaker, e, last, record):
+                    raise
+                delay = self.delay(attempt)
+                if budget is not None:
+                    delay = min(delay, budget)
+                    budget -= delay
+                self.sleep(delay)
+                continue
+            if record:
+                breaker.record_success()
+            return result
+
+    async def call_async(self, model, fn, idempotent=True, record=True):
+        """То же для корутин: fn(model_name) возвращает awaitable."""
+        self._count("calls")
+        error = None
+        for candidate in self._candidates(model):
+            if candidate != model and not self.breaker(model).is_open:
+                break
+            if candidate != model:
+                self._count("fallback_calls")
+            try:
+                return (
+                    await self._attempt_async(candidate, fn, idempotent, record),
+                    candidate,
+                )
+            except Exception as e:
+                if isinstance(e, CircuitOpenError) or classify_error(e) == TRANSIENT:
+                    error = e
+                    continue
+                raise
+        raise error
+
+    async def _attempt_async(self, model, fn, idempotent, record=True):
+        breaker = self.breaker(model)
+        attempts = self.max_attempts if idempotent else 1
+        for attempt in range(attempts):
+            if not breaker.allow():
+                self._count("rejected")
+                raise CircuitOpenError(model)
+            try:
+                result = await fn(model)
+            except Exception as e:
+                if not self._failed(breaker, e, attempt == attempts - 1, record):
+                    raise
+                await self.async_sleep(self.delay(attempt))
+                continue
+            if record:
+                breaker.record_success()
+            return result
+
+    def _failed(self, breaker, error, last, record=True):
+        """Учитывает ошибку; True — стоит повторить (last — попыток больше нет)."""
+        if classify_error(error) != TRANSIENT:
+            # Ошибка запроса, а не модели: предохранитель не трогаем, только
+            # освобождаем место пробного запроса
+            if record:
+                breaker.release()
+            return False
+        self._count("failures")
+        if record:
+            breaker.record_failure()
+        if last:
+            return False
+        self._count("retries")
+        return True
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+            result = {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "fallback_calls": self.fallback_calls,
+                "rejected_open": self.rejected,
+            }
+        result["breakers"] = {
+            model: {"state": breaker.state, "opens": breaker.opens}
+            for model, breaker in breakers.items()
+        }
+        return result
+
+
+def send_chat(gemini, chats, chat, model, send):
+    """
+    Отправляет сообщение в чат через gemini.call: send(chat) -> результат.
+    При переходе на запасную модель создаётся временный чат с той же
+    историей. Возвращает (результат, чат, в котором он получен) — этот чат
+    нужно передать в save_active_chat.
+    """
+
+    def attempt(model_name):
+        target = chat
+        if model_name != model:
+            target = chats.create(model=model_name, history=chat_history(chat))
+        return send(target), target
+
+    (result, used_chat), _ = gemini.call(model, attempt)
+    return result, used_chat
+
+
+async def send_chat_async(gemini, chats, chat, model, send):
+    """Асинхронный send_chat: send(chat) возвращает awaitable."""
+
+    async def attempt(model_name):
+        target = chat
+        if model_name != model:
+            target = chats.create(model=model_name, history=chat_history(chat))
+        return await send(target), target
+
+    (result, used_chat), _ = await gemini.call_async(model, attempt)
+    return result, used_chat
@@ -0,0 +1,198 @@
+"""
+Кэш ответов быстрых инструментов в SQLite.
+
+Инструменты с "cache": True в QUICK_TOOLS_CONFIG (перевод, корректура и
+т. п.) — по сути чистые функции от конфига и текста: одинаковый запрос от
+любого пользователя получает сохранённый ответ без вызова Gemini.
+
+Ключ — SHA-256 конфига инструмента (модель, system_instruction,
+thinking_budget — всё, кроме описания) и текста. Изменился конфиг — ключи
+другие, а старые ответы удаляет prune при запуске. Записи живут не дольше
+ttl секунд; сверх max_entries вытесняются давно не использованные.
+
+Попадание не пишет в БД: время использования копится в памяти и
+записывается пачкой, а вытеснение выполняется раз в evict_every записей —
+между ними кэш может ненадолго превысить max_entries.
+"""
+
+import hashlib
+import json
+import threading
+import time
+
+from constants import DEFAULT_MODEL, is_image_generation_model
+from database import crud
+from database.db import SessionLocal
+
+# Поля конфига, не влияющие на ответ модели
+IGNORED_FIELDS = ("description", "cache", "batch", "map_reduce")
+# Сколько отметок использования копится до записи в БД
+TOUCH_BATCH = 64
+# Вытеснение (подсчёт записей и удаление лишних) — раз в столько записей
+EVICT_EVERY = 32
+
+
+def config_hash(tool_config):
+    fields = {
+        name: value
+        for name, value in tool_config.items()
+        if name not in IGNORED_FIELDS
+    }
+    # Инструмент без "model" отвечает моделью по умолчанию
+    fields.setdefault("model", DEFAULT_MODEL)
+    canonical = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def response_tokens(response):
+    """Токены запроса и ответа по usage_metadata (0, если их нет)."""
+    usage = getattr(response, "usage_metadata", None)
+    return (getattr(usage, "total_token_count", None) or 0) if usage else 0
+
+
+class ResponseCache:
+    """session_factory — фабрика сессий БД, clock — источник времени (для тестов)."""
+
+    def __init__(
+        self,
+        max_entries,
+        ttl,
+        session_factory=SessionLocal,
+        clock=time.time,
+        touch_batch=TOUCH_BATCH,
+        evict_every=EVICT_EVERY,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.touch_batch = touch_batch
+        self.evict_every = evict_every
+        self.session_factory = session_factory
+        self.clock = clock
+        self._hashes = {}
+        self._touched = {}
+        self._puts = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+        self.saved_tokens = 0
+
+    @staticmethod
+    def enabled_for(tool_config):
+        """Кэшируются только текстовые инструменты, включившие "cache"."""
+        return bool(tool_config.get("cache")) and not is_image_generation_model(
+            tool_config.get("model", DEFAULT_MODEL)
+        )
+
+    def _config_hash(self, tool, tool_config):
+        with self._lock:
+            cached = self._hashes.get(tool)
+            if cached is None or cached[0] is not tool_config:
+                cached = (tool_config, config_hash(tool_config))
+                self._hashes[tool] = cached
+            return cached[1]
+
+    def key(self, tool, tool_config, text):
+        digest = hashlib.sha256(self._config_hash(tool, tool_config).encode())
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, tool, tool_config, text):
+        """Сохранённый ответ или None."""
+        key = self.key(tool, tool_config, text)
+        now = self.clock()
+        try:
+            with self.session_factory() as session:
+                row = crud.get_tool_response(session, key)
+                if row is not None and row.created_at < now - self.ttl:
+                    crud.delete_tool_response(session, key)
+                    row = None
+        except Exception as e:
+            # Кэш необязателен: без него запрос просто уйдёт в Gemini
+            print(f"Error reading quick tool cache: {e}")
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_tokens += row.tokens or 0
+            self._touched[key] = now
+            touched = self._take_touched(self.touch_batch)
+        if touched:
+            try:
+                with self.session_factory() as session:
+                    crud.touch_tool_responses(session, touched)
+            except Exception as e:
+                print(f"Error updating quick tool cache: {e}")
+        return row.response
+
+    def _take_touched(self, batch):
+        """Накопленные отметки использования, если их не меньше batch (под _lock)."""
+        if not self._touched or len(self._touched) < batch:
+            return None
+        touched, self._touched = self._touched, {}
+        return touched
+
+    def put(self, tool, tool_config, text, response_text, tokens=0):
+        if not response_text:
+            return
+        now = self.clock()
+        with self._lock:
+            self._puts += 1
+            evict = self._puts >= self.evict_every
+            if evict:
+                self._puts = 0
+                # Перед вытеснением давность использования должна быть точной
+                touched = self._take_touched(1)
+        try:
+            with self.session_factory() as session:
+                crud.put_tool_response(
+                    session,
+                    self.key(tool, tool_config, text),
+                    tool,
+                    self._config_hash(tool, tool_config),
+                    response_text,
+                    tokens,
+                    now,
+                )
+                evicted = 0
+                if evict:
+                    if touched:
+                        crud.touch_tool_responses(session, touched)
+                    evicted = crud.evict_tool_responses(
+                        session, self.max_entries, now - self.ttl
+                    )
+        except Exception as e:
+            print(f"Error saving quick tool cache: {e}")
+            return
+        with self._lock:
+            self.stores += 1
+            self.evicted += evicted
+
+    def prune(self, tools_config):
+        """Удаляет ответы инструментов, которых нет или чей конфиг изменился."""
+        hashes = {
+            tool: self._config_hash(tool, tool_config)
+            for tool, tool_config in tools_config.items()
+            if self.enabled_for(tool_config)
+        }
+        with self.session_factory() as session:
+            removed = crud.delete_stale_tool_responses(session, hashes)
+        if removed:
+            print(f"Удалено {removed} устаревших ответов быстрых инструментов")
+        return removed
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "stores": self.stores,
+                "evicted": self.evicted,
+                "saved_tokens": self.saved_tokens,
+            }
@@ -0,0 +1,88 @@
+"""
+Маршрутизация текстовых сообщений по словарям вместо цепочки предикатов.
+
+TeleBot проверяет для каждого апдейта все @message_handler(func=...) по
+очереди. Router регистрируется в TeleBot одним обработчиком текста и
+находит нужный за один-два поиска в словаре:
+
+- команда ("/start", "/translate@bot текст") — по имени команды;
+- кнопка с постоянным текстом ("Новый чат") — по точному совпадению;
+- кнопка с изменяемым текстом ("Режим: Ручной ✍️") — по первому слову и
+  проверке префикса;
+- остальное — обработчик по умолчанию.
+"""
+
+
+def command_name(text):
+    """Имя команды без "/" и "@бот" или None, если текст не команда."""
+    if not text.startswith("/"):
+        return None
+    return text.split(maxsplit=1)[0][1:].split("@", 1)[0]
+
+
+def command_args(text):
+    """Текст после команды (отделённый пробелом или переводом строки) или ""."""
+    words = text.split(maxsplit=1)
+    return words[1].strip() if len(words) == 2 else ""
+
+
+class Router:
+    def __init__(self):
+        self._commands = {}
+        self._exact = {}
+        self._prefixes = {}
+        self._default = None
+
+    def command(self, *names):
+        def decorator(handler):
+            for name in names:
+                self._commands[name] = handler
+            return handler
+
+        return decorator
+
+    def exact(self, *texts):
+        def decorator(handler):
+            for text in texts:
+                self._exact[text] = handler
+            return handler
+
+        return decorator
+
+    def prefix(self, prefix):
+        """Текст, начинающийся с prefix; prefix не короче первого слова."""
+        first_word = prefix.split(maxsplit=1)[0]
+
+        def decorator(handler):
+            self._prefixes.setdefault(first_word, []).append((prefix, handler))
+            return handler
+
+        return decorator
+
+    def default(self, handler):
+        self._default = handler
+        return handler
+
+    def resolve(self, text):
+        """Обработчик для текста сообщения (или обработчик по умолчанию)."""
+        if not text:
+            return self._default
+        name = command_name(text)
+        if name is not None:
+            return self._commands.get(name, self._default)
+        handler = self._exact.get(text)
+        if handler is not None:
+            return handler
+        words = text.split(maxsplit=1)
+        candidates = self._prefixes.get(words[0]) if words else None
+        if candidates:
+            for prefix, handler in candidates:
+                if text.startswith(prefix):
+                    return handler
+        return self._default
+
+    def dispatch(self, message):
+        """Вызывает обработчик; для async-обработчиков возвращает корутину."""
+        handler = self.resolve(message.text)
+        if handler is not None:
+            return handler(message)
@@ -0,0 +1,224 @@
+"""
+Потоковые ответы Gemini: текст показывается в сообщении-заглушке по мере
+генерации, а частота правок ограничена бюджетом на чат.
+
+По завершении стрима обработчик сам отправляет полный ответ через
+send_rich_response (с разбиением split_long_message) и удаляет заглушку,
+так что итоговое форматирование не отличается от обычного режима.
+"""
+
+import itertools
+import threading
+import time
+
+from telebot.types import ReplyParameters
+
+# Лимит длины обычного сообщения Telegram
+PREVIEW_LIMIT = 4000
+CURSOR = " ▌"
+
+
+class EditBudget:
+    """Разрешает не больше одной правки сообщения в чате за min_interval секунд."""
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._last_edit = {}
+        self._lock = threading.Lock()
+
+    def try_acquire(self, chat_id):
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_edit.get(chat_id)
+            if last is not None and now - last < self.min_interval:
+                return False
+            self._last_edit[chat_id] = now
+            # Старые записи не нужны: после паузы правка всё равно разрешена
+            if len(self._last_edit) > 10000:
+                self._last_edit = {
+                    k: v
+                    for k, v in self._last_edit.items()
+                    if now - v < self.min_interval
+                }
+            return True
+
+
+def _preview(text):
+    if len(text) > PREVIEW_LIMIT:
+        return text[:PREVIEW_LIMIT] + "…"
+    return text + CURSOR
+
+
+def _has_grounding(chunk):
+    candidates = getattr(chunk, "candidates", None)
+    return bool(candidates and candidates[0].grounding_metadata)
+
+
+class _StreamState:
+    def __init__(self, placeholder):
+        self.placeholder = placeholder
+        self.text = ""
+        self.response = None
+        self.shown = ""
+
+    def add(self, chunk):
+        if chunk.text:
+            self.text += chunk.text
+        # grounding-метаданные приходят в последних чанках
+        if self.response is None or _has_grounding(chunk):
+            self.response = chunk
+
+    def preview_due(self, budget, chat_id):
+        return (
+            bool(self.text.strip())
+            and self.text != self.shown
+            and len(self.shown) < PREVIEW_LIMIT
+            and budget.try_acquire(chat_id)
+        )
+
+
+def open_stream(chat_session, message_parts, config):
+    """
+    Запускает send_message_stream и дожидается первого чанка, чтобы ошибка
+    до начала ответа (429, 503) возникла здесь и запрос можно было повторить.
+    """
+    stream = iter(
+        chat_session.send_message_stream(message=message_parts, config=config)
+    )
+    first = next(stream, None)
+    return itertools.chain([] if first is None else [first], stream)
+
+
+async def open_stream_async(chat_session, message_parts, config):
+    """Асинхронный open_stream."""
+    stream = await chat_session.send_message_stream(
+        message=message_parts, config=config
+    )
+    try:
+        first = await anext(stream)
+    except StopAsyncIteration:
+        return stream
+
+    async def chunks():
+        yield first
+        async for chunk in stream:
+            yield chunk
+
+    return chunks()
+
+
+def stream_chat_response(
+    bot,
+    chat_session,
+    message_parts,
+    config,
+    chat_id,
+    budget,
+    reply_to_message_id=None,
+    placeholder=None,
+    stream=None,
+):
+    """
+    Отправляет запрос через send_message_stream и показывает текст в заглушке.
+    Возвращает (text, response, placeholder): response — чанк с grounding-
+    метаданными (или последний), placeholder — сообщение, которое нужно удалить
+    после отправки итогового ответа. stream — уже открытый open_stream.
+    """
+    state = _StreamState(placeholder)
+    try:
+        if stream is None:
+            stream = chat_session.send_message_stream(
+                message=message_parts, config=config
+            )
+        for chunk in stream:
+            state.add(chunk)
+            if state.preview_due(budget, chat_id):
+                state.shown = state.text
+                try:
+                    if state.placeholder is None:
+                        state.placeholder = bot.send_message(
+                            chat_id,
+                            _preview(state.text),
+                            reply_parameters=(
+                                ReplyParameters(message_id=reply_to_message_id)
+                                if reply_to_message_id
+                                else None
+                            ),
+                        )
+                    else:
+                        bot.edit_message_text(
+                            _preview(state.text),
+                            chat_id,
+                            state.placeholder.message_id,
+                        )
+                except Exception as e:
+                    print(f"Не удалось обновить потоковый ответ: {e}")
+    except Exception:
+        delete_placeholder(bot, chat_id, state.placeholder)
+        raise
+    return state.text, state.response, state.placeholder
+
+
+async def stream_chat_response_async(
+    bot,
+    chat_session,
+    message_parts,
+    config,
+    chat_id,
+    budget,
+    reply_to_message_id=None,
+    placeholder=None,
+    stream=None,
+):
+    """Асинхронный вариант stream_chat_response для AsyncTeleBot и client.aio."""
+    state = _StreamState(placeholder)
+    try:
+        if stream is None:
+            stream = await chat_session.send_message_stream(
+                message=message_parts, config=config
+            )
+        async for chunk in stream:
+            state.add(chunk)
+            if state.preview_due(budget, chat_id):
+                state.shown = state.text
+                try:
+                    if state.placeholder is None:
+                        state.placeholder = await bot.send_message(
+                            chat_id,
+                            _preview(state.text),
+                            reply_parameters=(
+                                ReplyParameters(message_id=reply_to_message_id)
+                                if reply_to_message_id
+                                else None
+                            ),
+                        )
+                    else:
+                        await bot.edit_message_text(
+                            _preview(state.text),
+                            chat_id,
+                            state.placeholder.message_id,
+                        )
+                except Exception as e:
+                    print(f"Не удалось обновить потоковый ответ: {e}")
+    except Exception:
+        await delete_placeholder_async(bot, chat_id, state.placeholder)
+        raise
+    return state.text, state.response, state.placeholder
+
+
+def delete_placeholder(bot, chat_id, placeholder):
+    if placeholder is None:
+        return
+    try:
+        bot.delete_message(chat_id, placeholder.message_id)
+    except Exception:
+        pass
+
+
+async def delete_placeholder_async(bot, chat_id, placeholder):
+    if placeholder is None:
+        return
+    try:
+        await bot.delete_message(chat_id, placeholder.message_id)
+    except Exception:
+        pass
@@ -0,0 +1,74 @@
+"""
+Локальная подделка клиента Gemini для тестов устойчивости: отвечает с
+заданной задержкой и с вероятностью error_rate возвращает 503 (или
+ошибки из очереди script). Модели из down всегда отвечают 503.
+"""
+
+import random
+import time
+from types import SimpleNamespace
+
+from google.genai import errors as genai_errors
+
+
+def server_error(code=503):
+    return genai_errors.ServerError(
+        code, {"error": {"message": "overloaded", "status": "UNAVAILABLE"}}
+    )
+
+
+def client_error(code=400):
+    return genai_errors.ClientError(
+        code, {"error": {"message": "bad request", "status": "INVALID_ARGUMENT"}}
+    )
+
+
+class FakeGemini:
+    def __init__(self, error_rate=0.0, latency=0.0, seed=0, script=(), down=()):
+        self.error_rate = error_rate
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.script = list(script)
+        self.down = set(down)
+        self.requests = []
+        self.models = SimpleNamespace(generate_content=self.generate_content)
+        self.chats = SimpleNamespace(create=self.create_chat)
+
+    def respond(self, model, contents):
+        self.requests.append(model)
+        if self.latency:
+            time.sleep(self.latency)
+        if self.script:
+            error = self.script.pop(0)
+            if error is not None:
+                raise error
+        elif model in self.down or self.rng.random() < self.error_rate:
+            raise server_error()
+        return SimpleNamespace(text=f"{model}: {contents}")
+
+    def generate_content(self, model, contents, config=None):
+        return self.respond(model, contents)
+
+    def create_chat(self, model, history=None):
+        return FakeChat(self, model, history)
+
+
+class FakeChat:
+    def __init__(self, backend, model, history=None):
+        self.backend = backend
+        self.model = model
+        self.history = list(history or [])
+
+    def get_history(self):
+        return list(self.history)
+
+    def send_message(self, message, config=None):
+        response = self.backend.respond(self.model, message)
+        self.history += [message, response.text]
+        return response
+
+    def send_message_stream(self, message, config=None):
+        response = self.backend.respond(self.model, message)
+        for word in response.text.split():
+            yield SimpleNamespace(text=word, candidates=None)
+        self.history += [message, response.text]
@@ -0,0 +1,46 @@
+"""
+Прежний markdown_to_text (markdown() → HTML → BeautifulSoup) — эталон для
+проверки однопроходного конвертера из utils и для бенчмарка.
+"""
+
+from bs4 import BeautifulSoup
+from markdown import markdown
+
+
+def legacy_markdown_to_text(markdown_string):
+    html = markdown(markdown_string)
+    soup = BeautifulSoup(html, "html.parser")
+
+    for br in soup.find_all("br"):
+        br.replace_with("\n")
+
+    block_tags = [
+        "p",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "ul",
+        "ol",
+        "li",
+        "blockquote",
+        "pre",
+        "hr",
+        "div",
+        "table",
+        "tr",
+    ]
+    for tag in soup.find_all(block_tags):
+        tag.append("\n")
+
+    for tag in soup.find_all(["td", "th"]):
+        tag.append(" ")
+
+    return soup.get_text(separator="").strip()
+
+
+def visible_lines(text):
+    """Непустые строки без отступов: сравнение без учёта пустых строк."""
+    return [line.strip() for line in text.split("\n") if line.strip()]
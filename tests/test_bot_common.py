@@ -0,0 +1,95 @@
+import unittest
+from unittest import mock
+
+import bot_common
+from constants import MAP_REDUCE_MAX_CHARS, QUICK_TOOL_MAX_CHARS
+from map_reduce import MapReduce
+
+
+class TestPlanQuickTool(unittest.TestCase):
+    def setUp(self):
+        self.map_reduce = MapReduce(1000, "cheap-model", 2)
+
+    def plan(self, command, text):
+        return bot_common.plan_quick_tool(command, text, self.map_reduce)
+
+    def test_short_text_is_single_request(self):
+        self.assertEqual(self.plan("prompt", "напиши стих"), ("single", None))
+
+    def test_lines_go_to_batch(self):
+        text = "\n".join(f"фраза {i}" for i in range(10))
+        plan, batch = self.plan("translate", text)
+        self.assertEqual(plan, "batch")
+        self.assertEqual(len(batch.items), 10)
+
+    def test_prose_tools_are_not_split_into_paragraphs(self):
+        text = "\n\n".join(f"абзац {i}" for i in range(10))
+        self.assertEqual(self.plan("proofread", text), ("single", None))
+        self.assertEqual(self.plan("formal", text), ("single", None))
+
+    def test_long_text_uses_map_reduce_when_enabled(self):
+        text = "слово " * QUICK_TOOL_MAX_CHARS
+        self.assertEqual(self.plan("simplify", text), ("map_reduce", None))
+        plan, reply = self.plan("prompt", text)
+        self.assertEqual(plan, "reject")
+        self.assertIn("/prompt", reply)
+
+    def test_map_reduce_limit(self):
+        plan, reply = self.plan("simplify", "x" * (MAP_REDUCE_MAX_CHARS + 1))
+        self.assertEqual(plan, "reject")
+        self.assertIn(str(MAP_REDUCE_MAX_CHARS), reply)
+
+
+class TestParseQuickTool(unittest.TestCase):
+    def test_bot_mention_is_dropped(self):
+        self.assertEqual(
+            bot_common.parse_quick_tool("/translate@mybot hello"),
+            ("translate", "hello"),
+        )
+
+    def test_query_on_next_line(self):
+        self.assertEqual(
+            bot_common.parse_quick_tool("/translate@mybot\nline1\nline2"),
+            ("translate", "line1\nline2"),
+        )
+        self.assertEqual(bot_common.parse_quick_tool("/todo"), ("todo", ""))
+
+
+class TestTexts(unittest.TestCase):
+    def test_filename_base(self):
+        self.assertEqual(
+            bot_common.filename_base("a/b c:d e\\f tail", "response"), "a_b_c_d_e_f"
+        )
+        self.assertEqual(bot_common.filename_base("  ", "response"), "response")
+
+    def test_quick_tool_filename(self):
+        self.assertEqual(
+            bot_common.quick_tool_filename("todo", "купить хлеб и молоко"),
+            "купить_хлеб_и_todo.md",
+        )
+        self.assertEqual(bot_common.quick_tool_filename("todo", ""), "todo_todo.md")
+        self.assertIsNone(bot_common.quick_tool_filename("translate", "текст"))
+
+    def test_document_added_text_depends_on_mode(self):
+        immediate = bot_common.document_added_text("a.pdf", "application/pdf", "", 2)
+        manual = bot_common.document_added_text(
+            "a.pdf", "application/pdf", "подпись", 2, buffer_count=3
+        )
+        self.assertIn("добавлен в контекст", immediate)
+        self.assertIn("(PDF)", immediate)
+        self.assertIn("добавлен в буфер (3 шт.)", manual)
+        self.assertIn("Подпись также добавлена", manual)
+
+
+class TestServices(unittest.TestCase):
+    def test_shutdown_flushes_chats_and_stops_image_pool(self):
+        services = bot_common.Services(mock.Mock())
+        services.image_preprocessor = mock.Mock()
+        with mock.patch.object(bot_common.user_chats, "flush") as flush:
+            services.shutdown()
+        flush.assert_called_once_with()
+        services.image_preprocessor.shutdown.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    unittest.main()
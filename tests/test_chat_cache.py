@@ -0,0 +1,127 @@
+import time
+import unittest
+from types import SimpleNamespace
+
+from chat_cache import ChatCache, estimate_history_bytes
+
+
+def content(text="", data=None):
+    inline_data = SimpleNamespace(data=data) if data else None
+    return SimpleNamespace(
+        parts=[SimpleNamespace(text=text, inline_data=inline_data)]
+    )
+
+
+class FakeChat:
+    def __init__(self, *history):
+        self.history = list(history)
+
+    def get_history(self):
+        return self.history
+
+
+class TestChatCache(unittest.TestCase):
+    def setUp(self):
+        self.saved = []
+
+    def make_cache(self, max_entries=10, max_bytes=10**6, ttl=0):
+        return ChatCache(
+            max_entries,
+            max_bytes,
+            ttl,
+            on_evict=lambda key, chat: self.saved.append(key),
+        )
+
+    def test_estimate_counts_text_and_inline_data(self):
+        history = [content("abc"), content("я", data=b"12345")]
+        self.assertEqual(estimate_history_bytes(history), 3 + 2 + 5)
+
+    def test_lru_eviction_by_entries(self):
+        cache = self.make_cache(max_entries=2)
+        cache.put(1, FakeChat())
+        cache.put(2, FakeChat())
+        cache.get(1)
+        cache.put(3, FakeChat())
+
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+        self.assertIn(3, cache)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_eviction_by_bytes_keeps_newest(self):
+        cache = self.make_cache(max_bytes=10)
+        cache.put(1, FakeChat(content("x" * 8)))
+        cache.put(2, FakeChat(content("y" * 20)))
+
+        self.assertNotIn(1, cache)
+        self.assertIn(2, cache)
+        self.assertEqual(cache.stats()["bytes"], 20)
+
+    def test_write_back_only_for_unsaved_history(self):
+        cache = self.make_cache(max_entries=1)
+        saved_chat = FakeChat(content("a"))
+        cache.put(1, saved_chat)
+        cache.put(2, FakeChat())
+        self.assertEqual(self.saved, [])
+
+        chat = cache.get(2)
+        chat.history.append(content("new turn"))
+        cache.put(3, FakeChat())
+        self.assertEqual(self.saved, [2])
+
+    def test_mark_saved_updates_size(self):
+        cache = self.make_cache()
+        chat = FakeChat()
+        cache.put(1, chat)
+        chat.history.append(content("hello"))
+        cache.mark_saved(1, chat.history)
+
+        self.assertEqual(cache.stats()["bytes"], 5)
+        cache.flush()
+        self.assertEqual(self.saved, [])
+
+    def test_ttl_expiration(self):
+        cache = self.make_cache(ttl=0.01)
+        chat = FakeChat()
+        cache.put(1, chat)
+        chat.history.append(content("unsaved"))
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(self.saved, [1])
+        stats = cache.stats()
+        self.assertEqual(stats["expirations"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_pop_discards_without_write_back(self):
+        cache = self.make_cache()
+        chat = FakeChat()
+        cache.put(1, chat)
+        chat.history.append(content("x"))
+
+        self.assertIs(cache.pop(1), chat)
+        self.assertNotIn(1, cache)
+        self.assertEqual(self.saved, [])
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+    def test_tokens_estimate_only_new_turns(self):
+        cache = self.make_cache()
+        chat = FakeChat(content("a"), content("b"))
+        cache.put(1, chat)
+        seen = []
+
+        def estimate(turns):
+            seen.append(len(turns))
+            return 10 * len(turns)
+
+        self.assertEqual(cache.tokens(1, chat.history, estimate), 20)
+        chat.history.append(content("c"))
+        self.assertEqual(cache.tokens(1, chat.history, estimate), 30)
+        self.assertEqual(cache.tokens(1, chat.history, estimate), 30)
+        self.assertEqual(seen, [2, 1])
+        # История стала короче (сброс) — считается заново
+        self.assertEqual(cache.tokens(1, chat.history[:1], estimate), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+import threading
+import unittest
+
+from google.genai import types as genai_types
+
+from compaction import (
+    MEDIA_PLACEHOLDER,
+    SUMMARY_PREFIX,
+    HistoryCompactor,
+    render_transcript,
+)
+from token_estimator import estimator
+
+
+def turn(role, text="", image=False):
+    parts = []
+    if text:
+        parts.append(genai_types.Part(text=text))
+    if image:
+        parts.append(
+            genai_types.Part.from_bytes(data=b"\x89PNG", mime_type="image/png")
+        )
+    return genai_types.Content(role=role, parts=parts)
+
+
+def conversation(exchanges, size=400, image=False):
+    history = []
+    for i in range(exchanges):
+        history.append(turn("user", f"вопрос {i} " + "x" * size, image=image))
+        history.append(turn("model", f"ответ {i} " + "y" * size))
+    return history
+
+
+class TestHistoryCompactor(unittest.TestCase):
+    def make(self, budget=1000, summarize=None, mode="summarize", keep_media=2):
+        return HistoryCompactor(
+            {"small": budget // 2},
+            budget,
+            keep_media,
+            summarize=summarize,
+            mode=mode,
+        )
+
+    def test_under_budget_is_untouched(self):
+        history = conversation(2)
+        self.assertIsNone(self.make().compact(history, "any"))
+
+    def test_budget_per_model(self):
+        compactor = self.make(budget=1000)
+        self.assertEqual(compactor.budget_for("small"), 500)
+        self.assertEqual(compactor.budget_for("other"), 1000)
+
+    def test_media_stripped_first(self):
+        history = conversation(6, size=20, image=True)
+        compactor = self.make(budget=1500)
+        self.assertGreater(estimator.history(history), 1500)
+
+        compacted = compactor.compact(history, "any")
+
+        self.assertEqual(len(compacted), len(history))
+        old_texts = [p.text for p in compacted[0].parts]
+        self.assertIn(MEDIA_PLACEHOLDER, old_texts)
+        self.assertIsNone(compacted[0].parts[1].inline_data)
+        # Последние ходы сохраняют вложения
+        self.assertIsNotNone(compacted[-2].parts[1].inline_data)
+        self.assertEqual(compactor.stats()["media_only"], 1)
+
+    def test_window_drops_oldest_turns_within_target(self):
+        history = conversation(20)
+        compactor = self.make(budget=1000, mode="window")
+
+        compacted = compactor.compact(history, "any")
+
+        self.assertLessEqual(estimator.history(compacted), 600)
+        self.assertEqual(compacted[0].role, "user")
+        self.assertEqual(compacted[-1], history[-1])
+        self.assertIsNone(compactor.compact(compacted, "any"))
+        self.assertEqual(compactor.stats()["windowed"], 1)
+
+    def test_summary_replaces_head(self):
+        history = conversation(40)
+        seen = []
+
+        def summarize(head):
+            seen.append(head)
+            return "пользователь спрашивал про x"
+
+        compactor = self.make(budget=3000, summarize=summarize)
+        compacted = compactor.compact(history, "any")
+
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(compacted[0].role, "user")
+        self.assertTrue(compacted[0].parts[0].text.startswith(SUMMARY_PREFIX))
+        self.assertEqual(compacted[1].role, "model")
+        self.assertEqual(compacted[2:], history[len(seen[0]):])
+        self.assertLessEqual(estimator.history(compacted), 1800)
+        self.assertEqual(compactor.stats()["summarized"], 1)
+
+    def test_summary_failure_falls_back_to_window(self):
+        def summarize(head):
+            raise RuntimeError("quota")
+
+        compactor = self.make(budget=3000, summarize=summarize)
+        compacted = compactor.compact(conversation(40), "any")
+
+        self.assertFalse(compacted[0].parts[0].text.startswith(SUMMARY_PREFIX))
+        self.assertEqual(compactor.stats()["summary_failures"], 1)
+        self.assertEqual(compactor.stats()["windowed"], 1)
+
+    def test_background_summary_applied_on_later_turn(self):
+        history = conversation(40)
+        release = threading.Event()
+        seen = []
+
+        def summarize(head):
+            seen.append(head)
+            release.wait(5)
+            return "пользователь спрашивал про x"
+
+        compactor = self.make(budget=3000, summarize=summarize)
+        # Ход пользователя не ждёт суммаризатор
+        self.assertIsNone(compactor.compact(history, "any", key=1))
+        self.assertIsNone(compactor.compact(history, "any", key=1))
+        self.assertEqual(compactor.stats()["summaries_pending"], 1)
+
+        release.set()
+        compactor._jobs[1].future.result(5)
+        history = history + conversation(1)
+        compacted = compactor.compact(history, "any", key=1)
+
+        self.assertEqual(len(seen), 1)
+        self.assertTrue(compacted[0].parts[0].text.startswith(SUMMARY_PREFIX))
+        # Ходы, добавленные, пока писалось содержание, сохранены
+        self.assertEqual(compacted[2:], history[len(seen[0]):])
+        self.assertEqual(compactor.stats()["summaries_pending"], 0)
+
+    def test_known_tokens_skip_estimate(self):
+        compactor = self.make(budget=1000, mode="window")
+        self.assertIsNone(compactor.compact(conversation(20), "any", tokens=10))
+
+    def test_last_exchange_kept_even_over_budget(self):
+        history = conversation(3, size=8000)
+        compacted = self.make(budget=1000, mode="window").compact(history, "any")
+        self.assertEqual(compacted, history[-2:])
+
+    def test_render_transcript_skips_thoughts(self):
+        history = [
+            turn("user", "привет"),
+            genai_types.Content(
+                role="model",
+                parts=[
+                    genai_types.Part(text="думаю", thought=True),
+                    genai_types.Part(text="здравствуйте"),
+                ],
+            ),
+        ]
+        self.assertEqual(
+            render_transcript(history),
+            "Пользователь: привет\n\nАссистент: здравствуйте",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
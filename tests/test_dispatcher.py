@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from dispatcher import AsyncUserDispatcher, UserDispatcher, update_user_key
+
+
+def make_update(update_id, user_id=None, callback=False):
+    event = (
+        SimpleNamespace(from_user=SimpleNamespace(id=user_id))
+        if user_id is not None
+        else None
+    )
+    return SimpleNamespace(
+        update_id=update_id,
+        message=None if callback else event,
+        callback_query=event if callback else None,
+    )
+
+
+class TestUserDispatcher(unittest.TestCase):
+    def test_update_user_key(self):
+        self.assertEqual(update_user_key(make_update(1, 42)), 42)
+        self.assertEqual(update_user_key(make_update(2, 42, callback=True)), 42)
+        self.assertEqual(update_user_key(make_update(3)), ("update", 3))
+
+    def test_same_user_runs_in_order(self):
+        dispatcher = UserDispatcher(max_workers=4)
+        order = []
+        running = []
+
+        def handler(i):
+            running.append(i)
+            self.assertEqual(len(running), 1)
+            time.sleep(0.01)
+            order.append(i)
+            running.remove(i)
+
+        for i in range(10):
+            dispatcher.submit(1, handler, i)
+        dispatcher.shutdown(wait=True)
+
+        self.assertEqual(order, list(range(10)))
+        stats = dispatcher.stats()
+        self.assertEqual(stats["processed"], 10)
+        self.assertEqual(stats["queue_depth"], 0)
+
+    def test_different_users_run_in_parallel(self):
+        dispatcher = UserDispatcher(max_workers=2)
+        barrier = threading.Barrier(2, timeout=2)
+
+        for user_id in (1, 2):
+            dispatcher.submit(user_id, barrier.wait)
+        dispatcher.shutdown(wait=True)
+
+        stats = dispatcher.stats()
+        self.assertEqual(stats["processed"], 2)
+        self.assertEqual(stats["failed"], 0)
+
+    def test_failures_do_not_block_queue(self):
+        dispatcher = UserDispatcher(max_workers=1)
+        done = []
+
+        def boom():
+            raise RuntimeError("boom")
+
+        dispatcher.submit(1, boom)
+        dispatcher.submit(1, done.append, "ok")
+        dispatcher.shutdown(wait=True)
+
+        self.assertEqual(done, ["ok"])
+        self.assertEqual(dispatcher.stats()["failed"], 1)
+
+
+class TestAsyncUserDispatcher(unittest.TestCase):
+    def test_order_and_concurrency_limit(self):
+        async def scenario():
+            dispatcher = AsyncUserDispatcher(max_concurrency=2)
+            order = {1: [], 2: [], 3: []}
+            active = 0
+            peak = 0
+
+            async def handler(user_id, i):
+                nonlocal active, peak
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.005)
+                order[user_id].append(i)
+                active -= 1
+
+            for i in range(5):
+                for user_id in order:
+                    dispatcher.submit(user_id, handler, user_id, i)
+            await dispatcher.join()
+            return dispatcher, order, peak
+
+        dispatcher, order, peak = asyncio.run(scenario())
+        for user_order in order.values():
+            self.assertEqual(user_order, list(range(5)))
+        self.assertEqual(peak, 2)
+        self.assertEqual(dispatcher.stats()["processed"], 15)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+import asyncio
+import datetime
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from fake_gemini import client_error
+from file_uploads import (
+    FileUploadCache,
+    send_with_fresh_files,
+    send_with_fresh_files_async,
+)
+from gemini_helpers import build_context_parts
+
+
+class FakeFiles:
+    """Локальная замена client.files: хранит загрузки в памяти."""
+
+    def __init__(self, ttl=48 * 3600, processing_polls=0, fail=False):
+        self.ttl = ttl
+        self.processing_polls = processing_polls
+        self.fail = fail
+        self.uploaded = []
+        self.get_calls = 0
+        self._pending = {}
+
+    def upload(self, file, config):
+        if self.fail:
+            raise ConnectionError("files endpoint unavailable")
+        data = file.read()
+        name = f"files/{len(self.uploaded)}"
+        self.uploaded.append((name, data, config.mime_type, config.display_name))
+        self._pending[name] = self.processing_polls
+        return self._file(name, config.mime_type)
+
+    def get(self, name):
+        self.get_calls += 1
+        self._pending[name] -= 1
+        return self._file(name, self.uploaded[int(name.split("/")[1])][2])
+
+    def _file(self, name, mime_type):
+        return SimpleNamespace(
+            name=name,
+            uri=f"https://fake.local/{name}",
+            mime_type=mime_type,
+            state="PROCESSING" if self._pending[name] > 0 else "ACTIVE",
+            expiration_time=datetime.datetime.fromtimestamp(
+                Clock.now + self.ttl, datetime.timezone.utc
+            ),
+        )
+
+
+class Clock:
+    now = 1_000_000.0
+
+    def __call__(self):
+        return Clock.now
+
+
+def pdf(data=b"%PDF-1.7 content"):
+    return {
+        "data": data,
+        "mime_type": "application/pdf",
+        "filename": "doc.pdf",
+        "caption": None,
+    }
+
+
+class TestFileUploadCache(unittest.TestCase):
+    def setUp(self):
+        Clock.now = 1_000_000.0
+        self.files = FakeFiles()
+        self.cache = FileUploadCache(self.files, expiry_margin=60, clock=Clock())
+
+    def test_uploads_once_and_returns_uri_part(self):
+        first = self.cache.part_for(pdf())
+        second = self.cache.part_for(pdf())
+
+        self.assertEqual(len(self.files.uploaded), 1)
+        self.assertEqual(first.file_data.file_uri, "https://fake.local/files/0")
+        self.assertEqual(second.file_data.file_uri, first.file_data.file_uri)
+        self.assertEqual(first.file_data.mime_type, "application/pdf")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_keyed_by_content_hash(self):
+        self.cache.part_for(pdf(b"one"))
+        self.cache.part_for({**pdf(b"one"), "filename": "copy.pdf"})
+        self.cache.part_for(pdf(b"two"))
+
+        self.assertEqual(len(self.files.uploaded), 2)
+
+    def test_reuploads_after_expiry(self):
+        self.files.ttl = 3600
+        self.cache.part_for(pdf())
+        Clock.now += 3600 - 30  # внутри запаса expiry_margin
+        part = self.cache.part_for(pdf())
+
+        self.assertEqual(len(self.files.uploaded), 2)
+        self.assertEqual(part.file_data.file_uri, "https://fake.local/files/1")
+        self.assertEqual(self.cache.stats()["reuploads"], 1)
+
+    def test_waits_for_processing(self):
+        self.files.processing_polls = 2
+        cache = FileUploadCache(self.files, clock=Clock())
+        with mock.patch("file_uploads.PROCESSING_POLL_INTERVAL", 0):
+            part = cache.part_for(pdf())
+        self.assertEqual(self.files.get_calls, 2)
+        self.assertIsNotNone(part.file_data)
+
+    def test_small_files_and_failures_stay_inline(self):
+        cache = FileUploadCache(self.files, min_bytes=1024, clock=Clock())
+        self.assertEqual(cache.part_for(pdf()).inline_data.data, pdf()["data"])
+        self.assertEqual(self.files.uploaded, [])
+
+        failing = FileUploadCache(FakeFiles(fail=True), clock=Clock())
+        part = failing.part_for(pdf())
+        self.assertEqual(part.inline_data.data, pdf()["data"])
+        self.assertEqual(failing.stats()["failures"], 1)
+
+    def test_build_context_parts_uses_uploads(self):
+        parts, errors = build_context_parts([pdf()], self.cache)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(parts[0].file_data.file_uri, "https://fake.local/files/0")
+        self.assertEqual(parts[1], "(Файл: doc.pdf)")
+
+    def test_failed_upload_releases_key_lock(self):
+        self.files.fail = True
+        self.cache.part_for(pdf())
+        self.assertEqual(self.cache._key_locks, {})
+
+        self.files.fail = False
+        self.assertIsNotNone(self.cache.part_for(pdf()).file_data)
+        self.assertEqual(len(self.cache._key_locks), 1)
+
+
+class TestSendWithFreshFiles(unittest.TestCase):
+    def setUp(self):
+        Clock.now = 1_000_000.0
+        self.files = FakeFiles()
+        self.cache = FileUploadCache(self.files, clock=Clock())
+        self.parts, _ = build_context_parts([pdf()], self.cache)
+        self.sent = []
+
+    def rebuild(self):
+        return build_context_parts([pdf()], self.cache)[0]
+
+    def send(self, errors):
+        def send():
+            self.sent.append(self.parts[0].file_data.file_uri)
+            if errors:
+                raise errors.pop(0)
+            return "ok"
+
+        return send
+
+    def test_reuploads_and_retries_once_when_file_is_gone(self):
+        result = send_with_fresh_files(
+            self.cache, self.parts, self.rebuild, self.send([client_error(404)])
+        )
+
+        self.assertEqual(result, "ok")
+        self.assertEqual(
+            self.sent,
+            ["https://fake.local/files/0", "https://fake.local/files/1"],
+        )
+        self.assertEqual(self.cache.stats()["invalidated"], 1)
+
+    def test_other_errors_and_second_failure_propagate(self):
+        send = self.send([client_error(400)])
+        with self.assertRaises(Exception):
+            send_with_fresh_files(self.cache, self.parts, self.rebuild, send)
+        self.assertEqual(len(self.sent), 1)
+
+        send = self.send([client_error(404), client_error(404)])
+        with self.assertRaises(Exception):
+            send_with_fresh_files(self.cache, self.parts, self.rebuild, send)
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual(len(self.files.uploaded), 2)
+
+    def test_inline_parts_are_not_retried(self):
+        parts = ["text only"]
+        send = mock.Mock(side_effect=client_error(404))
+        with self.assertRaises(Exception):
+            send_with_fresh_files(self.cache, parts, self.rebuild, send)
+        self.assertEqual(send.call_count, 1)
+
+    def test_async_variant(self):
+        errors = [client_error(403)]
+        send = self.send(errors)
+
+        async def rebuild():
+            return self.rebuild()
+
+        async def send_async():
+            return send()
+
+        result = asyncio.run(
+            send_with_fresh_files_async(
+                self.cache, self.parts, rebuild, send_async
+            )
+        )
+        self.assertEqual(result, "ok")
+        self.assertEqual(len(self.files.uploaded), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
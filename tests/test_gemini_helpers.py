@@ -0,0 +1,182 @@
+import io
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from google.genai import types as genai_types
+from PIL import Image
+
+from gemini_helpers import (
+    build_buffer_parts,
+    build_chat_config,
+    build_context_parts,
+    collect_response_parts,
+    compile_quick_tools,
+    extract_sources_text,
+    photo_part,
+)
+
+
+class TestGeminiHelpers(unittest.TestCase):
+    def test_build_chat_config_search(self):
+        config = build_chat_config("gemini-3.7-flash", search_enabled=True)
+        self.assertEqual(len(config.tools), 2)
+
+        config = build_chat_config("gemini-3.7-flash", search_enabled=False)
+        self.assertEqual(len(config.tools), 1)
+
+        config = build_chat_config("gemini-3.1-flash-image", True)
+        self.assertEqual(config.response_modalities, ["TEXT", "IMAGE"])
+        self.assertIsNone(config.tools)
+
+    def test_build_chat_config_shared(self):
+        self.assertIs(
+            build_chat_config("gemini-3.7-flash", True),
+            build_chat_config("gemini-3.7-flash", True),
+        )
+
+    def test_compile_quick_tools(self):
+        tools = compile_quick_tools(
+            {
+                "translate": {
+                    "system_instruction": "Translate.",
+                    "model": "gemini-3.5-flash-lite",
+                    "thinking_budget": 0,
+                },
+                "draw": {
+                    "system_instruction": "Draw.",
+                    "model": "gemini-3.1-flash-image",
+                },
+            },
+            len,
+        )
+        translate = tools["translate"]
+        self.assertEqual(translate.model, "gemini-3.5-flash-lite")
+        self.assertEqual(translate.config.thinking_config.thinking_budget, 0)
+        self.assertEqual(translate.instruction_tokens, len("Translate."))
+        self.assertEqual(
+            tools["draw"].config.response_modalities, ["TEXT", "IMAGE"]
+        )
+
+    def test_build_buffer_parts_joins_texts(self):
+        items = [
+            {"type": "text", "content": "a"},
+            {"type": "text", "content": "b"},
+            {
+                "type": "document",
+                "mime_type": "text/plain",
+                "data": b"doc",
+                "filename": "f.txt",
+                "caption": "cap",
+            },
+            {"type": "text", "content": "c"},
+        ]
+        parts, errors = build_buffer_parts(items)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(parts[0], "a\n\nb")
+        self.assertEqual(parts[1], "cap")
+        self.assertIsInstance(parts[2], genai_types.Part)
+        self.assertEqual(parts[3], "(Файл: f.txt)")
+        self.assertEqual(parts[4], "c")
+
+    def test_build_buffer_parts_loads_blobs_lazily(self):
+        png = io.BytesIO()
+        Image.new("RGB", (2, 2)).save(png, format="PNG")
+        loads = []
+
+        def loader(data):
+            def load():
+                loads.append(data)
+                return data
+
+            return load
+
+        items = [
+            {"type": "photo", "caption": "", "load": loader(png.getvalue())},
+            {
+                "type": "document",
+                "mime_type": "text/plain",
+                "load": loader(b"doc"),
+                "filename": "f.txt",
+                "caption": None,
+            },
+        ]
+        parts, errors = build_buffer_parts(items)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(loads), 2)
+        # Фото без сохранённого типа: тип по сигнатуре, байты без изменений
+        self.assertEqual(parts[0].inline_data.mime_type, "image/png")
+        self.assertEqual(parts[0].inline_data.data, png.getvalue())
+        self.assertEqual(parts[1].inline_data.data, b"doc")
+
+    def test_photo_part_keeps_original_bytes(self):
+        jpeg = b"\xff\xd8\xff\xe0 not decoded"
+        with mock.patch.object(Image, "open") as image_open:
+            part = photo_part({"data": io.BytesIO(jpeg), "mime_type": "image/jpeg"})
+            parts, _ = build_buffer_parts(
+                [{"type": "photo", "caption": "c", "data": jpeg, "mime_type": None}]
+            )
+
+        image_open.assert_not_called()
+        self.assertEqual(part.inline_data.data, jpeg)
+        self.assertEqual(part.inline_data.mime_type, "image/jpeg")
+        self.assertEqual(parts[0], "c")
+        self.assertEqual(parts[1].inline_data.mime_type, "image/jpeg")
+
+    def test_build_context_parts_reports_errors(self):
+        files = [
+            {
+                "mime_type": "text/plain",
+                "data": 123,
+                "filename": "broken.txt",
+                "caption": "",
+            }
+        ]
+        parts, errors = build_context_parts(files)
+        self.assertEqual(parts, [])
+        self.assertEqual(errors[0][0], "broken.txt")
+
+    def test_extract_sources_text(self):
+        chunk = SimpleNamespace(
+            web=SimpleNamespace(uri="https://a.example", title="A")
+        )
+        response = SimpleNamespace(
+            candidates=[
+                SimpleNamespace(
+                    grounding_metadata=SimpleNamespace(grounding_chunks=[chunk])
+                )
+            ]
+        )
+        self.assertEqual(
+            extract_sources_text(response),
+            "\n\nИсточники:\n1. [A](https://a.example)",
+        )
+        self.assertEqual(
+            extract_sources_text(SimpleNamespace(candidates=[])), ""
+        )
+
+    def test_collect_response_parts(self):
+        response = genai_types.GenerateContentResponse(
+            candidates=[
+                genai_types.Candidate(
+                    content=genai_types.Content(
+                        role="model",
+                        parts=[
+                            genai_types.Part(text="hello"),
+                            genai_types.Part.from_bytes(
+                                data=b"png", mime_type="image/png"
+                            ),
+                        ],
+                    )
+                )
+            ]
+        )
+        text_parts, media = collect_response_parts(response)
+        self.assertEqual(text_parts, ["hello"])
+        self.assertEqual(media, [(b"png", "image/png")])
+
+
+if __name__ == "__main__":
+    unittest.main()
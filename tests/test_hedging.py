@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from fake_gemini import server_error
+from hedging import Hedger, percentile
+from resilience import ResilientGemini
+
+PRO = "gemini-3.1-pro-preview"
+FLASH = "gemini-3.7-flash"
+
+
+def warmed_hedger(seconds=0.02, samples=5, **kwargs):
+    hedger = Hedger({PRO: FLASH}, percentile=95, min_samples=samples, **kwargs)
+    for _ in range(samples):
+        hedger.latency.record(PRO, seconds)
+    return hedger
+
+
+class TestHedger(unittest.TestCase):
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 95), 95)
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile([3], 99), 3)
+
+    def test_no_hedge_until_enough_samples(self):
+        hedger = Hedger({PRO: FLASH}, min_samples=3)
+        calls = []
+        for _ in range(3):
+            hedger.call(PRO, calls.append)
+        self.assertEqual(calls, [PRO] * 3)
+        self.assertIsNotNone(hedger.delay_for(PRO))
+        self.assertIsNone(hedger.delay_for(FLASH))
+
+    def test_slow_primary_is_hedged_and_loses(self):
+        hedger = warmed_hedger()
+        release = threading.Event()
+
+        def request(model):
+            if model == PRO:
+                release.wait(1)
+            return model
+
+        self.assertEqual(hedger.call(PRO, request, tokens=100), FLASH)
+        release.set()
+        stats = hedger.stats()
+        self.assertEqual(stats["hedged"], 1)
+        self.assertEqual(stats["hedge_wins"], 1)
+        self.assertEqual(stats["extra_tokens"], 100)
+
+    def test_fast_primary_is_not_hedged(self):
+        hedger = warmed_hedger(seconds=1)
+        self.assertEqual(hedger.call(PRO, lambda model: model), PRO)
+        self.assertEqual(hedger.stats()["hedged"], 0)
+
+    def test_failed_hedge_waits_for_primary(self):
+        hedger = warmed_hedger(seconds=0.01)
+
+        def request(model):
+            if model == FLASH:
+                raise server_error()
+            time.sleep(0.05)
+            return model
+
+        self.assertEqual(hedger.call(PRO, request), PRO)
+        self.assertEqual(hedger.stats()["hedge_wins"], 0)
+
+    def test_async_loser_is_cancelled(self):
+        hedger = warmed_hedger()
+        cancelled = []
+
+        async def request(model):
+            if model == PRO:
+                try:
+                    await asyncio.sleep(1)
+                except asyncio.CancelledError:
+                    cancelled.append(model)
+                    raise
+            return model
+
+        self.assertEqual(asyncio.run(hedger.call_async(PRO, request)), FLASH)
+        self.assertEqual(cancelled, [PRO])
+        self.assertEqual(hedger.stats()["win_rate"], 1.0)
+
+    def test_queue_wait_does_not_trigger_hedge(self):
+        hedger = warmed_hedger(max_workers=1)
+        busy = hedger._executor.submit(time.sleep, 0.1)
+
+        self.assertEqual(hedger.call(PRO, lambda model: model), PRO)
+        busy.result()
+        self.assertEqual(hedger.stats()["hedged"], 0)
+
+    def test_outcomes_recorded_per_attempt(self):
+        gemini = ResilientGemini(failure_threshold=1)
+        hedger = warmed_hedger(gemini=gemini)
+        release = threading.Event()
+
+        def request(model):
+            if model == PRO:
+                release.wait(1)
+                raise server_error()
+            return model
+
+        self.assertEqual(hedger.call(PRO, request), FLASH)
+        self.assertEqual(gemini.breaker(FLASH).state, "closed")
+        release.set()
+        # Проигравший дорабатывает в фоне, и его сбой засчитывается PRO
+        for _ in range(100):
+            if gemini.breaker(PRO).is_open:
+                break
+            time.sleep(0.01)
+        self.assertTrue(gemini.breaker(PRO).is_open)
+
+    def test_no_hedge_to_open_model(self):
+        gemini = ResilientGemini(failure_threshold=1, reset_timeout=60)
+        gemini.breaker(FLASH).record_failure()
+        hedger = warmed_hedger(seconds=0.01, gemini=gemini)
+
+        def request(model):
+            time.sleep(0.05)
+            return model
+
+        self.assertEqual(hedger.call(PRO, request), PRO)
+        self.assertEqual(hedger.stats()["hedged"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
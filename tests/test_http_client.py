@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from telebot import asyncio_helper
+
+import http_client
+from http_client import DownloadError, FileTooLargeError
+
+PAYLOADS = {
+    "/small": b"s" * 100,
+    "/large": b"L" * 300_000,
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/chunked":
+            # Без Content-Length: лимит проверяется только при чтении
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for _ in range(5):
+                chunk = b"c" * 50_000
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        body = PAYLOADS.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownload(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        patcher = mock.patch.object(http_client, "DOWNLOAD_SPOOL_MB", 0.1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_small_file_stays_in_memory(self):
+        with http_client.download(self.base + "/small", 1000) as f:
+            self.assertEqual(f.read(), PAYLOADS["/small"])
+            self.assertFalse(f._rolled)
+
+    def test_large_file_spools_to_disk(self):
+        with http_client.download(self.base + "/large") as f:
+            self.assertTrue(f._rolled)
+            self.assertEqual(f.read(), PAYLOADS["/large"])
+
+    def test_limit_enforced_by_header_and_while_reading(self):
+        with self.assertRaises(FileTooLargeError):
+            http_client.download(self.base + "/large", 1000)
+        with self.assertRaises(FileTooLargeError):
+            http_client.download(self.base + "/chunked", 100_000)
+        with http_client.download(self.base + "/chunked", 250_000) as f:
+            self.assertEqual(len(f.read()), 250_000)
+
+    def test_http_error(self):
+        with self.assertRaises(DownloadError):
+            http_client.download(self.base + "/missing")
+
+    def test_download_async(self):
+        async def fetch(path, max_bytes):
+            try:
+                url = self.base + path
+                with await http_client.download_async(url, max_bytes) as f:
+                    return f.read()
+            finally:
+                await asyncio_helper.session_manager.session.close()
+
+        self.assertEqual(
+            asyncio.run(fetch("/large", None)), PAYLOADS["/large"]
+        )
+        with self.assertRaises(FileTooLargeError):
+            asyncio.run(fetch("/chunked", 100_000))
+
+    def test_file_url_respects_local_bot_api(self):
+        self.assertEqual(
+            http_client.file_url("1:x", "photos/a.jpg"),
+            "https://api.telegram.org/file/bot1:x/photos/a.jpg",
+        )
+        with mock.patch.object(
+            http_client.apihelper, "FILE_URL", "http://local/file/bot{0}/{1}"
+        ):
+            self.assertEqual(
+                http_client.file_url("1:x", "a.jpg"), "http://local/file/bot1:x/a.jpg"
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import asyncio
+import io
+import unittest
+from types import SimpleNamespace
+
+from PIL import Image
+
+from image_preprocess import ImagePreprocessor, pick_photo_size
+
+
+def make_image(size, mode="RGB", fmt="JPEG", exif=False):
+    image = Image.new(mode, size, (200, 30, 30, 128)[: len(mode)])
+    out = io.BytesIO()
+    kwargs = {}
+    if exif:
+        data = Image.Exif()
+        data[0x0112] = 6  # Orientation: повернуть на 90°
+        kwargs["exif"] = data.tobytes()
+    image.save(out, format=fmt, **kwargs)
+    return out.getvalue()
+
+
+def opened(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+class TestImagePreprocessor(unittest.TestCase):
+    def setUp(self):
+        self.pre = ImagePreprocessor(
+            {"pro": 1000, "lite": 200}, 400, quality=80, workers=0
+        )
+
+    def test_small_image_passes_through_unchanged(self):
+        data = make_image((300, 200))
+        result, mime = self.pre.process(data, "image/jpeg", "flash")
+        self.assertIs(result, data)
+        self.assertEqual(mime, "image/jpeg")
+        self.assertEqual(self.pre.stats()["passed_through"], 1)
+
+    def test_large_image_downscaled_to_model_edge(self):
+        data = make_image((1600, 900))
+        result, mime = self.pre.process(data, "image/jpeg", "lite")
+        self.assertEqual(mime, "image/jpeg")
+        self.assertEqual(max(opened(result).size), 200)
+        result, _ = self.pre.process(data, "image/jpeg", "pro")
+        self.assertEqual(max(opened(result).size), 1000)
+        self.assertGreater(self.pre.stats()["bytes_saved"], 0)
+
+    def test_exif_applied_and_stripped(self):
+        data = make_image((300, 200), exif=True)
+        result, _ = self.pre.process(data, "image/jpeg", "flash")
+        image = opened(result)
+        self.assertEqual(image.size, (200, 300))
+        self.assertNotIn("exif", image.info)
+
+    def test_transparency_kept_as_png(self):
+        data = make_image((800, 800), mode="RGBA", fmt="PNG")
+        result, mime = self.pre.process(data, "image/png", "flash")
+        self.assertEqual(mime, "image/png")
+        self.assertEqual(opened(result).mode, "RGBA")
+
+    def test_cache_by_key_and_edge(self):
+        data = make_image((1600, 900))
+        first = self.pre.process(data, "image/jpeg", "flash", key="u1")
+        second = self.pre.process(data, "image/jpeg", "flash", key="u1")
+        self.assertIs(first, second)
+        self.pre.process(data, "image/jpeg", "lite", key="u1")
+        stats = self.pre.stats()
+        self.assertEqual((stats["cache_hits"], stats["transformed"]), (1, 2))
+
+    def test_cache_bounded_by_bytes(self):
+        self.pre.cache_bytes = 1
+        data = make_image((1600, 900))
+        self.pre.process(data, "image/jpeg", "flash", key="a")
+        self.pre.process(data, "image/jpeg", "flash", key="b")
+        self.assertEqual(self.pre.stats()["cached"], 1)
+
+    def test_buffer_items(self):
+        large = make_image((1600, 900))
+        small = make_image((100, 100))
+        items = [
+            {"type": "text", "content": "привет"},
+            {"type": "photo", "blob_hash": "big", "load": lambda: large},
+            {"type": "photo", "blob_hash": "small", "data": io.BytesIO(small)},
+        ]
+        result = self.pre.buffer_items(items, "flash")
+        self.assertIs(result[0], items[0])
+        self.assertEqual(result[1]["blob_hash"], "big@400")
+        self.assertNotIn("load", result[1])
+        self.assertEqual(result[1]["size"], len(result[1]["data"]))
+        self.assertEqual(max(opened(result[1]["data"]).size), 400)
+        self.assertEqual(result[2]["blob_hash"], "small")
+        self.assertEqual(result[2]["data"], small)
+
+    def test_async_matches_sync(self):
+        data = make_image((1600, 900))
+        result, _ = asyncio.run(self.pre.process_async(data, "image/jpeg", "lite"))
+        self.assertEqual(max(opened(result).size), 200)
+
+    def test_process_pool(self):
+        pre = ImagePreprocessor({}, 300, workers=2)
+        self.addCleanup(pre.shutdown)
+        images = [(make_image((900, 600)), "image/jpeg", None) for _ in range(3)]
+        results = pre.process_many(images, "flash")
+        self.assertEqual([max(opened(r).size) for r, _ in results], [300] * 3)
+        # Пул не наследует потоки и блокировки бота через fork
+        self.assertEqual(pre._pool._mp_context.get_start_method(), "spawn")
+
+
+class TestPickPhotoSize(unittest.TestCase):
+    def test_smallest_sufficient_size(self):
+        sizes = [
+            SimpleNamespace(width=90, height=60),
+            SimpleNamespace(width=800, height=533),
+            SimpleNamespace(width=1280, height=853),
+            SimpleNamespace(width=2560, height=1706),
+        ]
+        self.assertIs(pick_photo_size(sizes, 1000), sizes[2])
+        self.assertIs(pick_photo_size(sizes, 800), sizes[1])
+        self.assertIs(pick_photo_size(sizes, 4000), sizes[3])
+
+
+if __name__ == "__main__":
+    unittest.main()
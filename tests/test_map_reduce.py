@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from map_reduce import MapReduce
+
+LIST_TOOL = {
+    "system_instruction": "Make a list.",
+    "model": "gemini-3.1-pro-preview",
+    "map_reduce": "merge",
+}
+
+
+def long_text(paragraphs=6, words=40):
+    return "\n\n".join(
+        f"Paragraph {i}: " + "word " * words for i in range(paragraphs)
+    )
+
+
+class TestMapReduce(unittest.TestCase):
+    def setUp(self):
+        # Каждый абзац (~215 символов) — отдельный кусок
+        self.engine = MapReduce(250, "cheap-model", concurrency=8)
+
+    def test_merge_maps_chunks_on_cheap_model_then_reduces(self):
+        calls = []
+        lock = threading.Lock()
+
+        def call(config, text):
+            with lock:
+                calls.append((config, text))
+            return f"<{config['model']}:{text[:11]}>"
+
+        progress = []
+        result = self.engine.run(
+            LIST_TOOL, long_text(), call, lambda done, total: progress.append(total)
+        )
+        maps = [c for c in calls if c[0]["model"] == "cheap-model"]
+        reduces = [c for c in calls if c[0]["model"] == LIST_TOOL["model"]]
+        self.assertEqual(len(maps), 6)
+        self.assertTrue(all(text.startswith("Paragraph") for _, text in maps))
+        self.assertTrue(all(c["thinking_budget"] == 0 for c, _ in maps))
+        self.assertTrue(
+            any("part 1 of 6" in c["system_instruction"] for c, _ in maps)
+        )
+        self.assertEqual(len(reduces), 1)
+        reduce_config, reduce_text = reduces[0]
+        self.assertIn("Make a list.", reduce_config["system_instruction"])
+        self.assertLess(
+            reduce_text.index("Part 1 of 6"), reduce_text.index("Part 6 of 6")
+        )
+        self.assertTrue(result.startswith("<gemini-3.1-pro-preview:"))
+        self.assertEqual(progress, [7] * 7)
+
+    def test_concat_keeps_order_without_reduce(self):
+        tool = {**LIST_TOOL, "map_reduce": "concat"}
+        result = self.engine.run(tool, long_text(), lambda config, text: text[:11])
+        self.assertEqual(
+            result, "\n\n".join(f"Paragraph {i}" for i in range(6))
+        )
+
+    def test_chunks_run_in_parallel(self):
+        def call(config, text):
+            time.sleep(0.1)
+            return "ok"
+
+        start = time.perf_counter()
+        self.engine.run(LIST_TOOL, long_text(paragraphs=8), call)
+        # 8 кусков параллельно + reduce, а не 9 запросов подряд
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_chunk_error_aborts(self):
+        def call(config, text):
+            if "Paragraph 3" in text:
+                raise RuntimeError("boom")
+            return "ok"
+
+        with self.assertRaises(RuntimeError):
+            self.engine.run(LIST_TOOL, long_text(), call)
+
+    def test_run_async(self):
+        async def call(config, text):
+            await asyncio.sleep(0.01)
+            return text[:11] if config["model"] == "cheap-model" else text
+
+        progress = []
+
+        async def on_progress(done, total):
+            progress.append((done, total))
+
+        result = asyncio.run(
+            self.engine.run_async(LIST_TOOL, long_text(3), call, on_progress)
+        )
+        self.assertIn("--- Part 3 of 3 ---\nParagraph 2", result)
+        self.assertEqual(progress[-1], (4, 4))
+
+    def test_enabled_for(self):
+        self.assertTrue(MapReduce.enabled_for(LIST_TOOL))
+        self.assertFalse(MapReduce.enabled_for({"system_instruction": "x"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
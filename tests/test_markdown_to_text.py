@@ -0,0 +1,84 @@
+import os
+import unittest
+
+from markdown_reference import legacy_markdown_to_text, visible_lines
+from utils import markdown_to_text
+
+CORPUS = os.path.join(os.path.dirname(__file__), "fixtures", "markdown_to_text")
+
+# Здесь прежний конвертер ошибался: без расширения fenced_code блок ```
+# становился строчным кодом — язык попадал в текст, а пустая строка внутри
+# блока разрывала его и съедала отступы.
+LEGACY_DIFFERENCES = {"code_blocks.md"}
+
+SNIPPETS = [
+    "Intro:\n- a\n- b",
+    "Text\n===\n\nSub\n---\n\npara\n\n---\n\n***\n\nafter",
+    "> quote **b**\n> more\n\nnormal",
+    "```\nprint('x')\nx = 1\n```\n\ndone",
+    "[link](http://x.com/a_(b)) ![img](x.png) <http://auto.com> a < b & c",
+    "snake_case_name and __dunder__ and _em_ and ***both***",
+    "Escapes \\*not em\\* and \\_ and \\\\ and \\q",
+    "Line 1  \nLine 2<br>Line 3",
+    "    indented code\n    more\n\npara",
+    "[ref link][r1] and [r1] and [missing]\n\n[r1]: http://example.com",
+    "* one\ncontinued lazily\n* two\n\n    para in item\n\n* three",
+    "List<String> and <b>html</b> and <!-- comment -->",
+    "2 * 3 * 4, 5*3=15, *a *, **a** and **b**, **a *b***",
+    "`a` and ``b`c`` and \\`not code`",
+    "<div>\nblock html\n</div>\n\nafter",
+    "1. Step one\n   continued\n2. Step two",
+]
+
+
+def corpus():
+    for name in sorted(os.listdir(CORPUS)):
+        if name.endswith(".md"):
+            with open(os.path.join(CORPUS, name), encoding="utf-8") as f:
+                source = f.read()
+            with open(os.path.join(CORPUS, name[:-3] + ".txt"), encoding="utf-8") as f:
+                expected = f.read()
+            yield name, source, expected
+
+
+class TestGolden(unittest.TestCase):
+    def test_corpus_matches_expected_output(self):
+        for name, source, expected in corpus():
+            with self.subTest(name):
+                self.assertEqual(markdown_to_text(source) + "\n", expected)
+
+    def test_corpus_matches_legacy_text(self):
+        for name, source, _ in corpus():
+            if name in LEGACY_DIFFERENCES:
+                continue
+            with self.subTest(name):
+                self.assertEqual(
+                    visible_lines(markdown_to_text(source)),
+                    visible_lines(legacy_markdown_to_text(source)),
+                )
+
+    def test_snippets_match_legacy_text(self):
+        for source in SNIPPETS:
+            with self.subTest(source):
+                self.assertEqual(
+                    visible_lines(markdown_to_text(source)),
+                    visible_lines(legacy_markdown_to_text(source)),
+                )
+
+
+class TestBlocks(unittest.TestCase):
+    def test_fenced_code_is_verbatim(self):
+        text = markdown_to_text("```python\ndef f():\n    x = 1\n\n    return x\n```")
+        self.assertEqual(text, "def f():\n    x = 1\n\n    return x")
+
+    def test_nested_lists_are_indented(self):
+        text = markdown_to_text("- a\n    - b\n        - c\n- d")
+        self.assertEqual(text, "a\n  b\n    c\nd")
+
+    def test_single_blank_line_between_blocks(self):
+        text = markdown_to_text("# H\n\n\n\npara\n\n- a\n\n- b\n\n---\n\nend")
+        self.assertEqual(text, "H\n\npara\n\na\n\nb\n\nend")
+
+
+if __name__ == "__main__":
+    unittest.main()
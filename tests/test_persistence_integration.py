@@ -1,10 +1,25 @@
 import unittest
 import json
 import base64
-from sqlalchemy import create_engine
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock
+from google.genai import types as genai_types
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-from database import crud
+import bot_common
+import persistence
+from compaction import HistoryCompactor
+from database import blob_store, crud, user_cache
 from database.db import Base
+from database.migrations import (
+    migrate_blobs_to_store,
+    migrate_chat_sessions_to_turns,
+)
+from database.models import Blob, FileContext
+from token_estimator import estimator
 from utils import BytesEncoder
 from constants import DEFAULT_MODEL
 
@@ -23,10 +38,16 @@ class TestPersistenceIntegration(unittest.TestCase):
         Base.metadata.create_all(bind=engine)
         self.db = TestingSessionLocal()
         self.user_id = 12345
+        user_cache.clear()
+        self.blob_root = blob_store.store.root
+        self.blob_dir = tempfile.mkdtemp()
+        blob_store.configure(self.blob_dir)
 
     def tearDown(self):
         self.db.close()
         Base.metadata.drop_all(bind=engine)
+        blob_store.configure(self.blob_root)
+        shutil.rmtree(self.blob_dir)
 
     def test_user_persistence(self):
         # Create
@@ -42,6 +63,75 @@ class TestPersistenceIntegration(unittest.TestCase):
         fresh = crud.get_user(self.db, self.user_id)
         self.assertEqual(fresh.current_model, "gemini-pro")
 
+    def test_user_settings_cache_write_through(self):
+        crud.get_or_create_user(self.db, self.user_id)
+        self.assertEqual(user_cache.get(self.user_id).current_model, DEFAULT_MODEL)
+
+        crud.update_user_model(self.db, self.user_id, "gemini-pro")
+        crud.update_user_send_mode(self.db, self.user_id, "manual")
+        crud.update_user_search_enabled(self.db, self.user_id, False)
+        self.assertEqual(
+            user_cache.get(self.user_id),
+            user_cache.UserSettings("gemini-pro", "manual", False),
+        )
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            crud.ensure_user(self.db, self.user_id)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        self.assertEqual(statements, [])
+
+    def test_unit_of_work_commits_once(self):
+        crud.add_file_context(
+            self.db, self.user_id, "a.txt", "text/plain", b"context"
+        )
+        blob_path = blob_store.store.path(
+            crud.get_file_contexts(self.db, self.user_id)[0].blob_hash
+        )
+        user_cache.clear()
+        commits = []
+
+        def record(conn):
+            commits.append(conn)
+
+        event.listen(engine, "commit", record)
+        try:
+            with crud.unit_of_work(TestingSessionLocal) as session:
+                crud.update_user_model(session, self.user_id, "gemini-pro")
+                crud.clear_chat_session(session, self.user_id)
+                crud.clear_file_contexts(session, self.user_id)
+                crud.clear_buffer(session, self.user_id)
+                # Файл и кэш меняются только после фиксации
+                self.assertTrue(os.path.exists(blob_path))
+                self.assertIsNone(user_cache.get(self.user_id))
+        finally:
+            event.remove(engine, "commit", record)
+
+        self.assertEqual(len(commits), 1)
+        self.assertFalse(os.path.exists(blob_path))
+        self.assertEqual(user_cache.get(self.user_id).current_model, "gemini-pro")
+
+    def test_unit_of_work_rolls_back(self):
+        crud.get_or_create_user(self.db, self.user_id)
+        user_cache.clear()
+
+        with self.assertRaises(RuntimeError):
+            with crud.unit_of_work(TestingSessionLocal) as session:
+                crud.update_user_model(session, self.user_id, "gemini-pro")
+                raise RuntimeError("handler failed")
+
+        self.assertIsNone(user_cache.get(self.user_id))
+        self.db.expire_all()
+        self.assertEqual(
+            crud.get_user(self.db, self.user_id).current_model, DEFAULT_MODEL
+        )
+
     def test_chat_history_serialization(self):
         # Simulate history data (list of dicts as if coming from model_dump)
         history_data = [
@@ -78,6 +168,148 @@ class TestPersistenceIntegration(unittest.TestCase):
             base64.b64encode(b"fakebytes").decode("utf-8"),
         )
 
+    def test_chat_turns_append_and_replace(self):
+        crud.append_chat_turns(
+            self.db, self.user_id, 0, [("user", "{}"), ("model", "{}")]
+        )
+        crud.append_chat_turns(self.db, self.user_id, 2, [("user", "{}")])
+        turns = crud.get_chat_turns(self.db, self.user_id)
+        self.assertEqual([t.position for t in turns], [0, 1, 2])
+        self.assertEqual(crud.count_chat_turns(self.db, self.user_id), 3)
+
+        crud.replace_chat_turns(self.db, self.user_id, [("user", "{}")])
+        self.assertEqual(crud.count_chat_turns(self.db, self.user_id), 1)
+
+        crud.clear_chat_session(self.db, self.user_id)
+        self.assertEqual(crud.count_chat_turns(self.db, self.user_id), 0)
+
+    def test_history_round_trip_appends_only_new_turns(self):
+        history = [
+            genai_types.Content(
+                role="user", parts=[genai_types.Part(text="hello")]
+            ),
+            genai_types.Content(
+                role="model",
+                parts=[
+                    genai_types.Part.from_bytes(
+                        data=b"fakebytes", mime_type="image/png"
+                    )
+                ],
+            ),
+        ]
+        chat = mock.Mock(get_history=lambda: history)
+
+        with mock.patch.object(persistence, "SessionLocal", TestingSessionLocal):
+            persistence._write_history(self.user_id, chat)
+            first_ids = [t.id for t in crud.get_chat_turns(self.db, self.user_id)]
+            history.append(
+                genai_types.Content(
+                    role="user", parts=[genai_types.Part(text="again")]
+                )
+            )
+            persistence._write_history(self.user_id, chat)
+
+        turns = crud.get_chat_turns(self.db, self.user_id)
+        self.assertEqual([t.id for t in turns][:2], first_ids)
+        loaded = persistence.deserialize_history(t.content_json for t in turns)
+        self.assertEqual([c.role for c in loaded], ["user", "model", "user"])
+        self.assertEqual(loaded[1].parts[0].inline_data.data, b"fakebytes")
+        self.assertEqual(loaded[2].parts[0].text, "again")
+
+    def test_compacted_history_replaces_stored_turns(self):
+        long_text = "x" * 4000
+        contents = [
+            genai_types.Content(
+                role=role, parts=[genai_types.Part(text=f"{i} {long_text}")]
+            )
+            for i, role in enumerate(["user", "model"] * 5)
+        ]
+        stored = [(c.role, persistence.serialize_content(c)) for c in contents]
+        crud.append_chat_turns(self.db, self.user_id, 0, stored)
+        compactor = HistoryCompactor({}, 3000, mode="window")
+        chats = mock.Mock()
+
+        with mock.patch.object(persistence, "SessionLocal", TestingSessionLocal):
+            persistence.user_chats.pop(self.user_id)
+            persistence.get_active_chat(self.user_id, "m", chats, compactor)
+            persistence.user_chats.pop(self.user_id)
+
+        history = chats.create.call_args.kwargs["history"]
+        self.assertEqual(len(history), 2)
+        self.assertTrue(history[0].parts[0].text.startswith("8 "))
+        turns = crud.get_chat_turns(self.db, self.user_id)
+        self.assertEqual(
+            [t.content_json for t in turns], [c for _, c in stored[-2:]]
+        )
+
+    def test_default_compaction_bounds_history(self):
+        # Сжатие включено по умолчанию: история не растёт без предела
+        compactor = bot_common.Services(mock.Mock()).compactor
+        self.assertIsNotNone(compactor)
+        budget = compactor.budget_for(DEFAULT_MODEL)
+        contents = [
+            genai_types.Content(
+                role=role, parts=[genai_types.Part(text=f"{i} " + "x" * 8000)]
+            )
+            for i, role in enumerate(["user", "model"] * 20)
+        ]
+        self.assertGreater(estimator.history(contents), budget)
+        stored = [(c.role, persistence.serialize_content(c)) for c in contents]
+        crud.append_chat_turns(self.db, self.user_id, 0, stored)
+        chats = mock.Mock()
+
+        with mock.patch.object(persistence, "SessionLocal", TestingSessionLocal):
+            persistence.user_chats.pop(self.user_id)
+            persistence.get_active_chat(self.user_id, DEFAULT_MODEL, chats, compactor)
+            persistence.user_chats.pop(self.user_id)
+
+        history = chats.create.call_args.kwargs["history"]
+        self.assertLess(len(history), len(contents))
+        self.assertLessEqual(estimator.history(history), budget)
+        self.assertEqual(history[-1], contents[-1])
+
+    def test_fallback_chat_save_drops_stale_cache_entry(self):
+        turn = genai_types.Content(
+            role="user", parts=[genai_types.Part(text="hi")]
+        )
+        cached = mock.Mock(get_history=lambda: [])
+        fallback = mock.Mock(get_history=lambda: [turn])
+
+        with mock.patch.object(persistence, "SessionLocal", TestingSessionLocal):
+            persistence.user_chats.put(self.user_id, cached)
+            persistence.save_active_chat(self.user_id, fallback)
+
+        self.assertIsNone(persistence.user_chats.peek(self.user_id))
+        self.assertEqual(crud.count_chat_turns(self.db, self.user_id), 1)
+
+    def test_migrate_chat_sessions_to_turns(self):
+        history_data = [
+            {"role": "user", "parts": [{"text": "hello"}]},
+            {
+                "role": "model",
+                "parts": [
+                    {
+                        "inline_data": {
+                            "mime_type": "image/png",
+                            "data": b"fakebytes",
+                        }
+                    }
+                ],
+            },
+        ]
+        crud.save_chat_session(
+            self.db, self.user_id, json.dumps(history_data, cls=BytesEncoder)
+        )
+
+        self.assertEqual(migrate_chat_sessions_to_turns(self.db), 1)
+        self.assertEqual(migrate_chat_sessions_to_turns(self.db), 0)
+        self.assertIsNone(crud.get_chat_session(self.db, self.user_id))
+
+        turns = crud.get_chat_turns(self.db, self.user_id)
+        loaded = persistence.deserialize_history(t.content_json for t in turns)
+        self.assertEqual(loaded[0].parts[0].text, "hello")
+        self.assertEqual(loaded[1].parts[0].inline_data.data, b"fakebytes")
+
     def test_file_context_persistence(self):
         filename = "test.txt"
         data = b"some content"
@@ -112,6 +344,185 @@ class TestPersistenceIntegration(unittest.TestCase):
         buffer = crud.get_buffer(self.db, self.user_id)
         self.assertEqual(len(buffer), 0)
 
+    def test_buffered_photo_keeps_bytes_and_mime_type(self):
+        jpeg = b"\xff\xd8\xff\xe0 original jpeg"
+        with mock.patch.object(persistence, "SessionLocal", TestingSessionLocal):
+            persistence.add_to_message_buffer(
+                self.user_id,
+                {
+                    "type": "photo",
+                    "data": io.BytesIO(jpeg),
+                    "mime_type": "image/jpeg",
+                    "caption": "cap",
+                },
+            )
+            [photo] = persistence.get_message_buffer_list(self.user_id)
+
+        self.assertEqual(photo["mime_type"], "image/jpeg")
+        self.assertEqual(photo["caption"], "cap")
+        self.assertEqual(photo["load"](), jpeg)
+
+    def test_blob_dedup_and_refcount(self):
+        data = b"%PDF same document"
+        ctx = crud.add_file_context(
+            self.db, self.user_id, "a.pdf", "application/pdf", data
+        )
+        crud.add_to_buffer(
+            self.db,
+            self.user_id,
+            "document",
+            blob_data=data,
+            filename="a.pdf",
+            mime_type="application/pdf",
+        )
+
+        blob = self.db.get(Blob, ctx.blob_hash)
+        self.assertEqual(blob.refcount, 2)
+        self.assertEqual(blob.size, len(data))
+        path = blob_store.store.path(ctx.blob_hash)
+        self.assertTrue(os.path.exists(path))
+
+        crud.clear_file_contexts(self.db, self.user_id)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(crud.get_buffer(self.db, self.user_id)[0].blob_data, data)
+
+        crud.clear_buffer(self.db, self.user_id)
+        self.assertFalse(os.path.exists(path))
+        self.assertIsNone(self.db.get(Blob, ctx.blob_hash))
+
+    def test_blob_from_spooled_file(self):
+        data = b"%PDF spooled" * 10000
+        with tempfile.SpooledTemporaryFile(max_size=1024) as f:
+            f.write(data)
+            ctx = crud.add_file_context(
+                self.db, self.user_id, "a.pdf", "application/pdf", f
+            )
+            item = crud.add_to_buffer(
+                self.db, self.user_id, "document", blob_data=f
+            )
+
+        self.assertEqual(item.blob_hash, ctx.blob_hash)
+        blob = self.db.get(Blob, ctx.blob_hash)
+        self.assertEqual((blob.size, blob.refcount), (len(data), 2))
+        self.assertEqual(blob_store.store.read(ctx.blob_hash), data)
+        self.assertEqual(
+            [name for name in os.listdir(self.blob_dir) if name.endswith(".tmp")],
+            [],
+        )
+
+    def test_blob_is_staged_outside_lock(self):
+        events = []
+        lock = blob_store.lock
+        stage = blob_store.store.stage
+
+        class RecordingLock:
+            def acquire(self):
+                events.append("lock")
+                lock.acquire()
+
+            def release(self):
+                events.append("unlock")
+                lock.release()
+
+            __enter__ = acquire
+
+            def __exit__(self, *exc):
+                self.release()
+
+        def recording_stage(data):
+            events.append("stage")
+            return stage(data)
+
+        with mock.patch.object(blob_store, "lock", RecordingLock()), mock.patch.object(
+            blob_store.store, "stage", side_effect=recording_stage
+        ):
+            crud.add_file_context(
+                self.db, self.user_id, "a.pdf", "application/pdf", b"%PDF"
+            )
+        self.assertEqual(events, ["stage", "lock", "unlock"])
+
+    def test_rolled_back_upload_leaves_no_blob(self):
+        with self.assertRaises(RuntimeError):
+            with crud.unit_of_work(TestingSessionLocal) as session:
+                ctx = crud.add_file_context(
+                    session, self.user_id, "a.pdf", "application/pdf", b"%PDF"
+                )
+                path = blob_store.store.path(ctx.blob_hash)
+                self.assertTrue(os.path.exists(path))
+                raise RuntimeError("commit failed")
+
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(crud.get_file_contexts(self.db, self.user_id), [])
+
+    def test_sweep_removes_orphaned_blobs(self):
+        ctx = crud.add_file_context(
+            self.db, self.user_id, "a.pdf", "application/pdf", b"kept"
+        )
+        orphan = blob_store.store.write(b"orphan")
+        stray = os.path.join(self.blob_dir, "upload" + blob_store.TMP_SUFFIX)
+        with open(stray, "wb") as f:
+            f.write(b"partial")
+
+        self.assertEqual(crud.sweep_blobs(self.db), 0)
+        self.assertEqual(crud.sweep_blobs(self.db, min_age=0), 2)
+        self.assertTrue(os.path.exists(blob_store.store.path(ctx.blob_hash)))
+        self.assertFalse(os.path.exists(blob_store.store.path(orphan)))
+        self.assertFalse(os.path.exists(stray))
+
+    def test_migrate_blobs_to_store(self):
+        crud.get_or_create_user(self.db, self.user_id)
+        self.db.add(
+            FileContext(
+                user_id=self.user_id,
+                filename="old.txt",
+                mime_type="text/plain",
+                legacy_data=b"legacy bytes",
+            )
+        )
+        self.db.commit()
+
+        self.assertEqual(migrate_blobs_to_store(self.db), 1)
+        self.assertEqual(migrate_blobs_to_store(self.db), 0)
+
+        ctx = crud.get_file_contexts(self.db, self.user_id)[0]
+        self.assertIsNotNone(ctx.blob_hash)
+        self.assertIsNone(ctx.legacy_data)
+        self.assertEqual(ctx.data, b"legacy bytes")
+
+    def test_metadata_queries_do_not_read_blobs(self):
+        pdf = b"%PDF " * 1000
+        crud.add_file_context(
+            self.db, self.user_id, "a.pdf", "application/pdf", pdf
+        )
+        crud.add_to_buffer(self.db, self.user_id, "photo", blob_data=b"jpeg")
+        crud.add_to_buffer(self.db, self.user_id, "text", content="hi")
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            with mock.patch.object(
+                blob_store.store, "read", side_effect=AssertionError("read")
+            ), mock.patch.object(persistence, "SessionLocal", TestingSessionLocal):
+                self.assertEqual(crud.count_buffer(self.db, self.user_id), 2)
+                self.assertEqual(
+                    crud.count_file_contexts(self.db, self.user_id), 1
+                )
+                files = persistence.get_file_context_list(self.user_id)
+                buffer = persistence.get_message_buffer_list(self.user_id)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+        for statement in statements:
+            self.assertNotIn("data", statement)
+        self.assertEqual(files[0]["size"], len(pdf))
+        self.assertEqual(files[0]["load"](), pdf)
+        self.assertEqual(buffer[0]["load"](), b"jpeg")
+        self.assertEqual(buffer[1], {"type": "text", "content": "hi"})
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+import unittest
+
+import quick_batch
+from quick_batch import Batch, split_input
+
+LINES = {"batch": "line"}
+PARAGRAPHS = {"batch": "paragraph"}
+
+
+class TestSplit(unittest.TestCase):
+    def test_lines_keep_blank_separators(self):
+        batch = Batch("one\n\ntwo\n  three  ", "line")
+        self.assertEqual(batch.items, ["one", "two", "three"])
+        self.assertEqual(batch.assemble(["1", "2", "3"]), "1\n\n2\n3")
+
+    def test_paragraphs(self):
+        batch = Batch("first line\nsecond line\n \nnext\n\n\nlast", "paragraph")
+        self.assertEqual(batch.items, ["first line\nsecond line", "next", "last"])
+        self.assertEqual(batch.assemble(["A", "B", "C"]), "A\n\nB\n\nC")
+
+    def test_split_input_thresholds(self):
+        self.assertIsNone(split_input({}, "a\nb\nc", 2, 100))
+        self.assertIsNone(split_input(LINES, "a\nb", 3, 100))
+        self.assertIsNone(split_input(LINES, "x" * 200, 3, 100))
+        self.assertEqual(split_input(LINES, "a\nb\nc", 3, 100).items, ["a", "b", "c"])
+        long_text = "x" * 80 + "\n\n" + "y" * 80
+        self.assertEqual(len(split_input(PARAGRAPHS, long_text, 10, 100).items), 2)
+
+
+class TestRun(unittest.TestCase):
+    def test_order_concurrency_and_errors(self):
+        active = 0
+        peak = 0
+        lock = threading.Lock()
+        progress = []
+
+        def fn(item):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.01 * (item % 3))
+            with lock:
+                active -= 1
+            if item == 4:
+                raise RuntimeError("boom")
+            return str(item * 10)
+
+        results = quick_batch.run(
+            list(range(8)), fn, 3, lambda done, total: progress.append((done, total))
+        )
+        self.assertEqual(results[:4], ["0", "10", "20", "30"])
+        self.assertIsInstance(results[4], RuntimeError)
+        self.assertLessEqual(peak, 3)
+        self.assertEqual(progress[-1], (8, 8))
+        self.assertEqual(len(progress), 8)
+
+    def test_run_async(self):
+        active = 0
+        peak = 0
+        progress = []
+
+        async def fn(item):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01 * (3 - ord(item) % 3))
+            active -= 1
+            return item.upper()
+
+        async def on_progress(done, total):
+            progress.append(done)
+
+        items = list("abcdefg")
+        results = asyncio.run(quick_batch.run_async(items, fn, 2, on_progress))
+        self.assertEqual(results, list("ABCDEFG"))
+        self.assertEqual(peak, 2)
+        self.assertEqual(progress, list(range(1, 8)))
+
+    def test_merge_results_marks_failures(self):
+        batch = Batch("раз\nдва\nтри", "line")
+        text, failed = quick_batch.merge_results(
+            batch, ["one ", RuntimeError("x"), ""]
+        )
+        self.assertEqual(text, "one\n⚠️ два\n⚠️ три")
+        self.assertEqual(failed, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
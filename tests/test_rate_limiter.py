@@ -0,0 +1,199 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from telebot import apihelper, asyncio_helper
+
+import rate_limiter
+from rate_limiter import LOW, NORMAL, OutboundLimiter, classify
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+FLOOD = {
+    "ok": False,
+    "error_code": 429,
+    "description": "Too Many Requests: retry after 0.05",
+    "parameters": {"retry_after": 0.05},
+}
+
+
+class TestOutboundLimiter(unittest.TestCase):
+    def test_classify(self):
+        self.assertEqual(classify("sendMessage"), (NORMAL, True))
+        self.assertEqual(classify("editMessageText"), (NORMAL, True))
+        self.assertEqual(classify("deleteMessage"), (LOW, False))
+        self.assertEqual(classify("sendChatAction"), (LOW, False))
+        self.assertIsNone(classify("getUpdates"))
+
+    def test_chat_burst_then_rate(self):
+        clock = Clock()
+        limiter = OutboundLimiter(chat_rate=1, chat_burst=2, clock=clock)
+        waiters = [limiter._enqueue(1, NORMAL, True) for _ in range(3)]
+
+        self.assertEqual(limiter._poll(waiters[0]), 0)
+        self.assertEqual(limiter._poll(waiters[1]), 0)
+        self.assertAlmostEqual(limiter._poll(waiters[2]), 1.0)
+        # Другой чат не ждёт
+        other = limiter._enqueue(2, NORMAL, True)
+        self.assertEqual(limiter._poll(other), 0)
+
+        clock.now = 1.0
+        self.assertEqual(limiter._poll(waiters[2]), 0)
+
+    def test_order_within_chat(self):
+        limiter = OutboundLimiter(chat_burst=5, clock=Clock())
+        first = limiter._enqueue(1, NORMAL, True)
+        second = limiter._enqueue(1, NORMAL, True)
+
+        self.assertGreater(limiter._poll(second), 0)
+        self.assertEqual(limiter._poll(first), 0)
+        self.assertEqual(limiter._poll(second), 0)
+
+    def test_low_priority_yields_to_replies(self):
+        clock = Clock()
+        limiter = OutboundLimiter(global_rate=1, clock=clock)
+        limiter._global.tokens = 0
+        delete = limiter._enqueue(1, LOW, False)
+        reply = limiter._enqueue(2, NORMAL, True)
+
+        clock.now = 1.0
+        self.assertGreater(limiter._poll(delete), 0)
+        self.assertEqual(limiter._poll(reply), 0)
+        clock.now = 2.0
+        self.assertEqual(limiter._poll(delete), 0)
+
+    def test_cancelled_head_releases_next_in_chat(self):
+        limiter = OutboundLimiter(chat_burst=5, clock=Clock())
+        first = limiter._enqueue(1, NORMAL, True)
+        second = limiter._enqueue(1, NORMAL, True)
+
+        self.assertGreater(limiter._poll(second), 0)
+        limiter._cancel(first)
+        self.assertEqual(limiter._poll(second), 0)
+        self.assertEqual(limiter.stats()["queued"], 0)
+        self.assertEqual(limiter._queues, {})
+
+    def test_penalize_after_ready_delays_head(self):
+        clock = Clock()
+        limiter = OutboundLimiter(clock=clock)
+        waiter = limiter._enqueue(1, NORMAL, True)
+        limiter.penalize(1, 2)
+
+        self.assertAlmostEqual(limiter._poll(waiter), 2)
+        clock.now = 2.0
+        self.assertEqual(limiter._poll(waiter), 0)
+
+    def test_penalize_blocks_chat(self):
+        clock = Clock()
+        limiter = OutboundLimiter(clock=clock)
+        limiter.penalize(1, 5)
+        waiter = limiter._enqueue(1, NORMAL, True)
+
+        self.assertAlmostEqual(limiter._poll(waiter), 5)
+        clock.now = 5.0
+        self.assertEqual(limiter._poll(waiter), 0)
+        self.assertEqual(limiter.stats()["throttled_429"], 1)
+
+    def test_acquire_blocks_threads_in_rate(self):
+        limiter = OutboundLimiter(global_rate=1000, chat_rate=50, chat_burst=1)
+        granted = []
+
+        def send(i):
+            limiter.acquire(7)
+            granted.append((i, time.monotonic()))
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=send, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.005)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([i for i, _ in granted], [0, 1, 2, 3])
+        self.assertGreaterEqual(granted[-1][1] - start, 0.05)
+
+
+class TestInstall(unittest.TestCase):
+    def setUp(self):
+        sender = apihelper.CUSTOM_REQUEST_SENDER
+        process_request = asyncio_helper._process_request
+        self.addCleanup(setattr, apihelper, "CUSTOM_REQUEST_SENDER", sender)
+        self.addCleanup(
+            setattr, asyncio_helper, "_process_request", process_request
+        )
+
+    def test_sync_sender_retries_after_429(self):
+        session = mock.Mock()
+        session.request.side_effect = [
+            FakeResponse(429, FLOOD),
+            FakeResponse(200, {"ok": True, "result": {}}),
+        ]
+        limiter = OutboundLimiter()
+        rate_limiter.install(limiter, session)
+
+        response = apihelper.CUSTOM_REQUEST_SENDER(
+            "post",
+            "https://api.telegram.org/bot1:x/sendMessage",
+            params={"chat_id": 5, "text": "hi"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(session.request.call_count, 2)
+        self.assertEqual(limiter.stats()["throttled_429"], 1)
+
+    def test_sync_sender_skips_unlimited_methods(self):
+        session = mock.Mock()
+        session.request.return_value = FakeResponse(200, {"ok": True})
+        limiter = OutboundLimiter()
+        rate_limiter.install(limiter, session)
+
+        apihelper.CUSTOM_REQUEST_SENDER(
+            "get", "https://api.telegram.org/bot1:x/getUpdates", params={}
+        )
+        self.assertEqual(limiter.stats()["granted"], 0)
+
+    def test_async_request_retries_after_429(self):
+        calls = []
+
+        async def process_request(token, url, method="get", params=None, **kwargs):
+            calls.append(params)
+            if len(calls) == 1:
+                raise apihelper.ApiTelegramException(url, None, FLOOD)
+            return {"message_id": 1}
+
+        asyncio_helper._process_request = process_request
+        limiter = OutboundLimiter()
+        rate_limiter.install_async(limiter)
+
+        result = asyncio.run(
+            asyncio_helper._process_request(
+                "1:x", "sendMessage", "post", params={"chat_id": "5"}
+            )
+        )
+
+        self.assertEqual(result, {"message_id": 1})
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(limiter.stats()["granted"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,219 @@
+import asyncio
+import unittest
+
+import httpx
+
+from fake_gemini import FakeGemini, client_error, server_error
+from resilience import (
+    FATAL,
+    TRANSIENT,
+    CircuitBreaker,
+    CircuitOpenError,
+    ResilientGemini,
+    classify_error,
+    send_chat,
+)
+from streaming import open_stream
+
+PRO = "gemini-3.1-pro-preview"
+FLASH = "gemini-3.7-flash"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def resilient(clock=None, **kwargs):
+    delays = []
+    gemini = ResilientGemini(
+        sleep=delays.append,
+        clock=clock or Clock(),
+        rng=lambda: 1.0,
+        **kwargs,
+    )
+    return gemini, delays
+
+
+class TestClassify(unittest.TestCase):
+    def test_classify_error(self):
+        self.assertEqual(classify_error(server_error(503)), TRANSIENT)
+        self.assertEqual(classify_error(client_error(429)), TRANSIENT)
+        self.assertEqual(classify_error(httpx.ReadTimeout("t")), TRANSIENT)
+        self.assertEqual(classify_error(client_error(400)), FATAL)
+        self.assertEqual(classify_error(ValueError()), FATAL)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_and_recovers_through_single_probe(self):
+        clock = Clock()
+        breaker = CircuitBreaker(2, 10, clock)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        clock.now = 10
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+
+    def test_released_probe_keeps_state(self):
+        clock = Clock()
+        breaker = CircuitBreaker(1, 10, clock)
+        breaker.record_failure()
+        clock.now = 10
+        self.assertTrue(breaker.allow())
+        breaker.release()
+        # Остаётся полуоткрытым: пропускается следующий пробный запрос
+        self.assertEqual(breaker.state, "half_open")
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        clock = Clock()
+        breaker = CircuitBreaker(1, 10, clock)
+        breaker.record_failure()
+        clock.now = 10
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.opens, 2)
+
+
+class TestResilientGemini(unittest.TestCase):
+    def test_retries_transient_with_capped_backoff(self):
+        fake = FakeGemini(script=[server_error(), client_error(429)])
+        gemini, delays = resilient(max_attempts=3, base_delay=1, max_delay=1.5)
+
+        response, model = gemini.call(
+            FLASH, lambda m: fake.models.generate_content(model=m, contents="q")
+        )
+
+        self.assertEqual((response.text, model), (f"{FLASH}: q", FLASH))
+        self.assertEqual(delays, [1, 1.5])
+        self.assertEqual(gemini.stats()["retries"], 2)
+
+    def test_blocking_wait_is_capped(self):
+        fake = FakeGemini(script=[server_error(), server_error(), server_error()])
+        gemini, delays = resilient(
+            max_attempts=4, base_delay=1, max_delay=8, max_blocking_wait=1.5
+        )
+        with self.assertRaises(Exception):
+            gemini.call(FLASH, lambda m: fake.generate_content(m, "q"))
+        # 1 + 0.5 сек., после этого повторов больше нет
+        self.assertEqual(delays, [1, 0.5])
+        self.assertEqual(len(fake.requests), 3)
+
+    def test_fatal_error_leaves_breaker_unchanged(self):
+        fake = FakeGemini(script=[server_error(), client_error(400)])
+        gemini, _ = resilient(max_attempts=1, failure_threshold=2)
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                gemini.call(FLASH, lambda m: fake.generate_content(m, "q"))
+        self.assertEqual(gemini.breaker(FLASH).failures, 1)
+
+    def test_fatal_and_non_idempotent_are_not_retried(self):
+        fake = FakeGemini(script=[client_error(400)])
+        gemini, _ = resilient()
+        with self.assertRaises(Exception):
+            gemini.call(FLASH, lambda m: fake.generate_content(m, "q"))
+
+        fake.script = [server_error()]
+        with self.assertRaises(Exception):
+            gemini.call(FLASH, lambda m: fake.generate_content(m, "q"), False)
+        self.assertEqual(len(fake.requests), 2)
+        self.assertEqual(gemini.stats()["breakers"][FLASH]["state"], "closed")
+
+    def test_open_breaker_rejects_without_request(self):
+        fake = FakeGemini(down=[FLASH])
+        gemini, _ = resilient(max_attempts=2, failure_threshold=2)
+        with self.assertRaises(Exception):
+            gemini.call(FLASH, lambda m: fake.generate_content(m, "q"))
+        with self.assertRaises(CircuitOpenError):
+            gemini.call(FLASH, lambda m: fake.generate_content(m, "q"))
+        self.assertEqual(len(fake.requests), 2)
+
+    def test_fallback_while_primary_is_open(self):
+        clock = Clock()
+        fake = FakeGemini(down=[PRO])
+        gemini, _ = resilient(
+            clock,
+            max_attempts=2,
+            failure_threshold=2,
+            reset_timeout=30,
+            fallbacks={PRO: FLASH},
+        )
+
+        _, model = gemini.call(PRO, lambda m: fake.generate_content(m, "q"))
+        self.assertEqual(model, FLASH)
+        _, model = gemini.call(PRO, lambda m: fake.generate_content(m, "q"))
+        self.assertEqual(model, FLASH)
+        self.assertEqual(fake.requests, [PRO, PRO, FLASH, FLASH])
+
+        fake.down.clear()
+        clock.now = 30
+        _, model = gemini.call(PRO, lambda m: fake.generate_content(m, "q"))
+        self.assertEqual(model, PRO)
+
+    def test_error_rate_is_absorbed(self):
+        fake = FakeGemini(error_rate=0.3, seed=1)
+        gemini, _ = resilient(max_attempts=5, failure_threshold=100)
+        for i in range(50):
+            gemini.call(FLASH, lambda m: fake.generate_content(m, i))
+        self.assertGreater(gemini.stats()["retries"], 0)
+
+    def test_call_async(self):
+        calls = []
+
+        async def request(model):
+            calls.append(model)
+            if len(calls) == 1:
+                raise server_error()
+            return "ok"
+
+        async def no_sleep(delay):
+            pass
+
+        gemini = ResilientGemini(async_sleep=no_sleep)
+        result = asyncio.run(gemini.call_async(FLASH, request))
+        self.assertEqual(result, ("ok", FLASH))
+
+
+class TestSendChat(unittest.TestCase):
+    def test_fallback_chat_keeps_history(self):
+        fake = FakeGemini(down=[PRO])
+        chat = fake.chats.create(model=PRO, history=["earlier"])
+        gemini, _ = resilient(
+            max_attempts=1, failure_threshold=1, fallbacks={PRO: FLASH}
+        )
+
+        response, used = send_chat(
+            gemini, fake.chats, chat, PRO, lambda c: c.send_message("hi")
+        )
+
+        self.assertEqual(response.text, f"{FLASH}: hi")
+        self.assertIsNot(used, chat)
+        self.assertEqual(used.get_history(), ["earlier", "hi", response.text])
+        self.assertEqual(chat.get_history(), ["earlier"])
+
+    def test_stream_is_retried_before_first_chunk(self):
+        fake = FakeGemini(script=[server_error(), None])
+        chat = fake.chats.create(model=FLASH)
+        gemini, _ = resilient()
+
+        stream, used = send_chat(
+            gemini, fake.chats, chat, FLASH, lambda c: open_stream(c, "hi", None)
+        )
+
+        self.assertIs(used, chat)
+        self.assertEqual([c.text for c in stream], [f"{FLASH}:", "hi"])
+        self.assertEqual(len(chat.get_history()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
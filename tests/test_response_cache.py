@@ -0,0 +1,133 @@
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.db import Base
+from database.models import ToolResponse
+from response_cache import ResponseCache, config_hash
+
+TRANSLATE = {
+    "system_instruction": "Translate.",
+    "description": "Перевод",
+    "model": "gemini-3.5-flash-lite",
+    "thinking_budget": 0,
+    "cache": True,
+}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        Base.metadata.create_all(bind=engine)
+        self.addCleanup(engine.dispose)
+        self.session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+        self.clock = Clock()
+        self.cache = ResponseCache(
+            3, 100, session_factory=self.session_factory, clock=self.clock
+        )
+
+    def count(self):
+        with self.session_factory() as session:
+            return session.query(ToolResponse).count()
+
+    def test_hit_after_put(self):
+        self.assertIsNone(self.cache.get("translate", TRANSLATE, "привет"))
+        self.cache.put("translate", TRANSLATE, "привет", "hello", tokens=42)
+        self.assertEqual(self.cache.get("translate", TRANSLATE, "привет"), "hello")
+        self.assertIsNone(self.cache.get("translate", TRANSLATE, "пока"))
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertEqual(stats["saved_tokens"], 42)
+
+    def test_empty_response_not_cached(self):
+        self.cache.put("translate", TRANSLATE, "привет", "")
+        self.assertEqual(self.count(), 0)
+
+    def test_ttl(self):
+        self.cache.put("translate", TRANSLATE, "привет", "hello")
+        self.clock.now += 101
+        self.assertIsNone(self.cache.get("translate", TRANSLATE, "привет"))
+        self.assertEqual(self.count(), 0)
+
+    def test_lru_eviction(self):
+        self.cache.evict_every = 1
+        for text in "abc":
+            self.clock.now += 1
+            self.cache.put("translate", TRANSLATE, text, text.upper())
+        self.clock.now += 1
+        self.cache.get("translate", TRANSLATE, "a")
+        self.clock.now += 1
+        self.cache.put("translate", TRANSLATE, "d", "D")
+        self.assertEqual(self.count(), 3)
+        self.assertIsNone(self.cache.get("translate", TRANSLATE, "b"))
+        self.assertEqual(self.cache.get("translate", TRANSLATE, "a"), "A")
+        self.assertEqual(self.cache.stats()["evicted"], 1)
+
+    def test_hits_and_eviction_are_batched(self):
+        cache = ResponseCache(
+            2,
+            100,
+            session_factory=self.session_factory,
+            clock=self.clock,
+            touch_batch=2,
+            evict_every=3,
+        )
+        for text in "abc":
+            self.clock.now += 1
+            cache.put("translate", TRANSLATE, text, text.upper())
+        self.assertEqual(self.count(), 2)
+
+        self.clock.now += 1
+        cache.get("translate", TRANSLATE, "b")
+        with self.session_factory() as session:
+            used = {row.response: row.used_at for row in session.query(ToolResponse)}
+        # Одно попадание ещё не записано
+        self.assertEqual(used["B"], 1002)
+
+        cache.get("translate", TRANSLATE, "c")
+        with self.session_factory() as session:
+            used = {row.response: row.used_at for row in session.query(ToolResponse)}
+        self.assertEqual((used["B"], used["C"]), (1004, 1004))
+
+        # Между вытеснениями кэш может превысить max_entries
+        for text in "de":
+            cache.put("translate", TRANSLATE, text, text.upper())
+        self.assertEqual(self.count(), 4)
+
+    def test_config_change_invalidates(self):
+        self.cache.put("translate", TRANSLATE, "привет", "hello")
+        changed = {**TRANSLATE, "system_instruction": "Translate formally."}
+        self.assertIsNone(self.cache.get("translate", changed, "привет"))
+        # Описание на ответ не влияет
+        renamed = {**TRANSLATE, "description": "Другое описание"}
+        self.assertEqual(config_hash(renamed), config_hash(TRANSLATE))
+
+        self.cache.put("proofread", {**TRANSLATE, "model": "x"}, "текст", "ok")
+        removed = self.cache.prune({"translate": changed})
+        self.assertEqual(removed, 2)
+        self.assertEqual(self.count(), 0)
+
+    def test_enabled_for(self):
+        self.assertTrue(ResponseCache.enabled_for(TRANSLATE))
+        self.assertFalse(ResponseCache.enabled_for({**TRANSLATE, "cache": False}))
+        self.assertFalse(
+            ResponseCache.enabled_for({**TRANSLATE, "model": "gemini-3.1-flash-image"})
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
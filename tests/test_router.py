@@ -0,0 +1,54 @@
+import unittest
+
+from router import Router, command_args, command_name
+
+
+class TestRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = Router()
+        for name in ("start", "translate", "proofread"):
+            self.router.command(name)(name)
+        self.router.exact("Новый чат")("new_chat")
+        self.router.prefix("Режим:")("send_mode")
+        self.router.prefix("Получить .")("get_md")
+        self.router.default("message")
+
+    def test_commands(self):
+        self.assertEqual(self.router.resolve("/start"), "start")
+        self.assertEqual(self.router.resolve("/translate привет"), "translate")
+        self.assertEqual(self.router.resolve("/proofread@my_bot текст"), "proofread")
+        self.assertEqual(self.router.resolve("/unknown"), "message")
+
+    def test_buttons(self):
+        self.assertEqual(self.router.resolve("Новый чат"), "new_chat")
+        self.assertEqual(self.router.resolve("Режим: Ручной ✍️"), "send_mode")
+        self.assertEqual(self.router.resolve("Получить .MD 📄"), "get_md")
+
+    def test_default(self):
+        self.assertEqual(self.router.resolve("Новый чат?"), "message")
+        self.assertEqual(self.router.resolve("Получить ответ"), "message")
+        self.assertEqual(self.router.resolve("Режим работы"), "message")
+        self.assertEqual(self.router.resolve("   "), "message")
+        self.assertEqual(self.router.resolve(""), "message")
+
+    def test_dispatch_calls_handler(self):
+        router = Router()
+        router.exact("ping")(lambda message: ("pong", message.text))
+
+        class Message:
+            text = "ping"
+
+        self.assertEqual(router.dispatch(Message()), ("pong", "ping"))
+
+    def test_command_name(self):
+        self.assertEqual(command_name("/start@bot arg"), "start")
+        self.assertIsNone(command_name("start"))
+
+    def test_command_args_split_on_any_whitespace(self):
+        self.assertEqual(command_args("/translate\nline1\nline2"), "line1\nline2")
+        self.assertEqual(command_args("/translate@bot  hello world "), "hello world")
+        self.assertEqual(command_args("/translate"), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from streaming import (
+    CURSOR,
+    EditBudget,
+    stream_chat_response,
+    stream_chat_response_async,
+)
+
+
+def chunk(text, grounding=None):
+    return SimpleNamespace(
+        text=text,
+        candidates=[SimpleNamespace(grounding_metadata=grounding)],
+    )
+
+
+class FakeChat:
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+
+    def send_message_stream(self, message, config=None):
+        yield from self.chunks
+        if self.error:
+            raise self.error
+
+
+class FakeAsyncChat(FakeChat):
+    async def send_message_stream(self, message, config=None):
+        async def gen():
+            for c in self.chunks:
+                yield c
+            if self.error:
+                raise self.error
+
+        return gen()
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.edits = []
+        self.deleted = []
+
+    def send_message(self, chat_id, text, reply_parameters=None):
+        self.sent.append(text)
+        return SimpleNamespace(message_id=len(self.sent))
+
+    def edit_message_text(self, text, chat_id, message_id):
+        self.edits.append(text)
+
+    def delete_message(self, chat_id, message_id):
+        self.deleted.append(message_id)
+
+
+class FakeAsyncBot(FakeBot):
+    async def send_message(self, *args, **kwargs):
+        return FakeBot.send_message(self, *args, **kwargs)
+
+    async def edit_message_text(self, *args, **kwargs):
+        return FakeBot.edit_message_text(self, *args, **kwargs)
+
+    async def delete_message(self, *args, **kwargs):
+        return FakeBot.delete_message(self, *args, **kwargs)
+
+
+class TestEditBudget(unittest.TestCase):
+    def test_throttles_per_chat(self):
+        budget = EditBudget(60)
+        self.assertTrue(budget.try_acquire(1))
+        self.assertFalse(budget.try_acquire(1))
+        self.assertTrue(budget.try_acquire(2))
+
+    def test_zero_interval_always_allows(self):
+        budget = EditBudget(0)
+        self.assertTrue(budget.try_acquire(1))
+        self.assertTrue(budget.try_acquire(1))
+
+
+class TestStreamChatResponse(unittest.TestCase):
+    def test_collects_text_and_grounded_chunk(self):
+        bot = FakeBot()
+        grounded = chunk("!", grounding="meta")
+        chat = FakeChat([chunk("При"), chunk("вет"), grounded])
+
+        text, response, placeholder = stream_chat_response(
+            bot, chat, ["hi"], None, 1, EditBudget(0)
+        )
+
+        self.assertEqual(text, "Привет!")
+        self.assertIs(response, grounded)
+        self.assertEqual(bot.sent, ["При" + CURSOR])
+        self.assertEqual(bot.edits, ["Привет" + CURSOR, "Привет!" + CURSOR])
+        self.assertEqual(placeholder.message_id, 1)
+
+    def test_budget_limits_edits(self):
+        bot = FakeBot()
+        chat = FakeChat([chunk(str(i)) for i in range(20)])
+
+        text, _, _ = stream_chat_response(
+            bot, chat, ["hi"], None, 1, EditBudget(60)
+        )
+
+        self.assertEqual(len(text), 30)
+        self.assertEqual(len(bot.sent), 1)
+        self.assertEqual(bot.edits, [])
+
+    def test_error_deletes_placeholder(self):
+        bot = FakeBot()
+        chat = FakeChat([chunk("a")], error=RuntimeError("boom"))
+
+        with self.assertRaises(RuntimeError):
+            stream_chat_response(bot, chat, ["hi"], None, 1, EditBudget(0))
+        self.assertEqual(bot.deleted, [1])
+
+    def test_async_variant(self):
+        bot = FakeAsyncBot()
+        placeholder = SimpleNamespace(message_id=7)
+        chat = FakeAsyncChat([chunk("a"), chunk("b")])
+
+        text, response, returned = asyncio.run(
+            stream_chat_response_async(
+                bot, chat, ["hi"], None, 1, EditBudget(0),
+                placeholder=placeholder,
+            )
+        )
+
+        self.assertEqual(text, "ab")
+        self.assertIs(returned, placeholder)
+        self.assertEqual(bot.sent, [])
+        self.assertEqual(bot.edits, ["a" + CURSOR, "ab" + CURSOR])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import io
+import unittest
+from unittest import mock
+
+from google.genai import types as genai_types
+from PIL import Image
+
+import token_estimator
+from token_estimator import TokenEstimator, fit_text, pdf_page_count, preflight
+
+CALIBRATION = {
+    "text": [
+        {"chars": 400, "cyrillic": 0.0, "tokens": 100},
+        {"chars": 300, "cyrillic": 1.0, "tokens": 100},
+    ],
+    "image": [
+        {"width": 200, "height": 200, "tokens": 250},
+        {"width": 1500, "height": 700, "tokens": 500},
+    ],
+    "pdf": [{"pages": 2, "tokens": 600}],
+}
+
+
+def png(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def pdf(pages):
+    objects = b"".join(
+        b"%d 0 obj << /Type /Page /Parent 1 0 R >> endobj\n" % (i + 2)
+        for i in range(pages)
+    )
+    return b"%PDF-1.4\n1 0 obj << /Type /Pages /Count 3 >> endobj\n" + objects
+
+
+class TestTokenEstimator(unittest.TestCase):
+    def setUp(self):
+        self.estimator = TokenEstimator(CALIBRATION)
+
+    def test_fit_text_separates_scripts(self):
+        latin, cyrillic = fit_text(CALIBRATION["text"])
+        self.assertAlmostEqual(latin, 0.25)
+        self.assertAlmostEqual(cyrillic, 1 / 3)
+
+    def test_text_uses_cyrillic_share(self):
+        self.assertEqual(self.estimator.text("a" * 400), 100)
+        self.assertEqual(self.estimator.text("я" * 300), 100)
+        self.assertEqual(self.estimator.text(""), 0)
+
+    def test_image_by_dimensions(self):
+        self.assertEqual(self.estimator.image(png(300, 300)), 250)
+        # 1600×800 — 3×2 плитки по 768
+        self.assertEqual(self.estimator.image_size(1600, 800), 1500)
+        self.assertEqual(self.estimator.image(Image.new("RGB", (100, 100))), 250)
+        self.assertEqual(self.estimator.image(b"not an image"), 250)
+
+    def test_pdf_by_pages(self):
+        self.assertEqual(pdf_page_count(pdf(3)), 3)
+        self.assertEqual(self.estimator.data(pdf(3), "application/pdf"), 900)
+
+    def test_file_info_is_memoized_by_hash(self):
+        loads = []
+
+        def load():
+            loads.append(1)
+            return b"x" * 400
+
+        info = {"mime_type": "text/plain", "blob_hash": "h", "load": load}
+        self.assertEqual(self.estimator.file_info(info), 100)
+        self.assertEqual(self.estimator.file_info(info), 100)
+        self.assertEqual(len(loads), 1)
+
+    def test_history_parts(self):
+        history = [
+            genai_types.Content(
+                role="user", parts=[genai_types.Part(text="a" * 40)]
+            ),
+            genai_types.Content(
+                role="model",
+                parts=[
+                    genai_types.Part(text="b" * 400, thought=True),
+                    genai_types.Part.from_bytes(
+                        data=png(10, 10), mime_type="image/png"
+                    ),
+                ],
+            ),
+        ]
+        self.assertEqual(self.estimator.history(history), 10 + 250)
+
+    def test_observe_tracks_actual_ratio(self):
+        response = mock.Mock(usage_metadata=mock.Mock(prompt_token_count=120))
+        self.estimator.observe(100, response)
+        self.assertEqual(self.estimator.stats()["actual_to_estimate"], 1.2)
+
+
+class TestPreflight(unittest.TestCase):
+    def setUp(self):
+        for name, value in (
+            ("estimator", TokenEstimator(CALIBRATION)),
+            ("get_input_token_limit", lambda model_name: self.limit),
+        ):
+            patcher = mock.patch.object(token_estimator, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def file(self, name, chars):
+        return {
+            "filename": name,
+            "mime_type": "text/plain",
+            "data": b"x" * chars,
+            "caption": None,
+        }
+
+    def test_largest_files_dropped_to_fit(self):
+        files = [self.file("a", 400), self.file("big", 4000), self.file("c", 400)]
+        self.limit = 500
+        check = preflight("m", texts=["x" * 400], files=files)
+
+        self.assertTrue(check.ok)
+        self.assertEqual(check.total, 300)
+        self.assertEqual([f["filename"] for f, _ in check.dropped], ["big"])
+        self.assertEqual([f["filename"] for f in check.keep(files)], ["a", "c"])
+        self.assertIn("big", check.dropped_texts()[0])
+        self.assertEqual(token_estimator.estimator.stats()["trimmed_files"], 1)
+
+    def test_rejected_when_text_alone_is_too_large(self):
+        self.limit = 50
+        check = preflight("m", texts=["x" * 400])
+
+        self.assertFalse(check.ok)
+        self.assertIn("100", check.rejection_text())
+        self.assertEqual(token_estimator.estimator.stats()["rejected"], 1)
+
+    def test_uncalibrated_table_keeps_margin(self):
+        self.limit = 110
+        self.assertFalse(preflight("m", texts=["x" * 400]).ok)
+
+        calibrated = TokenEstimator(dict(CALIBRATION, calibrated=True))
+        with mock.patch.object(token_estimator, "estimator", calibrated):
+            check = preflight("m", texts=["x" * 400])
+        self.assertTrue(check.ok)
+        self.assertEqual(check.limit, 110)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,15 @@
 import unittest
 from unittest.mock import MagicMock
+from telebot.apihelper import ApiTelegramException
 from telebot.types import InputRichMessage, ReplyParameters
 from utils import (
     get_closers_and_openers,
+    iter_message_parts,
     markdown_to_text,
     parse_markdown_state,
     send_rich_response,
     split_long_message,
+    split_text,
 )
 
 
@@ -78,6 +81,31 @@ class TestUtils(unittest.TestCase):
         # Second part should reopen code block with python
         self.assertTrue(parts[1].startswith("```python\n"))
 
+    def test_iter_message_parts_is_lazy(self):
+        text = "\n\n".join(f"**Para {i}** " + "word " * 20 for i in range(200))
+        parts = iter_message_parts(text, max_length=300)
+        self.assertEqual(next(parts), split_long_message(text, max_length=300)[0])
+        self.assertEqual(
+            [next(parts)] + list(parts), split_long_message(text, max_length=300)[1:]
+        )
+
+    def test_split_long_message_carries_state_across_parts(self):
+        text = "```python\n" + "x = 1  # *note*\n" * 40 + "```\n\n*tail* `end`"
+        parts = split_long_message(text, max_length=80)
+        self.assertGreater(len(parts), 3)
+        for part in parts[1:-1]:
+            self.assertTrue(part.startswith("```python\n"))
+            self.assertTrue(part.endswith("\n```"))
+        self.assertTrue(parts[-1].endswith("*tail* `end`"))
+
+    def test_split_text_on_paragraphs(self):
+        paragraphs = [f"Paragraph {i} " + "word " * 30 for i in range(10)]
+        text = "\n\n".join(paragraphs)
+        parts = split_text(text, 400)
+        self.assertTrue(all(len(part) <= 400 for part in parts))
+        self.assertEqual("\n\n".join(parts), text)
+        self.assertTrue(all(part.startswith("Paragraph") for part in parts))
+
     def test_parse_markdown_state(self):
         state = parse_markdown_state("```python\ndef foo():\n**bar")
         self.assertTrue(state["in_code_block"])
@@ -87,6 +115,13 @@ class TestUtils(unittest.TestCase):
         self.assertFalse(state2["in_bold"])
         self.assertTrue(state2["in_italic"])
 
+        state3 = parse_markdown_state("* item `a ** b` ~~x\n  ```sh\n**")
+        self.assertTrue(state3["in_code_block"])
+        self.assertEqual(state3["code_block_lang"], "sh")
+        self.assertFalse(state3["in_italic"])
+        self.assertFalse(state3["in_bold"])
+        self.assertTrue(state3["in_strike"])
+
     def test_send_rich_response_basic(self):
         mock_bot = MagicMock()
         mock_bot.send_rich_message.return_value = "msg_obj"
@@ -134,6 +169,22 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(args[0], 123)
         self.assertEqual(args[1], "Bold and Italic")
 
+    def test_send_rich_response_stops_on_flood_error(self):
+        mock_bot = MagicMock()
+        mock_bot.send_rich_message.side_effect = ApiTelegramException(
+            "sendRichMessage",
+            None,
+            {
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 5",
+                "parameters": {"retry_after": 5},
+            },
+        )
+
+        # Ошибка не доходит до обработчика, который написал бы в тот же чат
+        self.assertEqual(send_rich_response(mock_bot, 123, "**Bold**"), [])
+        mock_bot.send_message.assert_not_called()
+
     def test_send_rich_response_long_message(self):
         mock_bot = MagicMock()
         mock_bot.send_rich_message.return_value = "msg_obj"
@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from webhook import SECRET_HEADER, WebhookServer
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "update_message.json")
+
+
+class TestWebhookServer(unittest.TestCase):
+    def setUp(self):
+        self.received = []
+        self.got_update = threading.Event()
+
+        def submit(updates):
+            self.received.extend(updates)
+            self.got_update.set()
+
+        self.server = WebhookServer("127.0.0.1", 0, "/hook", "s3cret", submit)
+        self.server.start()
+        host, port = self.server.server_address
+        self.base_url = f"http://{host}:{port}"
+
+        with open(FIXTURE, "rb") as f:
+            self.update_body = f.read()
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def post(self, path, body, secret="s3cret"):
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=body,
+            headers={"Content-Type": "application/json", SECRET_HEADER: secret},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def test_recorded_update_is_submitted(self):
+        self.assertEqual(self.post("/hook", self.update_body), 200)
+        self.assertTrue(self.got_update.wait(5))
+
+        update = self.received[0]
+        self.assertEqual(update.update_id, 100500)
+        self.assertEqual(update.message.text, "Привет!")
+        self.assertEqual(update.message.from_user.id, 12345)
+        self.assertEqual(self.server.stats()["received"], 1)
+
+    def test_wrong_secret_is_rejected(self):
+        self.assertEqual(self.post("/hook", self.update_body, "nope"), 403)
+        self.assertEqual(self.post("/hook", self.update_body, ""), 403)
+        self.assertEqual(self.post("/hook", self.update_body, "sécret"), 403)
+        self.assertEqual(self.received, [])
+        self.assertEqual(self.server.stats()["rejected"], 3)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.post("/other", self.update_body), 404)
+        self.assertEqual(self.post("/hook", b"{not json"), 400)
+
+    def get(self, path, secret=None):
+        headers = {SECRET_HEADER: secret} if secret is not None else {}
+        request = urllib.request.Request(self.base_url + path, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, b""
+
+    def test_stats_endpoint_requires_secret(self):
+        status, body = self.get("/stats", "s3cret")
+        self.assertEqual(status, 200)
+        self.assertIsInstance(json.loads(body), dict)
+
+        self.assertEqual(self.get("/stats")[0], 403)
+        self.assertEqual(self.get("/stats", "nope")[0], 403)
+        self.assertEqual(self.get("/healthz"), (200, b"ok"))
+
+    def test_secret_required(self):
+        with self.assertRaises(ValueError):
+            WebhookServer("127.0.0.1", 0, "/hook", "", lambda updates: None)
+
+
+if __name__ == "__main__":
+    unittest.main()
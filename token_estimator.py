@@ -0,0 +1,304 @@
+"""
+Локальная оценка числа токенов запроса к Gemini.
+
+Слишком большой запрос иначе обнаруживается только по ошибке API — после
+того как все файлы собраны и отправлены. Оценка делается без сети: текст —
+по числу символов с учётом доли кириллицы, картинки — по размерам (плитки
+768×768), PDF — по числу страниц. Коэффициенты подбираются по таблице
+реальных подсчётов token_calibration.json (benchmarks/calibrate_tokens.py).
+Пока таблица не измерена ("calibrated": false), проверка перед отправкой
+оставляет запас UNCALIBRATED_MARGIN.
+"""
+
+import io
+import json
+import math
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+from PIL import Image
+
+from constants import get_input_token_limit
+from gemini_helpers import file_bytes
+
+CALIBRATION_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "token_calibration.json"
+)
+
+# Картинка не больше SMALL_IMAGE_SIDE по обеим сторонам — одна плитка,
+# иначе она режется на плитки IMAGE_TILE_SIDE × IMAGE_TILE_SIDE
+SMALL_IMAGE_SIDE = 384
+IMAGE_TILE_SIDE = 768
+# Средний размер страницы PDF, если страницы не удалось посчитать
+PDF_BYTES_PER_PAGE = 100 * 1024
+# Доля кириллицы оценивается по началу длинного текста
+CYRILLIC_SAMPLE_CHARS = 65536
+MEMO_SIZE = 1024
+# Во сколько раз оценка может быть занижена без измеренной калибровки
+UNCALIBRATED_MARGIN = 1.25
+
+_CYRILLIC = re.compile("[Ѐ-ӿ]")
+_PDF_PAGE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+
+
+def _cyrillic_share(text):
+    sample = text[:CYRILLIC_SAMPLE_CHARS]
+    return len(_CYRILLIC.findall(sample)) / len(sample) if sample else 0.0
+
+
+def _image_tiles(width, height):
+    if width <= SMALL_IMAGE_SIDE and height <= SMALL_IMAGE_SIDE:
+        return 1
+    return math.ceil(width / IMAGE_TILE_SIDE) * math.ceil(height / IMAGE_TILE_SIDE)
+
+
+def pdf_page_count(data):
+    """Число страниц PDF по объектам /Type /Page; 0, если их не видно."""
+    return len(_PDF_PAGE.findall(data))
+
+
+def fit_text(rows):
+    """
+    Токенов на символ для латиницы и кириллицы: наименьшие квадраты для
+    tokens = a·chars·(1 − c) + b·chars·c, где c — доля кириллицы.
+    """
+    s11 = s12 = s22 = t1 = t2 = 0.0
+    for row in rows:
+        x1 = row["chars"] * (1 - row["cyrillic"])
+        x2 = row["chars"] * row["cyrillic"]
+        s11 += x1 * x1
+        s12 += x1 * x2
+        s22 += x2 * x2
+        t1 += x1 * row["tokens"]
+        t2 += x2 * row["tokens"]
+    det = s11 * s22 - s12 * s12
+    if not det:
+        raise ValueError("В калибровке нужны латинские и кириллические образцы")
+    return (t1 * s22 - t2 * s12) / det, (s11 * t2 - s12 * t1) / det
+
+
+class TokenEstimator:
+    """
+    Оценка токенов текста, картинок, файлов и истории чата. Оценки файлов
+    запоминаются по blob_hash. Счётчики проверок и расхождения с реальными
+    usage_metadata доступны через stats().
+    """
+
+    def __init__(self, calibration):
+        self.latin_per_char, self.cyrillic_per_char = fit_text(calibration["text"])
+        self.tokens_per_tile = sum(
+            row["tokens"] / _image_tiles(row["width"], row["height"])
+            for row in calibration["image"]
+        ) / len(calibration["image"])
+        pdf_rows = calibration["pdf"]
+        self.tokens_per_page = sum(row["tokens"] for row in pdf_rows) / sum(
+            row["pages"] for row in pdf_rows
+        )
+        self.calibrated = bool(calibration.get("calibrated"))
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.rejected = 0
+        self.trimmed_files = 0
+        self.last_estimate = 0
+        self.max_estimate = 0
+        self.observed = 0
+        self._observed_ratio = 0.0
+
+    @classmethod
+    def from_file(cls, path=CALIBRATION_PATH):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def input_limit(self, limit):
+        """Лимит запроса с запасом на погрешность неизмеренной калибровки."""
+        return limit if self.calibrated else int(limit / UNCALIBRATED_MARGIN)
+
+    def text(self, text):
+        if not text:
+            return 0
+        share = _cyrillic_share(text)
+        per_char = (
+            self.latin_per_char * (1 - share) + self.cyrillic_per_char * share
+        )
+        return math.ceil(len(text) * per_char)
+
+    def image_size(self, width, height):
+        return round(_image_tiles(width, height) * self.tokens_per_tile)
+
+    def image(self, image):
+        """Картинка PIL или байты; размеры читаются из заголовка."""
+        try:
+            if not isinstance(image, Image.Image):
+                image = Image.open(io.BytesIO(image))
+            return self.image_size(*image.size)
+        except Exception:
+            return round(self.tokens_per_tile)
+
+    def pdf(self, data):
+        pages = pdf_page_count(data) or max(1, len(data) // PDF_BYTES_PER_PAGE)
+        return round(pages * self.tokens_per_page)
+
+    def data(self, data, mime_type):
+        if not mime_type or mime_type.startswith("image/"):
+            return self.image(data)
+        if mime_type == "application/pdf":
+            return self.pdf(data)
+        # Остальные поддерживаемые типы — текстовые (код, CSV, HTML...)
+        return self.text(bytes(data).decode("utf-8", errors="replace"))
+
+    def file_info(self, file_info):
+        """
+        Оценка файла контекста или элемента буфера (фото или документ).
+        Байты читаются локально и только при первой оценке блоба.
+        """
+        image = file_info.get("image")
+        if image is not None:
+            return self.image(image)
+        blob_hash = file_info.get("blob_hash")
+        if blob_hash:
+            with self._lock:
+                tokens = self._memo.get(blob_hash)
+                if tokens is not None:
+                    self._memo.move_to_end(blob_hash)
+                    return tokens
+        tokens = self.data(file_bytes(file_info), file_info.get("mime_type"))
+        if blob_hash:
+            with self._lock:
+                self._memo[blob_hash] = tokens
+                if len(self._memo) > MEMO_SIZE:
+                    self._memo.popitem(last=False)
+        return tokens
+
+    def part(self, part):
+        """Строка, картинка PIL или types.Part."""
+        if isinstance(part, str):
+            return self.text(part)
+        if isinstance(part, Image.Image):
+            return self.image(part)
+        if getattr(part, "thought", None):
+            return 0
+        tokens = self.text(getattr(part, "text", None))
+        inline_data = getattr(part, "inline_data", None)
+        if inline_data is not None:
+            tokens += self.data(inline_data.data or b"", inline_data.mime_type)
+        if getattr(part, "file_data", None) is not None:
+            # Размер файла по ссылке неизвестен — считаем одной плиткой/страницей
+            tokens += round(self.tokens_per_tile)
+        return tokens
+
+    def parts(self, parts):
+        return sum(self.part(part) for part in parts)
+
+    def content(self, content):
+        return self.parts(getattr(content, "parts", None) or [])
+
+    def history(self, history):
+        return sum(self.content(content) for content in history)
+
+    def record(self, tokens, rejected=False, trimmed=0):
+        """Учитывает проверку запроса перед отправкой."""
+        with self._lock:
+            self.checks += 1
+            self.last_estimate = tokens
+            self.max_estimate = max(self.max_estimate, tokens)
+            self.rejected += int(rejected)
+            self.trimmed_files += trimmed
+
+    def observe(self, estimated, response):
+        """Сравнивает оценку с prompt_token_count из ответа Gemini."""
+        usage = getattr(response, "usage_metadata", None)
+        actual = getattr(usage, "prompt_token_count", None)
+        if not actual or not estimated:
+            return
+        with self._lock:
+            self.observed += 1
+            self._observed_ratio += actual / estimated
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calibrated": self.calibrated,
+                "checks": self.checks,
+                "rejected": self.rejected,
+                "trimmed_files": self.trimmed_files,
+                "last_estimate": self.last_estimate,
+                "max_estimate": self.max_estimate,
+                "observed": self.observed,
+                "actual_to_estimate": (
+                    round(self._observed_ratio / self.observed, 3)
+                    if self.observed
+                    else None
+                ),
+            }
+
+
+def fit_files(estimator, files, fixed_tokens, limit):
+    """
+    Подбирает файлы, которые помещаются в limit вместе с fixed_tokens
+    (история и текст запроса). При переполнении отбрасываются самые большие.
+    Возвращает (kept, dropped, total), где dropped — пары (файл, токены),
+    а total — оценка итогового запроса; total > limit, если запрос не
+    помещается даже без файлов.
+    """
+    estimates = [estimator.file_info(file_info) for file_info in files]
+    total = fixed_tokens + sum(estimates)
+    dropped_ids = set()
+    by_size = sorted(range(len(files)), key=lambda i: estimates[i], reverse=True)
+    for index in by_size:
+        if total <= limit:
+            break
+        dropped_ids.add(index)
+        total -= estimates[index]
+    kept = [f for i, f in enumerate(files) if i not in dropped_ids]
+    dropped = [(files[i], estimates[i]) for i in sorted(dropped_ids)]
+    return kept, dropped, total
+
+
+class Preflight(namedtuple("Preflight", "dropped total limit")):
+    """Результат проверки: dropped — пары (файл, токены), total — оценка."""
+
+    @property
+    def ok(self):
+        return self.total <= self.limit
+
+    def rejection_text(self):
+        return (
+            f"⚠️ Запрос слишком большой для модели: ~{self.total} токенов при "
+            f"лимите {self.limit}. Начните новый чат или сократите сообщение."
+        )
+
+    def dropped_texts(self):
+        return [
+            f"⚠️ Файл '{file_info.get('filename') or 'фото'}' (~{tokens} токенов) "
+            "не помещается в контекст модели и не будет отправлен."
+            for file_info, tokens in self.dropped
+        ]
+
+    def keep(self, items):
+        """items без отброшенных файлов (порядок сохраняется)."""
+        dropped = {id(file_info) for file_info, _ in self.dropped}
+        return [item for item in items if id(item) not in dropped]
+
+
+def preflight(model_name, history=(), texts=(), files=()):
+    """
+    Проверяет запрос до сборки частей: история чата, тексты и файлы
+    (метаданные из persistence) против окна контекста модели.
+    """
+    limit = estimator.input_limit(get_input_token_limit(model_name))
+    fixed = estimator.history(history) + sum(
+        estimator.text(text) for text in texts if text
+    )
+    fixed += sum(estimator.text(f.get("caption")) for f in files)
+    _, dropped, total = fit_files(estimator, files, fixed, limit)
+    check = Preflight(dropped, total, limit)
+    estimator.record(
+        total, rejected=not check.ok, trimmed=len(dropped) if check.ok else 0
+    )
+    return check
+
+
+estimator = TokenEstimator.from_file()
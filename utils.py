@@ -1,11 +1,12 @@
 import json
 import base64
+import html
+import re
 
-from bs4 import BeautifulSoup
-from markdown import markdown
 from telebot.types import InputRichMessage, ReplyParameters
 
 from constants import MAX_MESSAGE_LENGTH
+from rate_limiter import is_flood_error
 
 
 class BytesEncoder(json.JSONEncoder):
@@ -17,44 +18,281 @@ class BytesEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+# Markdown → обычный текст. Раньше текст рендерился в HTML через markdown()
+# и разбирался BeautifulSoup; теперь строки разбираются за один проход, а
+# строчная разметка — одним регулярным выражением. Правила повторяют
+# Python-Markdown без расширений: тот же видимый текст и те же строки.
+_MD_FENCE = re.compile(r"^( *)(`{3,}|~{3,})")
+_MD_ATX = re.compile(r"^(#{1,6})(.*?)#*$")
+_MD_SETEXT = re.compile(r"^[=-]+ *$")
+_MD_HR = re.compile(r"^ {0,3}([-*_])(?: {0,2}\1){2,} *$")
+_MD_LIST = re.compile(r"^( *)(?:[*+-]|\d+\.) +(.*)$")
+_MD_QUOTE = re.compile(r"^ {0,3}> ?")
+_MD_REF_DEF = re.compile(r"^ {0,3}\[([^\]]+)\]:[ \t]*\S+.*$", re.MULTILINE)
+_MD_INLINE = re.compile(
+    # Опережающая проверка отсекает позиции без разметки до перебора ветвей
+    r"(?=[`\\!\[<&*_])"
+    r"(?:(?P<code>(?P<ticks>`+)(?P<code_text>.+?)(?<!`)(?P=ticks)(?!`))"
+    r"|(?P<escape>\\(?P<escaped>[\\`*_{}\[\]()>#+\-.!]))"
+    r"|(?P<image>!\[[^\]]*\](?:\([^)]*\)|\s?\[[^\]]*\]))"
+    r"|(?P<link>\[(?P<label>(?:[^\[\]]|\[[^\]]*\])*)\]"
+    r"(?:\((?P<url>[^()]*(?:\([^()]*\)[^()]*)*)\)|\s?\[(?P<ref>[^\]]*)\])?)"
+    r"|(?P<autolink><(?P<address>(?i:ftp|https?)://[^<>]*|[^<> !]+@[^@<> ]+)>)"
+    r"|(?P<comment><!--.*?-->)"
+    r"|(?P<tag></?(?P<tag_name>[a-zA-Z][^\s\"'<>@/]*)[^<>]*>)"
+    r"|(?P<entity>&(?:#[0-9]+|#x[0-9a-fA-F]+|[a-zA-Z0-9]+);)"
+    r"|(?P<strong_em>\*{3}(?!\s)(?P<strong_em_text>.+?)(?<!\s)\*{3})"
+    r"|(?P<strong>\*\*(?!\s)(?P<strong_text>.+?)(?<!\s)\*\*(?!\*))"
+    r"|(?P<em>\*(?!\s)(?P<em_text>(?:[^*]|\*\*[^*]+\*\*)+?)(?<!\s)\*)"
+    r"|(?P<underscore>(?<!\w)(?P<marks>_{1,3})(?!_)(?P<underscore_text>.+?)"
+    r"(?<!_)(?P=marks)(?!\w)))",
+    re.DOTALL,
+)
+# Закрывающие теги, после которых HTML-текст переходит на новую строку
+_MD_BLOCK_TAGS = frozenset(
+    "p h1 h2 h3 h4 h5 h6 ul ol li blockquote pre hr div table tr".split()
+)
+
+
+def _inline_to_text(text, refs):
+    """Текст абзаца без строчной разметки, ссылок и HTML-тегов."""
+
+    def replace(match):
+        kind = match.lastgroup
+        if kind == "code":
+            return match["code_text"].strip()
+        if kind == "escape":
+            return match["escaped"]
+        if kind == "link":
+            label = _inline_to_text(match["label"], refs)
+            if match["url"] is not None:
+                return label
+            ref = match["ref"]
+            if (ref or match["label"]).lower() in refs:
+                return label
+            return f"[{label}]" if ref is None else f"[{label}][{ref}]"
+        if kind == "autolink":
+            return match["address"]
+        if kind == "tag":
+            name = match["tag_name"].lower()
+            if name == "br":
+                return "\n"
+            if match[0].startswith("</"):
+                if name in _MD_BLOCK_TAGS:
+                    return "\n"
+                if name in ("td", "th"):
+                    return " "
+            return ""
+        if kind == "entity":
+            return html.unescape(match[0])
+        if kind in ("image", "comment"):
+            return ""
+        return _inline_to_text(match[kind + "_text"], refs)
+
+    return _MD_INLINE.sub(replace, text)
+
+
 def markdown_to_text(markdown_string):
-    """Converts a markdown string to plaintext"""
-    html = markdown(markdown_string)
-    soup = BeautifulSoup(html, "html.parser")
-
-    # Replace <br> tags with explicit newlines
-    for br in soup.find_all("br"):
-        br.replace_with("\n")
-
-    # Add newlines after block elements to ensure separation
-    block_tags = [
-        "p",
-        "h1",
-        "h2",
-        "h3",
-        "h4",
-        "h5",
-        "h6",
-        "ul",
-        "ol",
-        "li",
-        "blockquote",
-        "pre",
-        "hr",
-        "div",
-        "table",
-        "tr",
-    ]
-    for tag in soup.find_all(block_tags):
-        tag.append("\n")
-
-    # Add spaces after table cells to ensure separation
-    for tag in soup.find_all(["td", "th"]):
-        tag.append(" ")
-
-    text = soup.get_text(separator="")
-
-    return text.strip()
+    """
+    Converts a markdown string to plaintext.
+
+    Заголовки, абзацы, элементы списков и код остаются на своих строках,
+    вложенные списки получают отступ; маркеры списков, цитат и строчная
+    разметка удаляются. Блоки разделяются одной пустой строкой.
+    """
+    refs = set()
+    if "]:" in markdown_string:
+        refs = {m[1].lower() for m in _MD_REF_DEF.finditer(markdown_string)}
+
+    out = []
+    para = []  # строки текущего абзаца или элемента списка
+    para_indent = ""
+    gap = False  # перед следующей строкой нужна пустая
+    block_start = True  # строка начинает новый блок (после пустой и т.п.)
+    fence = None  # (отступ, маркер) открытого ``` блока
+    code = False  # внутри блока кода с отступом
+    lists = []  # отступы маркеров открытых списков
+    quoted = False
+
+    def emit(line):
+        nonlocal gap
+        if not line:
+            gap = True
+            return
+        if gap and out:
+            out.append("")
+        gap = False
+        out.append(line)
+
+    def flush():
+        if para:
+            text = _inline_to_text("\n".join(para), refs)
+            for line in text.split("\n"):
+                line = line.strip()
+                emit(para_indent + line if line else "")
+            para.clear()
+
+    for line in markdown_string.expandtabs(4).split("\n"):
+        if fence:
+            indent, marker = fence
+            if line.strip().startswith(marker) and not line.strip(" " + marker[0]):
+                fence = None
+                gap = block_start = True
+            elif not line[:indent].strip():
+                emit(line[indent:].rstrip())
+            else:
+                emit(line.strip())
+            continue
+
+        is_quote = False
+        match = _MD_QUOTE.match(line)
+        while match:
+            is_quote = True
+            line = line[match.end() :]
+            match = _MD_QUOTE.match(line)
+        if is_quote != quoted:
+            flush()
+            quoted = is_quote
+            lists.clear()
+            gap = block_start = True
+
+        stripped = line.strip()
+        if not stripped:
+            flush()
+            gap = block_start = True
+            continue
+        indent = len(line) - len(line.lstrip(" "))
+
+        if code:
+            if indent >= 4:
+                emit(line[4:].rstrip())
+                continue
+            code = False
+        elif block_start and indent >= 4 and not lists:
+            code = True
+            emit(line[4:].rstrip())
+            continue
+
+        match = _MD_FENCE.match(line)
+        if match:
+            flush()
+            fence = (len(match[1]), match[2])
+            gap = True
+            continue
+
+        if refs and _MD_REF_DEF.match(line):
+            continue
+
+        match = _MD_ATX.match(stripped)
+        if match:
+            flush()
+            lists.clear()
+            para_indent = ""
+            gap = True
+            emit(_inline_to_text(match[2], refs).strip())
+            gap = block_start = True
+            continue
+
+        if para and not lists and _MD_SETEXT.match(line):
+            heading = para.pop()
+            flush()
+            gap = True
+            emit(_inline_to_text(heading, refs).strip())
+            gap = block_start = True
+            continue
+
+        if _MD_HR.match(line):
+            flush()
+            lists.clear()
+            gap = block_start = True
+            continue
+
+        match = _MD_LIST.match(line)
+        if match and (block_start or lists):
+            flush()
+            while lists and indent < lists[-1]:
+                lists.pop()
+            if not lists or indent > lists[-1]:
+                lists.append(indent)
+            para_indent = "  " * (len(lists) - 1)
+            para.append(match[2])
+        elif block_start and lists and indent == 0:
+            # Текст без отступа после пустой строки закрывает список
+            lists.clear()
+            para_indent = ""
+            para.append(stripped)
+        else:
+            if not lists:
+                para_indent = ""
+            para.append(line.lstrip())
+        block_start = False
+
+    flush()
+    return "\n".join(out).strip()
+
+
+# Разметка, меняющая состояние открытых тегов: строка ``` (в начале строки,
+# после пробелов), "* " в начале строки (маркер списка, не курсив) и
+# строчные маркеры. Начало строки ищется по "\n": все ветви начинаются с
+# известного символа, и поиск быстро пропускает обычный текст.
+_MD_LINE_START_TOKEN = re.compile(r"[^\S\n]*```.*|\*(?= )")
+_MD_STATE_TOKEN = re.compile(r"\n[^\S\n]*```.*|\n\*(?= )|\n|`|\|\||~~|\*\*\*|\*\*|\*")
+_MD_STATE_TOGGLES = {
+    "`": ("in_inline_code",),
+    "||": ("in_spoiler",),
+    "~~": ("in_strike",),
+    "***": ("in_bold", "in_italic"),
+    "**": ("in_bold",),
+    "*": ("in_italic",),
+}
+
+
+def _initial_markdown_state() -> dict:
+    return {
+        "in_code_block": False,
+        "code_block_lang": "",
+        "in_inline_code": False,
+        "in_bold": False,
+        "in_italic": False,
+        "in_strike": False,
+        "in_spoiler": False,
+    }
+
+
+def _toggle_code_block(state: dict, fence_line: str) -> None:
+    if state["in_code_block"]:
+        state["in_code_block"] = False
+        state["code_block_lang"] = ""
+    else:
+        state["in_code_block"] = True
+        state["code_block_lang"] = fence_line.strip()[3:].strip()
+
+
+def _scan_markdown_state(state: dict, text: str, pos: int, endpos: int) -> dict:
+    """
+    Продолжает разбор state по text[pos:endpos] без копирования строки.
+    Начало строки определяется по исходному тексту, а не по pos.
+    """
+    if pos == 0 or text[pos - 1] == "\n":
+        first = _MD_LINE_START_TOKEN.match(text, pos, endpos)
+        if first:
+            pos = first.end()
+            if first[0] != "*":
+                _toggle_code_block(state, first[0])
+    for match in _MD_STATE_TOKEN.finditer(text, pos, endpos):
+        token = match[0]
+        if token[0] == "\n":
+            # Перенос строки, маркер списка или строка ```
+            if len(token) > 1 and token != "\n*":
+                _toggle_code_block(state, token)
+        elif state["in_code_block"]:
+            continue
+        elif state["in_inline_code"] and token != "`":
+            continue
+        else:
+            for key in _MD_STATE_TOGGLES[token]:
+                state[key] = not state[key]
+    return state
 
 
 def parse_markdown_state(text: str) -> dict:
@@ -67,69 +305,7 @@ def parse_markdown_state(text: str) -> dict:
     - strikethrough (~~)
     - spoiler (||)
     """
-    in_code_block = False
-    code_block_lang = ""
-    in_inline_code = False
-    in_bold = False
-    in_italic = False
-    in_strike = False
-    in_spoiler = False
-
-    lines = text.split("\n")
-    for line in lines:
-        stripped = line.strip()
-        if stripped.startswith("```"):
-            if not in_code_block:
-                in_code_block = True
-                code_block_lang = stripped[3:].strip()
-            else:
-                in_code_block = False
-                code_block_lang = ""
-            continue
-
-        if in_code_block:
-            continue
-
-        i = 0
-        n = len(line)
-        while i < n:
-            if line[i] == "`":
-                in_inline_code = not in_inline_code
-                i += 1
-            elif in_inline_code:
-                i += 1
-            elif line[i : i + 2] == "||":
-                in_spoiler = not in_spoiler
-                i += 2
-            elif line[i : i + 2] == "~~":
-                in_strike = not in_strike
-                i += 2
-            elif line[i : i + 3] == "***":
-                in_bold = not in_bold
-                in_italic = not in_italic
-                i += 3
-            elif line[i : i + 2] == "**":
-                in_bold = not in_bold
-                i += 2
-            elif line[i] == "*":
-                # Не считаем маркированный список (* в начале строки с пробелом) за курсив
-                if i == 0 and len(line) > 1 and line[1] == " ":
-                    i += 1
-                else:
-                    in_italic = not in_italic
-                    i += 1
-            else:
-                i += 1
-
-    return {
-        "in_code_block": in_code_block,
-        "code_block_lang": code_block_lang,
-        "in_inline_code": in_inline_code,
-        "in_bold": in_bold,
-        "in_italic": in_italic,
-        "in_strike": in_strike,
-        "in_spoiler": in_spoiler,
-    }
+    return _scan_markdown_state(_initial_markdown_state(), text, 0, len(text))
 
 
 def get_closers_and_openers(state: dict) -> tuple[str, str]:
@@ -163,82 +339,135 @@ def get_closers_and_openers(state: dict) -> tuple[str, str]:
     return "".join(suffix), "".join(prefix)
 
 
-def split_long_message(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> list[str]:
+def find_split_point(chunk: str) -> tuple[int, int]:
     """
-    Умно разбивает длинный Markdown текст на части, автоматически
-    закрывая и заново открывая открытые теги форматирования (код, жирный, курсив и т.д.)
-    на границах сообщений.
+    Место разрыва текста в пределах chunk: (индекс, длина разделителя).
+    Предпочтения по убыванию: пустая строка между абзацами, перенос строки,
+    конец предложения, пробел; иначе — разрыв по длине chunk.
     """
-    if not text:
-        return []
-    if len(text) <= max_length:
-        return [text]
-
-    parts = []
-    current_text = text
-    current_prefix = ""
+    cut_idx = -1
+    delimiter_len = 0
+
+    # 1. Двойной перенос строки (между параграфами / таблицами)
+    pos = chunk.rfind("\n\n")
+    if pos != -1 and pos > len(chunk) // 4:
+        cut_idx = pos
+        delimiter_len = 2
+
+    # 2. Одинарный перенос строки
+    if cut_idx == -1:
+        pos = chunk.rfind("\n")
+        if pos != -1 and pos > len(chunk) // 4:
+            cut_idx = pos
+            delimiter_len = 1
+
+    # 3. Конец предложения
+    if cut_idx == -1:
+        for punct in (". ", "! ", "? "):
+            pos = chunk.rfind(punct)
+            if pos != -1 and pos > len(chunk) // 4:
+                cut_idx = pos + 1
+                delimiter_len = 1
+                break
 
-    while current_text:
-        if len(current_text) + len(current_prefix) <= max_length:
-            parts.append(current_prefix + current_text)
-            break
+    # 4. Пробел
+    if cut_idx == -1:
+        pos = chunk.rfind(" ")
+        if pos != -1:
+            cut_idx = pos
+            delimiter_len = 1
 
-        # Учитываем запас под закрывающие теги (например, **\n```)
-        safety_reserve = min(50, max(0, max_length // 4))
-        available_len = max(1, max_length - len(current_prefix) - safety_reserve)
+    # 5. Принудительный разрыв
+    if cut_idx == -1:
+        cut_idx = len(chunk)
+        delimiter_len = 0
 
-        candidate_chunk = current_text[:available_len]
+    return cut_idx, delimiter_len
 
-        cut_idx = -1
-        delimiter_len = 0
 
-        # 1. Двойной перенос строки (между параграфами / таблицами)
-        pos = candidate_chunk.rfind("\n\n")
-        if pos != -1 and pos > available_len // 4:
-            cut_idx = pos
-            delimiter_len = 2
+def split_text(text: str, max_length: int) -> list[str]:
+    """
+    Делит простой текст на части до max_length по тем же границам, что и
+    split_long_message, но без закрытия тегов разметки.
+    """
+    parts = []
+    while len(text) > max_length:
+        cut_idx, delimiter_len = find_split_point(text[:max_length])
+        if cut_idx == 0:
+            cut_idx, delimiter_len = max_length, 0
+        parts.append(text[:cut_idx])
+        text = text[cut_idx + delimiter_len :].lstrip("\n")
+    if text:
+        parts.append(text)
+    return parts
 
-        # 2. Одинарный перенос строки
-        if cut_idx == -1:
-            pos = candidate_chunk.rfind("\n")
-            if pos != -1 and pos > available_len // 4:
-                cut_idx = pos
-                delimiter_len = 1
 
-        # 3. Конец предложения
-        if cut_idx == -1:
-            for punct in (". ", "! ", "? "):
-                pos = candidate_chunk.rfind(punct)
-                if pos != -1 and pos > available_len // 4:
-                    cut_idx = pos + 1
-                    delimiter_len = 1
-                    break
-
-        # 4. Пробел
-        if cut_idx == -1:
-            pos = candidate_chunk.rfind(" ")
-            if pos != -1:
-                cut_idx = pos
-                delimiter_len = 1
+def iter_message_parts(text: str, max_length: int = MAX_MESSAGE_LENGTH):
+    """
+    Генератор частей для split_long_message: части отдаются по мере
+    разбиения. Текст не копируется на каждом шаге, а открытые теги не
+    пересчитываются с начала части: состояние переносится дальше, и каждый
+    символ разбирается один раз.
+    """
+    if not text:
+        return
+    if len(text) <= max_length:
+        yield text
+        return
+
+    # Учитываем запас под закрывающие теги (например, **\n```)
+    safety_reserve = min(50, max(0, max_length // 4))
+    prefix = ""
+    pos = 0
+    end = len(text)
+
+    while pos < end:
+        if end - pos + len(prefix) <= max_length:
+            yield prefix + text[pos:]
+            return
+
+        available_len = max(1, max_length - len(prefix) - safety_reserve)
+        cut_idx, delimiter_len = find_split_point(text[pos : pos + available_len])
+        cut = pos + cut_idx
+
+        # Первая строка части начинается с префикса — её разбираем вместе
+        # с ним, как её увидит Telegram; дальше состояние переносится
+        eol = text.find("\n", pos, cut)
+        if eol == -1:
+            eol = cut
+        first_line = prefix + text[pos:eol]
+        state = _scan_markdown_state(
+            _initial_markdown_state(), first_line, 0, len(first_line)
+        )
+        _scan_markdown_state(state, text, eol, cut)
+        suffix, next_prefix = get_closers_and_openers(state)
+        yield prefix + text[pos:cut] + suffix
+        prefix = next_prefix
 
-        # 5. Принудительный разрыв
-        if cut_idx == -1:
-            cut_idx = available_len
-            delimiter_len = 0
+        pos = cut + delimiter_len
+        while pos < end and text[pos] == "\n":
+            pos += 1
 
-        raw_chunk = current_text[:cut_idx]
-        current_text = current_text[cut_idx + delimiter_len :].lstrip("\n")
 
-        # Определяем открытые теги в этой части
-        combined_chunk = current_prefix + raw_chunk
-        state = parse_markdown_state(combined_chunk)
-        suffix, next_prefix = get_closers_and_openers(state)
+def split_long_message(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """
+    Умно разбивает длинный Markdown текст на части, автоматически
+    закрывая и заново открывая открытые теги форматирования (код, жирный, курсив и т.д.)
+    на границах сообщений.
+    """
+    return list(iter_message_parts(text, max_length))
 
-        final_part = combined_chunk + suffix
-        parts.append(final_part)
-        current_prefix = next_prefix
 
-    return parts
+def _with_last(items):
+    """(индекс, элемент, последний ли) с заглядыванием на один элемент вперёд."""
+    items = iter(items)
+    current = next(items, None)
+    index = 0
+    while current is not None:
+        following = next(items, None)
+        yield index, current, following is None
+        current = following
+        index += 1
 
 
 def send_rich_response(
@@ -257,13 +486,12 @@ def send_rich_response(
     if not markdown_text:
         return []
 
-    parts = split_long_message(markdown_text, max_length=MAX_MESSAGE_LENGTH)
+    parts = iter_message_parts(markdown_text, max_length=MAX_MESSAGE_LENGTH)
     sent_messages = []
     total_parts_sent = 0
 
-    for i, part in enumerate(parts):
+    for i, part, is_last in _with_last(parts):
         is_first = i == 0
-        is_last = i == len(parts) - 1
         reply_params = (
             ReplyParameters(message_id=reply_to_message_id)
             if (is_first and reply_to_message_id)
@@ -281,17 +509,22 @@ def send_rich_response(
             )
             sent_messages.append(msg)
             total_parts_sent += 1
-        except Exception:
+        except Exception as e:
+            # 429 после всех повторов ограничителя: любая следующая отправка
+            # в этот чат (текстом или сообщением об ошибке) тоже получит 429
+            if is_flood_error(e):
+                print(f"Чат {chat_id} превысил лимит Telegram, ответ прерван: {e}")
+                return sent_messages
             # Fallback: конвертируем в простой текст и делим на части по 4000 символов
             plain_part = markdown_to_text(part)
-            fallback_chunks = split_long_message(plain_part, max_length=4000)
-            for j, chunk in enumerate(fallback_chunks):
+            fallback_chunks = iter_message_parts(plain_part, max_length=4000)
+            for j, chunk, is_last_chunk in _with_last(fallback_chunks):
                 chunk_reply_params = (
                     reply_params if (is_first and j == 0) else None
                 )
                 chunk_markup = (
                     current_markup
-                    if (is_last and j == len(fallback_chunks) - 1)
+                    if (is_last and is_last_chunk)
                     else None
                 )
                 msg = bot.send_message(
@@ -312,3 +545,74 @@ def send_rich_response(
 
     return sent_messages
 
+
+async def send_rich_response_async(
+    bot,
+    chat_id,
+    markdown_text,
+    reply_to_message_id=None,
+    reply_markup=None,
+    fallback_download_keyboard=None,
+):
+    """
+    Асинхронный вариант send_rich_response для AsyncTeleBot: то же разбиение
+    на части и тот же fallback на обычный текст.
+    """
+    if not markdown_text:
+        return []
+
+    parts = iter_message_parts(markdown_text, max_length=MAX_MESSAGE_LENGTH)
+    sent_messages = []
+    total_parts_sent = 0
+
+    for i, part, is_last in _with_last(parts):
+        is_first = i == 0
+        reply_params = (
+            ReplyParameters(message_id=reply_to_message_id)
+            if (is_first and reply_to_message_id)
+            else None
+        )
+        current_markup = reply_markup if is_last else None
+
+        try:
+            rich_msg = InputRichMessage(markdown=part)
+            msg = await bot.send_rich_message(
+                chat_id=chat_id,
+                rich_message=rich_msg,
+                reply_parameters=reply_params,
+                reply_markup=current_markup,
+            )
+            sent_messages.append(msg)
+            total_parts_sent += 1
+        except Exception as e:
+            if is_flood_error(e):
+                print(f"Чат {chat_id} превысил лимит Telegram, ответ прерван: {e}")
+                return sent_messages
+            plain_part = markdown_to_text(part)
+            fallback_chunks = iter_message_parts(plain_part, max_length=4000)
+            for j, chunk, is_last_chunk in _with_last(fallback_chunks):
+                chunk_reply_params = (
+                    reply_params if (is_first and j == 0) else None
+                )
+                chunk_markup = (
+                    current_markup
+                    if (is_last and is_last_chunk)
+                    else None
+                )
+                msg = await bot.send_message(
+                    chat_id,
+                    chunk,
+                    reply_parameters=chunk_reply_params,
+                    reply_markup=chunk_markup,
+                )
+                sent_messages.append(msg)
+                total_parts_sent += 1
+
+    if total_parts_sent > 1 and fallback_download_keyboard:
+        await bot.send_message(
+            chat_id,
+            "Ответ был разбит на несколько сообщений.",
+            reply_markup=fallback_download_keyboard,
+        )
+
+    return sent_messages
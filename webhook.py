@@ -0,0 +1,131 @@
+"""
+Приём апдейтов через вебхук: встроенный HTTP-сервер на стандартной библиотеке.
+
+Сервер проверяет X-Telegram-Bot-Api-Secret-Token, сразу отвечает 200 и
+только после этого передаёт апдейт в конвейер обработчиков (через
+submit — обычно bot.process_new_updates с установленным диспетчером).
+GET /healthz нужен балансировщику. GET /stats отдаёт метрики бота и, как
+и вебхук, требует заголовок с секретом — сервер слушает публичный порт.
+
+Локальная проверка:
+    curl -X POST localhost:8080/telegram/webhook \\
+        -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+        -H "Content-Type: application/json" -d @tests/fixtures/update_message.json
+    curl localhost:8080/stats -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET"
+"""
+
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot.types import Update
+
+import metrics
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    server_version = "GeminiBotWebhook"
+
+    def _reply(self, status, body=b"", content_type="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+        self.wfile.flush()
+
+    def _authorized(self):
+        # compare_digest принимает str только из ASCII — сравниваем байты
+        token = self.headers.get(SECRET_HEADER, "").encode("utf-8")
+        secret = self.server.webhook.secret_token.encode("utf-8")
+        return hmac.compare_digest(token, secret)
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            self._reply(200, b"ok")
+        elif self.path == "/stats":
+            if not self._authorized():
+                self._reply(403)
+                return
+            body = json.dumps(metrics.snapshot(), ensure_ascii=False)
+            self._reply(200, body.encode("utf-8"), "application/json")
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        webhook = self.server.webhook
+        if self.path != webhook.path:
+            self._reply(404)
+            return
+
+        if not self._authorized():
+            webhook.rejected += 1
+            self._reply(403)
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            self._reply(413 if length > 0 else 400)
+            return
+
+        try:
+            update_json = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._reply(400)
+            return
+
+        # Telegram ждёт быстрый ответ: подтверждаем до обработки апдейта
+        self._reply(200)
+        webhook.received += 1
+
+        try:
+            webhook.submit([Update.de_json(update_json)])
+        except Exception as e:
+            print(f"Ошибка при передаче апдейта из вебхука: {e}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WebhookServer:
+    """HTTP-сервер вебхука; submit получает список telebot.types.Update."""
+
+    def __init__(self, host, port, path, secret_token, submit):
+        if not secret_token:
+            raise ValueError("Для вебхука нужен WEBHOOK_SECRET")
+        self.path = path
+        self.secret_token = secret_token
+        self.submit = submit
+        self.received = 0
+        self.rejected = 0
+        self.httpd = ThreadingHTTPServer((host, port), _WebhookHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.webhook = self
+        self._thread = None
+
+    @property
+    def server_address(self):
+        return self.httpd.server_address
+
+    def stats(self):
+        return {"received": self.received, "rejected": self.rejected}
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        """Запускает сервер в фоновом потоке."""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="webhook", daemon=True
+        )
+        self._thread.start()
+        return self._thread
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
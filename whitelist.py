@@ -0,0 +1,37 @@
+WHITELIST_FILE = "whitelist.txt"
+whitelisted_users = set()
+
+
+def load_whitelist():
+    """Загружает белый список пользователей из файла"""
+    try:
+        with open(WHITELIST_FILE, "r") as f:
+            for line in f:
+                user_id = line.strip()
+                if user_id:
+                    whitelisted_users.add(int(user_id))
+        print(f"Loaded {len(whitelisted_users)} users into whitelist.")
+    except FileNotFoundError:
+        print(
+            f"Whitelist file '{WHITELIST_FILE}' not found. Starting with empty whitelist."
+        )
+    except Exception as e:
+        print(f"Error loading whitelist: {e}")
+
+
+def add_to_whitelist(user_id):
+    """Добавляет пользователя в белый список."""
+    if user_id not in whitelisted_users:
+        try:
+            with open(WHITELIST_FILE, "a") as f:
+                f.write(f"{user_id}\n")
+            whitelisted_users.add(user_id)
+            print(f"Added user {user_id} to whitelist.")
+        except Exception as e:
+            print(f"Error adding user {user_id} to whitelist: {e}")
+
+
+def is_whitelisted(user_id):
+    """Checks if a user ID is in the whitelist."""
+
+    return user_id in whitelisted_users